@@ -0,0 +1,89 @@
+# persistence; embedded storage measures pipeline alone, postgres one measures it with db. Use dedicated database,
+# because benchmark subscriptions are left there
+persistence_use_postgres = False
+
+# db
+db_name = "feed_benchmark"
+db_user = "kirilldelimbetov"
+db_password = None
+db_host = "localhost"
+db_port = 5432
+
+# db pools; lookups of hot read path don't wait for connections behind slow writes. Statements running longer than
+# timeout are cancelled; 0 means no timeout
+db_read_pool_min_size = 1
+db_read_pool_max_size = 10
+db_read_pool_statement_timeout_ms = 10000
+db_write_pool_min_size = 1
+db_write_pool_max_size = 10
+db_write_pool_statement_timeout_ms = 30000
+# acquire waiting longer is warned about as pool saturation; pools stats are logged every db_pool_stats_seconds
+db_pool_acquire_warning_ms = 100
+db_pool_stats_seconds = 60.0
+db_pool_stats_window_size = 10000
+
+# scenarios; every channel has subscribers_per_channel subscribers out of users_count users, posts come to random
+# channels at posts_per_second for duration_seconds
+scenarios = {
+    "small": {
+        "channels_count": 10,
+        "users_count": 100,
+        "subscribers_per_channel": 20,
+        "posts_per_second": 5.0,
+        "duration_seconds": 30.0},
+    "fan_out": {
+        "channels_count": 5,
+        "users_count": 10000,
+        "subscribers_per_channel": 5000,
+        "posts_per_second": 1.0,
+        "duration_seconds": 30.0},
+    "many_channels": {
+        "channels_count": 2000,
+        "users_count": 2000,
+        "subscribers_per_channel": 5,
+        "posts_per_second": 50.0,
+        "duration_seconds": 60.0},
+}
+default_scenario = "small"
+
+# posts
+album_share = 0.1
+album_size = 4
+album_timeout_seconds = 1.0
+
+# fake telegram
+bots_count = 2
+send_latency_seconds = 0.05
+flood_wait_probability = 0.001
+flood_wait_seconds = 2
+
+# pipeline; same as feed bot config unless it slows benchmark down for no reason
+forward_max_wait_count = 500
+forward_timeout_seconds = 3.0
+handoff_public_posts = True
+handoff_batch_size = 100
+handoff_lease_seconds = 60.0
+handoff_poll_seconds = 5.0
+outbound_flush_seconds = 1.0
+outbound_sends_per_second = 1.0
+outbound_burst = 5
+outbound_max_message_length = 4000
+delivery_max_attempts = 3
+delivery_retry_delay_seconds = 1.0
+delivery_max_flood_wait_seconds = 300.0
+delivery_flush_seconds = 30.0
+delivery_lanes_count = 100
+outbox_batch_size = 500
+outbox_lease_seconds = 300.0
+outbox_poll_seconds = 1.0
+outbox_deferred_release_per_second = 20.0
+rollups_flush_seconds = 60.0
+duplicates_cache_max_size = 10000
+duplicates_cache_ttl_seconds = 3600.0
+user_state_cache_max_size = 100000
+user_state_cache_ttl_seconds = 3600.0
+
+# once posts are generated, deliveries are waited for that long
+settle_timeout_seconds = 60.0
+# delivery latency percentiles are taken over that many last deliveries
+latency_window_size = 1000000
@@ -0,0 +1,176 @@
+from asyncio import sleep, ensure_future
+from datetime import datetime, timezone
+from random import random
+
+from telethon import errors
+from telethon.events import StopPropagation
+from telethon.tl.types import InputPeerUser, InputPeerChannel, PeerUser, PeerChannel
+from telethon.utils import get_peer_id, resolve_id
+
+from common.logging import get_logger
+
+
+class FakeChat:
+    def __init__(self, chat_id: int, username, title: str):
+        self.id = chat_id
+        self.username = username
+        self.title = title
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, text: str, from_id=None, grouped_id=None):
+        self.id = message_id
+        self.message = text
+        self.from_id = from_id
+        self.grouped_id = grouped_id
+        self.date = datetime.now(timezone.utc)
+        self.entities = None
+        self.reply_markup = None
+        # only public channels posts are generated, so nothing is forwarded to anyone
+        self.forward = None
+        self.fwd_from = None
+
+
+# Stand-in of NewMessage.Event: only what handlers of the pipeline read
+class FakeEvent:
+    def __init__(self, client, chat: FakeChat, message: FakeMessage, is_private: bool, is_channel: bool):
+        self.client = client
+        self.chat = chat
+        self.chat_id = chat.id
+        self.message = message
+        self.grouped_id = message.grouped_id
+        self.is_private = is_private
+        self.is_group = False
+        self.is_channel = is_channel
+
+    async def get_chat(self) -> FakeChat:
+        return self.chat
+
+    async def get_input_chat(self):
+        return get_input_peer(self.chat_id)
+
+    def __repr__(self):
+        return f"chat_id={self.chat_id} msg id={self.message.id}"
+
+
+def get_input_peer(peer_id: int):
+    real_id, peer_type = resolve_id(peer_id)
+
+    if peer_type is PeerUser:
+        return InputPeerUser(user_id=real_id, access_hash=0)
+    elif peer_type is PeerChannel:
+        return InputPeerChannel(channel_id=real_id, access_hash=0)
+
+    raise RuntimeError(f"Fake client does not support peer id={peer_id}")
+
+
+# Stand-in of TelegramClient: events are dispatched to handlers as telethon does, sends are recorded instead of being
+# done. Every send takes latency_seconds and fails with flood wait of flood_wait_seconds with flood_wait_probability.
+# on_send(client, entity, message) & on_forward(client, entity, message_ids, from_peer) are called on every send
+class FakeClient:
+    def __init__(
+            self,
+            user_id: int,
+            usernames: dict,
+            latency_seconds: float,
+            flood_wait_probability: float,
+            flood_wait_seconds: int,
+            on_send=None,
+            on_forward=None):
+        self.user_id = user_id
+        # username -> peer id of public chats known to this client
+        self.usernames = usernames
+        self.latency_seconds = latency_seconds
+        self.flood_wait_probability = flood_wait_probability
+        self.flood_wait_seconds = flood_wait_seconds
+        self.on_send = on_send
+        self.on_forward = on_forward
+        self.handlers = list()
+        self.next_message_id = 1
+        self.sent_count = 0
+        self.forwarded_count = 0
+        self.flood_waits_count = 0
+
+    # only func filter of event builder is applied
+    def add_event_handler(self, callback, event=None):
+        self.handlers.append((callback, getattr(event, "func", None)))
+
+    def remove_event_handler(self, callback, event=None) -> int:
+        handlers_count = len(self.handlers)
+        self.handlers = [(handler, func) for handler, func in self.handlers if handler is not callback]
+
+        return handlers_count - len(self.handlers)
+
+    # handlers are called in order until one stops propagation; like telethon, every update is handled in own task
+    def emit(self, event: FakeEvent):
+        ensure_future(self.dispatch(event=event))
+
+    async def dispatch(self, event: FakeEvent):
+        for handler, func in self.handlers:
+            if func is not None and not func(event):
+                continue
+
+            try:
+                await handler(event)
+            except StopPropagation:
+                break
+            except Exception as e:
+                get_logger().error(f"Unhandled exception in handler of event=({event}): {str(e)}")
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def get_input_entity(self, peer):
+        if isinstance(peer, str):
+            username = peer.lstrip('@')
+
+            if username not in self.usernames:
+                raise ValueError(f"No user has \"{username}\" as username")
+
+            return get_input_peer(self.usernames[username])
+        elif isinstance(peer, int):
+            return get_input_peer(peer)
+
+        return peer
+
+    async def get_peer_id(self, peer) -> int:
+        return get_peer_id(peer)
+
+    async def get_messages(self, entity, ids: list) -> list:
+        await self.call()
+
+        return [FakeMessage(message_id=message_id, text="") for message_id in ids]
+
+    async def send_message(self, entity, message: str) -> FakeMessage:
+        await self.call()
+        self.sent_count += 1
+
+        if self.on_send is not None:
+            self.on_send(self, entity, message)
+
+        return self.get_new_message(text=message)
+
+    async def forward_messages(self, entity, messages, from_peer=None, as_album=None):
+        await self.call()
+        message_ids = [message if isinstance(message, int) else message.id for message in messages]
+        self.forwarded_count += 1
+
+        if self.on_forward is not None:
+            self.on_forward(self, entity, message_ids, from_peer)
+
+        return [self.get_new_message(text="") for _ in message_ids]
+
+    # Internal
+    async def call(self):
+        if self.latency_seconds > 0:
+            await sleep(self.latency_seconds)
+
+        if random() < self.flood_wait_probability:
+            self.flood_waits_count += 1
+            raise errors.FloodWaitError(request=None, capture=self.flood_wait_seconds)
+
+    def get_new_message(self, text: str) -> FakeMessage:
+        message = FakeMessage(message_id=self.next_message_id, text=text, from_id=self.user_id)
+        self.next_message_id += 1
+
+        return message
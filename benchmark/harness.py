@@ -0,0 +1,435 @@
+from asyncio import gather, sleep
+from random import random, randrange
+from resource import getrusage, RUSAGE_SELF
+from time import monotonic
+
+from telethon.events import NewMessage
+from telethon.tl.types import PeerChannel
+from telethon.utils import get_peer_id
+
+from common.histogram import RollingHistogram
+from common.logging import get_logger
+from common.resources.localization import Language
+from common.telegram import ChatType
+from handlers.album import AlbumHandler
+from handlers.message import MessageHandler
+from handlers.forwarders import ForwardersHandler
+from bundle import BundleIndex
+from delivery import DeliveryService
+from digest import DigestSettings
+from outbox import OutboxConsumer
+from quiet import QuietHours
+from handoff import HandoffConsumer
+from outbound import OutboundJournal, OutboundQueue
+from pool import BotPool
+from rollup import ChannelRollups
+from user_state import UserStateCache
+
+from fake import FakeClient, FakeChat, FakeMessage, FakeEvent, get_input_peer
+from storage import CountingStorage
+
+
+# fake ids; user ids of forwarder & bots are below user chat ids, so they never clash
+g_forwarder_user_id = 1000
+g_first_bot_user_id = 2000
+g_first_user_chat_id = 100000
+g_first_channel_id = 1000000
+# delivery latency bounds in seconds
+g_latency_bounds_seconds = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60]
+
+
+def get_channel_id(channel_index: int) -> int:
+    return get_peer_id(PeerChannel(g_first_channel_id + channel_index))
+
+
+def get_channel_username(channel_index: int) -> str:
+    return f"benchmark_channel_{channel_index}"
+
+
+class Scenario:
+    def __init__(
+            self,
+            name: str,
+            channels_count: int,
+            users_count: int,
+            subscribers_per_channel: int,
+            posts_per_second: float,
+            duration_seconds: float):
+        if channels_count < 1:
+            raise RuntimeError(f"Invalid channels_count={channels_count}")
+
+        if users_count < 1:
+            raise RuntimeError(f"Invalid users_count={users_count}")
+
+        if subscribers_per_channel < 1 or users_count < subscribers_per_channel:
+            raise RuntimeError(f"Invalid subscribers_per_channel={subscribers_per_channel}")
+
+        if posts_per_second <= 0:
+            raise RuntimeError(f"Invalid posts_per_second={posts_per_second}")
+
+        if duration_seconds <= 0:
+            raise RuntimeError(f"Invalid duration_seconds={duration_seconds}")
+
+        self.name = name
+        self.channels_count = channels_count
+        self.users_count = users_count
+        self.subscribers_per_channel = subscribers_per_channel
+        self.posts_per_second = posts_per_second
+        self.duration_seconds = duration_seconds
+
+    # subscribers of neighbour channels overlap, so users follow several channels like real ones do
+    def get_subscribers(self, channel_index: int) -> list:
+        first_idx = channel_index * self.subscribers_per_channel // 2
+
+        return [
+            g_first_user_chat_id + (first_idx + idx) % self.users_count
+            for idx in range(self.subscribers_per_channel)]
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+
+class BenchmarkConfig:
+    def __init__(
+            self,
+            scenario: Scenario,
+            album_share: float,
+            album_size: int,
+            album_timeout_seconds: float,
+            bots_count: int,
+            send_latency_seconds: float,
+            flood_wait_probability: float,
+            flood_wait_seconds: int,
+            forward_max_wait_count: int,
+            forward_timeout_seconds: float,
+            handoff_public_posts: bool,
+            handoff_batch_size: int,
+            handoff_lease_seconds: float,
+            handoff_poll_seconds: float,
+            outbound_flush_seconds: float,
+            outbound_sends_per_second: float,
+            outbound_burst: int,
+            outbound_max_message_length: int,
+            delivery_max_attempts: int,
+            delivery_retry_delay_seconds: float,
+            delivery_max_flood_wait_seconds: float,
+            delivery_flush_seconds: float,
+            delivery_lanes_count: int,
+            outbox_batch_size: int,
+            outbox_lease_seconds: float,
+            outbox_poll_seconds: float,
+            outbox_deferred_release_per_second: float,
+            rollups_flush_seconds: float,
+            duplicates_cache_max_size: int,
+            duplicates_cache_ttl_seconds: float,
+            user_state_cache_max_size: int,
+            user_state_cache_ttl_seconds: float,
+            settle_timeout_seconds: float,
+            latency_window_size: int):
+        if scenario is None:
+            raise RuntimeError("No scenario passed")
+
+        if album_share < 0 or album_share > 1:
+            raise RuntimeError(f"Invalid album_share={album_share}")
+
+        if album_size < 2:
+            raise RuntimeError(f"Invalid album_size={album_size}")
+
+        if bots_count < 1:
+            raise RuntimeError(f"Invalid bots_count={bots_count}")
+
+        if send_latency_seconds < 0:
+            raise RuntimeError(f"Invalid send_latency_seconds={send_latency_seconds}")
+
+        if flood_wait_probability < 0 or flood_wait_probability > 1:
+            raise RuntimeError(f"Invalid flood_wait_probability={flood_wait_probability}")
+
+        if settle_timeout_seconds < 0:
+            raise RuntimeError(f"Invalid settle_timeout_seconds={settle_timeout_seconds}")
+
+        self.scenario = scenario
+        self.album_share = album_share
+        self.album_size = album_size
+        self.album_timeout_seconds = album_timeout_seconds
+        self.bots_count = bots_count
+        self.send_latency_seconds = send_latency_seconds
+        self.flood_wait_probability = flood_wait_probability
+        self.flood_wait_seconds = flood_wait_seconds
+        self.forward_max_wait_count = forward_max_wait_count
+        self.forward_timeout_seconds = forward_timeout_seconds
+        self.handoff_public_posts = handoff_public_posts
+        self.handoff_batch_size = handoff_batch_size
+        self.handoff_lease_seconds = handoff_lease_seconds
+        self.handoff_poll_seconds = handoff_poll_seconds
+        self.outbound_flush_seconds = outbound_flush_seconds
+        self.outbound_sends_per_second = outbound_sends_per_second
+        self.outbound_burst = outbound_burst
+        self.outbound_max_message_length = outbound_max_message_length
+        self.delivery_max_attempts = delivery_max_attempts
+        self.delivery_retry_delay_seconds = delivery_retry_delay_seconds
+        self.delivery_max_flood_wait_seconds = delivery_max_flood_wait_seconds
+        self.delivery_flush_seconds = delivery_flush_seconds
+        self.delivery_lanes_count = delivery_lanes_count
+        self.outbox_batch_size = outbox_batch_size
+        self.outbox_lease_seconds = outbox_lease_seconds
+        self.outbox_poll_seconds = outbox_poll_seconds
+        self.outbox_deferred_release_per_second = outbox_deferred_release_per_second
+        self.rollups_flush_seconds = rollups_flush_seconds
+        self.duplicates_cache_max_size = duplicates_cache_max_size
+        self.duplicates_cache_ttl_seconds = duplicates_cache_ttl_seconds
+        self.user_state_cache_max_size = user_state_cache_max_size
+        self.user_state_cache_ttl_seconds = user_state_cache_ttl_seconds
+        self.settle_timeout_seconds = settle_timeout_seconds
+        self.latency_window_size = latency_window_size
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+
+# Runs the whole pipeline in one process with fake telegram clients: forwarder handlers get generated channel posts
+# and hand them off or queue them to the primary bot, forwarders handler fans posts out into outbox, outbox consumer
+# sends them through bots of the pool. Latency of delivery is time from post generation till forward to subscriber
+class Benchmark:
+    def __init__(self, config: BenchmarkConfig, persistent_storage):
+        if config is None:
+            raise RuntimeError("No benchmark config passed")
+
+        self.config = config
+        self.scenario = config.scenario
+        self.persistent_storage = CountingStorage(persistent_storage=persistent_storage, on_call=self.on_storage_call)
+
+        # fake telegram
+        usernames = {
+            get_channel_username(channel_index): get_channel_id(channel_index)
+            for channel_index in range(self.scenario.channels_count)}
+        # sends of forwarder are not flood limited, because its posts would be lost then and counts would not match
+        self.forwarder_client = FakeClient(
+            user_id=g_forwarder_user_id,
+            usernames=usernames,
+            latency_seconds=config.send_latency_seconds,
+            flood_wait_probability=0,
+            flood_wait_seconds=config.flood_wait_seconds,
+            on_send=self.on_forwarder_send)
+        self.bot_clients = [
+            FakeClient(
+                user_id=g_first_bot_user_id + bot_index,
+                usernames=usernames,
+                latency_seconds=config.send_latency_seconds,
+                flood_wait_probability=config.flood_wait_probability,
+                flood_wait_seconds=config.flood_wait_seconds,
+                on_forward=self.on_bot_forward) for bot_index in range(config.bots_count)]
+        self.pool = BotPool(clients=self.bot_clients, tokens=[str(client.user_id) for client in self.bot_clients])
+
+        # forwarder side; journal is in memory, benchmark is never restarted
+        self.outbound = OutboundQueue(
+            client=self.forwarder_client,
+            handoff_storage=self.persistent_storage if config.handoff_public_posts else None,
+            feedbot_entities=[get_input_peer(client.user_id) for client in self.bot_clients],
+            journal=OutboundJournal(file_path=":memory:"),
+            flush_seconds=config.outbound_flush_seconds,
+            sends_per_second=config.outbound_sends_per_second,
+            burst=config.outbound_burst,
+            max_message_length=config.outbound_max_message_length)
+        self.forwarder_client.add_event_handler(
+            callback=AlbumHandler(
+                persistent_storage=self.persistent_storage,
+                outbound=self.outbound,
+                album_timeout_seconds=config.album_timeout_seconds),
+            event=NewMessage(func=lambda e: e.grouped_id, incoming=True, outgoing=False))
+        self.forwarder_client.add_event_handler(
+            callback=MessageHandler(persistent_storage=self.persistent_storage, outbound=self.outbound),
+            event=NewMessage(func=lambda e: not e.grouped_id, incoming=True, outgoing=False))
+
+        # bot side
+        self.rollups = ChannelRollups(
+            persistent_storage=self.persistent_storage, flush_seconds=config.rollups_flush_seconds)
+        self.delivery = DeliveryService(
+            persistent_storage=self.persistent_storage,
+            pool=self.pool,
+            rollups=self.rollups,
+            max_attempts=config.delivery_max_attempts,
+            retry_delay_seconds=config.delivery_retry_delay_seconds,
+            max_flood_wait_seconds=config.delivery_max_flood_wait_seconds,
+            flush_seconds=config.delivery_flush_seconds)
+        self.consumer = OutboxConsumer(
+            persistent_storage=self.persistent_storage,
+            delivery=self.delivery,
+            partition_index=0,
+            partitions_count=1,
+            lanes_count=config.delivery_lanes_count,
+            batch_size=config.outbox_batch_size,
+            lease_seconds=config.outbox_lease_seconds,
+            poll_seconds=config.outbox_poll_seconds,
+            deferred_release_per_second=config.outbox_deferred_release_per_second)
+        forwarders_handler = ForwardersHandler(
+            persistent_storage=self.persistent_storage,
+            user_states=UserStateCache(
+                persistent_storage=self.persistent_storage,
+                max_size=config.user_state_cache_max_size,
+                ttl_seconds=config.user_state_cache_ttl_seconds),
+            forwarders_user_ids={g_forwarder_user_id},
+            max_wait_count=config.forward_max_wait_count,
+            timeout_seconds=config.forward_timeout_seconds,
+            digest_settings=DigestSettings(persistent_storage=self.persistent_storage),
+            quiet_hours=QuietHours(persistent_storage=self.persistent_storage),
+            pool=self.pool,
+            rollups=self.rollups,
+            bundles=BundleIndex(persistent_storage=self.persistent_storage),
+            duplicates_cache_max_size=config.duplicates_cache_max_size,
+            duplicates_cache_ttl_seconds=config.duplicates_cache_ttl_seconds)
+        self.pool.get_primary_client().add_event_handler(
+            callback=forwarders_handler,
+            event=NewMessage(from_users=[g_forwarder_user_id], incoming=True, outgoing=False))
+        self.handoff = HandoffConsumer(
+            persistent_storage=self.persistent_storage,
+            pool=self.pool,
+            forwarders_handler=forwarders_handler,
+            batch_size=config.handoff_batch_size,
+            lease_seconds=config.handoff_lease_seconds,
+            poll_seconds=config.handoff_poll_seconds)
+
+        # channel chat id -> id of the last generated message
+        self.channel_message_ids = dict()
+        # (channel chat id, first message id) -> monotonic time of post generation
+        self.post_times = dict()
+        self.latencies = RollingHistogram(window_size=config.latency_window_size, bounds=g_latency_bounds_seconds)
+        self.posts_count = 0
+        self.expected_deliveries_count = 0
+        self.deliveries_count = 0
+
+    # Callbacks
+    # adds of outbox items & handed off posts are where postgres storage notifies consumers
+    def on_storage_call(self, name: str):
+        if name == "add_outbox_items":
+            self.consumer.wakeup.set()
+        elif name == "add_handoff_posts":
+            self.handoff.wakeup.set()
+
+    def on_forwarder_send(self, client: FakeClient, entity, message: str):
+        primary_client = self.pool.get_primary_client()
+        primary_client.emit(FakeEvent(
+            client=primary_client,
+            chat=FakeChat(chat_id=g_forwarder_user_id, username=None, title="forwarder"),
+            message=primary_client.get_new_message(text=message),
+            is_private=True,
+            is_channel=False))
+
+    def on_bot_forward(self, client: FakeClient, entity, message_ids: list, from_peer):
+        post_time = self.post_times.get((get_peer_id(from_peer), message_ids[0]))
+
+        if post_time is None:
+            get_logger().warning(f"Unexpected forward of messages={message_ids} from={from_peer} to={entity}")
+            return
+
+        self.deliveries_count += 1
+        self.latencies.add(monotonic() - post_time)
+
+    # Internal
+    async def seed(self):
+        get_logger().info(f"Seeding subscriptions of scenario={self.scenario.name}")
+        user_chat_ids = [g_first_user_chat_id + idx for idx in range(self.scenario.users_count)]
+
+        # user chats are spread over the pool evenly
+        for idx, user_chat_id in enumerate(user_chat_ids):
+            await self.persistent_storage.add_or_enable_user_chat(
+                chat_id=user_chat_id,
+                chat_type=ChatType.PRIVATE,
+                language=Language.ENGLISH,
+                bot_index=idx % len(self.pool))
+
+        for channel_index in range(self.scenario.channels_count):
+            await gather(*[
+                self.persistent_storage.add_or_enable_subscription(
+                    user_chat_id=user_chat_id,
+                    target_chat_id=get_channel_id(channel_index),
+                    target_title=get_channel_username(channel_index),
+                    target_joiner=get_channel_username(channel_index))
+                for user_chat_id in self.scenario.get_subscribers(channel_index=channel_index)])
+
+        self.persistent_storage.reset()
+
+    def post(self):
+        channel_index = randrange(self.scenario.channels_count)
+        channel_id = get_channel_id(channel_index)
+        chat = FakeChat(chat_id=channel_id, username=get_channel_username(channel_index), title=str(channel_index))
+        is_album = random() < self.config.album_share
+        messages_count = self.config.album_size if is_album else 1
+        first_message_id = self.channel_message_ids.get(channel_id, 0) + 1
+        self.channel_message_ids[channel_id] = first_message_id + messages_count - 1
+
+        self.post_times[(channel_id, first_message_id)] = monotonic()
+        self.posts_count += 1
+        self.expected_deliveries_count += self.scenario.subscribers_per_channel
+
+        for message_id in range(first_message_id, first_message_id + messages_count):
+            self.forwarder_client.emit(FakeEvent(
+                client=self.forwarder_client,
+                chat=chat,
+                message=FakeMessage(
+                    message_id=message_id,
+                    text=f"post {message_id}",
+                    grouped_id=first_message_id if is_album else None),
+                is_private=False,
+                is_channel=True))
+
+    async def generate(self):
+        get_logger().info(f"Generating posts: {self.scenario}")
+        start_time = monotonic()
+        posts_total = int(self.scenario.posts_per_second * self.scenario.duration_seconds)
+
+        # posts are scheduled by start time, so slow event loop makes bursts instead of lowering the rate
+        for post_idx in range(posts_total):
+            delay_seconds = start_time + post_idx / self.scenario.posts_per_second - monotonic()
+
+            if delay_seconds > 0:
+                await sleep(delay_seconds)
+
+            self.post()
+
+    async def settle(self):
+        deadline = monotonic() + self.config.settle_timeout_seconds
+
+        while self.deliveries_count < self.expected_deliveries_count and monotonic() < deadline:
+            await sleep(0.1)
+
+    async def run(self) -> dict:
+        async with self.persistent_storage:
+            await self.seed()
+            tasks = gather(
+                self.outbound.run(),
+                self.handoff.run(),
+                self.delivery.run(),
+                *self.consumer.get_continuous_async_tasks())
+            start_time = monotonic()
+
+            try:
+                await self.generate()
+                await self.settle()
+            finally:
+                elapsed_seconds = monotonic() - start_time
+                await self.consumer.drain(timeout_seconds=0)
+                tasks.cancel()
+
+        return self.get_report(elapsed_seconds=elapsed_seconds)
+
+    def get_report(self, elapsed_seconds: float) -> dict:
+        flood_waits_count = sum(client.flood_waits_count for client in self.bot_clients)
+
+        return {
+            "scenario": self.scenario.name,
+            "elapsed_seconds": round(elapsed_seconds, 3),
+            "posts": self.posts_count,
+            "deliveries": self.deliveries_count,
+            "expected_deliveries": self.expected_deliveries_count,
+            "posts_per_second": round(self.posts_count / elapsed_seconds, 3),
+            "deliveries_per_second": round(self.deliveries_count / elapsed_seconds, 3),
+            "latency_p50_seconds": self.latencies.get_percentile(50),
+            "latency_p90_seconds": self.latencies.get_percentile(90),
+            "latency_p99_seconds": self.latencies.get_percentile(99),
+            "latency_max_seconds": self.latencies.get_max(),
+            "flood_waits": flood_waits_count,
+            "db_queries": self.persistent_storage.get_calls_count(),
+            "db_queries_per_post": round(self.persistent_storage.get_calls_count() / max(1, self.posts_count), 3),
+            "db_queries_by_op": dict(self.persistent_storage.calls_counts),
+            # kilobytes on linux
+            "peak_memory_mb": round(getrusage(RUSAGE_SELF).ru_maxrss / 1024, 1)}
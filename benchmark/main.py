@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import os
+import sys
+
+# pipeline modules import each other as top level ones, like they do when services run from their own dirs
+g_project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(g_project_path, "feed_bot"))
+sys.path.append(os.path.join(g_project_path, "forwarder"))
+
+from common.logging import configure_logging
+from common.persistent_storage.pool import PoolConfig
+from common.persistent_storage.factory import PostgresConfig, PersistentStorageType, PersistenceConfig
+from common.persistent_storage.factory import create_persistent_storage
+from harness import Benchmark, BenchmarkConfig, Scenario
+from storage import MemoryStorage
+import config
+
+
+def main():
+    # Configure logging; debug logs of every post would be measured as well
+    configure_logging(name="benchmark", level=logging.INFO)
+
+    # Parse command line args
+    # 0 - prog name
+    # 1 - scenario name, optional
+    if len(sys.argv) > 2:
+        raise RuntimeError(f"Only scenario name is expected as command line argument: {list(config.scenarios)}")
+
+    scenario_name = sys.argv[1] if len(sys.argv) > 1 else config.default_scenario
+
+    if scenario_name not in config.scenarios:
+        raise RuntimeError(f"Unknown scenario={scenario_name}; known ones: {list(config.scenarios)}")
+
+    # Load configs
+    scenario = Scenario(name=scenario_name, **config.scenarios[scenario_name])
+    benchmark_config = BenchmarkConfig(
+        scenario=scenario,
+        album_share=config.album_share,
+        album_size=config.album_size,
+        album_timeout_seconds=config.album_timeout_seconds,
+        bots_count=config.bots_count,
+        send_latency_seconds=config.send_latency_seconds,
+        flood_wait_probability=config.flood_wait_probability,
+        flood_wait_seconds=config.flood_wait_seconds,
+        forward_max_wait_count=config.forward_max_wait_count,
+        forward_timeout_seconds=config.forward_timeout_seconds,
+        handoff_public_posts=config.handoff_public_posts,
+        handoff_batch_size=config.handoff_batch_size,
+        handoff_lease_seconds=config.handoff_lease_seconds,
+        handoff_poll_seconds=config.handoff_poll_seconds,
+        outbound_flush_seconds=config.outbound_flush_seconds,
+        outbound_sends_per_second=config.outbound_sends_per_second,
+        outbound_burst=config.outbound_burst,
+        outbound_max_message_length=config.outbound_max_message_length,
+        delivery_max_attempts=config.delivery_max_attempts,
+        delivery_retry_delay_seconds=config.delivery_retry_delay_seconds,
+        delivery_max_flood_wait_seconds=config.delivery_max_flood_wait_seconds,
+        delivery_flush_seconds=config.delivery_flush_seconds,
+        delivery_lanes_count=config.delivery_lanes_count,
+        outbox_batch_size=config.outbox_batch_size,
+        outbox_lease_seconds=config.outbox_lease_seconds,
+        outbox_poll_seconds=config.outbox_poll_seconds,
+        outbox_deferred_release_per_second=config.outbox_deferred_release_per_second,
+        rollups_flush_seconds=config.rollups_flush_seconds,
+        duplicates_cache_max_size=config.duplicates_cache_max_size,
+        duplicates_cache_ttl_seconds=config.duplicates_cache_ttl_seconds,
+        user_state_cache_max_size=config.user_state_cache_max_size,
+        user_state_cache_ttl_seconds=config.user_state_cache_ttl_seconds,
+        settle_timeout_seconds=config.settle_timeout_seconds,
+        latency_window_size=config.latency_window_size)
+
+    if config.persistence_use_postgres:
+        read_pool_config = PoolConfig(
+            min_size=config.db_read_pool_min_size,
+            max_size=config.db_read_pool_max_size,
+            statement_timeout_ms=config.db_read_pool_statement_timeout_ms,
+            acquire_warning_ms=config.db_pool_acquire_warning_ms,
+            stats_seconds=config.db_pool_stats_seconds,
+            stats_window_size=config.db_pool_stats_window_size)
+        write_pool_config = PoolConfig(
+            min_size=config.db_write_pool_min_size,
+            max_size=config.db_write_pool_max_size,
+            statement_timeout_ms=config.db_write_pool_statement_timeout_ms,
+            acquire_warning_ms=config.db_pool_acquire_warning_ms,
+            stats_seconds=config.db_pool_stats_seconds,
+            stats_window_size=config.db_pool_stats_window_size)
+        postgres_config = PostgresConfig(
+            database=config.db_name,
+            user=config.db_user,
+            password=config.db_password,
+            host=config.db_host,
+            port=config.db_port,
+            read_pool_config=read_pool_config,
+            write_pool_config=write_pool_config)
+        persistent_storage = create_persistent_storage(persistence_config=PersistenceConfig(
+            persistence_type=PersistentStorageType.Postgres, postgres_config=postgres_config))
+    else:
+        persistent_storage = MemoryStorage()
+
+    # Run the benchmark
+    benchmark = Benchmark(config=benchmark_config, persistent_storage=persistent_storage)
+    report = asyncio.get_event_loop().run_until_complete(benchmark.run())
+
+    for key, value in report.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
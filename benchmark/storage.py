@@ -0,0 +1,238 @@
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+
+from common.logging import get_logger
+from common.telegram import ChatType
+
+
+# Embedded storage of the pipeline: only ops called on the way from forwarder to subscriber are implemented, so it
+# measures pipeline itself with db cost taken out. Outbox items & handed off posts are leased like in postgres one
+class MemoryStorage:
+    def __init__(self):
+        # user chat id -> bot index
+        self.user_chat_bot_indexes = dict()
+        # channel chat id -> dict of user chat id -> bot index
+        self.channel_subscribers = dict()
+        self.digest_items = list()
+        self.channel_rollups = list()
+        # item id -> outbox item without id
+        self.outbox = dict()
+        # item id -> monotonic time the lease ends
+        self.outbox_leases = dict()
+        # item id -> time deferred item or retry is due; items that are not deferred have none
+        self.outbox_not_befores = dict()
+        # item id -> failed attempts; items that did not fail have none
+        self.outbox_attempts = dict()
+        self.next_outbox_item_id = 1
+        # post id -> handed off post without id
+        self.handoff = dict()
+        # post id -> monotonic time the lease ends
+        self.handoff_leases = dict()
+        self.next_handoff_post_id = 1
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    async def add_or_enable_user_chat(self, chat_id: int, chat_type: ChatType, language, bot_index: int) -> tuple:
+        existed_before = chat_id in self.user_chat_bot_indexes
+        self.user_chat_bot_indexes.setdefault(chat_id, bot_index)
+
+        return existed_before, existed_before, language
+
+    async def add_or_enable_subscription(
+            self, user_chat_id: int, target_chat_id: int, target_title: str, target_joiner: str) -> tuple:
+        subscribers = self.channel_subscribers.setdefault(target_chat_id, dict())
+        existed_before = user_chat_id in subscribers
+        subscribers[user_chat_id] = self.user_chat_bot_indexes[user_chat_id]
+
+        return existed_before, existed_before
+
+    async def get_channel_subscribers(self, chat_id) -> dict:
+        return dict(self.channel_subscribers.get(chat_id, dict()))
+
+    async def get_channel_filters(self, chat_id: int) -> list:
+        return list()
+
+    async def get_digest_periods(self) -> tuple:
+        return dict(), dict()
+
+    async def get_quiet_hours(self) -> dict:
+        return dict()
+
+    async def add_digest_items(self, items: list):
+        self.digest_items.extend(items)
+
+    async def get_channel_bundles(self) -> dict:
+        return dict()
+
+    async def get_bundle_subscribers(self, bundle_id: int) -> dict:
+        return dict()
+
+    async def disable_user_chats(self, chat_ids: list) -> int:
+        disabled_count = 0
+
+        for subscribers in self.channel_subscribers.values():
+            for chat_id in chat_ids:
+                disabled_count += subscribers.pop(chat_id, None) is not None
+
+        return disabled_count
+
+    async def migrate_user_chat(self, chat_id: int, new_chat_id: int, new_chat_type: ChatType) -> bool:
+        return False
+
+    async def add_channel_rollups(self, rows: list):
+        self.channel_rollups.extend(rows)
+
+    async def add_outbox_items(self, items: list, handoff_post_ids: list):
+        await self.delete_handoff_posts(post_ids=handoff_post_ids)
+
+        for item in items:
+            *fields, not_before = item
+            self.outbox[self.next_outbox_item_id] = tuple(fields)
+
+            if not_before is not None:
+                self.outbox_not_befores[self.next_outbox_item_id] = not_before
+
+            self.next_outbox_item_id += 1
+
+    async def claim_outbox_items(
+            self,
+            partition_index: int,
+            partitions_count: int,
+            limit: int,
+            lease_seconds: float,
+            deferred: bool) -> list:
+        now = monotonic()
+        wall_now = datetime.now(tz=timezone.utc)
+        # items of user chat wait for its older waiting ones like in postgres storage
+        waiting_user_chat_ids = set()
+        items = list()
+
+        # dict keeps insertion order, which is the order of ids
+        for item_id, item in self.outbox.items():
+            if len(items) >= limit:
+                break
+
+            not_before = self.outbox_not_befores.get(item_id)
+            attempts = self.outbox_attempts.get(item_id, 0)
+            is_waiting = item[1] in waiting_user_chat_ids
+
+            # items that are not claimed the same way
+            if not_before is not None and ((attempts > 0 if deferred else attempts == 0) or not_before > wall_now):
+                waiting_user_chat_ids.add(item[1])
+
+            if self.outbox_leases.get(item_id, 0) > now or abs(item[1]) % partitions_count != partition_index:
+                continue
+
+            if deferred and (is_waiting or attempts > 0 or not_before is None or not_before > wall_now):
+                continue
+
+            if not deferred and (is_waiting or not_before is not None and (attempts == 0 or not_before > wall_now)):
+                continue
+
+            self.outbox_leases[item_id] = now + lease_seconds
+            items.append((item_id, *item, attempts))
+
+        return items
+
+    async def delete_outbox_items(self, item_ids: list):
+        for item_id in item_ids:
+            self.outbox.pop(item_id, None)
+            self.outbox_leases.pop(item_id, None)
+            self.outbox_not_befores.pop(item_id, None)
+            self.outbox_attempts.pop(item_id, None)
+
+    async def release_outbox_items(self, item_ids: list):
+        for item_id in item_ids:
+            self.outbox_leases.pop(item_id, None)
+
+    async def retry_outbox_items(self, items: list):
+        wall_now = datetime.now(tz=timezone.utc)
+
+        for item_id, attempts, delay_seconds in items:
+            self.outbox_leases.pop(item_id, None)
+            self.outbox_attempts[item_id] = attempts
+            self.outbox_not_befores[item_id] = wall_now + timedelta(seconds=delay_seconds)
+
+    async def add_handoff_posts(self, posts: list):
+        for post in posts:
+            self.handoff[self.next_handoff_post_id] = post
+            self.next_handoff_post_id += 1
+
+    async def claim_handoff_posts(self, limit: int, lease_seconds: float) -> list:
+        now = monotonic()
+        posts = list()
+
+        for post_id, post in self.handoff.items():
+            if len(posts) >= limit:
+                break
+
+            if self.handoff_leases.get(post_id, 0) > now:
+                continue
+
+            self.handoff_leases[post_id] = now + lease_seconds
+            posts.append((post_id, *post))
+
+        return posts
+
+    async def delete_handoff_posts(self, post_ids: list):
+        for post_id in post_ids:
+            self.handoff.pop(post_id, None)
+            self.handoff_leases.pop(post_id, None)
+
+    async def create_analytics_events_partitions(self, day):
+        pass
+
+    async def add_analytics_events(self, events: list):
+        pass
+
+
+# Counts calls of storage ops. Every op of postgres storage is a single transaction of one or few statements, so
+# calls are what the benchmark reports as db queries. on_call(name) is called after every call
+class CountingStorage:
+    def __init__(self, persistent_storage, on_call=None):
+        self.persistent_storage = persistent_storage
+        self.on_call = on_call
+        # op name -> calls count
+        self.calls_counts = dict()
+        # op name -> seconds spent in calls
+        self.calls_seconds = dict()
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.persistent_storage, name)
+
+        if not callable(attr) or name.startswith('_'):
+            return attr
+
+        async def counted(*args, **kwargs):
+            start_time = monotonic()
+
+            try:
+                return await attr(*args, **kwargs)
+            finally:
+                self.calls_counts[name] = self.calls_counts.get(name, 0) + 1
+                self.calls_seconds[name] = self.calls_seconds.get(name, 0) + monotonic() - start_time
+
+                if self.on_call is not None:
+                    self.on_call(name)
+
+        return counted
+
+    async def __aenter__(self):
+        await self.persistent_storage.__aenter__()
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.persistent_storage.__aexit__(exc_type, exc_val, exc_tb)
+
+    def get_calls_count(self) -> int:
+        return sum(self.calls_counts.values())
+
+    def reset(self):
+        get_logger().debug(f"Resetting storage calls counters: {self.calls_counts}")
+        self.calls_counts.clear()
+        self.calls_seconds.clear()
@@ -0,0 +1,208 @@
+from asyncio import gather, sleep, create_subprocess_exec
+from asyncio.subprocess import PIPE
+from datetime import datetime
+from time import monotonic
+
+from telethon import TelegramClient, events
+from telethon.events import NewMessage
+
+from common.logging import get_logger
+from common.client import BaseClientConfig, Client
+from common.handler import resolve_entity_try_cache
+from common.histogram import RollingHistogram
+
+
+class CanaryConfig(BaseClientConfig):
+    def __init__(
+            self,
+            api_id: int,
+            api_hash: str,
+            channel_username: str,
+            feedbot_username: str,
+            post_interval_seconds: float,
+            deadline_seconds: float,
+            watchdog_check_seconds: float,
+            restart_units: list,
+            restart_cooldown_seconds: float,
+            histogram_window_size: int):
+        super(CanaryConfig, self).__init__(api_id=api_id, api_hash=api_hash)
+
+        if channel_username is None or len(channel_username) < 1:
+            raise RuntimeError("Invalid channel_username: none or empty")
+
+        if feedbot_username is None or len(feedbot_username) < 1:
+            raise RuntimeError("Invalid feedbot_username: none or empty")
+
+        if post_interval_seconds <= 0:
+            raise RuntimeError(f"Invalid post_interval_seconds={post_interval_seconds}")
+
+        if deadline_seconds <= 0:
+            raise RuntimeError(f"Invalid deadline_seconds={deadline_seconds}")
+
+        if watchdog_check_seconds <= 0:
+            raise RuntimeError(f"Invalid watchdog_check_seconds={watchdog_check_seconds}")
+
+        if restart_units is None:
+            raise RuntimeError("Invalid restart_units: none")
+
+        if restart_cooldown_seconds < 0:
+            raise RuntimeError(f"Invalid restart_cooldown_seconds={restart_cooldown_seconds}")
+
+        if histogram_window_size < 1:
+            raise RuntimeError(f"Invalid histogram_window_size={histogram_window_size}")
+
+        self.channel_username = channel_username
+        self.feedbot_username = feedbot_username
+        self.post_interval_seconds = post_interval_seconds
+        self.deadline_seconds = deadline_seconds
+        self.watchdog_check_seconds = watchdog_check_seconds
+        self.restart_units = restart_units
+        self.restart_cooldown_seconds = restart_cooldown_seconds
+        self.histogram_window_size = histogram_window_size
+
+    def __repr__(self):
+        return super(CanaryConfig, self).__repr__() + \
+               f", channel_username={self.channel_username}, feedbot_username={self.feedbot_username}" \
+               f", post_interval_seconds={self.post_interval_seconds}, deadline_seconds={self.deadline_seconds}" \
+               f", watchdog_check_seconds={self.watchdog_check_seconds}, restart_units={self.restart_units}" \
+               f", restart_cooldown_seconds={self.restart_cooldown_seconds}" \
+               f", histogram_window_size={self.histogram_window_size}"
+
+
+# End-to-end check of the whole pipeline: canary posts into its own channel, which is followed through feed bot like
+# any other channel, and measures how long it takes for the post to come back. Missed deadline means some service is
+# stalled, so the services are restarted
+class Canary(Client):
+    # Client overrides
+    async def setup(self):
+        # canary channel id is needed to match forwards, so full entities are resolved
+        get_logger().info(f"Resolving channel_username={self.config.channel_username} "
+                          f"feedbot_username={self.config.feedbot_username}")
+        self.channel_entity, self.feedbot_entity = await gather(
+            resolve_entity_try_cache(self.client, self.config.channel_username),
+            resolve_entity_try_cache(self.client, self.config.feedbot_username))
+
+        # Add feed handler
+        self.client.add_event_handler(
+            callback=self.on_feed_message,
+            event=events.NewMessage(from_users=self.feedbot_entity, incoming=True, outgoing=False))
+
+    async def prepare(self):
+        # follow canary channel through the normal user path; repeated follow is harmless
+        get_logger().info(f"Following {self.config.channel_username} through {self.config.feedbot_username}")
+        await self.client.send_message(self.feedbot_entity, "/start")
+        await self.client.send_message(self.feedbot_entity, f"/follow {self.config.channel_username}")
+
+    def get_continuous_async_tasks(self):
+        return super(Canary, self).get_continuous_async_tasks() + [
+            self.post_task(),
+            self.watchdog_task()]
+
+    # Canary
+    async def post_task(self):
+        get_logger().info("Starting post task")
+
+        while True:
+            # first post is delayed too, so forwarder has time to join the channel after follow
+            await sleep(self.config.post_interval_seconds)
+
+            try:
+                message = await self.client.send_message(
+                    self.channel_entity, f"canary #{self.posts_count} {datetime.utcnow().isoformat()}")
+                self.pending_posts[message.id] = monotonic()
+                self.posts_count += 1
+                get_logger().debug(f"Posted canary post id={message.id}")
+            except Exception as e:
+                get_logger().error(f"Failed to post canary: {str(e)}")
+
+    async def on_feed_message(self, event: NewMessage.Event):
+        forward = event.message.fwd_from
+
+        if forward is None or forward.channel_id != self.channel_entity.id:
+            return
+
+        post_id = forward.channel_post
+        sent_time = self.pending_posts.pop(post_id, None)
+
+        if sent_time is None:
+            sent_time = self.missed_posts.pop(post_id, None)
+
+            if sent_time is None:
+                get_logger().warning(f"Received unknown or duplicate canary post id={post_id}")
+                return
+
+            get_logger().warning(f"Canary post id={post_id} came back after its deadline")
+
+        # late posts are accounted too, so histogram shows how bad the stall was
+        latency_seconds = monotonic() - sent_time
+        self.histogram.add(latency_seconds)
+        get_logger().info(f"Canary post id={post_id} latency={latency_seconds:.3f}s; histogram: {self.histogram}")
+
+    async def watchdog_task(self):
+        get_logger().info("Starting watchdog task")
+
+        while True:
+            await sleep(self.config.watchdog_check_seconds)
+
+            now = monotonic()
+            missed_post_ids = [
+                post_id for post_id, sent_time in self.pending_posts.items()
+                if now - sent_time > self.config.deadline_seconds]
+
+            if len(missed_post_ids) == 0:
+                continue
+
+            for post_id in missed_post_ids:
+                self.missed_posts[post_id] = self.pending_posts.pop(post_id)
+
+            # posts that never came back are forgotten eventually; dict keeps insertion order, so oldest go first
+            while len(self.missed_posts) > self.config.histogram_window_size:
+                self.missed_posts.pop(next(iter(self.missed_posts)))
+
+            get_logger().error(f"Canary posts={missed_post_ids} missed deadline of {self.config.deadline_seconds}s")
+            await self.restart_units()
+
+    async def restart_units(self):
+        if len(self.config.restart_units) == 0:
+            return
+
+        if self.last_restart_time is not None \
+                and monotonic() - self.last_restart_time < self.config.restart_cooldown_seconds:
+            get_logger().warning(f"Units were restarted less than {self.config.restart_cooldown_seconds}s ago; skip")
+            return
+
+        self.last_restart_time = monotonic()
+        self.restarts_count += 1
+        get_logger().warning(f"Restarting units={self.config.restart_units}, restart #{self.restarts_count}")
+
+        try:
+            process = await create_subprocess_exec(
+                "systemctl", "restart", *self.config.restart_units, stdout=PIPE, stderr=PIPE)
+            stdout, stderr = await process.communicate()
+            get_logger().info(f"Restart finished with code={process.returncode} stdout={stdout} stderr={stderr}")
+        except Exception as e:
+            get_logger().error(f"Failed to restart units={self.config.restart_units}: {str(e)}")
+
+    def __init__(self, config: CanaryConfig):
+        if config is None:
+            raise RuntimeError("No config passed")
+
+        super(Canary, self).__init__(
+            client=TelegramClient(
+                'canary',
+                api_id=config.api_id,
+                api_hash=config.api_hash))
+
+        self.config = config
+        get_logger().info(msg="Creating Canary object with config: {}".format(self.config))
+        # post id -> monotonic time of posting
+        self.pending_posts = dict()
+        self.missed_posts = dict()
+        self.posts_count = 0
+        self.restarts_count = 0
+        self.last_restart_time = None
+        self.histogram = RollingHistogram(window_size=self.config.histogram_window_size)
+
+        # resolved on setup
+        self.channel_entity = None
+        self.feedbot_entity = None
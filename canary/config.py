@@ -0,0 +1,17 @@
+# public channel owned by canary account; canary posts there and follows it through feed bot
+channel_username = "@feed_canary"
+# primary bot of the pool; canary account id must be in primary_bot_user_ids of feed bot, so it isn't redirected to
+# another bot of the pool on start
+feedbot_username = "@channel_aggregator_bot"
+
+# post canary every post_interval_seconds; if it doesn't come back through feed bot in deadline_seconds, restart
+post_interval_seconds = 300.0
+deadline_seconds = 120.0
+watchdog_check_seconds = 5.0
+
+# systemd units restarted on missed deadline; don't restart again until cooldown passes
+restart_units = ["feedbot", "forwarder@0_421", "forwarder@422_900", "forwarder@901_1380"]
+restart_cooldown_seconds = 600.0
+
+# latency histogram is kept over last histogram_window_size canary posts
+histogram_window_size = 288
@@ -0,0 +1,39 @@
+from common.logging import configure_logging
+from canary import Canary, CanaryConfig
+import config
+import sys
+
+
+def main():
+    # Configure logging
+    configure_logging(name="canary")
+
+    # Parse command line args
+    if len(sys.argv) != 3:
+        raise RuntimeError("App id, app hash are required to be passed as command line argument")
+
+    api_id = int(sys.argv[1])
+    api_hash = sys.argv[2]
+
+    # Load configs
+    canary_config = CanaryConfig(
+        api_id=api_id,
+        api_hash=api_hash,
+        channel_username=config.channel_username,
+        feedbot_username=config.feedbot_username,
+        post_interval_seconds=config.post_interval_seconds,
+        deadline_seconds=config.deadline_seconds,
+        watchdog_check_seconds=config.watchdog_check_seconds,
+        restart_units=config.restart_units,
+        restart_cooldown_seconds=config.restart_cooldown_seconds,
+        histogram_window_size=config.histogram_window_size)
+
+    # Create canary obj
+    canary = Canary(config=canary_config)
+
+    # Run the canary
+    canary.run()
+
+
+if __name__ == '__main__':
+    main()
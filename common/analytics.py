@@ -0,0 +1,249 @@
+import json
+import logging
+import os
+from asyncio import Future, TimeoutError, ensure_future, shield, sleep, wait_for
+from collections import deque
+from datetime import datetime, timezone
+from enum import Enum
+from logging.handlers import RotatingFileHandler
+from time import monotonic
+from typing import Optional
+
+from .logging import get_logger
+from .persistent_storage.base import IPersistentStorage
+
+
+class EventType(Enum):
+    COMMAND = 0  # detail is command, latency is time spent handling it
+    FOLLOW = 1
+    UNFOLLOW = 2
+    DELIVERY = 3  # latency is time spent sending
+    DELIVERY_FAILURE = 4  # detail is failure reason
+
+
+class AnalyticsEvent:
+    def __init__(
+            self,
+            event_type: EventType,
+            event_time: datetime,
+            user_chat_id: Optional[int],
+            chat_id: Optional[int],
+            latency_seconds: Optional[float],
+            detail: Optional[str]):
+        self.event_type = event_type
+        self.event_time = event_time
+        self.user_chat_id = user_chat_id
+        self.chat_id = chat_id
+        self.latency_seconds = latency_seconds
+        self.detail = detail
+
+    # row of analytics events table
+    def to_row(self) -> tuple:
+        return self.event_type.value, self.event_time, self.user_chat_id, self.chat_id, self.latency_seconds, \
+               self.detail
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "event_type": self.event_type.name,
+            "event_time": self.event_time.isoformat(),
+            "user_chat_id": self.user_chat_id,
+            "chat_id": self.chat_id,
+            "latency_seconds": self.latency_seconds,
+            "detail": self.detail})
+
+    def __repr__(self):
+        return self.to_json()
+
+
+class AnalyticsConfig:
+    def __init__(
+            self,
+            buffer_size: int,
+            flush_ms: int,
+            db_timeout_seconds: float,
+            fallback_dir: str,
+            fallback_file_max_bytes: int,
+            fallback_file_backups_count: int):
+        if buffer_size < 1:
+            raise RuntimeError(f"Invalid buffer_size={buffer_size}")
+
+        if flush_ms < 1:
+            raise RuntimeError(f"Invalid flush_ms={flush_ms}")
+
+        if db_timeout_seconds <= 0:
+            raise RuntimeError(f"Invalid db_timeout_seconds={db_timeout_seconds}")
+
+        if fallback_dir is None or len(fallback_dir) < 1:
+            raise RuntimeError("Invalid fallback_dir: none or empty")
+
+        if fallback_file_max_bytes < 1:
+            raise RuntimeError(f"Invalid fallback_file_max_bytes={fallback_file_max_bytes}")
+
+        if fallback_file_backups_count < 1:
+            raise RuntimeError(f"Invalid fallback_file_backups_count={fallback_file_backups_count}")
+
+        self.buffer_size = buffer_size
+        self.flush_ms = flush_ms
+        self.db_timeout_seconds = db_timeout_seconds
+        self.fallback_dir = fallback_dir
+        self.fallback_file_max_bytes = fallback_file_max_bytes
+        self.fallback_file_backups_count = fallback_file_backups_count
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+
+# Structured events of commands, subscriptions & deliveries. Recording only appends to in memory ring buffer, so it
+# never delays handlers; buffer is flushed into db in batches every flush_ms. If db write fails, the batch goes to local
+# rotating files instead. Write slower than db_timeout_seconds is left to finish in background and goes to files only
+# if it fails then, since it may be committed already; batches flushed meanwhile go to files right away. If flushing
+# can't keep up, oldest events are overwritten and counted as dropped
+class AnalyticsLog:
+    def __init__(self, name: str, persistent_storage: IPersistentStorage, config: AnalyticsConfig):
+        if config is None:
+            raise RuntimeError("No analytics config passed")
+
+        self.name = name
+        self.persistent_storage = persistent_storage
+        self.config = config
+        self.buffer = deque(maxlen=self.config.buffer_size)
+        self.dropped_count = 0
+        self.fallback_logger = None
+        # db write that took longer than timeout and is left to finish in background
+        self.late_write = None
+        # month partitions of events table exist up to this date
+        self.partitions_checked_date = None
+
+    def record(
+            self,
+            event_type: EventType,
+            user_chat_id: Optional[int] = None,
+            chat_id: Optional[int] = None,
+            latency_seconds: Optional[float] = None,
+            detail: Optional[str] = None):
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped_count += 1
+
+        self.buffer.append(AnalyticsEvent(
+            event_type=event_type,
+            event_time=datetime.now(timezone.utc),
+            user_chat_id=user_chat_id,
+            chat_id=chat_id,
+            latency_seconds=latency_seconds,
+            detail=detail))
+
+    async def run(self):
+        get_logger().info("Starting analytics log")
+
+        while True:
+            await sleep(self.config.flush_ms / 1000)
+
+            try:
+                await self.flush()
+            except Exception as e:
+                get_logger().error(f"Failed to flush analytics events: {str(e)}")
+
+    async def flush(self):
+        if len(self.buffer) == 0:
+            return
+
+        events = list(self.buffer)
+        self.buffer.clear()
+
+        if self.late_write is not None and not self.late_write.done():
+            get_logger().warning(f"Previous analytics events are still being written to db, writing {len(events)} "
+                                 f"events to file")
+            self.write_to_file(events=events)
+        else:
+            write = ensure_future(self.write_to_db(events=events))
+
+            try:
+                await wait_for(shield(write), timeout=self.config.db_timeout_seconds)
+            except TimeoutError:
+                get_logger().warning(f"Writing {len(events)} analytics events to db takes longer than "
+                                     f"{self.config.db_timeout_seconds}s, leave it in background")
+                self.late_write = write
+                write.add_done_callback(lambda done_write: self.on_late_write_done(write=done_write, events=events))
+            except Exception as e:
+                get_logger().warning(f"Failed to write {len(events)} analytics events to db, writing to file: {str(e)}")
+                self.write_to_file(events=events)
+
+        if self.dropped_count > 0:
+            get_logger().warning(f"Analytics buffer overflowed, {self.dropped_count} events were dropped")
+            self.dropped_count = 0
+
+    def on_late_write_done(self, write: Future, events: list):
+        if write.cancelled():
+            get_logger().warning(f"Writing {len(events)} analytics events to db was cancelled; they may be lost")
+        elif write.exception() is not None:
+            get_logger().warning(f"Failed to write {len(events)} analytics events to db, writing to file: "
+                                 f"{str(write.exception())}")
+            self.write_to_file(events=events)
+
+    async def write_to_db(self, events: list):
+        today = datetime.now(timezone.utc).date()
+
+        if self.partitions_checked_date != today:
+            await self.persistent_storage.create_analytics_events_partitions(day=today)
+            self.partitions_checked_date = today
+
+        await self.persistent_storage.add_analytics_events(events=[event.to_row() for event in events])
+
+    def write_to_file(self, events: list):
+        if self.fallback_logger is None:
+            handler = RotatingFileHandler(
+                filename=os.path.join(self.config.fallback_dir, f"{self.name}.analytics.log"),
+                maxBytes=self.config.fallback_file_max_bytes,
+                backupCount=self.config.fallback_file_backups_count)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.fallback_logger = logging.getLogger(name=f"{self.name}.analytics")
+            self.fallback_logger.propagate = False
+            self.fallback_logger.addHandler(handler)
+            self.fallback_logger.setLevel(logging.INFO)
+
+        for event in events:
+            self.fallback_logger.info(event.to_json())
+
+
+g_analytics = None
+
+
+# analytics is process wide like logging; events are silently skipped until it is configured. Name must be unique per
+# process, because it names fallback files
+def configure_analytics(name: str, persistent_storage: IPersistentStorage, config: AnalyticsConfig) -> AnalyticsLog:
+    global g_analytics
+    g_analytics = AnalyticsLog(name=name, persistent_storage=persistent_storage, config=config)
+
+    return g_analytics
+
+
+def record_event(
+        event_type: EventType,
+        user_chat_id: Optional[int] = None,
+        chat_id: Optional[int] = None,
+        latency_seconds: Optional[float] = None,
+        detail: Optional[str] = None):
+    if g_analytics is not None:
+        g_analytics.record(
+            event_type=event_type,
+            user_chat_id=user_chat_id,
+            chat_id=chat_id,
+            latency_seconds=latency_seconds,
+            detail=detail)
+
+
+# wraps event handler callback, so every command is recorded with its handling time
+def with_command_event(command: str, callback):
+    async def wrapper(event):
+        start_time = monotonic()
+
+        try:
+            await callback(event)
+        finally:
+            record_event(
+                event_type=EventType.COMMAND,
+                user_chat_id=event.chat_id,
+                latency_seconds=monotonic() - start_time,
+                detail=command)
+
+    return wrapper
@@ -0,0 +1,50 @@
+from collections import OrderedDict
+from time import monotonic
+
+
+# LRU cache whose entries also expire after ttl_seconds; not thread safe, meant to be used from event loop
+class TtlLruCache:
+    def __init__(self, max_size: int, ttl_seconds: float):
+        if max_size < 1:
+            raise RuntimeError(f"Invalid max_size={max_size}")
+
+        if ttl_seconds <= 0:
+            raise RuntimeError(f"Invalid ttl_seconds={ttl_seconds}")
+
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        # key -> (expiration time, value); order is recency of use
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # returns None on miss
+    def get(self, key):
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return None
+
+        expiration_time, value = entry
+
+        if expiration_time < monotonic():
+            self.entries.pop(key)
+            return None
+
+        self.entries.move_to_end(key)
+
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = monotonic() + self.ttl_seconds, value
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def pop(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
@@ -1,7 +1,12 @@
-from asyncio import gather
+from asyncio import gather, ensure_future, CancelledError
+from signal import SIGTERM, SIGINT
+from contextlib import AsyncExitStack
 from telethon import TelegramClient
 from .logging import get_logger
-from .persistent_storage.factory import PersistenceConfig, create_persistent_storage
+from .monitor import LoopMonitor
+from .startup import report_startup_stage
+from .persistent_storage.factory import PersistenceConfig, PersistentStorageType, create_persistent_storage
+from .session import SessionsConfig, StorageSession
 
 
 class BaseClientConfig:
@@ -24,48 +29,116 @@ class CommonConfig(BaseClientConfig):
             self,
             api_id: int,
             api_hash: str,
-            persistence_config: PersistenceConfig):
+            persistence_config: PersistenceConfig,
+            sessions_config: SessionsConfig):
         super(CommonConfig, self).__init__(api_id=api_id, api_hash=api_hash)
 
         if persistence_config is None:
             raise RuntimeError("No persistence config")
 
+        if sessions_config is None:
+            raise RuntimeError("No sessions config")
+
+        if sessions_config.in_storage and persistence_config.persistence_type != PersistentStorageType.Postgres:
+            raise RuntimeError("Sessions can only be kept in postgres storage")
+
         self.persistence_config = persistence_config
+        self.sessions_config = sessions_config
 
     def __repr__(self):
-        return super(CommonConfig, self).__repr__() + ", persistence config=({})".format(self.persistence_config)
+        return super(CommonConfig, self).__repr__() + ", persistence config=({}), sessions config=({})".format(
+            self.persistence_config, self.sessions_config)
 
 
+# Startup is staged: connect (together with everything else that needs no telegram connection), then setup that
+# resolves entities & adds event handlers, after which messages are handled; prepare & continuous tasks go last.
+# Nothing blocking is done in constructors
 class Client:
     def __init__(self, client: TelegramClient):
         self.client = client
+        self.loop_monitor = LoopMonitor()
+        # gather of continuous tasks; cancelled on termination
+        self.tasks_future = None
+        self.is_terminating = False
 
     # these are for overriding
+    async def connect(self):
+        await self.client.start()
+
+    async def setup(self):
+        pass
+
     async def prepare(self):
         pass
 
     def get_continuous_async_tasks(self):
-        return [self.client.run_until_disconnected()]
+        return [self.client.run_until_disconnected(), self.loop_monitor.run()]
+
+    async def disconnect(self):
+        await self.client.disconnect()
+
+    # called on SIGTERM before continuous tasks are cancelled; for stopping intake & saving unfinished work
+    async def shutdown(self):
+        pass
+
+    async def terminate(self):
+        get_logger().info("Shutting down ... ")
+
+        try:
+            await self.shutdown()
+        except Exception as e:
+            get_logger().error(f"Failed to shut down gracefully: {str(e)}")
+
+        if self.tasks_future is not None:
+            self.tasks_future.cancel()
+
+    def on_signal(self, signal_number: int):
+        get_logger().info(f"Received signal={signal_number}")
+
+        # repeated signal doesn't restart shutdown
+        if self.is_terminating:
+            return
+
+        self.is_terminating = True
+        ensure_future(self.terminate())
 
-    # TODO: fix errors on termination
     async def arun(self):
+        get_logger().info("Connecting ... ")
+        await self.connect()
+        report_startup_stage("connected")
+
+        get_logger().info("Setting up ... ")
+        await self.setup()
+        report_startup_stage("handling")
+
         get_logger().info("Preparing ... ")
         await self.prepare()
+        report_startup_stage("prepared")
 
         # get_logger().info("Catching up ... ")
         # DO NOT CATCHUP UNTIL ITS FIXED
         # await self.client.catch_up()
         # get_logger().info("Catching up complete")
         # TODO: somehow process errors in async tasks  (except main client loop - its working already)
-        await gather(*self.get_continuous_async_tasks())
+        self.tasks_future = gather(*self.get_continuous_async_tasks())
+
+        try:
+            await self.tasks_future
+        except CancelledError:
+            get_logger().info("Continuous tasks are cancelled")
 
     def run(self):
         get_logger().info("Starting run loop ...")
 
-        with self.client:
+        for signal_number in (SIGTERM, SIGINT):
+            self.client.loop.add_signal_handler(signal_number, self.on_signal, signal_number)
+
+        try:
             get_logger().info("Starting async run loop ... ")
             self.client.loop.run_until_complete(self.arun())
             get_logger().info("... async run loop is stopped")
+        finally:
+            self.client.loop.run_until_complete(self.disconnect())
 
         get_logger().info("... run loop is stopped")
 
@@ -75,9 +148,45 @@ class ClientWithPersistentStorage(Client):
         super(ClientWithPersistentStorage, self).__init__(client=client)
 
         # Prepare bot for running
-        # Load/create persistent storage
+        # Load/create persistent storage; it is opened on connect
         self.persistent_storage = create_persistent_storage(persistence_config=persistence_config)
+        self.exit_stack = None
+
+    # these are for overriding
+    # telegram clients whose sessions might be kept in storage
+    def get_telegram_clients(self) -> list:
+        return [self.client]
+
+    async def connect_telegram(self):
+        await super(ClientWithPersistentStorage, self).connect()
+
+    def get_storage_sessions(self) -> list:
+        return [
+            client.session for client in self.get_telegram_clients() if isinstance(client.session, StorageSession)]
+
+    async def open_storage(self):
+        await self.exit_stack.enter_async_context(self.persistent_storage)
+        await gather(*[
+            session.load(persistent_storage=self.persistent_storage) for session in self.get_storage_sessions()])
+
+    async def connect(self):
+        # storage is opened while telegram connects, unless sessions are kept in it
+        if len(self.get_storage_sessions()) == 0:
+            await gather(self.connect_telegram(), self.open_storage())
+        else:
+            await self.open_storage()
+            await self.connect_telegram()
+
+    def get_continuous_async_tasks(self):
+        return super(ClientWithPersistentStorage, self).get_continuous_async_tasks() + [
+            session.run() for session in self.get_storage_sessions()]
 
     async def arun(self):
-        async with self.persistent_storage:
-            await super(ClientWithPersistentStorage, self).arun()
+        async with AsyncExitStack() as exit_stack:
+            self.exit_stack = exit_stack
+
+            try:
+                await super(ClientWithPersistentStorage, self).arun()
+            finally:
+                # sessions changes are saved before storage is closed
+                await gather(*[session.flush() for session in self.get_storage_sessions()], return_exceptions=True)
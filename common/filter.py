@@ -0,0 +1,281 @@
+import re
+from collections import deque
+from enum import Enum
+from typing import Iterable, Optional
+
+from .logging import get_logger
+
+# regex parser is private since python 3.11, where public sre_* modules are deprecated
+try:
+    from re import _constants as regex_constants, _parser as regex_parser
+except ImportError:
+    import sre_constants as regex_constants
+    import sre_parse as regex_parser
+
+
+g_url_host_regex = re.compile(
+    r"(?:https?://|www\.|\b)((?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z]{2,})\b", re.IGNORECASE)
+g_hashtag_prefix = "#"
+g_www_prefix = "www."
+# regexes of filters are run on every post by backtracking engine, so they are limited to ones that can't backtrack
+# for long. Cost is the amount of steps regex takes at single position: sequential items add up, repeated ones are
+# multiplied by repeat count, unbounded repeat counts as telegram post length
+g_max_regex_length = 200
+g_regex_unbounded_repeat_cost = 4096
+g_max_regex_cost = 16 * g_regex_unbounded_repeat_cost
+# ops missing in older pythons are never met in their parsed regexes
+g_regex_repeat_ops = {regex_constants.MAX_REPEAT, regex_constants.MIN_REPEAT,
+                      getattr(regex_constants, "POSSESSIVE_REPEAT", regex_constants.MAX_REPEAT)}
+g_regex_group_ops = {regex_constants.SUBPATTERN, getattr(regex_constants, "ATOMIC_GROUP", regex_constants.SUBPATTERN)}
+
+
+class FilterType(Enum):
+    KEYWORD = 0  # case insensitive word or phrase
+    REGEX = 1  # python regex, case insensitive
+    HASHTAG = 2  # #tag
+    DOMAIN = 3  # link domain, subdomains are matched too
+
+
+def get_filter_type_from_string(filter_type: str) -> Optional[FilterType]:
+    return FilterType.__members__.get(filter_type.upper())
+
+
+def is_word_char(char: str):
+    return char.isalnum() or char == "_"
+
+
+def normalize_filter_pattern(filter_type: FilterType, pattern: str) -> str:
+    if pattern is None or len(pattern.strip()) < 1:
+        raise RuntimeError("Empty filter pattern")
+
+    pattern = pattern.strip()
+
+    if filter_type == FilterType.KEYWORD:
+        return pattern.lower()
+    elif filter_type == FilterType.REGEX:
+        compile_regex(pattern=pattern)
+
+        return pattern
+    elif filter_type == FilterType.HASHTAG:
+        tag = pattern.lower().lstrip(g_hashtag_prefix)
+
+        if len(tag) < 1 or not all(is_word_char(char) for char in tag):
+            raise RuntimeError(f"Invalid hashtag: {pattern}")
+
+        return g_hashtag_prefix + tag
+    elif filter_type == FilterType.DOMAIN:
+        match = g_url_host_regex.search(pattern)
+
+        if match is None:
+            raise RuntimeError(f"Invalid domain: {pattern}")
+
+        host = match.group(1).lower()
+
+        # www.example.com rule would be narrower than example.com one, while users mean the same
+        return host[len(g_www_prefix):] if host.startswith(g_www_prefix) and host.count(".") > 1 else host
+
+    raise RuntimeError(f"Unknown filter type: {filter_type}")
+
+
+# items are parsed regex; is_repeated is whether they are inside of repeat already
+def get_regex_cost(items, is_repeated: bool) -> int:
+    cost = 0
+
+    for op, av in items:
+        if op == regex_constants.GROUPREF or op == regex_constants.GROUPREF_EXISTS:
+            raise RuntimeError("Backreferences are not supported")
+        elif op in g_regex_repeat_ops:
+            _, max_count, item = av
+
+            # (a+)+ backtracks exponentially
+            if max_count > 1 and is_repeated:
+                raise RuntimeError("Nested quantifiers are not supported")
+
+            item_cost = get_regex_cost(item, is_repeated=is_repeated or max_count > 1)
+            cost += item_cost * (g_regex_unbounded_repeat_cost if max_count == regex_constants.MAXREPEAT else max_count)
+        elif op == regex_constants.BRANCH:
+            # (a|aa)+ backtracks exponentially just as well
+            if is_repeated:
+                raise RuntimeError("Alternation inside of quantifier is not supported")
+
+            cost += sum(get_regex_cost(branch, is_repeated=is_repeated) for branch in av[1])
+        elif op in g_regex_group_ops:
+            # subpattern is (group, add flags, del flags, items), atomic group is just items
+            cost += get_regex_cost(av[-1] if op == regex_constants.SUBPATTERN else av, is_repeated=is_repeated)
+        elif op == regex_constants.ASSERT or op == regex_constants.ASSERT_NOT:
+            cost += get_regex_cost(av[1], is_repeated=is_repeated)
+        else:
+            cost += 1
+
+    return cost
+
+
+def compile_regex(pattern: str):
+    if len(pattern) > g_max_regex_length:
+        raise RuntimeError(f"Regex is longer than {g_max_regex_length} chars")
+
+    try:
+        cost = get_regex_cost(regex_parser.parse(pattern, re.IGNORECASE), is_repeated=False)
+        compiled = re.compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        raise RuntimeError(f"Invalid regex: {str(e)}")
+
+    if cost > g_max_regex_cost:
+        raise RuntimeError("Regex is too complex: use fewer quantifiers or bounded ones like {0,10}")
+
+    return compiled
+
+
+def get_url_hosts(text: str, urls: Iterable[str]) -> set:
+    hosts = {match.group(1).lower() for match in g_url_host_regex.finditer(text)}
+
+    for url in urls:
+        hosts.update(match.group(1).lower() for match in g_url_host_regex.finditer(url))
+
+    return hosts
+
+
+class AhoCorasickAutomaton:
+    def __init__(self):
+        # state 0 is root; goto[state] is char -> state
+        self.goto = [dict()]
+        self.fail = [0]
+        # outputs[state] is list of (pattern length, value)
+        self.outputs = [list()]
+        self.is_built = False
+
+    def add(self, pattern: str, value):
+        if self.is_built:
+            raise RuntimeError("Can't add patterns to already built automaton")
+
+        if len(pattern) < 1:
+            raise RuntimeError("Empty pattern can't be added to automaton")
+
+        state = 0
+
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append(dict())
+                self.fail.append(0)
+                self.outputs.append(list())
+
+            state = next_state
+
+        self.outputs[state].append((len(pattern), value))
+
+    def build(self):
+        # bfs over trie to set failure links; outputs are merged so every match is reported at the end state
+        queue = deque(self.goto[0].values())
+
+        while queue:
+            state = queue.popleft()
+
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail_state = self.fail[state]
+
+                while fail_state > 0 and char not in self.goto[fail_state]:
+                    fail_state = self.fail[fail_state]
+
+                self.fail[next_state] = self.goto[fail_state].get(char, 0)
+
+                if self.fail[next_state] == next_state:
+                    self.fail[next_state] = 0
+
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+        self.is_built = True
+
+    # yields (start idx, end idx exclusive, value) for every occurrence of every pattern
+    def iter_matches(self, text: str):
+        if not self.is_built:
+            raise RuntimeError("Automaton must be built before matching")
+
+        state = 0
+
+        for idx, char in enumerate(text):
+            while state > 0 and char not in self.goto[state]:
+                state = self.fail[state]
+
+            state = self.goto[state].get(char, 0)
+
+            for pattern_length, value in self.outputs[state]:
+                yield idx + 1 - pattern_length, idx + 1, value
+
+
+class FilterMatcher:
+    # rules are (user_chat_id, filter_type, pattern) with already normalized patterns
+    def __init__(self, rules: Iterable[tuple]):
+        self.automaton = AhoCorasickAutomaton()
+        self.domains = dict()
+        self.regexes = dict()
+        self.rules_count = 0
+
+        for user_chat_id, filter_type, pattern in rules:
+            self.rules_count += 1
+
+            if filter_type == FilterType.KEYWORD or filter_type == FilterType.HASHTAG:
+                # value is (user chat id, whether preceding char must be checked for word boundary)
+                self.automaton.add(pattern, (user_chat_id, filter_type == FilterType.KEYWORD))
+            elif filter_type == FilterType.DOMAIN:
+                self.domains.setdefault(pattern, set()).add(user_chat_id)
+            elif filter_type == FilterType.REGEX:
+                # identical regexes of different users are compiled & evaluated once
+                if pattern not in self.regexes:
+                    # rules stored before regexes were limited are skipped
+                    try:
+                        self.regexes[pattern] = compile_regex(pattern=pattern), set()
+                    except RuntimeError as e:
+                        get_logger().warning(f"Skip regex filter={pattern} of user_chat_id={user_chat_id}: {str(e)}")
+                        continue
+
+                self.regexes[pattern][1].add(user_chat_id)
+            else:
+                raise RuntimeError(f"Unknown filter type: {filter_type}")
+
+        self.automaton.build()
+
+    def is_empty(self):
+        return self.rules_count == 0
+
+    # returns user chat ids whose rules match the post; post is scanned once for keywords & hashtags
+    def get_matched_user_chat_ids(self, text: str, urls: Iterable[str]) -> set:
+        matched = set()
+
+        if self.is_empty():
+            return matched
+
+        lowered = text.lower()
+
+        for start, end, (user_chat_id, check_start) in self.automaton.iter_matches(lowered):
+            if user_chat_id in matched:
+                continue
+
+            if check_start and start > 0 and is_word_char(lowered[start - 1]):
+                continue
+
+            if end < len(lowered) and is_word_char(lowered[end]):
+                continue
+
+            matched.add(user_chat_id)
+
+        if self.domains:
+            for host in get_url_hosts(text=text, urls=urls):
+                # example.com rule matches example.com and any of its subdomains
+                labels = host.split(".")
+
+                for idx in range(len(labels) - 1):
+                    matched.update(self.domains.get(".".join(labels[idx:]), set()))
+
+        for compiled, user_chat_ids in self.regexes.values():
+            if user_chat_ids.issubset(matched):
+                continue
+
+            if compiled.search(text) is not None:
+                matched.update(user_chat_ids)
+
+        return matched
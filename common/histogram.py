@@ -0,0 +1,66 @@
+from bisect import bisect_left
+from collections import deque
+
+
+# latency bounds in seconds, roughly log scale; last bucket is everything above the last bound
+g_default_latency_bounds_seconds = [0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, 600]
+
+
+# Histogram over the last window_size samples; bucket counts are kept in sync with the window, so reading them is O(1)
+class RollingHistogram:
+    def __init__(self, window_size: int, bounds: list = None):
+        if window_size < 1:
+            raise RuntimeError(f"Invalid window_size={window_size}")
+
+        self.bounds = sorted(bounds if bounds is not None else g_default_latency_bounds_seconds)
+
+        if len(self.bounds) < 1:
+            raise RuntimeError("Histogram must have at least one bucket bound")
+
+        self.window_size = window_size
+        self.samples = deque()
+        self.bucket_counts = [0] * (len(self.bounds) + 1)
+        self.total_count = 0
+
+    def __len__(self):
+        return len(self.samples)
+
+    def get_bucket_index(self, value: float) -> int:
+        return bisect_left(self.bounds, value)
+
+    def add(self, value: float):
+        if len(self.samples) == self.window_size:
+            evicted = self.samples.popleft()
+            self.bucket_counts[self.get_bucket_index(evicted)] -= 1
+
+        self.samples.append(value)
+        self.bucket_counts[self.get_bucket_index(value)] += 1
+        self.total_count += 1
+
+    # percentile is in [0, 100]; returns None if there are no samples
+    def get_percentile(self, percentile: float):
+        if len(self.samples) == 0:
+            return None
+
+        ordered = sorted(self.samples)
+        idx = min(len(ordered) - 1, max(0, int(round(percentile / 100 * (len(ordered) - 1)))))
+
+        return ordered[idx]
+
+    def get_max(self):
+        return max(self.samples) if len(self.samples) > 0 else None
+
+    # returns list of (upper bound or None for the last bucket, count) of non empty buckets
+    def get_buckets(self) -> list:
+        return [
+            (self.bounds[idx] if idx < len(self.bounds) else None, count)
+            for idx, count in enumerate(self.bucket_counts) if count > 0]
+
+    def __repr__(self):
+        buckets = ", ".join(
+            f"<={bound}: {count}" if bound is not None else f">{self.bounds[-1]}: {count}"
+            for bound, count in self.get_buckets())
+
+        return f"samples={len(self.samples)} (total={self.total_count}), p50={self.get_percentile(50)}, " \
+               f"p90={self.get_percentile(90)}, p99={self.get_percentile(99)}, max={self.get_max()}, " \
+               f"buckets=[{buckets}]"
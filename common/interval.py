@@ -12,6 +12,9 @@ class ContinuousInclusiveInterval:
     def includes(self, value: int):
         return self.start <= value <= self.end
 
+    def __repr__(self):
+        return f"[{self.start}, {self.end}]"
+
 
 class MultiInterval:
     def __init__(self, intervals: List[ContinuousInclusiveInterval]):
@@ -22,3 +25,6 @@ class MultiInterval:
 
     def includes(self, value: int):
         return any([interval.includes(value) for interval in self.intervals])
+
+    def __repr__(self):
+        return " ".join(str(interval) for interval in self.intervals)
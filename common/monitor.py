@@ -0,0 +1,158 @@
+from asyncio import all_tasks, sleep
+from collections import Counter
+from os.path import basename, dirname
+from signal import ITIMER_PROF, SIGPROF, setitimer, signal
+from sys import _current_frames
+from threading import Thread, get_ident, main_thread
+from time import monotonic, sleep as sleep_thread
+from traceback import extract_stack, format_list
+
+from .histogram import RollingHistogram
+from .logging import get_logger
+
+
+# loop lag is sampled every g_loop_lag_interval_seconds; loop not getting to the sample for g_loop_stall_seconds past
+# that is stalled by callback, and stack of loop thread is logged while it is. Stats are logged every
+# g_loop_stats_seconds
+g_loop_lag_interval_seconds = 0.1
+g_loop_lag_bounds_seconds = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30]
+g_loop_lag_window_size = 10000
+g_loop_stall_seconds = 0.5
+g_loop_stats_seconds = 60.0
+g_stack_limit = 30
+
+# profiler samples stack of loop thread every g_profile_interval_seconds of process cpu time
+g_profile_interval_seconds = 0.005
+
+
+# function of frame as "name (dir/file.py:line of definition)"
+def get_function(frame) -> str:
+    code = frame.f_code
+
+    return f"{code.co_name} ({basename(dirname(code.co_filename))}/{basename(code.co_filename)}:" \
+           f"{code.co_firstlineno})"
+
+
+def format_stack(frame) -> str:
+    return "".join(format_list(extract_stack(frame, limit=g_stack_limit)))
+
+
+def walk_frames(frame):
+    while frame is not None:
+        yield frame
+        frame = frame.f_back
+
+
+# returns list of (task location, count) of running tasks sorted by count; location is where coroutine of task is
+# suspended, so tasks waiting at the same place are counted together
+def get_tasks_dump() -> list:
+    locations = Counter()
+
+    for task in all_tasks():
+        stack = task.get_stack(limit=1)
+
+        if len(stack) == 0:
+            locations[repr(task)] += 1
+            continue
+
+        locations[f"{get_function(stack[0])} at line {stack[0].f_lineno}"] += 1
+
+    return locations.most_common()
+
+
+# Measures lag of event loop: how late sleeping task wakes up, which is how long callbacks of the loop run without
+# yielding. Watchdog thread logs stack of loop thread while loop is stalled, so blocking calls are seen in the act.
+# Profiles loop thread on demand by cpu time timer signal, which interrupts loop thread wherever it runs; sampling it
+# from another thread would mostly see it where it releases GIL
+class LoopMonitor:
+    def __init__(self):
+        self.lags = RollingHistogram(window_size=g_loop_lag_window_size, bounds=g_loop_lag_bounds_seconds)
+        self.heartbeat_time = monotonic()
+        self.loop_thread_id = None
+        self.is_profiling = False
+        # of current profiling; counters of functions on top of stack & anywhere in stack
+        self.samples_count = 0
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        # since last stats
+        self.stalls_count = 0
+        self.stats_time = monotonic()
+
+    async def run(self):
+        get_logger().info("Starting event loop monitor")
+        self.loop_thread_id = get_ident()
+        self.heartbeat_time = monotonic()
+        Thread(target=self.watch, name="loop watchdog", daemon=True).start()
+
+        while True:
+            start_time = monotonic()
+            await sleep(g_loop_lag_interval_seconds)
+            self.heartbeat_time = monotonic()
+            lag_seconds = max(0.0, self.heartbeat_time - start_time - g_loop_lag_interval_seconds)
+            self.lags.add(lag_seconds)
+
+            if lag_seconds >= g_loop_stall_seconds:
+                get_logger().warning(f"Event loop was stalled for {lag_seconds:.3f}s")
+
+            if self.heartbeat_time - self.stats_time >= g_loop_stats_seconds:
+                get_logger().info(f"Event loop lag stats: stalls {self.stalls_count}; {self.lags}")
+                self.stalls_count = 0
+                self.stats_time = self.heartbeat_time
+
+    # runs in watchdog thread; stack is logged once per stall
+    def watch(self):
+        reported_heartbeat_time = None
+
+        while True:
+            sleep_thread(g_loop_stall_seconds / 5)
+            heartbeat_time = self.heartbeat_time
+            stalled_seconds = monotonic() - heartbeat_time - g_loop_lag_interval_seconds
+
+            if stalled_seconds < g_loop_stall_seconds or heartbeat_time == reported_heartbeat_time:
+                continue
+
+            reported_heartbeat_time = heartbeat_time
+            self.stalls_count += 1
+            frame = _current_frames().get(self.loop_thread_id)
+            stack = format_stack(frame) if frame is not None else "none"
+            get_logger().warning(f"Event loop is stalled for {stalled_seconds:.3f}s; stack of loop thread:\n{stack}")
+
+    # samples loop thread for seconds; returns samples_count, list of (function, self count, total count) of top_count
+    # functions by self count, list of (task location, count). Idle loop takes no cpu time, so it is not sampled;
+    # signals can only be handled by main thread, which runs the loop
+    async def profile(self, seconds: float, top_count: int) -> tuple:
+        if self.loop_thread_id != main_thread().ident:
+            raise RuntimeError("Event loop monitor is not running in main thread")
+
+        if self.is_profiling:
+            raise RuntimeError("Profiling is in progress already")
+
+        self.is_profiling = True
+        self.samples_count = 0
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        get_logger().info(f"Profiling event loop for {seconds}s")
+        previous_handler = signal(SIGPROF, self.on_profile_signal)
+        setitimer(ITIMER_PROF, g_profile_interval_seconds, g_profile_interval_seconds)
+
+        try:
+            await sleep(seconds)
+        finally:
+            setitimer(ITIMER_PROF, 0)
+            signal(SIGPROF, previous_handler)
+            self.is_profiling = False
+
+        top_functions = [
+            (function, self_count, self.total_counts[function])
+            for function, self_count in self.self_counts.most_common(top_count)]
+
+        return self.samples_count, top_functions, get_tasks_dump()
+
+    def on_profile_signal(self, signal_number: int, frame):
+        if frame is None:
+            return
+
+        self.samples_count += 1
+        self.self_counts[get_function(frame)] += 1
+        # recursive function is counted once per sample
+        self.total_counts.update({get_function(stack_frame) for stack_frame in walk_frames(frame)})
@@ -1,7 +1,10 @@
 from abc import ABC, abstractmethod
+from datetime import date
+from typing import Optional
 from common.telegram import ChatType
 from common.resources.localization import Language
 from common.interval import MultiInterval
+from common.filter import FilterType
 
 
 # Must be thread safe
@@ -15,7 +18,7 @@ class IPersistentStorage(ABC):
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         pass
 
-    # subscription to notifies; notifies_to_handlers is notify: str to handler: coroutine
+    # subscription to notifies; notifies_to_handlers is notify: str to handler(payload: str): coroutine
     # NOTE: subscribe and listen should get the same connection to work
     @abstractmethod
     async def subscribe(self, notifies_to_handlers: dict):
@@ -26,44 +29,287 @@ class IPersistentStorage(ABC):
         pass
 
     # User subs ops
-    # returns is_enrolled: bool, locale: Language
+    # returns is_enrolled: bool, locale: Optional[Language], chat_type: Optional[ChatType]; locale & chat type are
+    # None if user chat never existed
     @abstractmethod
-    async def get_user_enrolled_and_locale(self, user_chat_id: int) -> tuple:
+    async def get_user_chat_state(self, user_chat_id: int) -> tuple:
         pass
 
+    # returns total_count, list of (subscription_id, title, chat_id) of at most limit subscriptions ordered by id that
+    # go after (is_forward) or before cursor_subscription_id; None cursor means first (is_forward) or last page
     @abstractmethod
-    async def get_user_chat_id_enabled_subscriptions(self, user_chat_id: int) -> list:
+    async def get_user_chat_id_enabled_subscriptions_page(
+            self,
+            user_chat_id: int,
+            cursor_subscription_id: Optional[int],
+            is_forward: bool,
+            limit: int) -> tuple:
         pass
 
-    # returns existed_before, enabled_before
+    # returns existed_before, enabled_before; new or re-enabled user chat is pinned to bot_index of bot pool
     @abstractmethod
-    async def add_or_enable_user_chat(self, chat_id: int, chat_type: ChatType, language: Language) -> tuple:
+    async def add_or_enable_user_chat(
+            self, chat_id: int, chat_type: ChatType, language: Language, bot_index: int) -> tuple:
         pass
 
     @abstractmethod
     async def disable_user_chat(self, chat_id: int) -> bool:
         pass
 
+    # disables all given user chats at once; returns amount of user chats that were enabled before
+    @abstractmethod
+    async def disable_user_chats(self, chat_ids: list) -> int:
+        pass
+
+    # moves user chat to new telegram chat id (group upgraded to supergroup); returns whether it was moved
+    @abstractmethod
+    async def migrate_user_chat(self, chat_id: int, new_chat_id: int, new_chat_type: ChatType) -> bool:
+        pass
+
     @abstractmethod
     async def add_or_enable_subscription(
             self, user_chat_id: int, target_chat_id: int, target_title: str, target_joiner: str) -> tuple:
         pass
 
+    # returns set of (enabled, chat_type, language, user_chat_id, bot_index)
     @abstractmethod
     async def get_all_user_chats(self) -> set:
         pass
 
+    # returns bot_index -> count of enabled user chats pinned to that bot
+    @abstractmethod
+    async def get_bot_loads(self) -> dict:
+        pass
+
     # returns enabled_before, did_disable
     @abstractmethod
     async def disable_subscription(self, user_chat_id: int, target_chat_id: int) -> tuple:
         pass
 
     # Channel subs ops
+    # returns user_chat_id -> bot_index of subscribers
     @abstractmethod
-    async def get_channel_subscribers(self, chat_id) -> set:
+    async def get_channel_subscribers(self, chat_id) -> dict:
         pass
 
+    # returns telegram chat id -> (enabled, joiner) of chats changed after prev_seq & seq of the last change;
+    # prev_seq=None means every chat of the interval
     @abstractmethod
     async def get_monitored_channels_delta(
-            self, handicap_seconds: int, prev_max_time: str, monitored_chats_id_interval: MultiInterval) -> tuple:
+            self, prev_seq: Optional[int], monitored_chats_id_interval: MultiInterval) -> tuple:
+        pass
+
+    # returns seq of the last monitored chat change consumed by consumer or None if it never consumed any
+    @abstractmethod
+    async def get_monitored_chat_changes_cursor(self, consumer: str) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    async def set_monitored_chat_changes_cursor(self, consumer: str, seq: int):
+        pass
+
+    # deletes monitored chat changes every consumer is past; returns amount of deleted changes
+    @abstractmethod
+    async def delete_consumed_monitored_chat_changes(self) -> int:
+        pass
+
+    # Filters ops
+    # returns is_target_followed, existed_before, enabled_before; target_chat_id=None means filter for all subscriptions
+    @abstractmethod
+    async def add_or_enable_filter(
+            self, user_chat_id: int, target_chat_id: Optional[int], filter_type: FilterType, pattern: str) -> tuple:
+        pass
+
+    # returns did_disable
+    @abstractmethod
+    async def disable_filter(self, user_chat_id: int, filter_id: int) -> bool:
+        pass
+
+    # returns list of (filter_id, filter_type, pattern, target_chat_id or None, target_title or None)
+    @abstractmethod
+    async def get_user_chat_enabled_filters(self, user_chat_id: int) -> list:
+        pass
+
+    # returns list of (user_chat_id, filter_type, pattern) of enabled filters of channel subscribers
+    @abstractmethod
+    async def get_channel_filters(self, chat_id: int) -> list:
+        pass
+
+    # Digest ops
+    # period_minutes=None turns user chat digest off; returns whether enabled user chat was found
+    @abstractmethod
+    async def set_user_chat_digest_period(self, user_chat_id: int, period_minutes: Optional[int]) -> bool:
+        pass
+
+    # period_minutes=None falls back to user chat setting, 0 means no digest; returns whether subscription was found
+    @abstractmethod
+    async def set_subscription_digest_period(
+            self, user_chat_id: int, target_chat_id: int, period_minutes: Optional[int]) -> bool:
+        pass
+
+    # returns user_chat_id -> period dict, (user_chat_id, chat_id) -> period dict; only set periods are returned
+    @abstractmethod
+    async def get_digest_periods(self) -> tuple:
+        pass
+
+    # items are (user_chat_id, chat_id, message_id, due_time)
+    @abstractmethod
+    async def add_digest_items(self, items: list):
+        pass
+
+    # returns list of
+    # (item_id, user_chat_id, user_chat_enabled, language, bot_index, chat_id, title, joiner, message_id)
+    @abstractmethod
+    async def get_due_digest_items(self, limit: int) -> list:
+        pass
+
+    @abstractmethod
+    async def delete_digest_items(self, item_ids: list):
+        pass
+
+    # Quiet hours ops
+    # minutes are utc minutes of day, both None turn quiet hours off; returns whether enabled user chat was found
+    @abstractmethod
+    async def set_user_chat_quiet_hours(
+            self, user_chat_id: int, from_minute: Optional[int], to_minute: Optional[int]) -> bool:
+        pass
+
+    # returns user_chat_id -> (from_minute, to_minute) dict of enabled user chats that have quiet hours
+    @abstractmethod
+    async def get_quiet_hours(self) -> dict:
+        pass
+
+    # Analytics ops
+    # makes sure month partitions of analytics events exist for month of day and the next one
+    @abstractmethod
+    async def create_analytics_events_partitions(self, day: date):
+        pass
+
+    # events are (event_type, event_time, user_chat_id, chat_id, latency_seconds, detail)
+    @abstractmethod
+    async def add_analytics_events(self, events: list):
+        pass
+
+    # Channel rollups ops
+    # rows are (chat_id, hour, posts, deliveries, failures, duplicates, unfollows); counts are added to stored ones
+    @abstractmethod
+    async def add_channel_rollups(self, rows: list):
+        pass
+
+    # returns list of (chat_id, title, posts, deliveries, failures, duplicates, unfollows) of enabled subscriptions for
+    # the last days, including today; sorted by posts
+    @abstractmethod
+    async def get_user_chat_channel_stats(self, user_chat_id: int, days: int) -> list:
+        pass
+
+    # Bundle ops
+    # returns list of (name, channels count) of every bundle
+    @abstractmethod
+    async def get_bundles(self) -> list:
+        pass
+
+    # returns names of bundles user chat is subscribed to
+    @abstractmethod
+    async def get_user_chat_bundles(self, user_chat_id: int) -> list:
+        pass
+
+    # returns bundle_exists, enabled_before
+    @abstractmethod
+    async def add_or_enable_bundle_subscription(self, user_chat_id: int, bundle_name: str) -> tuple:
+        pass
+
+    # returns true if subscription was enabled before
+    @abstractmethod
+    async def disable_bundle_subscription(self, user_chat_id: int, bundle_name: str) -> bool:
+        pass
+
+    # creates bundle if needed & monitors channel; returns true if channel was in bundle already
+    @abstractmethod
+    async def add_or_enable_bundle_channel(
+            self, bundle_name: str, target_chat_id: int, target_title: str, target_joiner: str) -> bool:
+        pass
+
+    # returns true if channel was in bundle; channel is no longer monitored if nothing else needs it
+    @abstractmethod
+    async def disable_bundle_channel(self, bundle_name: str, target_chat_id: int) -> bool:
+        pass
+
+    # returns dict: channel chat id -> set of ids of enabled bundles containing it
+    @abstractmethod
+    async def get_channel_bundles(self) -> dict:
+        pass
+
+    # returns dict: user chat id -> bot index of enabled subscribers of bundle
+    @abstractmethod
+    async def get_bundle_subscribers(self, bundle_id: int) -> dict:
+        pass
+
+    # Delivery outbox ops
+    # items are (bot_index, user_chat_id, chat_id, user_peer, from_peer, message_ids, as_album, not_before); peers
+    # are serialized, not_before is None for items to be sent as soon as possible. Handed off posts of
+    # handoff_post_ids are deleted at once, so post that is fanned out is never handed off again
+    @abstractmethod
+    async def add_outbox_items(self, items: list, handoff_post_ids: list):
+        pass
+
+    # leases up to limit items of partition for lease_seconds, so no other consumer claims them meanwhile; returns
+    # list of (id, bot_index, user_chat_id, chat_id, user_peer, from_peer, message_ids, as_album, attempts) sorted by
+    # id. deferred=True claims deferred items that are due; otherwise items to be sent as soon as possible & retries
+    # that are due. Either way items that have older items of the same user chat still waiting are not claimed, so
+    # posts are delivered to user chat in order
+    @abstractmethod
+    async def claim_outbox_items(
+            self,
+            partition_index: int,
+            partitions_count: int,
+            limit: int,
+            lease_seconds: float,
+            deferred: bool) -> list:
+        pass
+
+    # marks items done
+    @abstractmethod
+    async def delete_outbox_items(self, item_ids: list):
+        pass
+
+    # gives claimed items back, so they are claimed again right away instead of after lease expiry
+    @abstractmethod
+    async def release_outbox_items(self, item_ids: list):
+        pass
+
+    # gives failed items back to be retried; items are (id, attempts, delay_seconds): item is not claimed again for
+    # delay_seconds and attempts is the amount of failed attempts so far
+    @abstractmethod
+    async def retry_outbox_items(self, items: list):
+        pass
+
+    # Post handoff ops
+    # posts are (chat_id, username, message_ids, text, urls) of public channels; text & urls are what filters run on
+    @abstractmethod
+    async def add_handoff_posts(self, posts: list):
+        pass
+
+    # leases up to limit posts for lease_seconds, so no other bot claims them meanwhile; returns list of
+    # (id, chat_id, username, message_ids, text, urls) sorted by id
+    @abstractmethod
+    async def claim_handoff_posts(self, limit: int, lease_seconds: float) -> list:
+        pass
+
+    # marks posts handled
+    @abstractmethod
+    async def delete_handoff_posts(self, post_ids: list):
+        pass
+
+    # Telegram session ops
+    # returns session, update_states, entities: session is (dc_id, server_address, port, auth_key, takeout_id) or None
+    # if there is no session of that name; update_states is list of (entity_id, pts, qts, date, seq) of session;
+    # entities is list of (id, hash, username, phone, name) of scope
+    @abstractmethod
+    async def load_telegram_session(self, name: str, scope: str) -> tuple:
+        pass
+
+    # upserts session if it's not None, update states of session & entities of scope at once
+    @abstractmethod
+    async def save_telegram_session(
+            self, name: str, scope: str, session: Optional[tuple], update_states: list, entities: list):
         pass
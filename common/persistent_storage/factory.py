@@ -1,6 +1,7 @@
 from enum import Enum
 from .pickle import PicklePersistentStorage
 from .postgres import PostgresPersistentStorage
+from .pool import PoolConfig
 
 
 class PersistentStorageType(Enum):
@@ -10,7 +11,15 @@ class PersistentStorageType(Enum):
 
 class PostgresConfig:
     # pw is ok to be none
-    def __init__(self, database: str, user: str, password: str, host: str, port: int):
+    def __init__(
+            self,
+            database: str,
+            user: str,
+            password: str,
+            host: str,
+            port: int,
+            read_pool_config: PoolConfig,
+            write_pool_config: PoolConfig):
         if len(database) < 1:
             raise RuntimeError("Invalid database: " + database)
 
@@ -23,15 +32,21 @@ class PostgresConfig:
         if port < 1:
             raise RuntimeError("Invalid port: " + str(port))
 
+        if read_pool_config is None or write_pool_config is None:
+            raise RuntimeError("No read or write pool config passed")
+
         # do not check pw as it might not be specified
         self.database = database
         self.user = user
         self.password = password
         self.host = host
         self.port = port
+        self.read_pool_config = read_pool_config
+        self.write_pool_config = write_pool_config
 
     def __repr__(self):
-        return "database={}, user={}, pw=***, host={}, port={}".format(self.database, self.user, self.host, self.port)
+        return "database={}, user={}, pw=***, host={}, port={}, read_pool={}, write_pool={}".format(
+            self.database, self.user, self.host, self.port, self.read_pool_config, self.write_pool_config)
 
 
 class PersistenceConfig:
@@ -0,0 +1,145 @@
+from contextlib import asynccontextmanager
+from enum import Enum
+from time import monotonic
+
+from aiopg import create_pool
+
+from common.histogram import RollingHistogram
+from common.logging import get_logger
+
+
+class PoolWorkload(Enum):
+    READ = 0  # short lookups of hot path, e.g. subscribers of channel on every post
+    WRITE = 1  # everything else: writes & transactions mixing reads and writes
+
+
+# acquire wait bounds in seconds
+g_acquire_wait_bounds_seconds = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5]
+
+
+class PoolConfig:
+    # statement_timeout_ms of 0 means no timeout
+    def __init__(
+            self,
+            min_size: int,
+            max_size: int,
+            statement_timeout_ms: int,
+            acquire_warning_ms: int,
+            stats_seconds: float,
+            stats_window_size: int):
+        if min_size < 0:
+            raise RuntimeError(f"Invalid min_size={min_size}")
+
+        if max_size < 1 or max_size < min_size:
+            raise RuntimeError(f"Invalid max_size={max_size}")
+
+        if statement_timeout_ms < 0:
+            raise RuntimeError(f"Invalid statement_timeout_ms={statement_timeout_ms}")
+
+        if acquire_warning_ms < 0:
+            raise RuntimeError(f"Invalid acquire_warning_ms={acquire_warning_ms}")
+
+        if stats_seconds <= 0:
+            raise RuntimeError(f"Invalid stats_seconds={stats_seconds}")
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_timeout_ms = statement_timeout_ms
+        self.acquire_warning_ms = acquire_warning_ms
+        self.stats_seconds = stats_seconds
+        self.stats_window_size = stats_window_size
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+
+# Connection pool that measures how long connections are waited for and how many are in use. Stats are logged every
+# stats_seconds on acquire, so idle pool logs nothing. Acquire that waits longer than acquire_warning_ms or finds every
+# connection in use is counted as saturated and warned about once per stats period
+class InstrumentedPool:
+    def __init__(self, workload: PoolWorkload, config: PoolConfig):
+        if config is None:
+            raise RuntimeError(f"No config of {workload.name} pool passed")
+
+        self.workload = workload
+        self.config = config
+        # created on open
+        self.pool = None
+        self.acquire_waits = RollingHistogram(
+            window_size=config.stats_window_size, bounds=g_acquire_wait_bounds_seconds)
+        self.in_use_count = 0
+        self.waiting_count = 0
+        # since last stats
+        self.acquires_count = 0
+        self.saturated_count = 0
+        self.stats_time = monotonic()
+
+    async def open(self, **kwargs):
+        self.pool = await create_pool(minsize=self.config.min_size, maxsize=self.config.max_size, **kwargs)
+        await self.pool.__aenter__()
+
+    async def close(self, exc_type, exc_val, exc_tb):
+        if self.pool is not None:
+            await self.pool.__aexit__(exc_type, exc_val, exc_tb)
+
+    @asynccontextmanager
+    async def acquire(self):
+        start_time = monotonic()
+        is_acquired = False
+        self.waiting_count += 1
+
+        try:
+            async with self.pool.acquire() as connection:
+                is_acquired = True
+                self.waiting_count -= 1
+                self.in_use_count += 1
+                self.on_acquired(wait_seconds=monotonic() - start_time)
+
+                try:
+                    yield connection
+                finally:
+                    self.in_use_count -= 1
+        finally:
+            # acquire failed or was cancelled
+            if not is_acquired:
+                self.waiting_count -= 1
+
+    # limits statements of current transaction of cursor to statement_timeout_ms
+    async def set_statement_timeout(self, cursor):
+        if self.config.statement_timeout_ms > 0:
+            await cursor.execute(f"SET LOCAL statement_timeout = {int(self.config.statement_timeout_ms)}")
+
+    def get_stats(self) -> dict:
+        return {
+            "size": self.pool.size,
+            "in_use": self.in_use_count,
+            "idle": self.pool.freesize,
+            "waiting": self.waiting_count,
+            "acquires": self.acquires_count,
+            "saturated": self.saturated_count,
+            "wait_p50_ms": get_ms(self.acquire_waits.get_percentile(50)),
+            "wait_p99_ms": get_ms(self.acquire_waits.get_percentile(99)),
+            "wait_max_ms": get_ms(self.acquire_waits.get_max())}
+
+    # Internal
+    def on_acquired(self, wait_seconds: float):
+        self.acquire_waits.add(wait_seconds)
+        self.acquires_count += 1
+
+        if wait_seconds * 1000 >= self.config.acquire_warning_ms or self.in_use_count >= self.config.max_size:
+            if self.saturated_count == 0:
+                get_logger().warning(f"{self.workload.name} pool is saturated: waited {wait_seconds * 1000:.1f}ms "
+                                     f"for connection; {self.in_use_count}/{self.config.max_size} in use, "
+                                     f"{self.waiting_count} waiting")
+
+            self.saturated_count += 1
+
+        if monotonic() - self.stats_time >= self.config.stats_seconds:
+            get_logger().info(f"{self.workload.name} pool stats: {self.get_stats()}")
+            self.acquires_count = 0
+            self.saturated_count = 0
+            self.stats_time = monotonic()
+
+
+def get_ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
@@ -1,19 +1,22 @@
+from datetime import date, datetime, timedelta, timezone
 from functools import wraps
-from time import time, sleep
+from time import time
 from typing import Optional
 from logging import INFO
 from itertools import chain
 import psycopg2
 import psycopg2.extensions
-from aiopg import create_pool
+from asyncio import gather, sleep
+from aiopg import connect
 from aiopg.transaction import IsolationLevel, Transaction
-from asyncio import get_event_loop
 from psycopg2.sql import SQL, Identifier
 from common.logging import get_logger
 from common.telegram import ChatType
 from common.resources.localization import Language
 from common.interval import MultiInterval, ContinuousInclusiveInterval
+from common.filter import FilterType
 from .base import IPersistentStorage
+from .pool import PoolConfig, PoolWorkload, InstrumentedPool
 
 
 # chats
@@ -29,6 +32,10 @@ g_user_chats_id = "id"
 g_user_chats_chats_id = "chats_id"
 g_user_chats_language = "language"
 g_user_chats_enabled = "enabled"
+g_user_chats_digest_period_minutes = "digest_period_minutes"
+g_user_chats_bot_index = "bot_index"
+g_user_chats_quiet_from_minute = "quiet_from_minute"
+g_user_chats_quiet_to_minute = "quiet_to_minute"
 g_user_chats_chats_id_unique = "user_chats_chats_id_unique"
 
 # monitored chats
@@ -47,8 +54,135 @@ g_subscriptions_id = "id"
 g_subscriptions_user_chats_id = "user_chats_id"
 g_subscriptions_monitored_chats_id = "monitored_chats_id"
 g_subscriptions_enabled = "enabled"
+g_subscriptions_digest_period_minutes = "digest_period_minutes"
 g_subscriptions_user_monitored_chats_id_unique = "subscriptions_user_monitored_chats_is_unique"
 
+# bundles
+g_bundles = "bundles"
+g_bundles_id = "id"
+g_bundles_name = "name"
+g_bundles_name_unique = "bundles_name_unique"
+
+# bundle channels
+g_bundle_channels = "bundle_channels"
+g_bundle_channels_bundles_id = "bundles_id"
+g_bundle_channels_monitored_chats_id = "monitored_chats_id"
+g_bundle_channels_enabled = "enabled"
+g_bundle_channels_pk = "bundle_channels_pk"
+
+# bundle subscriptions
+g_bundle_subscriptions = "bundle_subscriptions"
+g_bundle_subscriptions_user_chats_id = "user_chats_id"
+g_bundle_subscriptions_bundles_id = "bundles_id"
+g_bundle_subscriptions_enabled = "enabled"
+g_bundle_subscriptions_unique = "bundle_subscriptions_bundles_id_user_chats_id_unique"
+
+# delivery outbox
+g_delivery_outbox = "delivery_outbox"
+g_delivery_outbox_id = "id"
+g_delivery_outbox_bot_index = "bot_index"
+g_delivery_outbox_user_chat_id = "user_chat_id"
+g_delivery_outbox_chat_id = "chat_id"
+g_delivery_outbox_user_peer = "user_peer"
+g_delivery_outbox_from_peer = "from_peer"
+g_delivery_outbox_message_ids = "message_ids"
+g_delivery_outbox_as_album = "as_album"
+g_delivery_outbox_lease_until = "lease_until"
+g_delivery_outbox_not_before = "not_before"
+g_delivery_outbox_attempts = "attempts"
+
+# post handoff
+g_post_handoff = "post_handoff"
+g_post_handoff_id = "id"
+g_post_handoff_chat_id = "chat_id"
+g_post_handoff_username = "username"
+g_post_handoff_message_ids = "message_ids"
+g_post_handoff_text = "text"
+g_post_handoff_urls = "urls"
+g_post_handoff_lease_until = "lease_until"
+
+# telegram sessions
+g_telegram_sessions = "telegram_sessions"
+g_telegram_sessions_name = "name"
+g_telegram_sessions_dc_id = "dc_id"
+g_telegram_sessions_server_address = "server_address"
+g_telegram_sessions_port = "port"
+g_telegram_sessions_auth_key = "auth_key"
+g_telegram_sessions_takeout_id = "takeout_id"
+g_telegram_update_states = "telegram_update_states"
+g_telegram_update_states_session_name = "session_name"
+g_telegram_update_states_entity_id = "entity_id"
+g_telegram_update_states_pts = "pts"
+g_telegram_update_states_qts = "qts"
+g_telegram_update_states_date = "date"
+g_telegram_update_states_seq = "seq"
+g_telegram_entities = "telegram_entities"
+g_telegram_entities_scope = "scope"
+g_telegram_entities_id = "id"
+g_telegram_entities_hash = "hash"
+g_telegram_entities_username = "username"
+g_telegram_entities_phone = "phone"
+g_telegram_entities_name = "name"
+
+# channel subscribers
+g_channel_subscribers = "channel_subscribers"
+g_channel_subscribers_telegram_chat_id = "telegram_chat_id"
+g_channel_subscribers_user_telegram_chat_ids = "user_telegram_chat_ids"
+g_channel_subscribers_bot_indexes = "bot_indexes"
+
+# filters
+g_filters = "filters"
+g_filters_id = "id"
+g_filters_user_chats_id = "user_chats_id"
+g_filters_monitored_chats_id = "monitored_chats_id"
+g_filters_filter_type = "filter_type"
+g_filters_pattern = "pattern"
+g_filters_enabled = "enabled"
+
+# digest items
+g_digest_items = "digest_items"
+g_digest_items_id = "id"
+g_digest_items_user_chats_id = "user_chats_id"
+g_digest_items_monitored_chats_id = "monitored_chats_id"
+g_digest_items_message_id = "message_id"
+g_digest_items_due_time = "due_time"
+
+# monitored chat changes
+g_monitored_chat_changes = "monitored_chat_changes"
+g_monitored_chat_changes_seq = "seq"
+g_monitored_chat_changes_monitored_chats_id = "monitored_chats_id"
+
+# monitored chat change cursors
+g_monitored_chat_change_cursors = "monitored_chat_change_cursors"
+g_monitored_chat_change_cursors_consumer = "consumer"
+g_monitored_chat_change_cursors_seq = "seq"
+
+# analytics events
+g_analytics_events = "analytics_events"
+g_analytics_events_event_type = "event_type"
+g_analytics_events_event_time = "event_time"
+g_analytics_events_user_chat_id = "user_chat_id"
+g_analytics_events_chat_id = "chat_id"
+g_analytics_events_latency_seconds = "latency_seconds"
+g_analytics_events_detail = "detail"
+
+# channel rollups; hourly & daily tables have the same columns
+g_channel_rollups_hourly = "channel_rollups_hourly"
+g_channel_rollups_daily = "channel_rollups_daily"
+g_channel_rollups_monitored_chats_id = "monitored_chats_id"
+g_channel_rollups_bucket = "bucket"
+# in order of feed_bot/rollup.py ChannelCounter
+g_channel_rollups_counters = ["posts", "deliveries", "failures", "duplicates", "unfollows"]
+
+# max value of int8 column
+g_max_int8 = 2 ** 63 - 1
+
+# aliases for queries joining chats table twice
+g_user_chat_alias = "user_chat"
+g_monitored_chat_alias = "monitored_chat"
+# alias of waiting items of the same user chat in outbox claim
+g_waiting_alias = "waiting"
+
 
 def timed(log_level: int = INFO):
     def decorator(func):
@@ -66,8 +200,10 @@ def timed(log_level: int = INFO):
     return decorator
 
 
+# workload tells which pool transaction takes connection from
 def retriable_transaction(
         isolation_level: IsolationLevel = IsolationLevel.read_committed,
+        workload: PoolWorkload = PoolWorkload.WRITE,
         readonly: bool = False,
         max_retries_count: int = 10,
         timeout_ms: int = 100):
@@ -75,21 +211,24 @@ def retriable_transaction(
         @wraps(transaction)
         async def wrapper(*args, **kwargs):
             self = args[0]
+            pool = self.pools[workload]
             try_number = 0
 
             while try_number <= max_retries_count:
+                # retry backs off without blocking event loop
                 if try_number > 0:
-                    sleep(timeout_ms / 1000)
+                    await sleep(timeout_ms / 1000)
                     get_logger().warning(
                         f"Retrying transaction {transaction.__name__}: {try_number}/{max_retries_count}")
 
                 try:
-                    async with self.connection_pool.acquire() as connection:
+                    async with pool.acquire() as connection:
                         async with connection.cursor() as cursor:
                             async with Transaction(
                                     cur=cursor,
                                     isolation_level=isolation_level,
                                     readonly=readonly) as scope_of_transaction:
+                                await pool.set_statement_timeout(cursor=cursor)
                                 get_logger().debug(
                                     f"Performing transaction {transaction.__name__} "
                                     f"args={str(args)} kwargs={str(kwargs)}")
@@ -152,12 +291,8 @@ async def update_title_joiner(cursor, chat_id: int, title: str, joiner: str):
         raise RuntimeError(f"{cursor.query} affected unexpected amount of rows={cursor.rowcount}")
 
 
-async def get_user_chat_exists_enabled_type(cursor, chat_id: int, chat_type: ChatType = None):
-    existed_before = False
-    enabled_before = False
-    language_before = None
-
-    # check if chat is there and enabled
+# returns enabled, chat_type, language of user chat or None if there is no such user chat
+async def get_user_chat_enabled_type_language(cursor, chat_id: int) -> Optional[tuple]:
     query = SQL("SELECT {}, {}, {} FROM {}, {} WHERE {}=%s AND {}={}").format(
         Identifier(g_user_chats, g_user_chats_enabled),
         Identifier(g_chats, g_chats_chat_type),
@@ -172,24 +307,35 @@ async def get_user_chat_exists_enabled_type(cursor, chat_id: int, chat_type: Cha
 
     if cursor.rowcount > 1:
         raise RuntimeError(f"{cursor.query} returned unexpected amount of rows={cursor.rowcount}")
-    elif cursor.rowcount == 1:
-        existed_before = True
-        result = await cursor.fetchone()
-        get_logger().debug(f"{cursor.query} returned result={result}")
+    elif cursor.rowcount == 0:
+        get_logger().debug(f"There are no chats with chat_id={chat_id}")
+        return None
 
-        if len(result) != 3 or not isinstance(result[0], bool) or not isinstance(result[1], int):
-            raise RuntimeError(f"{cursor.query} returned invalid amount of columns or invalid result={result}")
+    result = await cursor.fetchone()
+    get_logger().debug(f"{cursor.query} returned result={result}")
 
-        enabled_before = result[0]
-        curr_chat_type = ChatType(value=result[1])
-        language_before = Language(value=result[2])
+    if len(result) != 3 or not isinstance(result[0], bool) or not isinstance(result[1], int):
+        raise RuntimeError(f"{cursor.query} returned invalid amount of columns or invalid result={result}")
+
+    return result[0], ChatType(value=result[1]), Language(value=result[2])
+
+
+async def get_user_chat_exists_enabled_type(cursor, chat_id: int, chat_type: ChatType = None):
+    existed_before = False
+    enabled_before = False
+    language_before = None
+
+    # check if chat is there and enabled
+    row = await get_user_chat_enabled_type_language(cursor=cursor, chat_id=chat_id)
+
+    if row is not None:
+        existed_before = True
+        enabled_before, curr_chat_type, language_before = row
 
         # should not happen
         if chat_type is not None and chat_type != curr_chat_type:
             get_logger().error(f"CHAT TYPE MISMATCH: old={curr_chat_type} new={chat_type}. Update to new one")
             await update_chat_type(cursor=cursor, chat_id=chat_id, chat_type=chat_type)
-    else:
-        get_logger().debug(f"There are no chats with chat_id={chat_id}")
 
     return existed_before, enabled_before, language_before
 
@@ -332,20 +478,24 @@ async def insert_new_chat(cursor, chat_id: int, chat_type: ChatType, existed_bef
             raise RuntimeError(f"Failed to insert chat id={chat_id}")
 
 
-async def insert_or_enable_user_chat(cursor, chat_id: int, language: Language):
-    sql = SQL("INSERT INTO {} ({}, {})"
-              " SELECT {}, %s FROM {} WHERE {}=%s"
-              " ON CONFLICT ON CONSTRAINT {} DO UPDATE SET {}=TRUE")
+async def insert_or_enable_user_chat(cursor, chat_id: int, language: Language, bot_index: int):
+    # re-enabled user chat is pinned to the bot it was re-enabled with, because user surely started that bot
+    sql = SQL("INSERT INTO {} ({}, {}, {})"
+              " SELECT {}, %s, %s FROM {} WHERE {}=%s"
+              " ON CONFLICT ON CONSTRAINT {} DO UPDATE SET {}=TRUE, {}=EXCLUDED.{}")
     query = sql.format(
         Identifier(g_user_chats),
         Identifier(g_user_chats_chats_id),
         Identifier(g_user_chats_language),
+        Identifier(g_user_chats_bot_index),
         Identifier(g_chats, g_chats_id),
         Identifier(g_chats),
         Identifier(g_chats, g_chats_telegram_chat_id),
         Identifier(g_user_chats_chats_id_unique),
-        Identifier(g_user_chats_enabled))
-    values = language.value, chat_id
+        Identifier(g_user_chats_enabled),
+        Identifier(g_user_chats_bot_index),
+        Identifier(g_user_chats_bot_index))
+    values = language.value, bot_index, chat_id
     await execute(cursor, query, values)
 
     # upsert returns 1 on insert and update. other numbers are failures
@@ -463,6 +613,36 @@ async def add_or_enable_monitored_chat(cursor, chat_id: int, chat_type: ChatType
     return existed_before, enabled_before
 
 
+async def get_user_chat_enabled_subscriptions_count(cursor, user_chat_id: int) -> int:
+    sql = SQL("SELECT COUNT({}) FROM {} WHERE {}=True AND {}=(SELECT {} FROM {}, {} WHERE {}=%s AND {}={})")
+    query = sql.format(
+        Identifier(g_subscriptions, g_subscriptions_id),
+        Identifier(g_subscriptions),
+        # where
+        Identifier(g_subscriptions, g_subscriptions_enabled),
+        Identifier(g_subscriptions, g_subscriptions_user_chats_id),
+        # select
+        Identifier(g_user_chats, g_user_chats_id),
+        Identifier(g_user_chats),
+        Identifier(g_chats),
+        Identifier(g_chats, g_chats_telegram_chat_id),
+        Identifier(g_chats, g_chats_id),
+        Identifier(g_user_chats, g_user_chats_chats_id))
+    values = user_chat_id,
+    await execute(cursor, query, values)
+
+    if cursor.rowcount != 1:
+        raise RuntimeError(f"{cursor.query} returned unexpected amount of rows={cursor.rowcount}")
+
+    result = await cursor.fetchone()
+    get_logger().debug(f"{cursor.query} returned result={result}")
+
+    if len(result) != 1 or not isinstance(result[0], int) or result[0] < 0:
+        raise RuntimeError(f"{cursor.query} returned invalid amount of columns or invalid result={result}")
+
+    return result[0]
+
+
 async def get_channel_subscribers_count(cursor, chat_id: int) -> int:
     sql = SQL("SELECT COUNT({}) FROM {} WHERE {}=True AND {}=(SELECT {} FROM {}, {} WHERE {}=%s AND {}={})")
     query = sql.format(
@@ -498,83 +678,284 @@ async def get_channel_subscribers_count(cursor, chat_id: int) -> int:
     return sub_count
 
 
-async def get_max_monitored_modification_time(cursor):
-    sql = SQL("SELECT MAX({})::text FROM {}")
+# returns seq of the last monitored chat change or 0 if there were none
+async def get_max_monitored_chat_change_seq(cursor) -> int:
+    sql = SQL("SELECT COALESCE(MAX({}), 0) FROM {}")
     query = sql.format(
-        Identifier(g_monitored_chats, g_monitored_chats_modification_time),
-        Identifier(g_monitored_chats))
+        Identifier(g_monitored_chat_changes, g_monitored_chat_changes_seq),
+        Identifier(g_monitored_chat_changes))
     await execute(cursor, query, tuple())
 
-    if cursor.rowcount > 1:
+    if cursor.rowcount != 1:
         raise RuntimeError(f"{cursor.query} returned unexpected amount of rows={cursor.rowcount}")
 
     result = await cursor.fetchone()
     get_logger().debug(f"{cursor.query} returned result={result}")
 
-    if len(result) != 1:
-        raise RuntimeError(f"{cursor.query} returned invalid amount of columns")
+    if len(result) != 1 or not isinstance(result[0], int):
+        raise RuntimeError(f"{cursor.query} returned invalid amount of columns or invalid result={result}")
+
+    return result[0]
+
+
+# returns element of array literal, which is taken as is whatever chars it has
+def get_quoted_array_element(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+# deletes handed off posts of id array
+def get_handoff_posts_delete():
+    return SQL("DELETE FROM {} WHERE {}=ANY(%s::int8[])").format(
+        Identifier(g_post_handoff),
+        Identifier(g_post_handoff, g_post_handoff_id))
+
+
+# upserts rows of unnested arrays (telegram chat id, hour bucket, *counters) into rollup table; bucket_sql turns
+# items.bucket into bucket of the table
+def get_channel_rollups_upsert(table: str, bucket_sql: str):
+    counters_count = len(g_channel_rollups_counters)
+    items_columns = ", ".join(["chat_id", "bucket"] + g_channel_rollups_counters)
+    sql = SQL("INSERT INTO {} ({}, {}, " + ", ".join(["{}"] * counters_count) + ") "
+              "SELECT {}, " + bucket_sql + ", " + ", ".join(["SUM(items.{})"] * counters_count) + " "
+              "FROM unnest(%s::int8[], %s::timestamptz[], " + ", ".join(["%s::int8[]"] * counters_count) + ") "
+              "AS items(" + items_columns + "), {}, {} "
+              "WHERE {}=items.chat_id AND {}={} "
+              "GROUP BY 1, 2 "
+              "ON CONFLICT ({}, {}) DO UPDATE SET " + ", ".join(["{}={}+EXCLUDED.{}"] * counters_count))
+
+    return sql.format(
+        Identifier(table),
+        Identifier(g_channel_rollups_monitored_chats_id),
+        Identifier(g_channel_rollups_bucket),
+        *[Identifier(counter) for counter in g_channel_rollups_counters],
+        # select
+        Identifier(g_monitored_chats, g_monitored_chats_id),
+        *[Identifier(counter) for counter in g_channel_rollups_counters],
+        # from
+        Identifier(g_chats),
+        Identifier(g_monitored_chats),
+        # where
+        Identifier(g_chats, g_chats_telegram_chat_id),
+        Identifier(g_monitored_chats, g_monitored_chats_chats_id),
+        Identifier(g_chats, g_chats_id),
+        # on conflict
+        Identifier(g_channel_rollups_monitored_chats_id),
+        Identifier(g_channel_rollups_bucket),
+        *chain(*[
+            (Identifier(counter), Identifier(table, counter), Identifier(counter))
+            for counter in g_channel_rollups_counters]))
+
+
+# (SELECT user_chats.id ...) by telegram chat id passed as %s
+def get_user_chats_id_subselect():
+    return SQL("(SELECT {} FROM {}, {} WHERE {}=%s AND {}={})").format(
+        Identifier(g_user_chats, g_user_chats_id),
+        Identifier(g_user_chats),
+        Identifier(g_chats),
+        Identifier(g_chats, g_chats_telegram_chat_id),
+        Identifier(g_chats, g_chats_id),
+        Identifier(g_user_chats, g_user_chats_chats_id))
+
+
+# (SELECT monitored_chats.id ...) by telegram chat id passed as %s
+def get_monitored_chats_id_subselect():
+    return SQL("(SELECT {} FROM {}, {} WHERE {}=%s AND {}={})").format(
+        Identifier(g_monitored_chats, g_monitored_chats_id),
+        Identifier(g_monitored_chats),
+        Identifier(g_chats),
+        Identifier(g_chats, g_chats_telegram_chat_id),
+        Identifier(g_chats, g_chats_id),
+        Identifier(g_monitored_chats, g_monitored_chats_chats_id))
 
-    # rowcount == 1 yet result is None if table is empty
-    if not result[0]:
-        return None
 
-    if not isinstance(result[0], str):
-        raise RuntimeError(f"{cursor.query} returned invalid result={result}")
+# (SELECT bundles.id ...) by bundle name passed as %s
+def get_bundles_id_subselect():
+    return SQL("(SELECT {} FROM {} WHERE {}=%s)").format(
+        Identifier(g_bundles, g_bundles_id),
+        Identifier(g_bundles),
+        Identifier(g_bundles, g_bundles_name))
+
+
+# amount of enabled bundles channel is in; channels of bundles stay monitored regardless of direct subscribers
+async def get_channel_bundles_count(cursor, chat_id: int) -> int:
+    query = SQL("SELECT COUNT(*) FROM {} WHERE {}=TRUE AND {}={}").format(
+        Identifier(g_bundle_channels),
+        Identifier(g_bundle_channels, g_bundle_channels_enabled),
+        Identifier(g_bundle_channels, g_bundle_channels_monitored_chats_id),
+        get_monitored_chats_id_subselect())
+    values = chat_id,
+    await execute(cursor, query, values)
+
+    if cursor.rowcount != 1:
+        raise RuntimeError(f"{cursor.query} returned unexpected amount of rows={cursor.rowcount}")
+
+    result = await cursor.fetchone()
+    get_logger().debug(f"{cursor.query} returned result={result}")
+
+    if len(result) != 1 or not isinstance(result[0], int) or result[0] < 0:
+        raise RuntimeError(f"{cursor.query} returned invalid amount of columns or invalid result={result}")
 
     return result[0]
 
 
+# disables monitored chat if neither direct subscription nor bundle needs it anymore
+async def disable_monitored_chat_if_unused(cursor, chat_id: int):
+    sub_count = await get_channel_subscribers_count(cursor=cursor, chat_id=chat_id)
+    bundles_count = await get_channel_bundles_count(cursor=cursor, chat_id=chat_id)
+    get_logger().debug(f"monitored chat id={chat_id} has sub count={sub_count} bundles count={bundles_count}")
+
+    if sub_count < 1 and bundles_count < 1:
+        get_logger().info(f"disabling monitoring of chat id={chat_id}")
+        await disable_monitored_chat(cursor=cursor, chat_id=chat_id)
+
+
+# returns exists, enabled, filter id
+async def get_filter_exists_enabled(
+        cursor, user_chat_id: int, target_chat_id: Optional[int], filter_type: FilterType, pattern: str):
+    target_clause = SQL("IS NULL") if target_chat_id is None else SQL("= {}").format(
+        get_monitored_chats_id_subselect())
+    query = SQL("SELECT {}, {} FROM {} WHERE {}={} AND {}=%s AND {}=%s AND {} {}").format(
+        Identifier(g_filters, g_filters_id),
+        Identifier(g_filters, g_filters_enabled),
+        # from
+        Identifier(g_filters),
+        # where
+        Identifier(g_filters, g_filters_user_chats_id),
+        get_user_chats_id_subselect(),
+        Identifier(g_filters, g_filters_filter_type),
+        Identifier(g_filters, g_filters_pattern),
+        Identifier(g_filters, g_filters_monitored_chats_id),
+        target_clause)
+    values = (user_chat_id, filter_type.value, pattern) + ((target_chat_id,) if target_chat_id is not None else ())
+    await execute(cursor, query, values)
+
+    if cursor.rowcount == 0:
+        return False, False, None
+    elif cursor.rowcount > 1:
+        raise RuntimeError(f"{cursor.query} returned unexpected amount of rows={cursor.rowcount}")
+
+    result = await cursor.fetchone()
+    get_logger().debug(f"{cursor.query} returned result={result}")
+
+    if len(result) != 2 or not isinstance(result[0], int) or not isinstance(result[1], bool):
+        raise RuntimeError(f"{cursor.query} returned invalid amount of columns or invalid result={result}")
+
+    return True, result[1], result[0]
+
+
+async def insert_filter(
+        cursor, user_chat_id: int, target_chat_id: Optional[int], filter_type: FilterType, pattern: str):
+    target_select = SQL("NULL::int8") if target_chat_id is None else get_monitored_chats_id_subselect()
+    query = SQL("INSERT INTO {} ({}, {}, {}, {}) SELECT {}, {}, %s, %s").format(
+        Identifier(g_filters),
+        Identifier(g_filters_user_chats_id),
+        Identifier(g_filters_monitored_chats_id),
+        Identifier(g_filters_filter_type),
+        Identifier(g_filters_pattern),
+        # select
+        get_user_chats_id_subselect(),
+        target_select)
+    values = (user_chat_id,) + ((target_chat_id,) if target_chat_id is not None else ()) + (filter_type.value, pattern)
+    await execute(cursor, query, values)
+
+    if cursor.rowcount != 1:
+        raise RuntimeError(f"{cursor.query} affected unexpected amount of rows={cursor.rowcount}")
+
+
+async def set_filter_enabled(cursor, filter_id: int, enabled: bool):
+    query = SQL("UPDATE {} SET {}=%s WHERE {}=%s").format(
+        Identifier(g_filters),
+        Identifier(g_filters_enabled),
+        Identifier(g_filters_id))
+    values = enabled, filter_id
+    await execute(cursor, query, values)
+
+    if cursor.rowcount != 1:
+        raise RuntimeError(f"{cursor.query} affected unexpected amount of rows={cursor.rowcount}")
+
+
 class PostgresPersistentStorage(IPersistentStorage):
-    def __init__(self, **kwargs):
-        self.connection_pool = get_event_loop().run_until_complete(create_pool(**kwargs))
+    def __init__(self, read_pool_config: PoolConfig, write_pool_config: PoolConfig, **kwargs):
+        # pools are created on enter, so it is done concurrently with the rest of startup
+        self.connection_kwargs = kwargs
+        self.pools = {
+            PoolWorkload.READ: InstrumentedPool(workload=PoolWorkload.READ, config=read_pool_config),
+            PoolWorkload.WRITE: InstrumentedPool(workload=PoolWorkload.WRITE, config=write_pool_config)}
+        # notifies come to connection that listens to them, so it is held for good outside of pools; created on
+        # subscribe
+        self.listen_connection = None
 
     # IPersistentStorage
     async def __aenter__(self):
-        await self.connection_pool.__aenter__()
+        await gather(*[pool.open(**self.connection_kwargs) for pool in self.pools.values()])
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.connection_pool.__aexit__(exc_type, exc_val, exc_tb)
+        if self.listen_connection is not None:
+            await self.listen_connection.close()
+
+        await gather(*[pool.close(exc_type, exc_val, exc_tb) for pool in self.pools.values()])
 
     async def subscribe(self, notifies_to_handlers: dict):
-        async with self.connection_pool.acquire() as connection:
-            async with connection.cursor() as cur:
-                for notify, _ in notifies_to_handlers.items():
-                    get_logger().debug(f"Start listening to {notify}")
-                    await cur.execute(f"LISTEN {notify}")
+        if self.listen_connection is None:
+            self.listen_connection = await connect(**self.connection_kwargs)
+
+        async with self.listen_connection.cursor() as cur:
+            for notify, _ in notifies_to_handlers.items():
+                get_logger().debug(f"Start listening to {notify}")
+                await cur.execute(f"LISTEN {notify}")
 
     async def listen(self, notifies_to_handlers: dict, should_run_func):
         if len(notifies_to_handlers) == 0:
             return
 
-        async with self.connection_pool.acquire() as connection:
-            while should_run_func():
-                new_notification = await connection.notifies.get()
-                get_logger().info(f"Received notification: f{new_notification.channel}")
+        if self.listen_connection is None:
+            raise RuntimeError("Listen is called before subscribe")
 
-                if new_notification.channel in notifies_to_handlers:
-                    await notifies_to_handlers[new_notification.channel]()
-                else:
-                    get_logger().warning(f"No handlers for notification: f{new_notification.channel}")
+        while should_run_func():
+            new_notification = await self.listen_connection.notifies.get()
+            get_logger().info(f"Received notification: f{new_notification.channel}")
 
-    @retriable_transaction()
-    async def get_user_enrolled_and_locale(self, user_chat_id: int, cursor) -> tuple:
-        existed_before, enabled_before, language_before = await get_user_chat_exists_enabled_type(
-            cursor=cursor, chat_id=user_chat_id)
-        get_logger().debug(f"user chat={user_chat_id} existed_before={existed_before} enabled_before={enabled_before}")
+            if new_notification.channel in notifies_to_handlers:
+                await notifies_to_handlers[new_notification.channel](new_notification.payload)
+            else:
+                get_logger().warning(f"No handlers for notification: f{new_notification.channel}")
 
-        # return enabled_before as is_enrolled intentionally
-        return enabled_before, language_before
+    @retriable_transaction(workload=PoolWorkload.READ)
+    async def get_user_chat_state(self, user_chat_id: int, cursor) -> tuple:
+        row = await get_user_chat_enabled_type_language(cursor=cursor, chat_id=user_chat_id)
 
-    @retriable_transaction()
-    async def get_user_chat_id_enabled_subscriptions(self, user_chat_id: int, cursor) -> list:
-        sql = SQL("SELECT {}, {} "
+        if row is None:
+            return False, None, None
+
+        # enabled is is_enrolled intentionally
+        enabled, chat_type, language = row
+
+        return enabled, language, chat_type
+
+    @retriable_transaction(isolation_level=IsolationLevel.repeatable_read, workload=PoolWorkload.READ)
+    async def get_user_chat_id_enabled_subscriptions_page(
+            self,
+            user_chat_id: int,
+            cursor_subscription_id: Optional[int],
+            is_forward: bool,
+            limit: int,
+            cursor) -> tuple:
+        total_count = await get_user_chat_enabled_subscriptions_count(cursor=cursor, user_chat_id=user_chat_id)
+
+        # keyset pagination on subscription id: page is next/previous limit rows relative to cursor id; previous page
+        # is selected in reversed order so limit applies to the rows closest to cursor
+        sql = SQL("SELECT {}, {}, {} "
                   "FROM {}, {}, {} "
                   "WHERE "
                   "{}=(SELECT {} FROM {}, {} WHERE {}=%s AND {}={}) AND "
                   "{}={} AND "
                   "{}={} AND "
-                  "{}=TRUE")
+                  "{}=TRUE AND "
+                  "{} {} %s "
+                  "ORDER BY {} {} "
+                  "LIMIT %s")
         query = sql.format(
+            Identifier(g_subscriptions, g_subscriptions_id),
             Identifier(g_monitored_chats, g_monitored_chats_title),
             Identifier(g_chats, g_chats_telegram_chat_id),
             # from
@@ -597,12 +978,22 @@ class PostgresPersistentStorage(IPersistentStorage):
             Identifier(g_monitored_chats, g_monitored_chats_chats_id),
             Identifier(g_chats, g_chats_id),
             # where enabled
-            Identifier(g_subscriptions, g_subscriptions_enabled))
-        values = user_chat_id,
+            Identifier(g_subscriptions, g_subscriptions_enabled),
+            # where keyset
+            Identifier(g_subscriptions, g_subscriptions_id),
+            SQL(">") if is_forward else SQL("<"),
+            # order
+            Identifier(g_subscriptions, g_subscriptions_id),
+            SQL("ASC") if is_forward else SQL("DESC"))
+        # serial ids start from 1, so 0 is before any of them
+        if cursor_subscription_id is None:
+            cursor_subscription_id = 0 if is_forward else g_max_int8
+
+        values = user_chat_id, cursor_subscription_id, limit
         await execute(cursor, query, values)
 
         # fetch
-        title_id_subs = list()
+        subs = list()
 
         while True:
             partial_result = await cursor.fetchmany()
@@ -612,16 +1003,21 @@ class PostgresPersistentStorage(IPersistentStorage):
                 break
 
             for row in partial_result:
-                if len(row) != 2 or not isinstance(row[0], str) or not isinstance(row[1], int):
+                if len(row) != 3 or not isinstance(row[0], int) or not isinstance(row[1], str) \
+                        or not isinstance(row[2], int):
                     raise RuntimeError(
                         f"{cursor.query} returned invalid amount of columns or invalid result={partial_result}")
 
-                title_id_subs.append((row[0], row[1]))
+                subs.append((row[0], row[1], row[2]))
 
-        return title_id_subs
+        if not is_forward:
+            subs.reverse()
+
+        return total_count, subs
 
     @retriable_transaction(isolation_level=IsolationLevel.repeatable_read)
-    async def add_or_enable_user_chat(self, chat_id: int, chat_type: ChatType, language: Language, cursor) -> tuple:
+    async def add_or_enable_user_chat(
+            self, chat_id: int, chat_type: ChatType, language: Language, bot_index: int, cursor) -> tuple:
         if chat_type == ChatType.CHANNEL:
             raise RuntimeError("Channels are not supported yet as users")
 
@@ -647,7 +1043,7 @@ class PostgresPersistentStorage(IPersistentStorage):
             cursor=cursor, chat_id=chat_id, chat_type=chat_type, existed_before=existed_before)
 
         # now we've it in chats table so put it into user chats / or update if its there
-        await insert_or_enable_user_chat(cursor=cursor, chat_id=chat_id, language=language)
+        await insert_or_enable_user_chat(cursor=cursor, chat_id=chat_id, language=language, bot_index=bot_index)
 
         return existed_before, enabled_before, language
 
@@ -680,6 +1076,60 @@ class PostgresPersistentStorage(IPersistentStorage):
 
         return enabled_before
 
+    @retriable_transaction()
+    async def disable_user_chats(self, chat_ids: list, cursor) -> int:
+        if len(chat_ids) == 0:
+            return 0
+
+        sql = SQL("UPDATE {} SET {}=FALSE "
+                  "FROM {} "
+                  "WHERE {}={} AND {}=ANY(%s::int8[]) AND {}=TRUE")
+        query = sql.format(
+            # update
+            Identifier(g_user_chats),
+            Identifier(g_user_chats_enabled),
+            # from
+            Identifier(g_chats),
+            # where
+            Identifier(g_chats, g_chats_id),
+            Identifier(g_user_chats, g_user_chats_chats_id),
+            Identifier(g_chats, g_chats_telegram_chat_id),
+            Identifier(g_user_chats, g_user_chats_enabled))
+        values = list(chat_ids),
+        await execute(cursor, query, values)
+
+        if cursor.rowcount > len(chat_ids):
+            raise RuntimeError(f"{cursor.query} affected unexpected amount of rows={cursor.rowcount}")
+
+        return cursor.rowcount
+
+    @retriable_transaction(isolation_level=IsolationLevel.repeatable_read)
+    async def migrate_user_chat(self, chat_id: int, new_chat_id: int, new_chat_type: ChatType, cursor) -> bool:
+        # if new chat is known already (e.g. bot was started there too), old chat is left as is
+        sql = SQL("UPDATE {} SET {}=%s, {}=%s "
+                  "WHERE {}=%s AND NOT EXISTS (SELECT 1 FROM {} WHERE {}=%s) AND "
+                  "EXISTS (SELECT 1 FROM {} WHERE {}={})")
+        query = sql.format(
+            # update
+            Identifier(g_chats),
+            Identifier(g_chats_telegram_chat_id),
+            Identifier(g_chats_chat_type),
+            # where
+            Identifier(g_chats, g_chats_telegram_chat_id),
+            Identifier(g_chats),
+            Identifier(g_chats, g_chats_telegram_chat_id),
+            # only user chats are migrated
+            Identifier(g_user_chats),
+            Identifier(g_user_chats, g_user_chats_chats_id),
+            Identifier(g_chats, g_chats_id))
+        values = new_chat_id, new_chat_type.value, chat_id, new_chat_id
+        await execute(cursor, query, values)
+
+        if cursor.rowcount > 1:
+            raise RuntimeError(f"{cursor.query} affected unexpected amount of rows={cursor.rowcount}")
+
+        return cursor.rowcount == 1
+
     @retriable_transaction(isolation_level=IsolationLevel.serializable)
     async def add_or_enable_subscription(
             self, user_chat_id: int, target_chat_id: int, target_title: str, target_joiner: str, cursor) -> tuple:
@@ -707,14 +1157,15 @@ class PostgresPersistentStorage(IPersistentStorage):
 
         return subscription_existed_before, subscription_enabled_before
 
-    @retriable_transaction(isolation_level=IsolationLevel.repeatable_read)
+    @retriable_transaction(isolation_level=IsolationLevel.repeatable_read, workload=PoolWorkload.READ)
     async def get_all_user_chats(self, cursor) -> set:
-        query = SQL("SELECT {}, {}, {}, {} FROM {}, {} WHERE {}={}").format(
+        query = SQL("SELECT {}, {}, {}, {}, {} FROM {}, {} WHERE {}={}").format(
             # select
             Identifier(g_user_chats, g_user_chats_enabled),
             Identifier(g_chats, g_chats_chat_type),
             Identifier(g_user_chats, g_user_chats_language),
             Identifier(g_chats, g_chats_telegram_chat_id),
+            Identifier(g_user_chats, g_user_chats_bot_index),
             # from
             Identifier(g_chats),
             Identifier(g_user_chats),
@@ -734,13 +1185,14 @@ class PostgresPersistentStorage(IPersistentStorage):
                 break
 
             for row_result in partial_result:
-                if len(row_result) != 4 or not isinstance(row_result[0], bool)\
+                if len(row_result) != 5 or not isinstance(row_result[0], bool)\
                         or not isinstance(row_result[1], int) or not isinstance(row_result[2], int) \
-                        or not isinstance(row_result[3], int):
+                        or not isinstance(row_result[3], int) or not isinstance(row_result[4], int):
                     raise RuntimeError(f"{cursor.query} returned invalid amount of columns "
                                        f"or invalid result={row_result}")
 
-                user_chats.add((row_result[0], row_result[1], Language(value=row_result[2]), row_result[3]))
+                user_chats.add(
+                    (row_result[0], row_result[1], Language(value=row_result[2]), row_result[3], row_result[4]))
 
         return user_chats
 
@@ -800,13 +1252,7 @@ class PostgresPersistentStorage(IPersistentStorage):
             enabled_before = result[0]
 
             # disable monitored chat if its last subscription on that channel
-            sub_count = await get_channel_subscribers_count(cursor=cursor, chat_id=target_chat_id)
-            get_logger().debug(f"monitored chat id={target_chat_id} has sub count "
-                               f"after disabling user chat id={user_chat_id}: {sub_count}")
-
-            if sub_count < 1:
-                get_logger().info(f"disabling monitoring of chat id={target_chat_id}")
-                await disable_monitored_chat(cursor=cursor, chat_id=target_chat_id)
+            await disable_monitored_chat_if_unused(cursor=cursor, chat_id=target_chat_id)
 
             # get db title
             _, _, title, joiner = await get_monitored_chat_exists_enabled(
@@ -817,43 +1263,44 @@ class PostgresPersistentStorage(IPersistentStorage):
 
             return enabled_before, True, title, joiner
 
-    @retriable_transaction()
-    async def get_channel_subscribers(self, chat_id, cursor) -> set:
-        sql = SQL("SELECT {} FROM {}, {}, {} "
-                  "WHERE "
-                  "{}={} AND {}=TRUE AND "
-                  "{}={} AND {}=TRUE AND "
-                  "{}=(SELECT {} FROM {}, {} WHERE {}=%s AND {}={} AND {}=TRUE) ")
-        query = sql.format(
-            # select chats.telegram_chat_id
-            Identifier(g_chats, g_chats_telegram_chat_id),
-            # from chats & user_chats & subscriptions
-            Identifier(g_chats),
-            Identifier(g_user_chats),
-            Identifier(g_subscriptions),
-            # where user_chats.chats_id = chats.id
-            Identifier(g_user_chats, g_user_chats_chats_id),
-            Identifier(g_chats, g_chats_id),
-            Identifier(g_user_chats, g_user_chats_enabled),
-            # where subscriptions.user_chats_id=user_chats.id
-            Identifier(g_subscriptions, g_subscriptions_user_chats_id),
-            Identifier(g_user_chats, g_user_chats_id),
-            Identifier(g_subscriptions, g_subscriptions_enabled),
-            # where monitored
-            Identifier(g_subscriptions, g_subscriptions_monitored_chats_id),
-            # select monitored chat
-            Identifier(g_monitored_chats, g_monitored_chats_id),
-            Identifier(g_monitored_chats),
-            Identifier(g_chats),
-            Identifier(g_chats, g_chats_telegram_chat_id),
-            Identifier(g_chats, g_chats_id),
-            Identifier(g_monitored_chats, g_monitored_chats_chats_id),
-            Identifier(g_monitored_chats, g_monitored_chats_enabled))
+    # subscribers are kept denormalized by triggers, so it is a single row lookup
+    @retriable_transaction(workload=PoolWorkload.READ)
+    async def get_channel_subscribers(self, chat_id, cursor) -> dict:
+        query = SQL("SELECT {}, {} FROM {} WHERE {}=%s").format(
+            Identifier(g_channel_subscribers, g_channel_subscribers_user_telegram_chat_ids),
+            Identifier(g_channel_subscribers, g_channel_subscribers_bot_indexes),
+            Identifier(g_channel_subscribers),
+            Identifier(g_channel_subscribers, g_channel_subscribers_telegram_chat_id))
         values = chat_id,
         await execute(cursor, query, values)
 
+        if cursor.rowcount > 1:
+            raise RuntimeError(f"{cursor.query} returned unexpected amount of rows={cursor.rowcount}")
+
+        # channel without subscribers has no row
+        if cursor.rowcount == 0:
+            return dict()
+
+        result = await cursor.fetchone()
+        get_logger().debug(f"{cursor.query} returned result={result}")
+
+        if len(result) != 2 or not isinstance(result[0], list) or not isinstance(result[1], list) \
+                or len(result[0]) != len(result[1]):
+            raise RuntimeError(f"{cursor.query} returned invalid amount of columns or invalid result={result}")
+
+        return dict(zip(result[0], result[1]))
+
+    @retriable_transaction(workload=PoolWorkload.READ)
+    async def get_bot_loads(self, cursor) -> dict:
+        query = SQL("SELECT {}, COUNT(*) FROM {} WHERE {}=TRUE GROUP BY {}").format(
+            Identifier(g_user_chats, g_user_chats_bot_index),
+            Identifier(g_user_chats),
+            Identifier(g_user_chats, g_user_chats_enabled),
+            Identifier(g_user_chats, g_user_chats_bot_index))
+        await execute(cursor, query, tuple())
+
         # fetch
-        subbed_telegram_user_chat_ids = set()
+        bot_loads = dict()
 
         while True:
             partial_result = await cursor.fetchmany()
@@ -863,24 +1310,20 @@ class PostgresPersistentStorage(IPersistentStorage):
                 break
 
             for row in partial_result:
-                if len(row) != 1 or not isinstance(row[0], int):
+                if len(row) != 2 or not isinstance(row[0], int) or not isinstance(row[1], int):
                     raise RuntimeError(
                         f"{cursor.query} returned invalid amount of columns or invalid result={partial_result}")
 
-                subbed_telegram_user_chat_ids.add(row[0])
+                bot_loads[row[0]] = row[1]
 
-        return subbed_telegram_user_chat_ids
+        return bot_loads
 
-    @retriable_transaction(isolation_level=IsolationLevel.repeatable_read)
+    @retriable_transaction(isolation_level=IsolationLevel.repeatable_read, workload=PoolWorkload.READ)
     async def get_monitored_channels_delta(
             self,
-            handicap_seconds: int,
-            prev_max_time: str,
+            prev_seq: Optional[int],
             monitored_chats_id_interval: MultiInterval,
             cursor) -> tuple:
-        if prev_max_time is None:
-            prev_max_time = '2000-01-01 19:10:25-07'
-
         where_interval_clause = "("
 
         for idx, interval in enumerate(monitored_chats_id_interval.intervals):
@@ -889,12 +1332,13 @@ class PostgresPersistentStorage(IPersistentStorage):
             where_interval_clause += "{} BETWEEN %s AND %s"
 
         where_interval_clause += ")"
-        unformatted_query_str = "SELECT {}, {}, {} " \
-                                "FROM {}, {} " \
-                                "WHERE {}={} AND {} > LEAST(%s::timestamp, NOW() - '%s seconds'::interval) AND "\
-                                + where_interval_clause
-        sql = SQL(unformatted_query_str)
-        query = sql.format(
+        list_of_interval_pairs = [(interval.start, interval.end) for interval in monitored_chats_id_interval.intervals]
+        # using chain to squash list of tuples into list of values of tuples
+        interval_values = list(chain(*list_of_interval_pairs))
+        interval_identifiers = [
+            Identifier(g_monitored_chats, g_monitored_chats_id)
+            for _ in range(len(monitored_chats_id_interval.intervals))]
+        select_from_where = [
             # select
             Identifier(g_chats, g_chats_telegram_chat_id),
             Identifier(g_monitored_chats, g_monitored_chats_enabled),
@@ -904,13 +1348,26 @@ class PostgresPersistentStorage(IPersistentStorage):
             Identifier(g_monitored_chats),
             # where
             Identifier(g_chats, g_chats_id),
-            Identifier(g_monitored_chats, g_monitored_chats_chats_id),
-            Identifier(g_monitored_chats, g_monitored_chats_modification_time),
-            *[Identifier(g_monitored_chats, g_monitored_chats_id)
-              for _ in range(len(monitored_chats_id_interval.intervals))])
-        list_of_interval_pairs = [(interval.start, interval.end) for interval in monitored_chats_id_interval.intervals]
-        # using chain to squash list of tuples into list of values of tuples
-        values = prev_max_time, handicap_seconds, *list(chain(*list_of_interval_pairs))
+            Identifier(g_monitored_chats, g_monitored_chats_chats_id)]
+
+        if prev_seq is None:
+            # whole state of the interval
+            sql = SQL("SELECT {}, {}, {} FROM {}, {} WHERE {}={} AND " + where_interval_clause)
+            query = sql.format(*select_from_where, *interval_identifiers)
+            values = interval_values
+        else:
+            # only chats changed after prev_seq; seqs are committed in order, so nothing before max seq is missed
+            sql = SQL("SELECT {}, {}, {} FROM {}, {} WHERE {}={} AND {} IN (SELECT {} FROM {} WHERE {} > %s) AND "
+                      + where_interval_clause)
+            query = sql.format(
+                *select_from_where,
+                Identifier(g_monitored_chats, g_monitored_chats_id),
+                Identifier(g_monitored_chat_changes, g_monitored_chat_changes_monitored_chats_id),
+                Identifier(g_monitored_chat_changes),
+                Identifier(g_monitored_chat_changes, g_monitored_chat_changes_seq),
+                *interval_identifiers)
+            values = prev_seq, *interval_values
+
         await execute(cursor, query, values)
 
         # fetch
@@ -931,7 +1388,1335 @@ class PostgresPersistentStorage(IPersistentStorage):
 
                 chat_to_enabled_dict[row[0]] = row[1], row[2]
 
-        # get new max time
-        new_max_time = await get_max_monitored_modification_time(cursor)
+        # same snapshot, so every change up to this seq is accounted above
+        new_seq = await get_max_monitored_chat_change_seq(cursor)
+
+        return chat_to_enabled_dict, new_seq
+
+    @retriable_transaction(workload=PoolWorkload.READ)
+    async def get_monitored_chat_changes_cursor(self, consumer: str, cursor) -> Optional[int]:
+        sql = SQL("SELECT {} FROM {} WHERE {}=%s")
+        query = sql.format(
+            Identifier(g_monitored_chat_change_cursors, g_monitored_chat_change_cursors_seq),
+            Identifier(g_monitored_chat_change_cursors),
+            Identifier(g_monitored_chat_change_cursors, g_monitored_chat_change_cursors_consumer))
+        await execute(cursor, query, (consumer,))
+
+        if cursor.rowcount > 1:
+            raise RuntimeError(f"{cursor.query} returned unexpected amount of rows={cursor.rowcount}")
+
+        if cursor.rowcount < 1:
+            return None
+
+        result = await cursor.fetchone()
+        get_logger().debug(f"{cursor.query} returned result={result}")
+
+        if len(result) != 1 or not isinstance(result[0], int):
+            raise RuntimeError(f"{cursor.query} returned invalid amount of columns or invalid result={result}")
+
+        return result[0]
+
+    @retriable_transaction()
+    async def set_monitored_chat_changes_cursor(self, consumer: str, seq: int, cursor):
+        # cursor never goes back, even if concurrent consumers of the same name race
+        sql = SQL("INSERT INTO {} ({}, {}) VALUES (%s, %s) ON CONFLICT ({}) DO UPDATE SET {}=GREATEST({}, EXCLUDED.{})")
+        query = sql.format(
+            Identifier(g_monitored_chat_change_cursors),
+            Identifier(g_monitored_chat_change_cursors_consumer),
+            Identifier(g_monitored_chat_change_cursors_seq),
+            Identifier(g_monitored_chat_change_cursors_consumer),
+            Identifier(g_monitored_chat_change_cursors_seq),
+            Identifier(g_monitored_chat_change_cursors, g_monitored_chat_change_cursors_seq),
+            Identifier(g_monitored_chat_change_cursors_seq))
+        await execute(cursor, query, (consumer, seq))
 
-        return chat_to_enabled_dict, new_max_time
+    @retriable_transaction()
+    async def delete_consumed_monitored_chat_changes(self, cursor) -> int:
+        # change at the lowest cursor is kept, so max seq never goes back to 0. Consumer that has no cursor yet starts
+        # from the whole state anyway
+        sql = SQL("DELETE FROM {} WHERE {} < (SELECT MIN({}) FROM {})")
+        query = sql.format(
+            Identifier(g_monitored_chat_changes),
+            Identifier(g_monitored_chat_changes, g_monitored_chat_changes_seq),
+            Identifier(g_monitored_chat_change_cursors, g_monitored_chat_change_cursors_seq),
+            Identifier(g_monitored_chat_change_cursors))
+        await execute(cursor, query, tuple())
+
+        return cursor.rowcount
+
+    @retriable_transaction(isolation_level=IsolationLevel.serializable)
+    async def add_or_enable_filter(
+            self,
+            user_chat_id: int,
+            target_chat_id: Optional[int],
+            filter_type: FilterType,
+            pattern: str,
+            cursor) -> tuple:
+        # per subscription filters are only allowed for enabled subscriptions
+        if target_chat_id is not None:
+            _, subscription_enabled = await get_subscription_exists_enabled(
+                cursor=cursor, user_chat_id=user_chat_id, monitored_chat_id=target_chat_id)
+
+            if not subscription_enabled:
+                return False, False, False
+
+        existed_before, enabled_before, filter_id = await get_filter_exists_enabled(
+            cursor=cursor, user_chat_id=user_chat_id, target_chat_id=target_chat_id, filter_type=filter_type,
+            pattern=pattern)
+        get_logger().debug(f"filter {filter_type.name}={pattern} for user chat={user_chat_id} target={target_chat_id} "
+                           f"existed_before={existed_before} enabled_before={enabled_before}")
+
+        if enabled_before:
+            return True, existed_before, enabled_before
+
+        if existed_before:
+            await set_filter_enabled(cursor=cursor, filter_id=filter_id, enabled=True)
+        else:
+            await insert_filter(
+                cursor=cursor, user_chat_id=user_chat_id, target_chat_id=target_chat_id, filter_type=filter_type,
+                pattern=pattern)
+
+        return True, existed_before, enabled_before
+
+    @retriable_transaction()
+    async def disable_filter(self, user_chat_id: int, filter_id: int, cursor) -> bool:
+        query = SQL("UPDATE {} SET {}=FALSE WHERE {}=%s AND {}=TRUE AND {}={}").format(
+            Identifier(g_filters),
+            Identifier(g_filters_enabled),
+            # where
+            Identifier(g_filters, g_filters_id),
+            Identifier(g_filters, g_filters_enabled),
+            Identifier(g_filters, g_filters_user_chats_id),
+            get_user_chats_id_subselect())
+        values = filter_id, user_chat_id
+        await execute(cursor, query, values)
+
+        if cursor.rowcount > 1:
+            raise RuntimeError(f"{cursor.query} affected unexpected amount of rows={cursor.rowcount}")
+
+        return cursor.rowcount == 1
+
+    @retriable_transaction(workload=PoolWorkload.READ)
+    async def get_user_chat_enabled_filters(self, user_chat_id: int, cursor) -> list:
+        sql = SQL("SELECT {}, {}, {}, {}, {} "
+                  "FROM {} LEFT JOIN {} ON {}={} LEFT JOIN {} ON {}={} "
+                  "WHERE {}={} AND {}=TRUE "
+                  "ORDER BY {}")
+        query = sql.format(
+            Identifier(g_filters, g_filters_id),
+            Identifier(g_filters, g_filters_filter_type),
+            Identifier(g_filters, g_filters_pattern),
+            Identifier(g_chats, g_chats_telegram_chat_id),
+            Identifier(g_monitored_chats, g_monitored_chats_title),
+            # from filters left join monitored_chats
+            Identifier(g_filters),
+            Identifier(g_monitored_chats),
+            Identifier(g_filters, g_filters_monitored_chats_id),
+            Identifier(g_monitored_chats, g_monitored_chats_id),
+            # left join chats
+            Identifier(g_chats),
+            Identifier(g_monitored_chats, g_monitored_chats_chats_id),
+            Identifier(g_chats, g_chats_id),
+            # where
+            Identifier(g_filters, g_filters_user_chats_id),
+            get_user_chats_id_subselect(),
+            Identifier(g_filters, g_filters_enabled),
+            # order
+            Identifier(g_filters, g_filters_id))
+        values = user_chat_id,
+        await execute(cursor, query, values)
+
+        # fetch
+        filters = list()
+
+        while True:
+            partial_result = await cursor.fetchmany()
+            get_logger().debug(f"{cursor.query} returned result={partial_result}")
+
+            if not partial_result:
+                break
+
+            for row in partial_result:
+                if len(row) != 5 or not isinstance(row[0], int) or not isinstance(row[1], int) \
+                        or not isinstance(row[2], str) or not (row[3] is None or isinstance(row[3], int)) \
+                        or not (row[4] is None or isinstance(row[4], str)):
+                    raise RuntimeError(
+                        f"{cursor.query} returned invalid amount of columns or invalid result={partial_result}")
+
+                filters.append((row[0], FilterType(value=row[1]), row[2], row[3], row[4]))
+
+        return filters
+
+    @retriable_transaction(workload=PoolWorkload.READ)
+    async def get_channel_filters(self, chat_id: int, cursor) -> list:
+        # global filters and filters of this channel; only of those user chats that are receiving channel posts
+        sql = SQL("SELECT {}, {}, {} FROM {}, {}, {} "
+                  "WHERE "
+                  "{}={} AND {}={} AND {}=TRUE AND {}=TRUE AND "
+                  "({} IS NULL OR {}={}) AND "
+                  "(EXISTS (SELECT 1 FROM {} WHERE {}={} AND {}=TRUE AND {}={}) OR "
+                  "EXISTS (SELECT 1 FROM {}, {} WHERE {}={} AND {}=TRUE AND {}={} AND {}=TRUE AND {}={}))")
+        query = sql.format(
+            # select
+            Identifier(g_chats, g_chats_telegram_chat_id),
+            Identifier(g_filters, g_filters_filter_type),
+            Identifier(g_filters, g_filters_pattern),
+            # from
+            Identifier(g_filters),
+            Identifier(g_user_chats),
+            Identifier(g_chats),
+            # where joins & enabled
+            Identifier(g_filters, g_filters_user_chats_id),
+            Identifier(g_user_chats, g_user_chats_id),
+            Identifier(g_user_chats, g_user_chats_chats_id),
+            Identifier(g_chats, g_chats_id),
+            Identifier(g_filters, g_filters_enabled),
+            Identifier(g_user_chats, g_user_chats_enabled),
+            # where scope
+            Identifier(g_filters, g_filters_monitored_chats_id),
+            Identifier(g_filters, g_filters_monitored_chats_id),
+            get_monitored_chats_id_subselect(),
+            # where subscribed
+            Identifier(g_subscriptions),
+            Identifier(g_subscriptions, g_subscriptions_user_chats_id),
+            Identifier(g_user_chats, g_user_chats_id),
+            Identifier(g_subscriptions, g_subscriptions_enabled),
+            Identifier(g_subscriptions, g_subscriptions_monitored_chats_id),
+            get_monitored_chats_id_subselect(),
+            # or subscribed to bundle with the channel
+            Identifier(g_bundle_subscriptions),
+            Identifier(g_bundle_channels),
+            Identifier(g_bundle_subscriptions, g_bundle_subscriptions_user_chats_id),
+            Identifier(g_user_chats, g_user_chats_id),
+            Identifier(g_bundle_subscriptions, g_bundle_subscriptions_enabled),
+            Identifier(g_bundle_channels, g_bundle_channels_bundles_id),
+            Identifier(g_bundle_subscriptions, g_bundle_subscriptions_bundles_id),
+            Identifier(g_bundle_channels, g_bundle_channels_enabled),
+            Identifier(g_bundle_channels, g_bundle_channels_monitored_chats_id),
+            get_monitored_chats_id_subselect())
+        values = chat_id, chat_id, chat_id
+        await execute(cursor, query, values)
+
+        # fetch
+        filters = list()
+
+        while True:
+            partial_result = await cursor.fetchmany()
+            get_logger().debug(f"{cursor.query} returned result={partial_result}")
+
+            if not partial_result:
+                break
+
+            for row in partial_result:
+                if len(row) != 3 or not isinstance(row[0], int) or not isinstance(row[1], int) \
+                        or not isinstance(row[2], str):
+                    raise RuntimeError(
+                        f"{cursor.query} returned invalid amount of columns or invalid result={partial_result}")
+
+                filters.append((row[0], FilterType(value=row[1]), row[2]))
+
+        return filters
+
+    @retriable_transaction()
+    async def set_user_chat_digest_period(self, user_chat_id: int, period_minutes: Optional[int], cursor) -> bool:
+        query = SQL("UPDATE {} SET {}=%s WHERE {}=TRUE AND {}={}").format(
+            Identifier(g_user_chats),
+            Identifier(g_user_chats_digest_period_minutes),
+            # where
+            Identifier(g_user_chats, g_user_chats_enabled),
+            Identifier(g_user_chats, g_user_chats_id),
+            get_user_chats_id_subselect())
+        values = period_minutes, user_chat_id
+        await execute(cursor, query, values)
+
+        if cursor.rowcount > 1:
+            raise RuntimeError(f"{cursor.query} affected unexpected amount of rows={cursor.rowcount}")
+
+        return cursor.rowcount == 1
+
+    @retriable_transaction()
+    async def set_subscription_digest_period(
+            self, user_chat_id: int, target_chat_id: int, period_minutes: Optional[int], cursor) -> bool:
+        query = SQL("UPDATE {} SET {}=%s WHERE {}=TRUE AND {}={} AND {}={}").format(
+            Identifier(g_subscriptions),
+            Identifier(g_subscriptions_digest_period_minutes),
+            # where
+            Identifier(g_subscriptions, g_subscriptions_enabled),
+            Identifier(g_subscriptions, g_subscriptions_user_chats_id),
+            get_user_chats_id_subselect(),
+            Identifier(g_subscriptions, g_subscriptions_monitored_chats_id),
+            get_monitored_chats_id_subselect())
+        values = period_minutes, user_chat_id, target_chat_id
+        await execute(cursor, query, values)
+
+        if cursor.rowcount > 1:
+            raise RuntimeError(f"{cursor.query} affected unexpected amount of rows={cursor.rowcount}")
+
+        return cursor.rowcount == 1
+
+    @retriable_transaction(isolation_level=IsolationLevel.repeatable_read, workload=PoolWorkload.READ)
+    async def get_digest_periods(self, cursor) -> tuple:
+        # user chat periods
+        query = SQL("SELECT {}, {} FROM {}, {} WHERE {}={} AND {} IS NOT NULL").format(
+            Identifier(g_chats, g_chats_telegram_chat_id),
+            Identifier(g_user_chats, g_user_chats_digest_period_minutes),
+            # from
+            Identifier(g_chats),
+            Identifier(g_user_chats),
+            # where
+            Identifier(g_chats, g_chats_id),
+            Identifier(g_user_chats, g_user_chats_chats_id),
+            Identifier(g_user_chats, g_user_chats_digest_period_minutes))
+        await execute(cursor, query, tuple())
+        user_chat_periods = dict()
+
+        for row in await cursor.fetchall():
+            if len(row) != 2 or not isinstance(row[0], int) or not isinstance(row[1], int):
+                raise RuntimeError(f"{cursor.query} returned invalid amount of columns or invalid result={row}")
+
+            user_chat_periods[row[0]] = row[1]
+
+        # subscription periods
+        sql = SQL("SELECT {}, {}, {} FROM {}, {}, {} {}, {}, {} {} "
+                  "WHERE "
+                  "{}={} AND {}={} AND "
+                  "{}={} AND {}={} AND "
+                  "{}=TRUE AND {} IS NOT NULL")
+        query = sql.format(
+            Identifier(g_user_chat_alias, g_chats_telegram_chat_id),
+            Identifier(g_monitored_chat_alias, g_chats_telegram_chat_id),
+            Identifier(g_subscriptions, g_subscriptions_digest_period_minutes),
+            # from
+            Identifier(g_subscriptions),
+            Identifier(g_user_chats),
+            Identifier(g_chats),
+            Identifier(g_user_chat_alias),
+            Identifier(g_monitored_chats),
+            Identifier(g_chats),
+            Identifier(g_monitored_chat_alias),
+            # where user chat
+            Identifier(g_subscriptions, g_subscriptions_user_chats_id),
+            Identifier(g_user_chats, g_user_chats_id),
+            Identifier(g_user_chats, g_user_chats_chats_id),
+            Identifier(g_user_chat_alias, g_chats_id),
+            # where monitored chat
+            Identifier(g_subscriptions, g_subscriptions_monitored_chats_id),
+            Identifier(g_monitored_chats, g_monitored_chats_id),
+            Identifier(g_monitored_chats, g_monitored_chats_chats_id),
+            Identifier(g_monitored_chat_alias, g_chats_id),
+            # where set
+            Identifier(g_subscriptions, g_subscriptions_enabled),
+            Identifier(g_subscriptions, g_subscriptions_digest_period_minutes))
+        await execute(cursor, query, tuple())
+        subscription_periods = dict()
+
+        for row in await cursor.fetchall():
+            if len(row) != 3 or not isinstance(row[0], int) or not isinstance(row[1], int) \
+                    or not isinstance(row[2], int):
+                raise RuntimeError(f"{cursor.query} returned invalid amount of columns or invalid result={row}")
+
+            subscription_periods[(row[0], row[1])] = row[2]
+
+        return user_chat_periods, subscription_periods
+
+    @retriable_transaction()
+    async def add_digest_items(self, items: list, cursor):
+        if len(items) == 0:
+            return
+
+        # single statement for any amount of items: arrays are unnested into rows
+        sql = SQL("INSERT INTO {} ({}, {}, {}, {}) "
+                  "SELECT {}, {}, items.message_id, items.due_time "
+                  "FROM unnest(%s::int8[], %s::int8[], %s::int8[], %s::timestamptz[]) "
+                  "AS items(user_chat_id, chat_id, message_id, due_time), "
+                  "{} {}, {}, {} {}, {} "
+                  "WHERE "
+                  "{}=items.user_chat_id AND {}={} AND "
+                  "{}=items.chat_id AND {}={}")
+        query = sql.format(
+            Identifier(g_digest_items),
+            Identifier(g_digest_items_user_chats_id),
+            Identifier(g_digest_items_monitored_chats_id),
+            Identifier(g_digest_items_message_id),
+            Identifier(g_digest_items_due_time),
+            # select
+            Identifier(g_user_chats, g_user_chats_id),
+            Identifier(g_monitored_chats, g_monitored_chats_id),
+            # from
+            Identifier(g_chats),
+            Identifier(g_user_chat_alias),
+            Identifier(g_user_chats),
+            Identifier(g_chats),
+            Identifier(g_monitored_chat_alias),
+            Identifier(g_monitored_chats),
+            # where user chat
+            Identifier(g_user_chat_alias, g_chats_telegram_chat_id),
+            Identifier(g_user_chats, g_user_chats_chats_id),
+            Identifier(g_user_chat_alias, g_chats_id),
+            # where monitored chat
+            Identifier(g_monitored_chat_alias, g_chats_telegram_chat_id),
+            Identifier(g_monitored_chats, g_monitored_chats_chats_id),
+            Identifier(g_monitored_chat_alias, g_chats_id))
+        values = tuple(list(column) for column in zip(*items))
+        await execute(cursor, query, values)
+
+        if cursor.rowcount != len(items):
+            raise RuntimeError(f"{cursor.query} inserted unexpected amount of rows={cursor.rowcount}")
+
+    @retriable_transaction()
+    async def get_due_digest_items(self, limit: int, cursor) -> list:
+        sql = SQL("SELECT {}, {}, {}, {}, {}, {}, {}, {}, {} "
+                  "FROM {}, {}, {} {}, {}, {} {} "
+                  "WHERE "
+                  "{} <= NOW() AND "
+                  "{}={} AND {}={} AND "
+                  "{}={} AND {}={} "
+                  "ORDER BY {}, {} "
+                  "LIMIT %s")
+        query = sql.format(
+            Identifier(g_digest_items, g_digest_items_id),
+            Identifier(g_user_chat_alias, g_chats_telegram_chat_id),
+            Identifier(g_user_chats, g_user_chats_enabled),
+            Identifier(g_user_chats, g_user_chats_language),
+            Identifier(g_user_chats, g_user_chats_bot_index),
+            Identifier(g_monitored_chat_alias, g_chats_telegram_chat_id),
+            Identifier(g_monitored_chats, g_monitored_chats_title),
+            Identifier(g_monitored_chats, g_monitored_chats_joiner),
+            Identifier(g_digest_items, g_digest_items_message_id),
+            # from
+            Identifier(g_digest_items),
+            Identifier(g_user_chats),
+            Identifier(g_chats),
+            Identifier(g_user_chat_alias),
+            Identifier(g_monitored_chats),
+            Identifier(g_chats),
+            Identifier(g_monitored_chat_alias),
+            # where due
+            Identifier(g_digest_items, g_digest_items_due_time),
+            # where user chat
+            Identifier(g_digest_items, g_digest_items_user_chats_id),
+            Identifier(g_user_chats, g_user_chats_id),
+            Identifier(g_user_chats, g_user_chats_chats_id),
+            Identifier(g_user_chat_alias, g_chats_id),
+            # where monitored chat
+            Identifier(g_digest_items, g_digest_items_monitored_chats_id),
+            Identifier(g_monitored_chats, g_monitored_chats_id),
+            Identifier(g_monitored_chats, g_monitored_chats_chats_id),
+            Identifier(g_monitored_chat_alias, g_chats_id),
+            # order
+            Identifier(g_digest_items, g_digest_items_due_time),
+            Identifier(g_digest_items, g_digest_items_id))
+        values = limit,
+        await execute(cursor, query, values)
+
+        # fetch
+        items = list()
+
+        while True:
+            partial_result = await cursor.fetchmany()
+            get_logger().debug(f"{cursor.query} returned result={partial_result}")
+
+            if not partial_result:
+                break
+
+            for row in partial_result:
+                if len(row) != 9 or not isinstance(row[0], int) or not isinstance(row[1], int) \
+                        or not isinstance(row[2], bool) or not isinstance(row[3], int) \
+                        or not isinstance(row[4], int) or not isinstance(row[5], int) \
+                        or not isinstance(row[6], str) or not isinstance(row[7], str) \
+                        or not isinstance(row[8], int):
+                    raise RuntimeError(
+                        f"{cursor.query} returned invalid amount of columns or invalid result={partial_result}")
+
+                items.append(
+                    (row[0], row[1], row[2], Language(value=row[3]), row[4], row[5], row[6], row[7], row[8]))
+
+        return items
+
+    @retriable_transaction()
+    async def delete_digest_items(self, item_ids: list, cursor):
+        if len(item_ids) == 0:
+            return
+
+        query = SQL("DELETE FROM {} WHERE {}=ANY(%s::int8[])").format(
+            Identifier(g_digest_items),
+            Identifier(g_digest_items, g_digest_items_id))
+        values = list(item_ids),
+        await execute(cursor, query, values)
+
+    @retriable_transaction()
+    async def set_user_chat_quiet_hours(
+            self, user_chat_id: int, from_minute: Optional[int], to_minute: Optional[int], cursor) -> bool:
+        query = SQL("UPDATE {} SET {}=%s, {}=%s WHERE {}=TRUE AND {}={}").format(
+            Identifier(g_user_chats),
+            Identifier(g_user_chats_quiet_from_minute),
+            Identifier(g_user_chats_quiet_to_minute),
+            # where
+            Identifier(g_user_chats, g_user_chats_enabled),
+            Identifier(g_user_chats, g_user_chats_id),
+            get_user_chats_id_subselect())
+        values = from_minute, to_minute, user_chat_id
+        await execute(cursor, query, values)
+
+        if cursor.rowcount > 1:
+            raise RuntimeError(f"{cursor.query} affected unexpected amount of rows={cursor.rowcount}")
+
+        return cursor.rowcount == 1
+
+    @retriable_transaction(isolation_level=IsolationLevel.repeatable_read, workload=PoolWorkload.READ)
+    async def get_quiet_hours(self, cursor) -> dict:
+        query = SQL("SELECT {}, {}, {} FROM {}, {} WHERE {}={} AND {}=TRUE AND {} IS NOT NULL").format(
+            Identifier(g_chats, g_chats_telegram_chat_id),
+            Identifier(g_user_chats, g_user_chats_quiet_from_minute),
+            Identifier(g_user_chats, g_user_chats_quiet_to_minute),
+            # from
+            Identifier(g_chats),
+            Identifier(g_user_chats),
+            # where
+            Identifier(g_chats, g_chats_id),
+            Identifier(g_user_chats, g_user_chats_chats_id),
+            Identifier(g_user_chats, g_user_chats_enabled),
+            Identifier(g_user_chats, g_user_chats_quiet_from_minute))
+        await execute(cursor, query, tuple())
+        quiet_hours = dict()
+
+        for row in await cursor.fetchall():
+            if len(row) != 3 or not isinstance(row[0], int) or not isinstance(row[1], int) \
+                    or not isinstance(row[2], int):
+                raise RuntimeError(f"{cursor.query} returned invalid amount of columns or invalid result={row}")
+
+            quiet_hours[row[0]] = row[1], row[2]
+
+        return quiet_hours
+
+    @retriable_transaction()
+    async def create_analytics_events_partitions(self, day: date, cursor):
+        month_start = day.replace(day=1)
+        next_month_start = (month_start + timedelta(days=32)).replace(day=1)
+        next_next_month_start = (next_month_start + timedelta(days=32)).replace(day=1)
+
+        for partition_start, partition_end in [
+                (month_start, next_month_start), (next_month_start, next_next_month_start)]:
+            partition = f"{g_analytics_events}_{partition_start.year}_{partition_start.month:02}"
+            query = SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)").format(
+                Identifier(partition),
+                Identifier(g_analytics_events))
+            # bounds are utc midnights; plain dates would be taken in server time zone
+            values = tuple(
+                datetime(bound.year, bound.month, bound.day, tzinfo=timezone.utc)
+                for bound in (partition_start, partition_end))
+            await execute(cursor, query, values)
+
+    @retriable_transaction()
+    async def add_analytics_events(self, events: list, cursor):
+        if len(events) == 0:
+            return
+
+        # aiopg has no COPY support, so batch is sent as single statement of unnested arrays instead
+        sql = SQL("INSERT INTO {} ({}, {}, {}, {}, {}, {}) "
+                  "SELECT * FROM unnest(%s::int2[], %s::timestamptz[], %s::int8[], %s::int8[], %s::float8[], "
+                  "%s::text[])")
+        query = sql.format(
+            Identifier(g_analytics_events),
+            Identifier(g_analytics_events_event_type),
+            Identifier(g_analytics_events_event_time),
+            Identifier(g_analytics_events_user_chat_id),
+            Identifier(g_analytics_events_chat_id),
+            Identifier(g_analytics_events_latency_seconds),
+            Identifier(g_analytics_events_detail))
+        values = tuple(list(column) for column in zip(*events))
+        await execute(cursor, query, values)
+
+    @retriable_transaction()
+    async def add_channel_rollups(self, rows: list, cursor):
+        if len(rows) == 0:
+            return
+
+        values = tuple(list(column) for column in zip(*rows))
+        # hourly rows are unique already, daily are summed up from them
+        await execute(
+            cursor, get_channel_rollups_upsert(table=g_channel_rollups_hourly, bucket_sql="items.bucket"), values)
+        await execute(
+            cursor,
+            get_channel_rollups_upsert(
+                table=g_channel_rollups_daily,
+                bucket_sql="date_trunc('day', items.bucket AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'"),
+            values)
+
+    @retriable_transaction(workload=PoolWorkload.READ)
+    async def get_user_chat_channel_stats(self, user_chat_id: int, days: int, cursor) -> list:
+        counters_count = len(g_channel_rollups_counters)
+        sql = SQL("SELECT {}, {}, " + ", ".join(["COALESCE(SUM({}), 0)::int8"] * counters_count) + " "
+                  "FROM {} "
+                  "JOIN {} ON {}={} "
+                  "JOIN {} ON {}={} "
+                  "LEFT JOIN {} ON {}={} AND {} >= date_trunc('day', NOW()) - %s * '1 day'::interval "
+                  "WHERE {}={} AND {}=TRUE "
+                  "GROUP BY {}, {} "
+                  "ORDER BY 3 DESC")
+        query = sql.format(
+            Identifier(g_chats, g_chats_telegram_chat_id),
+            Identifier(g_monitored_chats, g_monitored_chats_title),
+            *[Identifier(g_channel_rollups_daily, counter) for counter in g_channel_rollups_counters],
+            # from
+            Identifier(g_subscriptions),
+            Identifier(g_monitored_chats),
+            Identifier(g_subscriptions, g_subscriptions_monitored_chats_id),
+            Identifier(g_monitored_chats, g_monitored_chats_id),
+            Identifier(g_chats),
+            Identifier(g_monitored_chats, g_monitored_chats_chats_id),
+            Identifier(g_chats, g_chats_id),
+            Identifier(g_channel_rollups_daily),
+            Identifier(g_channel_rollups_daily, g_channel_rollups_monitored_chats_id),
+            Identifier(g_monitored_chats, g_monitored_chats_id),
+            Identifier(g_channel_rollups_daily, g_channel_rollups_bucket),
+            # where
+            Identifier(g_subscriptions, g_subscriptions_user_chats_id),
+            get_user_chats_id_subselect(),
+            Identifier(g_subscriptions, g_subscriptions_enabled),
+            # group
+            Identifier(g_chats, g_chats_telegram_chat_id),
+            Identifier(g_monitored_chats, g_monitored_chats_title))
+        # today is not over yet, so it is counted on top of days
+        values = days - 1, user_chat_id
+        await execute(cursor, query, values)
+
+        # fetch
+        stats = list()
+
+        while True:
+            partial_result = await cursor.fetchmany()
+            get_logger().debug(f"{cursor.query} returned result={partial_result}")
+
+            if not partial_result:
+                break
+
+            for row in partial_result:
+                if len(row) != 2 + counters_count or not isinstance(row[0], int) or not isinstance(row[1], str) \
+                        or not all(isinstance(value, int) for value in row[2:]):
+                    raise RuntimeError(
+                        f"{cursor.query} returned invalid amount of columns or invalid result={partial_result}")
+
+                stats.append(tuple(row))
+
+        return stats
+
+    @retriable_transaction(workload=PoolWorkload.READ)
+    async def get_bundles(self, cursor) -> list:
+        query = SQL("SELECT {}, COUNT({}) FROM {} LEFT JOIN {} ON {}={} AND {}=TRUE GROUP BY {} ORDER BY {}").format(
+            Identifier(g_bundles, g_bundles_name),
+            Identifier(g_bundle_channels, g_bundle_channels_monitored_chats_id),
+            # from
+            Identifier(g_bundles),
+            Identifier(g_bundle_channels),
+            Identifier(g_bundle_channels, g_bundle_channels_bundles_id),
+            Identifier(g_bundles, g_bundles_id),
+            Identifier(g_bundle_channels, g_bundle_channels_enabled),
+            # group & order
+            Identifier(g_bundles, g_bundles_name),
+            Identifier(g_bundles, g_bundles_name))
+        await execute(cursor, query, tuple())
+
+        # fetch
+        bundles = list()
+
+        while True:
+            partial_result = await cursor.fetchmany()
+            get_logger().debug(f"{cursor.query} returned result={partial_result}")
+
+            if not partial_result:
+                break
+
+            for row in partial_result:
+                if len(row) != 2 or not isinstance(row[0], str) or not isinstance(row[1], int):
+                    raise RuntimeError(
+                        f"{cursor.query} returned invalid amount of columns or invalid result={partial_result}")
+
+                bundles.append((row[0], row[1]))
+
+        return bundles
+
+    @retriable_transaction(workload=PoolWorkload.READ)
+    async def get_user_chat_bundles(self, user_chat_id: int, cursor) -> list:
+        query = SQL("SELECT {} FROM {} JOIN {} ON {}={} WHERE {}={} AND {}=TRUE ORDER BY {}").format(
+            Identifier(g_bundles, g_bundles_name),
+            # from
+            Identifier(g_bundle_subscriptions),
+            Identifier(g_bundles),
+            Identifier(g_bundle_subscriptions, g_bundle_subscriptions_bundles_id),
+            Identifier(g_bundles, g_bundles_id),
+            # where
+            Identifier(g_bundle_subscriptions, g_bundle_subscriptions_user_chats_id),
+            get_user_chats_id_subselect(),
+            Identifier(g_bundle_subscriptions, g_bundle_subscriptions_enabled),
+            # order
+            Identifier(g_bundles, g_bundles_name))
+        values = user_chat_id,
+        await execute(cursor, query, values)
+
+        # fetch
+        names = list()
+
+        while True:
+            partial_result = await cursor.fetchmany()
+            get_logger().debug(f"{cursor.query} returned result={partial_result}")
+
+            if not partial_result:
+                break
+
+            for row in partial_result:
+                if len(row) != 1 or not isinstance(row[0], str):
+                    raise RuntimeError(
+                        f"{cursor.query} returned invalid amount of columns or invalid result={partial_result}")
+
+                names.append(row[0])
+
+        return names
+
+    @retriable_transaction(isolation_level=IsolationLevel.serializable)
+    async def add_or_enable_bundle_subscription(self, user_chat_id: int, bundle_name: str, cursor) -> tuple:
+        query = SQL("SELECT {}, {} FROM {} LEFT JOIN {} ON {}={} AND {}={} WHERE {}=%s").format(
+            Identifier(g_bundles, g_bundles_id),
+            Identifier(g_bundle_subscriptions, g_bundle_subscriptions_enabled),
+            # from
+            Identifier(g_bundles),
+            Identifier(g_bundle_subscriptions),
+            Identifier(g_bundle_subscriptions, g_bundle_subscriptions_bundles_id),
+            Identifier(g_bundles, g_bundles_id),
+            Identifier(g_bundle_subscriptions, g_bundle_subscriptions_user_chats_id),
+            get_user_chats_id_subselect(),
+            # where
+            Identifier(g_bundles, g_bundles_name))
+        values = user_chat_id, bundle_name
+        await execute(cursor, query, values)
+
+        if cursor.rowcount > 1:
+            raise RuntimeError(f"{cursor.query} returned unexpected amount of rows={cursor.rowcount}")
+
+        # no such bundle
+        if cursor.rowcount == 0:
+            return False, False
+
+        result = await cursor.fetchone()
+        get_logger().debug(f"{cursor.query} returned result={result}")
+
+        if len(result) != 2 or not isinstance(result[0], int) or not isinstance(result[1], (bool, type(None))):
+            raise RuntimeError(f"{cursor.query} returned invalid amount of columns or invalid result={result}")
+
+        bundle_id, enabled_before = result[0], result[1] is True
+
+        if enabled_before:
+            return True, enabled_before
+
+        query = SQL("INSERT INTO {} ({}, {}) SELECT {}, %s ON CONFLICT ON CONSTRAINT {} DO UPDATE SET {}=TRUE").format(
+            Identifier(g_bundle_subscriptions),
+            Identifier(g_bundle_subscriptions_user_chats_id),
+            Identifier(g_bundle_subscriptions_bundles_id),
+            get_user_chats_id_subselect(),
+            Identifier(g_bundle_subscriptions_unique),
+            Identifier(g_bundle_subscriptions_enabled))
+        values = user_chat_id, bundle_id
+        await execute(cursor, query, values)
+
+        # upsert returns 1 on insert and update. other numbers are failures
+        if cursor.rowcount != 1:
+            raise RuntimeError(f"{cursor.query} affected unexpected amount of rows={cursor.rowcount}")
+
+        return True, enabled_before
+
+    # returns true if subscription was enabled before
+    @retriable_transaction()
+    async def disable_bundle_subscription(self, user_chat_id: int, bundle_name: str, cursor) -> bool:
+        query = SQL("UPDATE {} SET {}=FALSE WHERE {}=TRUE AND {}={} AND {}={}").format(
+            Identifier(g_bundle_subscriptions),
+            Identifier(g_bundle_subscriptions_enabled),
+            # where
+            Identifier(g_bundle_subscriptions, g_bundle_subscriptions_enabled),
+            Identifier(g_bundle_subscriptions, g_bundle_subscriptions_user_chats_id),
+            get_user_chats_id_subselect(),
+            Identifier(g_bundle_subscriptions, g_bundle_subscriptions_bundles_id),
+            get_bundles_id_subselect())
+        values = user_chat_id, bundle_name
+        await execute(cursor, query, values)
+
+        if cursor.rowcount > 1:
+            raise RuntimeError(f"{cursor.query} affected unexpected amount of rows={cursor.rowcount}")
+
+        return cursor.rowcount == 1
+
+    # bundle is created if it doesn't exist; channel gets monitored. Returns true if channel was in bundle already
+    @retriable_transaction(isolation_level=IsolationLevel.serializable)
+    async def add_or_enable_bundle_channel(
+            self, bundle_name: str, target_chat_id: int, target_title: str, target_joiner: str, cursor) -> bool:
+        query = SQL("INSERT INTO {} ({}) VALUES (%s) ON CONFLICT ON CONSTRAINT {} DO NOTHING").format(
+            Identifier(g_bundles),
+            Identifier(g_bundles_name),
+            Identifier(g_bundles_name_unique))
+        values = bundle_name,
+        await execute(cursor, query, values)
+
+        await add_or_enable_monitored_chat(
+            cursor=cursor, chat_id=target_chat_id, chat_type=ChatType.CHANNEL, title=target_title, joiner=target_joiner)
+
+        query = SQL("SELECT {} FROM {} WHERE {}={} AND {}={}").format(
+            Identifier(g_bundle_channels, g_bundle_channels_enabled),
+            Identifier(g_bundle_channels),
+            Identifier(g_bundle_channels, g_bundle_channels_bundles_id),
+            get_bundles_id_subselect(),
+            Identifier(g_bundle_channels, g_bundle_channels_monitored_chats_id),
+            get_monitored_chats_id_subselect())
+        values = bundle_name, target_chat_id
+        await execute(cursor, query, values)
+
+        if cursor.rowcount > 1:
+            raise RuntimeError(f"{cursor.query} returned unexpected amount of rows={cursor.rowcount}")
+
+        if cursor.rowcount == 1:
+            result = await cursor.fetchone()
+            get_logger().debug(f"{cursor.query} returned result={result}")
+
+            if len(result) != 1 or not isinstance(result[0], bool):
+                raise RuntimeError(f"{cursor.query} returned invalid amount of columns or invalid result={result}")
+
+            if result[0]:
+                return True
+
+        query = SQL("INSERT INTO {} ({}, {}) SELECT {}, {} ON CONFLICT ON CONSTRAINT {} DO UPDATE SET {}=TRUE").format(
+            Identifier(g_bundle_channels),
+            Identifier(g_bundle_channels_bundles_id),
+            Identifier(g_bundle_channels_monitored_chats_id),
+            get_bundles_id_subselect(),
+            get_monitored_chats_id_subselect(),
+            Identifier(g_bundle_channels_pk),
+            Identifier(g_bundle_channels_enabled))
+        await execute(cursor, query, values)
+
+        # upsert returns 1 on insert and update. other numbers are failures
+        if cursor.rowcount != 1:
+            raise RuntimeError(f"{cursor.query} affected unexpected amount of rows={cursor.rowcount}")
+
+        return False
+
+    # returns true if channel was in bundle
+    @retriable_transaction(isolation_level=IsolationLevel.serializable)
+    async def disable_bundle_channel(self, bundle_name: str, target_chat_id: int, cursor) -> bool:
+        query = SQL("UPDATE {} SET {}=FALSE WHERE {}=TRUE AND {}={} AND {}={}").format(
+            Identifier(g_bundle_channels),
+            Identifier(g_bundle_channels_enabled),
+            # where
+            Identifier(g_bundle_channels, g_bundle_channels_enabled),
+            Identifier(g_bundle_channels, g_bundle_channels_bundles_id),
+            get_bundles_id_subselect(),
+            Identifier(g_bundle_channels, g_bundle_channels_monitored_chats_id),
+            get_monitored_chats_id_subselect())
+        values = bundle_name, target_chat_id
+        await execute(cursor, query, values)
+
+        if cursor.rowcount > 1:
+            raise RuntimeError(f"{cursor.query} affected unexpected amount of rows={cursor.rowcount}")
+
+        if cursor.rowcount == 0:
+            return False
+
+        await disable_monitored_chat_if_unused(cursor=cursor, chat_id=target_chat_id)
+
+        return True
+
+    @retriable_transaction(isolation_level=IsolationLevel.repeatable_read, workload=PoolWorkload.READ)
+    async def get_channel_bundles(self, cursor) -> dict:
+        query = SQL("SELECT {}, {} FROM {} JOIN {} ON {}={} JOIN {} ON {}={} WHERE {}=TRUE AND {}=TRUE").format(
+            Identifier(g_chats, g_chats_telegram_chat_id),
+            Identifier(g_bundle_channels, g_bundle_channels_bundles_id),
+            # from
+            Identifier(g_bundle_channels),
+            Identifier(g_monitored_chats),
+            Identifier(g_bundle_channels, g_bundle_channels_monitored_chats_id),
+            Identifier(g_monitored_chats, g_monitored_chats_id),
+            Identifier(g_chats),
+            Identifier(g_monitored_chats, g_monitored_chats_chats_id),
+            Identifier(g_chats, g_chats_id),
+            # where
+            Identifier(g_bundle_channels, g_bundle_channels_enabled),
+            Identifier(g_monitored_chats, g_monitored_chats_enabled))
+        await execute(cursor, query, tuple())
+
+        # fetch
+        chat_id_to_bundle_ids = dict()
+
+        while True:
+            partial_result = await cursor.fetchmany()
+            get_logger().debug(f"{cursor.query} returned result={partial_result}")
+
+            if not partial_result:
+                break
+
+            for row in partial_result:
+                if len(row) != 2 or not isinstance(row[0], int) or not isinstance(row[1], int):
+                    raise RuntimeError(
+                        f"{cursor.query} returned invalid amount of columns or invalid result={partial_result}")
+
+                chat_id_to_bundle_ids.setdefault(row[0], set()).add(row[1])
+
+        return chat_id_to_bundle_ids
+
+    @retriable_transaction(workload=PoolWorkload.READ)
+    async def get_bundle_subscribers(self, bundle_id: int, cursor) -> dict:
+        query = SQL("SELECT {}, {} FROM {} JOIN {} ON {}={} JOIN {} ON {}={} "
+                    "WHERE {}=%s AND {}=TRUE AND {}=TRUE").format(
+            Identifier(g_chats, g_chats_telegram_chat_id),
+            Identifier(g_user_chats, g_user_chats_bot_index),
+            # from
+            Identifier(g_bundle_subscriptions),
+            Identifier(g_user_chats),
+            Identifier(g_bundle_subscriptions, g_bundle_subscriptions_user_chats_id),
+            Identifier(g_user_chats, g_user_chats_id),
+            Identifier(g_chats),
+            Identifier(g_user_chats, g_user_chats_chats_id),
+            Identifier(g_chats, g_chats_id),
+            # where
+            Identifier(g_bundle_subscriptions, g_bundle_subscriptions_bundles_id),
+            Identifier(g_bundle_subscriptions, g_bundle_subscriptions_enabled),
+            Identifier(g_user_chats, g_user_chats_enabled))
+        values = bundle_id,
+        await execute(cursor, query, values)
+
+        # fetch
+        subbed_telegram_user_chat_id_to_bot_index = dict()
+
+        while True:
+            partial_result = await cursor.fetchmany()
+            get_logger().debug(f"{cursor.query} returned result={partial_result}")
+
+            if not partial_result:
+                break
+
+            for row in partial_result:
+                if len(row) != 2 or not isinstance(row[0], int) or not isinstance(row[1], int):
+                    raise RuntimeError(
+                        f"{cursor.query} returned invalid amount of columns or invalid result={partial_result}")
+
+                subbed_telegram_user_chat_id_to_bot_index[row[0]] = row[1]
+
+        return subbed_telegram_user_chat_id_to_bot_index
+
+    @retriable_transaction()
+    async def add_outbox_items(self, items: list, handoff_post_ids: list, cursor):
+        # post is fanned out in the same transaction it stops being handed off
+        if len(handoff_post_ids) > 0:
+            values = list(handoff_post_ids),
+            await execute(cursor, get_handoff_posts_delete(), values)
+
+        if len(items) == 0:
+            return
+
+        # message ids are passed as array literals, because unnest flattens multidimensional arrays
+        sql = SQL("INSERT INTO {} ({}, {}, {}, {}, {}, {}, {}, {}) "
+                  "SELECT items.bot_index, items.user_chat_id, items.chat_id, items.user_peer, items.from_peer, "
+                  "items.message_ids::int4[], items.as_album, items.not_before "
+                  "FROM unnest(%s::int4[], %s::int8[], %s::int8[], %s::bytea[], %s::bytea[], %s::text[], %s::bool[], "
+                  "%s::timestamptz[]) "
+                  "AS items(bot_index, user_chat_id, chat_id, user_peer, from_peer, message_ids, as_album, not_before)")
+        query = sql.format(
+            Identifier(g_delivery_outbox),
+            Identifier(g_delivery_outbox_bot_index),
+            Identifier(g_delivery_outbox_user_chat_id),
+            Identifier(g_delivery_outbox_chat_id),
+            Identifier(g_delivery_outbox_user_peer),
+            Identifier(g_delivery_outbox_from_peer),
+            Identifier(g_delivery_outbox_message_ids),
+            Identifier(g_delivery_outbox_as_album),
+            Identifier(g_delivery_outbox_not_before))
+        rows = [
+            (bot_index, user_chat_id, chat_id, user_peer, from_peer,
+             "{" + ",".join(str(message_id) for message_id in message_ids) + "}", as_album, not_before)
+            for bot_index, user_chat_id, chat_id, user_peer, from_peer, message_ids, as_album, not_before in items]
+        values = tuple(list(column) for column in zip(*rows))
+        await execute(cursor, query, values)
+
+        if cursor.rowcount != len(items):
+            raise RuntimeError(f"{cursor.query} inserted unexpected amount of rows={cursor.rowcount}")
+
+    # items being claimed by other consumers are skipped instead of waited for
+    @retriable_transaction()
+    async def claim_outbox_items(
+            self,
+            partition_index: int,
+            partitions_count: int,
+            limit: int,
+            lease_seconds: float,
+            deferred: bool,
+            cursor) -> list:
+        # retries are not deferred by quiet hours, so due ones are sent as soon as possible. Items of user chat wait
+        # for its older items that are not claimed the same way, so posts are delivered to user chat in order: items
+        # to be sent as soon as possible wait for deferred items & retries that are not due yet, deferred items wait
+        # for retries & deferred items that are not due yet
+        if deferred:
+            readiness = SQL("{} = 0 AND {} <= NOW()").format(
+                Identifier(g_delivery_outbox, g_delivery_outbox_attempts),
+                Identifier(g_delivery_outbox, g_delivery_outbox_not_before))
+            waiting = SQL("{} > 0 OR {} > NOW()").format(
+                Identifier(g_waiting_alias, g_delivery_outbox_attempts),
+                Identifier(g_waiting_alias, g_delivery_outbox_not_before))
+        else:
+            readiness = SQL("({} IS NULL OR ({} > 0 AND {} <= NOW()))").format(
+                Identifier(g_delivery_outbox, g_delivery_outbox_not_before),
+                Identifier(g_delivery_outbox, g_delivery_outbox_attempts),
+                Identifier(g_delivery_outbox, g_delivery_outbox_not_before))
+            waiting = SQL("{} = 0 OR {} > NOW()").format(
+                Identifier(g_waiting_alias, g_delivery_outbox_attempts),
+                Identifier(g_waiting_alias, g_delivery_outbox_not_before))
+
+        sql = SQL("{} AND NOT EXISTS (SELECT 1 FROM {} {} WHERE {}={} AND {} IS NOT NULL AND {} < {} AND ({}))")
+        readiness = sql.format(
+            readiness,
+            Identifier(g_delivery_outbox),
+            Identifier(g_waiting_alias),
+            Identifier(g_waiting_alias, g_delivery_outbox_user_chat_id),
+            Identifier(g_delivery_outbox, g_delivery_outbox_user_chat_id),
+            Identifier(g_waiting_alias, g_delivery_outbox_not_before),
+            Identifier(g_waiting_alias, g_delivery_outbox_id),
+            Identifier(g_delivery_outbox, g_delivery_outbox_id),
+            waiting)
+
+        sql = SQL("UPDATE {} SET {}=NOW() + %s * '1 second'::interval "
+                  "WHERE {} IN ("
+                  "SELECT {} FROM {} "
+                  "WHERE ({} IS NULL OR {} < NOW()) AND abs({}) %% %s = %s AND {} "
+                  "ORDER BY {} "
+                  "LIMIT %s "
+                  "FOR UPDATE SKIP LOCKED) "
+                  "RETURNING {}, {}, {}, {}, {}, {}, {}, {}, {}")
+        query = sql.format(
+            Identifier(g_delivery_outbox),
+            Identifier(g_delivery_outbox_lease_until),
+            # where
+            Identifier(g_delivery_outbox, g_delivery_outbox_id),
+            # select
+            Identifier(g_delivery_outbox, g_delivery_outbox_id),
+            Identifier(g_delivery_outbox),
+            Identifier(g_delivery_outbox, g_delivery_outbox_lease_until),
+            Identifier(g_delivery_outbox, g_delivery_outbox_lease_until),
+            Identifier(g_delivery_outbox, g_delivery_outbox_user_chat_id),
+            readiness,
+            Identifier(g_delivery_outbox, g_delivery_outbox_id),
+            # returning
+            Identifier(g_delivery_outbox_id),
+            Identifier(g_delivery_outbox_bot_index),
+            Identifier(g_delivery_outbox_user_chat_id),
+            Identifier(g_delivery_outbox_chat_id),
+            Identifier(g_delivery_outbox_user_peer),
+            Identifier(g_delivery_outbox_from_peer),
+            Identifier(g_delivery_outbox_message_ids),
+            Identifier(g_delivery_outbox_as_album),
+            Identifier(g_delivery_outbox_attempts))
+        values = lease_seconds, partitions_count, partition_index, limit
+        await execute(cursor, query, values)
+
+        # fetch
+        items = list()
+
+        while True:
+            partial_result = await cursor.fetchmany()
+            get_logger().debug(f"{cursor.query} returned {len(partial_result)} rows")
+
+            if not partial_result:
+                break
+
+            for row in partial_result:
+                if len(row) != 9 or not isinstance(row[0], int) or not isinstance(row[1], int) \
+                        or not isinstance(row[2], int) or not isinstance(row[3], (int, type(None))) \
+                        or not isinstance(row[4], (bytes, memoryview)) \
+                        or not isinstance(row[5], (bytes, memoryview)) \
+                        or not isinstance(row[6], list) or not isinstance(row[7], bool) \
+                        or not isinstance(row[8], int):
+                    raise RuntimeError(
+                        f"{cursor.query} returned invalid amount of columns or invalid result={partial_result}")
+
+                items.append((row[0], row[1], row[2], row[3], bytes(row[4]), bytes(row[5]), row[6], row[7], row[8]))
+
+        # returning gives no order guarantee, while items of the same user chat must be sent in order
+        items.sort(key=lambda item: item[0])
+
+        return items
+
+    @retriable_transaction()
+    async def delete_outbox_items(self, item_ids: list, cursor):
+        if len(item_ids) == 0:
+            return
+
+        query = SQL("DELETE FROM {} WHERE {}=ANY(%s::int8[])").format(
+            Identifier(g_delivery_outbox),
+            Identifier(g_delivery_outbox, g_delivery_outbox_id))
+        values = list(item_ids),
+        await execute(cursor, query, values)
+
+    @retriable_transaction()
+    async def release_outbox_items(self, item_ids: list, cursor):
+        if len(item_ids) == 0:
+            return
+
+        query = SQL("UPDATE {} SET {}=NULL WHERE {}=ANY(%s::int8[])").format(
+            Identifier(g_delivery_outbox),
+            Identifier(g_delivery_outbox_lease_until),
+            Identifier(g_delivery_outbox, g_delivery_outbox_id))
+        values = list(item_ids),
+        await execute(cursor, query, values)
+
+    @retriable_transaction()
+    async def retry_outbox_items(self, items: list, cursor):
+        if len(items) == 0:
+            return
+
+        sql = SQL("UPDATE {} SET {}=NULL, {}=items.attempts, {}=NOW() + items.delay_seconds * '1 second'::interval "
+                  "FROM unnest(%s::int8[], %s::int4[], %s::float8[]) AS items(id, attempts, delay_seconds) "
+                  "WHERE {}=items.id")
+        query = sql.format(
+            Identifier(g_delivery_outbox),
+            Identifier(g_delivery_outbox_lease_until),
+            Identifier(g_delivery_outbox_attempts),
+            Identifier(g_delivery_outbox_not_before),
+            Identifier(g_delivery_outbox, g_delivery_outbox_id))
+        values = tuple(list(column) for column in zip(*items))
+        await execute(cursor, query, values)
+
+    @retriable_transaction()
+    async def add_handoff_posts(self, posts: list, cursor):
+        if len(posts) == 0:
+            return
+
+        # message ids & urls are passed as array literals, because unnest flattens multidimensional arrays
+        sql = SQL("INSERT INTO {} ({}, {}, {}, {}, {}) "
+                  "SELECT posts.chat_id, posts.username, posts.message_ids::int4[], posts.text, posts.urls::text[] "
+                  "FROM unnest(%s::int8[], %s::text[], %s::text[], %s::text[], %s::text[]) "
+                  "AS posts(chat_id, username, message_ids, text, urls)")
+        query = sql.format(
+            Identifier(g_post_handoff),
+            Identifier(g_post_handoff_chat_id),
+            Identifier(g_post_handoff_username),
+            Identifier(g_post_handoff_message_ids),
+            Identifier(g_post_handoff_text),
+            Identifier(g_post_handoff_urls))
+        rows = [
+            (chat_id,
+             username,
+             "{" + ",".join(str(message_id) for message_id in message_ids) + "}",
+             text,
+             "{" + ",".join(get_quoted_array_element(url) for url in urls) + "}")
+            for chat_id, username, message_ids, text, urls in posts]
+        values = tuple(list(column) for column in zip(*rows))
+        await execute(cursor, query, values)
+
+        if cursor.rowcount != len(posts):
+            raise RuntimeError(f"{cursor.query} inserted unexpected amount of rows={cursor.rowcount}")
+
+    # posts being claimed by other bots are skipped instead of waited for
+    @retriable_transaction()
+    async def claim_handoff_posts(self, limit: int, lease_seconds: float, cursor) -> list:
+        sql = SQL("UPDATE {} SET {}=NOW() + %s * '1 second'::interval "
+                  "WHERE {} IN ("
+                  "SELECT {} FROM {} "
+                  "WHERE {} IS NULL OR {} < NOW() "
+                  "ORDER BY {} "
+                  "LIMIT %s "
+                  "FOR UPDATE SKIP LOCKED) "
+                  "RETURNING {}, {}, {}, {}, {}, {}")
+        query = sql.format(
+            Identifier(g_post_handoff),
+            Identifier(g_post_handoff_lease_until),
+            # where
+            Identifier(g_post_handoff, g_post_handoff_id),
+            # select
+            Identifier(g_post_handoff, g_post_handoff_id),
+            Identifier(g_post_handoff),
+            Identifier(g_post_handoff, g_post_handoff_lease_until),
+            Identifier(g_post_handoff, g_post_handoff_lease_until),
+            Identifier(g_post_handoff, g_post_handoff_id),
+            # returning
+            Identifier(g_post_handoff_id),
+            Identifier(g_post_handoff_chat_id),
+            Identifier(g_post_handoff_username),
+            Identifier(g_post_handoff_message_ids),
+            Identifier(g_post_handoff_text),
+            Identifier(g_post_handoff_urls))
+        values = lease_seconds, limit
+        await execute(cursor, query, values)
+
+        # fetch
+        posts = list()
+
+        while True:
+            partial_result = await cursor.fetchmany()
+            get_logger().debug(f"{cursor.query} returned {len(partial_result)} rows")
+
+            if not partial_result:
+                break
+
+            for row in partial_result:
+                if len(row) != 6 or not isinstance(row[0], int) or not isinstance(row[1], int) \
+                        or not isinstance(row[2], str) or not isinstance(row[3], list) \
+                        or not isinstance(row[4], str) or not isinstance(row[5], list):
+                    raise RuntimeError(
+                        f"{cursor.query} returned invalid amount of columns or invalid result={partial_result}")
+
+                posts.append(tuple(row))
+
+        # returning gives no order guarantee, while posts of the same channel should be handled in order
+        posts.sort(key=lambda post: post[0])
+
+        return posts
+
+    @retriable_transaction()
+    async def delete_handoff_posts(self, post_ids: list, cursor):
+        if len(post_ids) == 0:
+            return
+
+        values = list(post_ids),
+        await execute(cursor, get_handoff_posts_delete(), values)
+
+    @retriable_transaction(isolation_level=IsolationLevel.repeatable_read, workload=PoolWorkload.READ)
+    async def load_telegram_session(self, name: str, scope: str, cursor) -> tuple:
+        # session
+        query = SQL("SELECT {}, {}, {}, {}, {} FROM {} WHERE {}=%s").format(
+            Identifier(g_telegram_sessions_dc_id),
+            Identifier(g_telegram_sessions_server_address),
+            Identifier(g_telegram_sessions_port),
+            Identifier(g_telegram_sessions_auth_key),
+            Identifier(g_telegram_sessions_takeout_id),
+            Identifier(g_telegram_sessions),
+            Identifier(g_telegram_sessions_name))
+        values = name,
+        await execute(cursor, query, values)
+        result = await cursor.fetchall()
+        get_logger().debug(f"{cursor.query} returned {result}")
+
+        if len(result) > 1 or any(len(row) != 5 for row in result):
+            raise RuntimeError(f"{cursor.query} returned invalid amount of rows or columns={result}")
+
+        session = None
+
+        if len(result) == 1:
+            dc_id, server_address, port, auth_key, takeout_id = result[0]
+            session = dc_id, server_address, port, None if auth_key is None else bytes(auth_key), takeout_id
+
+        # update states
+        query = SQL("SELECT {}, {}, {}, {}, {} FROM {} WHERE {}=%s").format(
+            Identifier(g_telegram_update_states_entity_id),
+            Identifier(g_telegram_update_states_pts),
+            Identifier(g_telegram_update_states_qts),
+            Identifier(g_telegram_update_states_date),
+            Identifier(g_telegram_update_states_seq),
+            Identifier(g_telegram_update_states),
+            Identifier(g_telegram_update_states_session_name))
+        values = name,
+        await execute(cursor, query, values)
+        update_states = [tuple(row) for row in await cursor.fetchall()]
+
+        # entities; there are lots of them for bots, so they are fetched in parts
+        query = SQL("SELECT {}, {}, {}, {}, {} FROM {} WHERE {}=%s").format(
+            Identifier(g_telegram_entities_id),
+            Identifier(g_telegram_entities_hash),
+            Identifier(g_telegram_entities_username),
+            Identifier(g_telegram_entities_phone),
+            Identifier(g_telegram_entities_name),
+            Identifier(g_telegram_entities),
+            Identifier(g_telegram_entities_scope))
+        values = scope,
+        await execute(cursor, query, values)
+        entities = list()
+
+        while True:
+            partial_result = await cursor.fetchmany()
+
+            if not partial_result:
+                break
+
+            entities.extend(tuple(row) for row in partial_result)
+
+        get_logger().debug(f"Loaded telegram session={name} with {len(update_states)} update states and "
+                           f"{len(entities)} entities of scope={scope}")
+
+        return session, update_states, entities
+
+    # entities are upserted in order of id, so concurrent saves of the same scope don't deadlock
+    @retriable_transaction()
+    async def save_telegram_session(
+            self, name: str, scope: str, session: Optional[tuple], update_states: list, entities: list, cursor):
+        if session is not None:
+            sql = SQL("INSERT INTO {} ({}, {}, {}, {}, {}, {}) VALUES (%s, %s, %s, %s, %s, %s) "
+                      "ON CONFLICT ({}) DO UPDATE SET {}=EXCLUDED.{}, {}=EXCLUDED.{}, {}=EXCLUDED.{}, "
+                      "{}=EXCLUDED.{}, {}=EXCLUDED.{}")
+            query = sql.format(
+                Identifier(g_telegram_sessions),
+                Identifier(g_telegram_sessions_name),
+                Identifier(g_telegram_sessions_dc_id),
+                Identifier(g_telegram_sessions_server_address),
+                Identifier(g_telegram_sessions_port),
+                Identifier(g_telegram_sessions_auth_key),
+                Identifier(g_telegram_sessions_takeout_id),
+                # on conflict
+                Identifier(g_telegram_sessions_name),
+                *chain(*[
+                    (Identifier(column), Identifier(column)) for column in (
+                        g_telegram_sessions_dc_id,
+                        g_telegram_sessions_server_address,
+                        g_telegram_sessions_port,
+                        g_telegram_sessions_auth_key,
+                        g_telegram_sessions_takeout_id)]))
+            dc_id, server_address, port, auth_key, takeout_id = session
+            values = name, dc_id, server_address, port, auth_key, takeout_id
+            await execute(cursor, query, values)
+
+        if len(update_states) > 0:
+            sql = SQL("INSERT INTO {} ({}, {}, {}, {}, {}, {}) "
+                      "SELECT %s, states.entity_id, states.pts, states.qts, states.date, states.seq "
+                      "FROM unnest(%s::int8[], %s::int4[], %s::int4[], %s::timestamptz[], %s::int4[]) "
+                      "AS states(entity_id, pts, qts, date, seq) "
+                      "ON CONFLICT ({}, {}) DO UPDATE SET {}=EXCLUDED.{}, {}=EXCLUDED.{}, {}=EXCLUDED.{}, "
+                      "{}=EXCLUDED.{}")
+            query = sql.format(
+                Identifier(g_telegram_update_states),
+                Identifier(g_telegram_update_states_session_name),
+                Identifier(g_telegram_update_states_entity_id),
+                Identifier(g_telegram_update_states_pts),
+                Identifier(g_telegram_update_states_qts),
+                Identifier(g_telegram_update_states_date),
+                Identifier(g_telegram_update_states_seq),
+                # on conflict
+                Identifier(g_telegram_update_states_session_name),
+                Identifier(g_telegram_update_states_entity_id),
+                *chain(*[
+                    (Identifier(column), Identifier(column)) for column in (
+                        g_telegram_update_states_pts,
+                        g_telegram_update_states_qts,
+                        g_telegram_update_states_date,
+                        g_telegram_update_states_seq)]))
+            values = (name,) + tuple(list(column) for column in zip(*update_states))
+            await execute(cursor, query, values)
+
+        if len(entities) > 0:
+            sql = SQL("INSERT INTO {} ({}, {}, {}, {}, {}, {}) "
+                      "SELECT %s, entities.id, entities.hash, entities.username, entities.phone, entities.name "
+                      "FROM unnest(%s::int8[], %s::int8[], %s::text[], %s::text[], %s::text[]) "
+                      "AS entities(id, hash, username, phone, name) "
+                      "ORDER BY entities.id "
+                      "ON CONFLICT ({}, {}) DO UPDATE SET {}=EXCLUDED.{}, {}=EXCLUDED.{}, {}=EXCLUDED.{}, "
+                      "{}=EXCLUDED.{}")
+            query = sql.format(
+                Identifier(g_telegram_entities),
+                Identifier(g_telegram_entities_scope),
+                Identifier(g_telegram_entities_id),
+                Identifier(g_telegram_entities_hash),
+                Identifier(g_telegram_entities_username),
+                Identifier(g_telegram_entities_phone),
+                Identifier(g_telegram_entities_name),
+                # on conflict
+                Identifier(g_telegram_entities_scope),
+                Identifier(g_telegram_entities_id),
+                *chain(*[
+                    (Identifier(column), Identifier(column)) for column in (
+                        g_telegram_entities_hash,
+                        g_telegram_entities_username,
+                        g_telegram_entities_phone,
+                        g_telegram_entities_name)]))
+            values = (scope,) + tuple(list(column) for column in zip(*entities))
+            await execute(cursor, query, values)
@@ -14,13 +14,23 @@ g_key_handlers_no_username = "HANDLERS_NO_USERNAME"
 g_key_handlers_help_0 = "HANDLERS_HELP_0"
 g_key_handlers_help_1 = "HANDLERS_HELP_1"
 g_key_handlers_help_2 = "HANDLERS_HELP_2"
+g_key_handlers_help_3 = "HANDLERS_HELP_3"
+g_key_handlers_help_4 = "HANDLERS_HELP_4"
+g_key_handlers_help_5 = "HANDLERS_HELP_5"
+g_key_handlers_help_6 = "HANDLERS_HELP_6"
 
 # # list
 g_key_handlers_list_count = "HANDLERS_LIST_COUNT"
 g_key_handlers_list_list = "HANDLERS_LIST_LIST"
 
+# # stats
+g_key_handlers_stats_no_subs = "HANDLERS_STATS_NO_SUBS"
+g_key_handlers_stats = "HANDLERS_STATS"
+
 # # start
 g_key_handlers_start_not_user = "HANDLERS_START_NOT_USER"
+g_key_handlers_start_redirect = "HANDLERS_START_REDIRECT"
+g_key_handlers_start_redirect_group = "HANDLERS_START_REDIRECT_GROUP"
 g_key_handlers_start_already_enabled = "HANDLERS_START_ALREADY_ENABLED"
 g_key_handlers_start_already_existed = "HANDLERS_START_ALREADY_EXISTED"
 g_key_handlers_start_introduction_0 = "HANDLERS_START_INTRODUCTION_0"
@@ -39,6 +49,40 @@ g_key_handlers_follow_did_enable = "HANDLERS_FOLLOW_DID_ENABLE"
 # # unfollow
 g_key_handlers_unfollow_not_followed = "HANDLERS_UNFOLLOW_NOT_FOLLOWED"
 g_key_handlers_unfollow_did_disable = "HANDLERS_UNFOLLOW_DID_DISABLE"
+# # filter
+g_key_handlers_filter_usage = "HANDLERS_FILTER_USAGE"
+g_key_handlers_filter_invalid_pattern = "HANDLERS_FILTER_INVALID_PATTERN"
+g_key_handlers_filter_not_followed = "HANDLERS_FILTER_NOT_FOLLOWED"
+g_key_handlers_filter_already_enabled = "HANDLERS_FILTER_ALREADY_ENABLED"
+g_key_handlers_filter_did_enable = "HANDLERS_FILTER_DID_ENABLE"
+g_key_handlers_filter_scope_all = "HANDLERS_FILTER_SCOPE_ALL"
+g_key_handlers_filter_list = "HANDLERS_FILTER_LIST"
+# # unfilter
+g_key_handlers_unfilter_not_found = "HANDLERS_UNFILTER_NOT_FOUND"
+g_key_handlers_unfilter_did_disable = "HANDLERS_UNFILTER_DID_DISABLE"
+# # bundle
+g_key_handlers_bundle_no_bundles = "HANDLERS_BUNDLE_NO_BUNDLES"
+g_key_handlers_bundle_list = "HANDLERS_BUNDLE_LIST"
+g_key_handlers_bundle_not_found = "HANDLERS_BUNDLE_NOT_FOUND"
+g_key_handlers_bundle_already_enabled = "HANDLERS_BUNDLE_ALREADY_ENABLED"
+g_key_handlers_bundle_did_enable = "HANDLERS_BUNDLE_DID_ENABLE"
+# # unbundle
+g_key_handlers_unbundle_no_args = "HANDLERS_UNBUNDLE_NO_ARGS"
+g_key_handlers_unbundle_not_subscribed = "HANDLERS_UNBUNDLE_NOT_SUBSCRIBED"
+g_key_handlers_unbundle_did_disable = "HANDLERS_UNBUNDLE_DID_DISABLE"
+# # digest
+g_key_handlers_digest_usage = "HANDLERS_DIGEST_USAGE"
+g_key_handlers_digest_not_followed = "HANDLERS_DIGEST_NOT_FOLLOWED"
+g_key_handlers_digest_did_enable = "HANDLERS_DIGEST_DID_ENABLE"
+g_key_handlers_digest_did_disable = "HANDLERS_DIGEST_DID_DISABLE"
+g_key_handlers_digest_did_inherit = "HANDLERS_DIGEST_DID_INHERIT"
+# # quiet
+g_key_handlers_quiet_usage = "HANDLERS_QUIET_USAGE"
+g_key_handlers_quiet_did_enable = "HANDLERS_QUIET_DID_ENABLE"
+g_key_handlers_quiet_did_disable = "HANDLERS_QUIET_DID_DISABLE"
+
+# digest
+g_key_digest_header = "DIGEST_HEADER"
 
 g_ietf_russian = "ru"
 g_ietf_english = "en"
@@ -0,0 +1,295 @@
+from asyncio import Event, TimeoutError, wait_for
+from datetime import datetime, timezone
+from os.path import exists
+from sqlite3 import connect
+from typing import Optional
+
+from telethon import utils
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession
+from telethon.tl.types import PeerUser, PeerChat, PeerChannel
+from telethon.tl.types.updates import State
+
+from .logging import get_logger
+from .persistent_storage.base import IPersistentStorage
+
+
+class SessionsConfig:
+    # in_storage keeps sessions in persistent storage; otherwise they are sqlite files of telethon
+    def __init__(self, in_storage: bool, flush_seconds: float):
+        if flush_seconds <= 0:
+            raise RuntimeError(f"Invalid flush_seconds={flush_seconds}")
+
+        self.in_storage = in_storage
+        self.flush_seconds = flush_seconds
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+
+# scope of entities of bot; access hashes are bound to account, so all sessions of the same bot share them
+def get_bot_session_scope(token: str) -> str:
+    return f"bot{token.split(':')[0]}"
+
+
+# returns session, update_states, entities in format of storage, or None if there is no such sqlite session file
+def read_sqlite_session(session_name: str) -> Optional[tuple]:
+    path = f"{session_name}.session"
+
+    if not exists(path):
+        return None
+
+    connection = connect(path)
+
+    try:
+        sessions = connection.execute(
+            "SELECT dc_id, server_address, port, auth_key, takeout_id FROM sessions").fetchall()
+        update_states = [
+            (entity_id, pts, qts, datetime.fromtimestamp(date, tz=timezone.utc), seq)
+            for entity_id, pts, qts, date, seq in connection.execute(
+                "SELECT id, pts, qts, date, seq FROM update_state")]
+        entities = [
+            tuple(row) for row in connection.execute("SELECT id, hash, username, phone, name FROM entities")]
+    finally:
+        connection.close()
+
+    return sessions[0] if len(sessions) > 0 else None, update_states, entities
+
+
+# returns session for telegram client: StorageSession if sessions are kept in storage, otherwise name of sqlite session
+# file, which is imported by StorageSession if there is one
+def create_session(name: str, scope: str, config: SessionsConfig, sqlite_session_name: Optional[str] = None):
+    if sqlite_session_name is None:
+        sqlite_session_name = name
+
+    if not config.in_storage:
+        return sqlite_session_name
+
+    return StorageSession(
+        name=name, scope=scope, flush_seconds=config.flush_seconds, sqlite_session_name=sqlite_session_name)
+
+
+# Auth key telethon sender is created with. It is the very object session keeps, so key loaded after client is created
+# is used on connect; till then it claims to be set, otherwise sender would replace it with one of its own
+class StorageAuthKey(AuthKey):
+    def __init__(self):
+        self.is_loaded = False
+        super(StorageAuthKey, self).__init__(data=None)
+
+    def set_key(self, value):
+        # sender sets keys it generates as AuthKey objects
+        AuthKey.key.fset(self, value.key if isinstance(value, AuthKey) else value)
+
+    key = property(AuthKey.key.fget, set_key)
+
+    def __bool__(self):
+        return not self.is_loaded or super(StorageAuthKey, self).__bool__()
+
+
+# Telethon session kept in persistent storage instead of sqlite file, so it is not bound to host & its entities are
+# shared by all sessions of the same account (scope) without file locks. Storage is read once on load, all lookups are
+# served from memory and changes are written behind every flush_seconds; telethon saving session flushes it sooner.
+# Existing sqlite session file of sqlite_session_name is imported if storage has no session of that name yet
+class StorageSession(MemorySession):
+    def __init__(self, name: str, scope: str, flush_seconds: float, sqlite_session_name: Optional[str] = None):
+        super(StorageSession, self).__init__()
+
+        if flush_seconds <= 0:
+            raise RuntimeError(f"Invalid flush_seconds={flush_seconds}")
+
+        self.name = name
+        self.scope = scope
+        self.flush_seconds = flush_seconds
+        self.sqlite_session_name = sqlite_session_name
+        self._auth_key = StorageAuthKey()
+        # set on load
+        self.persistent_storage = None
+        # read cache; rows are (id, hash, username, phone, name)
+        self.entity_rows = dict()
+        self.username_ids = dict()
+        self.phone_ids = dict()
+        # write behind
+        self.is_session_dirty = False
+        self.dirty_update_states = dict()
+        self.dirty_entity_rows = dict()
+        self.wakeup = Event()
+
+    async def load(self, persistent_storage: IPersistentStorage):
+        self.persistent_storage = persistent_storage
+        session, update_states, entity_rows = await persistent_storage.load_telegram_session(
+            name=self.name, scope=self.scope)
+
+        for row in entity_rows:
+            self.put_entity_row(row=row)
+
+        imported = None if session is not None or self.sqlite_session_name is None \
+            else read_sqlite_session(session_name=self.sqlite_session_name)
+
+        if imported is not None:
+            get_logger().info(f"Importing sqlite session={self.sqlite_session_name} as session={self.name}")
+            session, update_states, imported_entity_rows = imported
+
+            for row in imported_entity_rows:
+                if row[0] not in self.entity_rows:
+                    self.put_entity_row(row=row)
+                    self.dirty_entity_rows[row[0]] = row
+
+        for entity_id, pts, qts, date, seq in update_states:
+            state = State(pts=pts, qts=qts, date=date, seq=seq, unread_count=0)
+            self._update_states[entity_id] = state
+
+            if imported is not None:
+                self.dirty_update_states[entity_id] = state
+
+        # new session is saved once telethon connects & sets dc and auth key
+        if session is not None:
+            self._dc_id, self._server_address, self._port, auth_key, self._takeout_id = session
+            self._auth_key.key = auth_key
+
+        self._auth_key.is_loaded = True
+        self.is_session_dirty = imported is not None and session is not None
+        get_logger().info(f"Loaded telegram session={self.name}: authorized={bool(self._auth_key)}, "
+                          f"{len(self.entity_rows)} entities of scope={self.scope}")
+
+    async def run(self):
+        get_logger().info(f"Starting flushes of telegram session={self.name}")
+
+        while True:
+            try:
+                await wait_for(self.wakeup.wait(), timeout=self.flush_seconds)
+            except TimeoutError:
+                pass
+
+            self.wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                get_logger().error(f"Failed to flush telegram session={self.name}: {str(e)}")
+
+    async def flush(self):
+        if self.persistent_storage is None or not self.is_session_dirty and len(self.dirty_update_states) == 0 \
+                and len(self.dirty_entity_rows) == 0:
+            return
+
+        is_session_dirty = self.is_session_dirty
+        session = (self._dc_id, self._server_address, self._port, self._auth_key.key, self._takeout_id)
+        dirty_update_states = self.dirty_update_states
+        dirty_entity_rows = self.dirty_entity_rows
+        self.is_session_dirty = False
+        self.dirty_update_states = dict()
+        self.dirty_entity_rows = dict()
+
+        try:
+            await self.persistent_storage.save_telegram_session(
+                name=self.name,
+                scope=self.scope,
+                session=session if is_session_dirty else None,
+                update_states=[
+                    (entity_id, state.pts, state.qts, state.date, state.seq)
+                    for entity_id, state in dirty_update_states.items()],
+                entities=list(dirty_entity_rows.values()))
+        except Exception:
+            # merge back unless changed meanwhile, so nothing is lost
+            self.is_session_dirty = self.is_session_dirty or is_session_dirty
+
+            for entity_id, state in dirty_update_states.items():
+                self.dirty_update_states.setdefault(entity_id, state)
+
+            for entity_id, row in dirty_entity_rows.items():
+                self.dirty_entity_rows.setdefault(entity_id, row)
+
+            raise
+
+        get_logger().debug(f"Flushed telegram session={self.name}: {len(dirty_update_states)} update states, "
+                           f"{len(dirty_entity_rows)} entities")
+
+    # Internal
+    def put_entity_row(self, row: tuple):
+        entity_id, _, username, phone, _ = row
+        previous_row = self.entity_rows.get(entity_id)
+
+        if previous_row is not None:
+            if self.username_ids.get(previous_row[2]) == entity_id:
+                del self.username_ids[previous_row[2]]
+
+            if self.phone_ids.get(previous_row[3]) == entity_id:
+                del self.phone_ids[previous_row[3]]
+
+        self.entity_rows[entity_id] = row
+
+        if username is not None:
+            self.username_ids[username] = entity_id
+
+        if phone is not None:
+            self.phone_ids[phone] = entity_id
+
+    def get_entity_row_by_id(self, entity_id) -> Optional[tuple]:
+        row = self.entity_rows.get(entity_id)
+
+        return None if row is None else (row[0], row[1])
+
+    # MemorySession overrides
+    @property
+    def auth_key(self):
+        return self._auth_key
+
+    @auth_key.setter
+    def auth_key(self, value):
+        # telethon sets the very key it got from session after connect
+        if value is not self._auth_key:
+            self._auth_key.key = value
+
+        self.is_session_dirty = True
+
+    @property
+    def takeout_id(self):
+        return self._takeout_id
+
+    @takeout_id.setter
+    def takeout_id(self, value):
+        self._takeout_id = value
+        self.is_session_dirty = True
+
+    def set_dc(self, dc_id, server_address, port):
+        super(StorageSession, self).set_dc(dc_id=dc_id, server_address=server_address, port=port)
+        self.is_session_dirty = True
+
+    def set_update_state(self, entity_id, state):
+        super(StorageSession, self).set_update_state(entity_id, state)
+        self.dirty_update_states[entity_id] = state
+
+    def save(self):
+        self.wakeup.set()
+
+    def process_entities(self, tlo):
+        for row in self._entities_to_rows(tlo):
+            if self.entity_rows.get(row[0]) != row:
+                self.put_entity_row(row=row)
+                self.dirty_entity_rows[row[0]] = row
+
+    def get_entity_rows_by_phone(self, phone):
+        entity_id = self.phone_ids.get(phone)
+
+        return None if entity_id is None else self.get_entity_row_by_id(entity_id=entity_id)
+
+    def get_entity_rows_by_username(self, username):
+        entity_id = self.username_ids.get(username)
+
+        return None if entity_id is None else self.get_entity_row_by_id(entity_id=entity_id)
+
+    def get_entity_rows_by_name(self, name):
+        return next(((row[0], row[1]) for row in self.entity_rows.values() if row[4] == name), None)
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            return self.get_entity_row_by_id(entity_id=id)
+
+        for peer_id in (utils.get_peer_id(PeerUser(id)), utils.get_peer_id(PeerChat(id)),
+                        utils.get_peer_id(PeerChannel(id))):
+            row = self.get_entity_row_by_id(entity_id=peer_id)
+
+            if row is not None:
+                return row
+
+        return None
@@ -0,0 +1,25 @@
+from time import monotonic
+
+from .logging import get_logger
+
+
+# process start is approximated by import of this module, which is imported by every service before it starts
+g_start_time = monotonic()
+g_reported_first_events = set()
+
+
+def get_seconds_since_start() -> float:
+    return monotonic() - g_start_time
+
+
+def report_startup_stage(stage: str):
+    get_logger().info(f"Startup stage={stage} is reached in {get_seconds_since_start():.3f}s")
+
+
+# logs time from start to the first occurrence of event, e.g. first forward; later occurrences are ignored
+def report_first(event: str):
+    if event in g_reported_first_events:
+        return
+
+    g_reported_first_events.add(event)
+    get_logger().info(f"Time to first {event}: {get_seconds_since_start():.3f}s")
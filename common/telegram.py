@@ -2,6 +2,7 @@ from enum import Enum
 from telethon.events import NewMessage
 from telethon.tl.functions.messages import ImportChatInviteRequest
 from telethon.tl.custom import Message
+from telethon.tl.types import MessageEntityTextUrl, ReplyInlineMarkup, KeyboardButtonUrl
 
 
 g_joinchat_prefix = "t.me/joinchat/"
@@ -68,3 +69,25 @@ def get_forwarded_message_hash(msg: Message):
     # TODO: use media/text as part of the hash too?
     tpl = msg.date, msg.fwd_from.date, msg.fwd_from.channel_id, msg.fwd_from.channel_post
     return hash(tpl)
+
+
+# returns text & urls of messages (album parts are joined) to run filters on
+def get_messages_filterable_text_and_urls(messages: list) -> tuple:
+    texts = list()
+    urls = list()
+
+    for msg in messages:
+        if msg.message:
+            texts.append(msg.message)
+
+        # hidden links in text
+        for entity in msg.entities or []:
+            if isinstance(entity, MessageEntityTextUrl):
+                urls.append(entity.url)
+
+        # ad posts often come with url buttons
+        if isinstance(msg.reply_markup, ReplyInlineMarkup):
+            for row in msg.reply_markup.rows:
+                urls += [button.url for button in row.buttons if isinstance(button, KeyboardButtonUrl)]
+
+    return "\n".join(texts), urls
@@ -93,7 +93,7 @@ sed -i 's/kirilldelimbetov/root/g' $PROJECT_DIR/feed_bot/config.py
 sed -i 's/db_password = None/db_password = "'$DB_PASS'"/g' $PROJECT_DIR/feed_bot/config.py
 
 ## put service scripts in place
-cp $PROJECT_DIR/etc/{feedbot,forwarder@,resolver}.service /etc/systemd/system
+cp $PROJECT_DIR/etc/{feedbot,forwarder@,resolver,canary}.service /etc/systemd/system
 
 # run: to establish session I have to type phone number & code
 cd $PROJECT_DIR
@@ -112,6 +112,9 @@ python3.7 ../main.py YOUR_OWN_API_ID YOUR_OWN_API_HASH 901 1380
 ## resolver
 python3.7 ./main.py YOUR_OWN_API_ID YOUR_OWN_API_HASH
 
+## canary: account must own public channel set in canary/config.py
+python3.7 ./main.py YOUR_OWN_API_ID YOUR_OWN_API_HASH
+
 ## prepare working dirs for multi forwarders
 ## dirs must match forwarder run params
 mkdir -p $PROJECT_DIR/forwarder/forwarder0_421
@@ -120,8 +123,8 @@ mkdir -p $PROJECT_DIR/forwarder/forwarder901_1380
 
 # run services
 systemctl daemon-reload
-systemctl restart feedbot forwarder@0_421 forwarder@422_900 forwarder@901_1380 resolver
-systemctl status feedbot forwarder@0_421 forwarder@422_900 forwarder@901_1380 resolver
+systemctl restart feedbot forwarder@0_421 forwarder@422_900 forwarder@901_1380 resolver canary
+systemctl status feedbot forwarder@0_421 forwarder@422_900 forwarder@901_1380 resolver canary
 
 TODO:
 - use user instead of root
@@ -0,0 +1,26 @@
+-- filters
+CREATE TABLE "filters" (
+	"id" serial8,
+	"user_chats_id" int8 NOT NULL,
+	"monitored_chats_id" int8, -- NULL for filter applied to every subscription of user chat
+	"filter_type" int2 NOT NULL,
+	"pattern" text NOT NULL,
+	"enabled" boolean NOT NULL DEFAULT TRUE,
+	CONSTRAINT "filters_pk" PRIMARY KEY ("id"),
+	CONSTRAINT "filters_fk_user_chats" FOREIGN KEY ("user_chats_id") REFERENCES "user_chats"("id"),
+	CONSTRAINT "filters_fk_monitored_chats" FOREIGN KEY ("monitored_chats_id") REFERENCES "monitored_chats"("id")
+);
+
+CREATE OR REPLACE FUNCTION function_notify_filters_updated()
+RETURNS TRIGGER AS $$
+BEGIN
+  NOTIFY notify_filters_updated;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER filters_updated
+AFTER UPDATE OR INSERT ON "filters"
+EXECUTE PROCEDURE function_notify_filters_updated();
+
+CREATE INDEX filters_user_chats_id_btree ON "filters" USING BTREE ("user_chats_id");
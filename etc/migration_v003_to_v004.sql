@@ -0,0 +1,36 @@
+-- digest settings
+ALTER TABLE "user_chats"
+ADD COLUMN "digest_period_minutes" int4; -- NULL if posts are delivered as soon as they are posted
+
+ALTER TABLE "subscriptions"
+ADD COLUMN "digest_period_minutes" int4; -- NULL to use user chat setting, 0 to deliver as soon as posted
+
+-- digest items: posts buffered for digest delivery
+CREATE TABLE "digest_items" (
+	"id" serial8,
+	"user_chats_id" int8 NOT NULL,
+	"monitored_chats_id" int8 NOT NULL,
+	"message_id" int8 NOT NULL,
+	"due_time" timestamp with time zone NOT NULL,
+	CONSTRAINT "digest_items_pk" PRIMARY KEY ("id"),
+	CONSTRAINT "digest_items_fk_user_chats" FOREIGN KEY ("user_chats_id") REFERENCES "user_chats"("id"),
+	CONSTRAINT "digest_items_fk_monitored_chats" FOREIGN KEY ("monitored_chats_id") REFERENCES "monitored_chats"("id")
+);
+
+CREATE OR REPLACE FUNCTION function_notify_digest_updated()
+RETURNS TRIGGER AS $$
+BEGIN
+  NOTIFY notify_digest_updated;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER user_chats_digest_updated
+AFTER UPDATE OF "digest_period_minutes" ON "user_chats"
+EXECUTE PROCEDURE function_notify_digest_updated();
+
+CREATE TRIGGER subscriptions_digest_updated
+AFTER UPDATE OF "digest_period_minutes" ON "subscriptions"
+EXECUTE PROCEDURE function_notify_digest_updated();
+
+CREATE INDEX digest_items_due_time_btree ON "digest_items" USING BTREE ("due_time");
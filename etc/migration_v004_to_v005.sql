@@ -0,0 +1,3 @@
+-- bot pool: user chat is pinned to the bot it was started with; existing ones are served by the first bot
+ALTER TABLE "user_chats"
+ADD COLUMN "bot_index" int4 NOT NULL DEFAULT 0; -- index of pool bot the user chat is pinned to
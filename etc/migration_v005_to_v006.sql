@@ -0,0 +1,2 @@
+-- for keyset paginated list of user chat subscriptions
+CREATE INDEX subscriptions_user_chats_id_id_btree ON "subscriptions" USING BTREE ("user_chats_id", "id");
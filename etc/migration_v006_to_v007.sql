@@ -0,0 +1,13 @@
+-- user state cache of feed bot: notify is sent per changed user chat
+CREATE OR REPLACE FUNCTION function_notify_user_chats_updated()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM pg_notify('notify_user_chats_updated', (SELECT "telegram_chat_id" FROM "chats" WHERE "id"=NEW."chats_id")::text);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER user_chats_updated
+AFTER UPDATE OF "enabled", "language", "chats_id" OR INSERT ON "user_chats"
+FOR EACH ROW
+EXECUTE PROCEDURE function_notify_user_chats_updated();
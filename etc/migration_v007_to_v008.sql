@@ -0,0 +1,62 @@
+-- monitored chat change log replaces modification time based deltas of forwarders
+-- monitored chat change log: every change of monitored chat or of its subscriptions gets next seq; forwarders consume
+-- it by cursor. Writers are serialized by advisory lock until commit, so seq order is commit order
+CREATE TABLE "monitored_chat_changes" (
+	"seq" bigserial,
+	"monitored_chats_id" int8 NOT NULL,
+	"change_time" timestamp with time zone NOT NULL DEFAULT NOW(),
+	CONSTRAINT "monitored_chat_changes_pk" PRIMARY KEY ("seq"),
+	CONSTRAINT "monitored_chat_changes_fk_monitored_chats" FOREIGN KEY ("monitored_chats_id") REFERENCES "monitored_chats"("id")
+);
+
+-- position of every consumer of monitored chat change log
+CREATE TABLE "monitored_chat_change_cursors" (
+	"consumer" text NOT NULL,
+	"seq" int8 NOT NULL,
+	CONSTRAINT "monitored_chat_change_cursors_pk" PRIMARY KEY ("consumer")
+);
+
+-- 2133 is arbitrary key of advisory lock serializing monitored chat change log writers. Every transaction that inserts
+-- or flips subscription or monitored chat holds it until commit, so follows and unfollows of all channels go one at a
+-- time. That is accepted, since these writes are single row ones made by user commands, while ordering seqs by commit
+-- without the lock needs xid snapshot checks on every read of the log. Bulk writes like disabling of user chats or
+-- bundle subscriptions don't touch these tables and don't take the lock; a bulk one that does would stall the others
+CREATE OR REPLACE FUNCTION function_log_monitored_chat_change()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM pg_advisory_xact_lock(2133);
+  INSERT INTO "monitored_chat_changes" ("monitored_chats_id") VALUES (NEW."id");
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION function_log_subscription_change()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM pg_advisory_xact_lock(2133);
+  INSERT INTO "monitored_chat_changes" ("monitored_chats_id") VALUES (NEW."monitored_chats_id");
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION function_notify_monitored_chat_changes()
+RETURNS TRIGGER AS $$
+BEGIN
+  NOTIFY notify_monitored_chat_changes;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER monitored_chats_changed
+AFTER UPDATE OF "enabled", "joiner" OR INSERT ON "monitored_chats"
+FOR EACH ROW
+EXECUTE PROCEDURE function_log_monitored_chat_change();
+
+CREATE TRIGGER subscriptions_changed
+AFTER UPDATE OF "enabled" OR INSERT ON "subscriptions"
+FOR EACH ROW
+EXECUTE PROCEDURE function_log_subscription_change();
+
+CREATE TRIGGER monitored_chat_changes_inserted
+AFTER INSERT ON "monitored_chat_changes"
+EXECUTE PROCEDURE function_notify_monitored_chat_changes();
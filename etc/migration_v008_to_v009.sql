@@ -0,0 +1,9 @@
+-- analytics events; partitioned by month, partitions are created ahead by analytics log writers
+CREATE TABLE "analytics_events" (
+	"event_type" int2 NOT NULL, -- see common/analytics.py EventType
+	"event_time" timestamp with time zone NOT NULL,
+	"user_chat_id" int8, -- telegram chat id
+	"chat_id" int8, -- telegram chat id
+	"latency_seconds" float8,
+	"detail" text
+) PARTITION BY RANGE ("event_time");
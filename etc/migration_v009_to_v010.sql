@@ -0,0 +1,25 @@
+-- per channel counters by hour; upserted by feed bot
+CREATE TABLE "channel_rollups_hourly" (
+	"monitored_chats_id" int8 NOT NULL,
+	"bucket" timestamp with time zone NOT NULL,
+	"posts" int8 NOT NULL DEFAULT 0,
+	"deliveries" int8 NOT NULL DEFAULT 0,
+	"failures" int8 NOT NULL DEFAULT 0,
+	"duplicates" int8 NOT NULL DEFAULT 0,
+	"unfollows" int8 NOT NULL DEFAULT 0,
+	CONSTRAINT "channel_rollups_hourly_pk" PRIMARY KEY ("monitored_chats_id", "bucket"),
+	CONSTRAINT "channel_rollups_hourly_fk_monitored_chats" FOREIGN KEY ("monitored_chats_id") REFERENCES "monitored_chats"("id")
+);
+
+-- per channel counters by utc day; /stats reads only these
+CREATE TABLE "channel_rollups_daily" (
+	"monitored_chats_id" int8 NOT NULL,
+	"bucket" timestamp with time zone NOT NULL,
+	"posts" int8 NOT NULL DEFAULT 0,
+	"deliveries" int8 NOT NULL DEFAULT 0,
+	"failures" int8 NOT NULL DEFAULT 0,
+	"duplicates" int8 NOT NULL DEFAULT 0,
+	"unfollows" int8 NOT NULL DEFAULT 0,
+	CONSTRAINT "channel_rollups_daily_pk" PRIMARY KEY ("monitored_chats_id", "bucket"),
+	CONSTRAINT "channel_rollups_daily_fk_monitored_chats" FOREIGN KEY ("monitored_chats_id") REFERENCES "monitored_chats"("id")
+);
@@ -0,0 +1,59 @@
+-- bundles: named sets of channels users subscribe to as a whole
+CREATE TABLE "bundles" (
+	"id" serial8,
+	"name" text NOT NULL,
+	CONSTRAINT "bundles_pk" PRIMARY KEY ("id"),
+	CONSTRAINT "bundles_name_unique" UNIQUE ("name")
+);
+
+-- bundle membership; stored once per bundle, not per subscriber
+CREATE TABLE "bundle_channels" (
+	"bundles_id" int8 NOT NULL,
+	"monitored_chats_id" int8 NOT NULL,
+	"enabled" boolean NOT NULL DEFAULT TRUE,
+	CONSTRAINT "bundle_channels_pk" PRIMARY KEY ("bundles_id", "monitored_chats_id"),
+	CONSTRAINT "bundle_channels_fk_bundles" FOREIGN KEY ("bundles_id") REFERENCES "bundles"("id"),
+	CONSTRAINT "bundle_channels_fk_monitored_chats" FOREIGN KEY ("monitored_chats_id") REFERENCES "monitored_chats"("id")
+);
+
+CREATE TABLE "bundle_subscriptions" (
+	"id" serial8,
+	"user_chats_id" int8 NOT NULL,
+	"bundles_id" int8 NOT NULL,
+	"enabled" boolean NOT NULL DEFAULT TRUE,
+	CONSTRAINT "bundle_subscriptions_pk" PRIMARY KEY ("id"),
+	CONSTRAINT "bundle_subscriptions_fk_user_chats" FOREIGN KEY ("user_chats_id") REFERENCES "user_chats"("id"),
+	CONSTRAINT "bundle_subscriptions_fk_bundles" FOREIGN KEY ("bundles_id") REFERENCES "bundles"("id"),
+	CONSTRAINT "bundle_subscriptions_bundles_id_user_chats_id_unique" UNIQUE ("bundles_id", "user_chats_id")
+);
+
+-- payload is id of changed bundle
+CREATE OR REPLACE FUNCTION function_notify_bundle_channels_updated()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM pg_notify('notify_bundle_channels_updated', NEW."bundles_id"::text);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- payload is id of changed bundle
+CREATE OR REPLACE FUNCTION function_notify_bundle_subscriptions_updated()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM pg_notify('notify_bundle_subscriptions_updated', NEW."bundles_id"::text);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER bundle_channels_updated
+AFTER UPDATE OR INSERT ON "bundle_channels"
+FOR EACH ROW
+EXECUTE PROCEDURE function_notify_bundle_channels_updated();
+
+CREATE TRIGGER bundle_subscriptions_updated
+AFTER UPDATE OR INSERT ON "bundle_subscriptions"
+FOR EACH ROW
+EXECUTE PROCEDURE function_notify_bundle_subscriptions_updated();
+
+-- for bundles of channel lookup
+CREATE INDEX bundle_channels_monitored_chats_id_btree ON "bundle_channels" USING BTREE ("monitored_chats_id");
@@ -0,0 +1,27 @@
+-- delivery outbox: forwards of posts to user chats waiting to be sent. Consumers claim batches by leasing them and
+-- delete sent ones; lease of consumer that died expires, so its items are claimed again. Peers are serialized input
+-- peers of the bot, so any process of the bot can send without entity cache
+CREATE TABLE "delivery_outbox" (
+	"id" bigserial,
+	"bot_index" int4 NOT NULL,
+	"user_chat_id" int8 NOT NULL,
+	"chat_id" int8,
+	"user_peer" bytea NOT NULL,
+	"from_peer" bytea NOT NULL,
+	"message_ids" int4[] NOT NULL,
+	"as_album" boolean NOT NULL,
+	"lease_until" timestamp with time zone,
+	CONSTRAINT "delivery_outbox_pk" PRIMARY KEY ("id")
+);
+
+CREATE OR REPLACE FUNCTION function_notify_delivery_outbox()
+RETURNS TRIGGER AS $$
+BEGIN
+  NOTIFY notify_delivery_outbox;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER delivery_outbox_inserted
+AFTER INSERT ON "delivery_outbox"
+EXECUTE PROCEDURE function_notify_delivery_outbox();
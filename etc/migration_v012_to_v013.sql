@@ -0,0 +1,22 @@
+-- post handoff: posts of public channels passed from forwarders to the bot. Bot claims batches by leasing them and
+-- deletes handled ones; lease of bot that died expires, so its posts are claimed again
+CREATE TABLE "post_handoff" (
+	"id" bigserial,
+	"chat_id" int8 NOT NULL,
+	"username" text NOT NULL,
+	"message_ids" int4[] NOT NULL,
+	"lease_until" timestamp with time zone,
+	CONSTRAINT "post_handoff_pk" PRIMARY KEY ("id")
+);
+
+CREATE OR REPLACE FUNCTION function_notify_post_handoff()
+RETURNS TRIGGER AS $$
+BEGIN
+  NOTIFY notify_post_handoff;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER post_handoff_inserted
+AFTER INSERT ON "post_handoff"
+EXECUTE PROCEDURE function_notify_post_handoff();
@@ -0,0 +1,119 @@
+-- channel subscribers: enabled subscribers of enabled monitored chats, denormalized from subscriptions, user chats &
+-- chats, so subscribers of channel are looked up by a single index probe on every post. Kept by triggers on source
+-- tables; user_telegram_chat_ids[i] is pinned to bot_indexes[i]. Channels without subscribers have no row
+CREATE TABLE "channel_subscribers" (
+	"monitored_chats_id" int8 NOT NULL,
+	"telegram_chat_id" int8 NOT NULL,
+	"user_telegram_chat_ids" int8[] NOT NULL,
+	"bot_indexes" int4[] NOT NULL,
+	CONSTRAINT "channel_subscribers_pk" PRIMARY KEY ("monitored_chats_id"),
+	CONSTRAINT "channel_subscribers_fk_monitored_chats" FOREIGN KEY ("monitored_chats_id") REFERENCES "monitored_chats"("id"),
+	CONSTRAINT "channel_subscribers_telegram_chat_id_unique" UNIQUE ("telegram_chat_id")
+);
+
+-- recomputes channel subscribers row of monitored chat. Monitored chat row is locked first, so recomputes of the same
+-- chat are serialized: the later one sees changes of the earlier one or fails to serialize and is retried
+CREATE OR REPLACE FUNCTION refresh_channel_subscribers(target_monitored_chats_id int8)
+RETURNS void AS $$
+BEGIN
+  PERFORM 1 FROM "monitored_chats" WHERE "id"=target_monitored_chats_id FOR NO KEY UPDATE;
+  DELETE FROM "channel_subscribers" WHERE "monitored_chats_id"=target_monitored_chats_id;
+  INSERT INTO "channel_subscribers" ("monitored_chats_id", "telegram_chat_id", "user_telegram_chat_ids", "bot_indexes")
+  SELECT "monitored_chats"."id", "chats"."telegram_chat_id", "subscribers"."user_telegram_chat_ids", "subscribers"."bot_indexes"
+  FROM "monitored_chats"
+  JOIN "chats" ON "chats"."id"="monitored_chats"."chats_id"
+  CROSS JOIN LATERAL (
+    SELECT
+      array_agg("user_chats_chats"."telegram_chat_id" ORDER BY "user_chats"."id") AS "user_telegram_chat_ids",
+      array_agg("user_chats"."bot_index" ORDER BY "user_chats"."id") AS "bot_indexes"
+    FROM "subscriptions"
+    JOIN "user_chats" ON "user_chats"."id"="subscriptions"."user_chats_id"
+    JOIN "chats" AS "user_chats_chats" ON "user_chats_chats"."id"="user_chats"."chats_id"
+    WHERE "subscriptions"."monitored_chats_id"="monitored_chats"."id" AND "subscriptions"."enabled"=TRUE AND "user_chats"."enabled"=TRUE
+  ) AS "subscribers"
+  WHERE "monitored_chats"."id"=target_monitored_chats_id AND "monitored_chats"."enabled"=TRUE AND "subscribers"."user_telegram_chat_ids" IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- monitored chats are recomputed in order of ids, so concurrent recomputes of several chats don't deadlock
+CREATE OR REPLACE FUNCTION refresh_channel_subscribers_of_user_chat(target_user_chats_id int8)
+RETURNS void AS $$
+BEGIN
+  PERFORM refresh_channel_subscribers("monitored_chats_id")
+  FROM "subscriptions" WHERE "user_chats_id"=target_user_chats_id ORDER BY "monitored_chats_id";
+END;
+$$ LANGUAGE plpgsql;
+
+-- one shot rebuild of the whole table, e.g. after it was created: SELECT rebuild_channel_subscribers();
+CREATE OR REPLACE FUNCTION rebuild_channel_subscribers()
+RETURNS void AS $$
+BEGIN
+  PERFORM refresh_channel_subscribers("id") FROM "monitored_chats" ORDER BY "id";
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION function_refresh_channel_subscribers_of_subscription()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    PERFORM refresh_channel_subscribers(OLD."monitored_chats_id");
+  END IF;
+
+  IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND OLD."monitored_chats_id" <> NEW."monitored_chats_id") THEN
+    PERFORM refresh_channel_subscribers(NEW."monitored_chats_id");
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION function_refresh_channel_subscribers_of_user_chat()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM refresh_channel_subscribers_of_user_chat(NEW."id");
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION function_refresh_channel_subscribers_of_monitored_chat()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM refresh_channel_subscribers(NEW."id");
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- migrated chat keeps its row in chats, but gets new telegram chat id
+CREATE OR REPLACE FUNCTION function_refresh_channel_subscribers_of_chat()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM refresh_channel_subscribers("id") FROM "monitored_chats" WHERE "chats_id"=NEW."id";
+  PERFORM refresh_channel_subscribers_of_user_chat("id") FROM "user_chats" WHERE "chats_id"=NEW."id";
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER subscriptions_channel_subscribers
+AFTER UPDATE OF "enabled", "user_chats_id", "monitored_chats_id" OR INSERT OR DELETE ON "subscriptions"
+FOR EACH ROW
+EXECUTE PROCEDURE function_refresh_channel_subscribers_of_subscription();
+
+CREATE TRIGGER user_chats_channel_subscribers
+AFTER UPDATE OF "enabled", "bot_index", "chats_id" ON "user_chats"
+FOR EACH ROW
+WHEN (OLD."enabled" IS DISTINCT FROM NEW."enabled" OR OLD."bot_index" IS DISTINCT FROM NEW."bot_index" OR OLD."chats_id" IS DISTINCT FROM NEW."chats_id")
+EXECUTE PROCEDURE function_refresh_channel_subscribers_of_user_chat();
+
+CREATE TRIGGER monitored_chats_channel_subscribers
+AFTER UPDATE OF "enabled", "chats_id" ON "monitored_chats"
+FOR EACH ROW
+WHEN (OLD."enabled" IS DISTINCT FROM NEW."enabled" OR OLD."chats_id" IS DISTINCT FROM NEW."chats_id")
+EXECUTE PROCEDURE function_refresh_channel_subscribers_of_monitored_chat();
+
+CREATE TRIGGER chats_channel_subscribers
+AFTER UPDATE OF "telegram_chat_id" ON "chats"
+FOR EACH ROW
+WHEN (OLD."telegram_chat_id" IS DISTINCT FROM NEW."telegram_chat_id")
+EXECUTE PROCEDURE function_refresh_channel_subscribers_of_chat();
+
+SELECT rebuild_channel_subscribers();
@@ -0,0 +1,29 @@
+-- quiet hours of user chat; posts coming during them are deferred till they end
+ALTER TABLE "user_chats"
+ADD COLUMN "quiet_from_minute" int2; -- utc minute of day quiet hours start at; NULL if there are no quiet hours
+
+ALTER TABLE "user_chats"
+ADD COLUMN "quiet_to_minute" int2; -- utc minute of day quiet hours end at; NULL if there are no quiet hours
+
+ALTER TABLE "user_chats"
+ADD CONSTRAINT "user_chats_quiet_hours_check" CHECK (("quiet_from_minute" IS NULL) = ("quiet_to_minute" IS NULL));
+
+ALTER TABLE "delivery_outbox"
+ADD COLUMN "not_before" timestamp with time zone; -- NULL if item is sent as soon as possible
+
+CREATE OR REPLACE FUNCTION function_notify_quiet_hours_updated()
+RETURNS TRIGGER AS $$
+BEGIN
+  NOTIFY notify_quiet_hours_updated;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER user_chats_quiet_hours_updated
+AFTER UPDATE OF "quiet_from_minute", "quiet_to_minute" ON "user_chats"
+EXECUTE PROCEDURE function_notify_quiet_hours_updated();
+
+CREATE INDEX delivery_outbox_deferred_user_chat_id_btree ON "delivery_outbox" USING BTREE ("user_chat_id")
+WHERE "not_before" IS NOT NULL;
+CREATE INDEX delivery_outbox_deferred_not_before_btree ON "delivery_outbox" USING BTREE ("not_before")
+WHERE "not_before" IS NOT NULL;
@@ -0,0 +1,32 @@
+-- telegram sessions of services, so they are not bound to host. Session keeps auth key & dc by name; entities (access
+-- hashes) are kept by scope shared by all sessions of the same account, so every process of it resolves them
+CREATE TABLE "telegram_sessions" (
+	"name" text NOT NULL,
+	"dc_id" int4 NOT NULL,
+	"server_address" text NOT NULL,
+	"port" int4 NOT NULL,
+	"auth_key" bytea, -- NULL until session is authorized
+	"takeout_id" int8,
+	CONSTRAINT "telegram_sessions_pk" PRIMARY KEY ("name")
+);
+
+CREATE TABLE "telegram_update_states" (
+	"session_name" text NOT NULL,
+	"entity_id" int8 NOT NULL, -- 0 for common update state
+	"pts" int4 NOT NULL,
+	"qts" int4 NOT NULL,
+	"date" timestamp with time zone NOT NULL,
+	"seq" int4 NOT NULL,
+	CONSTRAINT "telegram_update_states_pk" PRIMARY KEY ("session_name", "entity_id"),
+	CONSTRAINT "telegram_update_states_fk_telegram_sessions" FOREIGN KEY ("session_name") REFERENCES "telegram_sessions"("name")
+);
+
+CREATE TABLE "telegram_entities" (
+	"scope" text NOT NULL,
+	"id" int8 NOT NULL, -- marked peer id
+	"hash" int8 NOT NULL,
+	"username" text,
+	"phone" text,
+	"name" text,
+	CONSTRAINT "telegram_entities_pk" PRIMARY KEY ("scope", "id")
+);
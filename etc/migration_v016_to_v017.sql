@@ -0,0 +1,3 @@
+-- failed outbox items are given back to be retried instead of being retried in memory
+ALTER TABLE "delivery_outbox"
+ADD COLUMN "attempts" int4 NOT NULL DEFAULT 0; -- failed attempts to send item
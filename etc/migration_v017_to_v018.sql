@@ -0,0 +1,153 @@
+-- channel subscribers are kept incrementally: follow, unfollow or user chat change appends or removes just its own
+-- element instead of recomputing whole arrays of the channel
+
+-- recomputes channel subscribers row of monitored chat from scratch; only done when monitored chat itself changes and
+-- on rebuild, follows & unfollows change just their own element. Monitored chat row is locked first, so recomputes of
+-- the same chat are serialized with each other and with element changes of the chat
+CREATE OR REPLACE FUNCTION refresh_channel_subscribers(target_monitored_chats_id int8)
+RETURNS void AS $$
+BEGIN
+  PERFORM 1 FROM "monitored_chats" WHERE "id"=target_monitored_chats_id FOR NO KEY UPDATE;
+  DELETE FROM "channel_subscribers" WHERE "monitored_chats_id"=target_monitored_chats_id;
+  INSERT INTO "channel_subscribers" ("monitored_chats_id", "telegram_chat_id", "user_telegram_chat_ids", "bot_indexes")
+  SELECT "monitored_chats"."id", "chats"."telegram_chat_id", "subscribers"."user_telegram_chat_ids", "subscribers"."bot_indexes"
+  FROM "monitored_chats"
+  JOIN "chats" ON "chats"."id"="monitored_chats"."chats_id"
+  CROSS JOIN LATERAL (
+    SELECT
+      array_agg("user_chats_chats"."telegram_chat_id" ORDER BY "user_chats"."id") AS "user_telegram_chat_ids",
+      array_agg("user_chats"."bot_index" ORDER BY "user_chats"."id") AS "bot_indexes"
+    FROM "subscriptions"
+    JOIN "user_chats" ON "user_chats"."id"="subscriptions"."user_chats_id"
+    JOIN "chats" AS "user_chats_chats" ON "user_chats_chats"."id"="user_chats"."chats_id"
+    WHERE "subscriptions"."monitored_chats_id"="monitored_chats"."id" AND "subscriptions"."enabled"=TRUE AND "user_chats"."enabled"=TRUE
+  ) AS "subscribers"
+  WHERE "monitored_chats"."id"=target_monitored_chats_id AND "monitored_chats"."enabled"=TRUE AND "subscribers"."user_telegram_chat_ids" IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- appends enabled user chat to subscribers of enabled monitored chat, unless it is there already. Monitored chat row is
+-- share locked, so concurrent follows of the chat don't wait for each other, only for its recompute
+CREATE OR REPLACE FUNCTION add_channel_subscriber(target_monitored_chats_id int8, target_user_chats_id int8)
+RETURNS void AS $$
+BEGIN
+  PERFORM 1 FROM "monitored_chats" WHERE "id"=target_monitored_chats_id AND "enabled"=TRUE FOR SHARE;
+
+  IF NOT FOUND THEN
+    RETURN;
+  END IF;
+
+  INSERT INTO "channel_subscribers" ("monitored_chats_id", "telegram_chat_id", "user_telegram_chat_ids", "bot_indexes")
+  SELECT "monitored_chats"."id", "chats"."telegram_chat_id", ARRAY["user_chats_chats"."telegram_chat_id"], ARRAY["user_chats"."bot_index"]
+  FROM "monitored_chats"
+  JOIN "chats" ON "chats"."id"="monitored_chats"."chats_id"
+  CROSS JOIN "user_chats"
+  JOIN "chats" AS "user_chats_chats" ON "user_chats_chats"."id"="user_chats"."chats_id"
+  WHERE "monitored_chats"."id"=target_monitored_chats_id AND "user_chats"."id"=target_user_chats_id AND "user_chats"."enabled"=TRUE
+  ON CONFLICT ("monitored_chats_id") DO UPDATE SET
+    "user_telegram_chat_ids"=array_append("channel_subscribers"."user_telegram_chat_ids", EXCLUDED."user_telegram_chat_ids"[1]),
+    "bot_indexes"=array_append("channel_subscribers"."bot_indexes", EXCLUDED."bot_indexes"[1])
+  WHERE NOT EXCLUDED."user_telegram_chat_ids"[1]=ANY("channel_subscribers"."user_telegram_chat_ids");
+END;
+$$ LANGUAGE plpgsql;
+
+-- removes user chat from subscribers of monitored chat along with its bot index; row without subscribers is dropped.
+-- User chat is given by telegram chat id, since that is what is stored and it may be changed already
+CREATE OR REPLACE FUNCTION remove_channel_subscriber(target_monitored_chats_id int8, target_user_telegram_chat_id int8)
+RETURNS void AS $$
+BEGIN
+  PERFORM 1 FROM "monitored_chats" WHERE "id"=target_monitored_chats_id FOR SHARE;
+  UPDATE "channel_subscribers" SET
+    "user_telegram_chat_ids"="user_telegram_chat_ids"[:array_position("user_telegram_chat_ids", target_user_telegram_chat_id) - 1]
+      || "user_telegram_chat_ids"[array_position("user_telegram_chat_ids", target_user_telegram_chat_id) + 1:],
+    "bot_indexes"="bot_indexes"[:array_position("user_telegram_chat_ids", target_user_telegram_chat_id) - 1]
+      || "bot_indexes"[array_position("user_telegram_chat_ids", target_user_telegram_chat_id) + 1:]
+  WHERE "monitored_chats_id"=target_monitored_chats_id AND target_user_telegram_chat_id=ANY("user_telegram_chat_ids");
+  DELETE FROM "channel_subscribers"
+  WHERE "monitored_chats_id"=target_monitored_chats_id AND cardinality("user_telegram_chat_ids")=0;
+END;
+$$ LANGUAGE plpgsql;
+
+-- one shot rebuild of the whole table, e.g. after it was created: SELECT rebuild_channel_subscribers();
+CREATE OR REPLACE FUNCTION rebuild_channel_subscribers()
+RETURNS void AS $$
+BEGIN
+  PERFORM refresh_channel_subscribers("id") FROM "monitored_chats" ORDER BY "id";
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION function_refresh_channel_subscribers_of_subscription()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'UPDATE' AND OLD."enabled"=NEW."enabled" AND OLD."user_chats_id"=NEW."user_chats_id"
+      AND OLD."monitored_chats_id"=NEW."monitored_chats_id" THEN
+    RETURN NULL;
+  END IF;
+
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD."enabled"=TRUE THEN
+    PERFORM remove_channel_subscriber(OLD."monitored_chats_id", "chats"."telegram_chat_id")
+    FROM "user_chats" JOIN "chats" ON "chats"."id"="user_chats"."chats_id"
+    WHERE "user_chats"."id"=OLD."user_chats_id";
+  END IF;
+
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW."enabled"=TRUE THEN
+    PERFORM add_channel_subscriber(NEW."monitored_chats_id", NEW."user_chats_id");
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- user chat is removed from channels of its subscriptions as it was and added back as it is now; channels go in order
+-- of ids, so concurrent changes of several user chats don't deadlock
+CREATE OR REPLACE FUNCTION function_refresh_channel_subscribers_of_user_chat()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF OLD."enabled"=TRUE THEN
+    PERFORM remove_channel_subscriber(
+      "subscriptions"."monitored_chats_id", (SELECT "telegram_chat_id" FROM "chats" WHERE "id"=OLD."chats_id"))
+    FROM "subscriptions"
+    WHERE "subscriptions"."user_chats_id"=NEW."id" AND "subscriptions"."enabled"=TRUE
+    ORDER BY "subscriptions"."monitored_chats_id";
+  END IF;
+
+  IF NEW."enabled"=TRUE THEN
+    PERFORM add_channel_subscriber("subscriptions"."monitored_chats_id", NEW."id")
+    FROM "subscriptions"
+    WHERE "subscriptions"."user_chats_id"=NEW."id" AND "subscriptions"."enabled"=TRUE
+    ORDER BY "subscriptions"."monitored_chats_id";
+  END IF;
+
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION function_refresh_channel_subscribers_of_monitored_chat()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM refresh_channel_subscribers(NEW."id");
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- migrated chat keeps its row in chats, but gets new telegram chat id; user chat keeps its place in arrays
+CREATE OR REPLACE FUNCTION function_refresh_channel_subscribers_of_chat()
+RETURNS TRIGGER AS $$
+BEGIN
+  UPDATE "channel_subscribers" SET "telegram_chat_id"=NEW."telegram_chat_id"
+  FROM "monitored_chats"
+  WHERE "monitored_chats"."id"="channel_subscribers"."monitored_chats_id" AND "monitored_chats"."chats_id"=NEW."id";
+  UPDATE "channel_subscribers"
+  SET "user_telegram_chat_ids"=array_replace("user_telegram_chat_ids", OLD."telegram_chat_id", NEW."telegram_chat_id")
+  WHERE "monitored_chats_id" IN (
+    SELECT "subscriptions"."monitored_chats_id"
+    FROM "subscriptions"
+    JOIN "user_chats" ON "user_chats"."id"="subscriptions"."user_chats_id"
+    WHERE "user_chats"."chats_id"=NEW."id" AND "subscriptions"."enabled"=TRUE
+  ) AND OLD."telegram_chat_id"=ANY("user_telegram_chat_ids");
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- user chat changes no longer recompute channels of the user chat
+DROP FUNCTION IF EXISTS refresh_channel_subscribers_of_user_chat(int8);
@@ -0,0 +1,4 @@
+-- handed off posts carry text & urls to run filters on, so the bot doesn't fetch every post just to filter it
+ALTER TABLE "post_handoff"
+ADD COLUMN "text" text NOT NULL DEFAULT '', -- text of the post to run filters on; album texts are joined
+ADD COLUMN "urls" text[] NOT NULL DEFAULT '{}'; -- hidden & button urls of the post to run filters on
@@ -0,0 +1,4 @@
+#!/bin/bash
+
+echo "Rebuilding channel subscribers of db feed"
+psql -c "SELECT rebuild_channel_subscribers();" feed
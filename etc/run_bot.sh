@@ -4,4 +4,4 @@ echo "Enabling venv"
 source ../venv/bin/activate
 
 echo "Starting bot"
-python3.7 ./main.py $BOT_ARGS
+exec python3.7 ./main.py $BOT_ARGS
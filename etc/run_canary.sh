@@ -0,0 +1,7 @@
+echo "Preparing env vars"
+source ../etc/env
+echo "Enabling venv"
+source ../venv/bin/activate
+
+echo "Starting canary"
+python3.7 ./main.py $CANARY_ARGS
@@ -16,7 +16,12 @@ CREATE TABLE "user_chats" (
 	"chats_id" int8 NOT NULL,
 	"language" int2 NOT NULL,
 	"enabled" boolean NOT NULL DEFAULT TRUE,
+	"digest_period_minutes" int4, -- NULL if posts are delivered as soon as they are posted
+	"bot_index" int4 NOT NULL DEFAULT 0, -- index of pool bot the user chat is pinned to
+	"quiet_from_minute" int2, -- utc minute of day quiet hours start at; NULL if there are no quiet hours
+	"quiet_to_minute" int2, -- utc minute of day quiet hours end at; NULL if there are no quiet hours
 	CONSTRAINT "user_chats_pk" PRIMARY KEY ("id"),
+	CONSTRAINT "user_chats_quiet_hours_check" CHECK (("quiet_from_minute" IS NULL) = ("quiet_to_minute" IS NULL)),
 	CONSTRAINT "user_chats_fk_chats" FOREIGN KEY ("chats_id") REFERENCES "chats"("id"),
 	CONSTRAINT "user_chats_chats_id_unique" UNIQUE ("chats_id")
 );
@@ -43,12 +48,216 @@ CREATE TABLE "subscriptions" (
 	"monitored_chats_id" int8 NOT NULL,
 	"enabled" boolean NOT NULL DEFAULT TRUE,
 	"modification_time" timestamp with time zone NOT NULL DEFAULT NOW(), -- use with statement_timeout (set local!)
+	"digest_period_minutes" int4, -- NULL to use user chat setting, 0 to deliver as soon as posted
 	CONSTRAINT "subscriptions_pk" PRIMARY KEY ("id"),
 	CONSTRAINT "subscriptions_fk_user_chats" FOREIGN KEY ("user_chats_id") REFERENCES "user_chats"("id"),
 	CONSTRAINT "subscriptions_fk_monitored_chats" FOREIGN KEY ("monitored_chats_id") REFERENCES "monitored_chats"("id"),
 	CONSTRAINT "subscriptions_user_monitored_chats_is_unique" UNIQUE ("monitored_chats_id", "user_chats_id")
 );
 
+-- filters
+DROP TABLE IF EXISTS "filters" CASCADE;
+CREATE TABLE "filters" (
+	"id" serial8,
+	"user_chats_id" int8 NOT NULL,
+	"monitored_chats_id" int8, -- NULL for filter applied to every subscription of user chat
+	"filter_type" int2 NOT NULL,
+	"pattern" text NOT NULL,
+	"enabled" boolean NOT NULL DEFAULT TRUE,
+	CONSTRAINT "filters_pk" PRIMARY KEY ("id"),
+	CONSTRAINT "filters_fk_user_chats" FOREIGN KEY ("user_chats_id") REFERENCES "user_chats"("id"),
+	CONSTRAINT "filters_fk_monitored_chats" FOREIGN KEY ("monitored_chats_id") REFERENCES "monitored_chats"("id")
+);
+
+-- digest items: posts buffered for digest delivery
+DROP TABLE IF EXISTS "digest_items" CASCADE;
+CREATE TABLE "digest_items" (
+	"id" serial8,
+	"user_chats_id" int8 NOT NULL,
+	"monitored_chats_id" int8 NOT NULL,
+	"message_id" int8 NOT NULL,
+	"due_time" timestamp with time zone NOT NULL,
+	CONSTRAINT "digest_items_pk" PRIMARY KEY ("id"),
+	CONSTRAINT "digest_items_fk_user_chats" FOREIGN KEY ("user_chats_id") REFERENCES "user_chats"("id"),
+	CONSTRAINT "digest_items_fk_monitored_chats" FOREIGN KEY ("monitored_chats_id") REFERENCES "monitored_chats"("id")
+);
+
+-- monitored chat change log: every change of monitored chat or of its subscriptions gets next seq; forwarders consume
+-- it by cursor. Writers are serialized by advisory lock until commit, so seq order is commit order
+DROP TABLE IF EXISTS "monitored_chat_changes" CASCADE;
+CREATE TABLE "monitored_chat_changes" (
+	"seq" bigserial,
+	"monitored_chats_id" int8 NOT NULL,
+	"change_time" timestamp with time zone NOT NULL DEFAULT NOW(),
+	CONSTRAINT "monitored_chat_changes_pk" PRIMARY KEY ("seq"),
+	CONSTRAINT "monitored_chat_changes_fk_monitored_chats" FOREIGN KEY ("monitored_chats_id") REFERENCES "monitored_chats"("id")
+);
+
+-- position of every consumer of monitored chat change log
+DROP TABLE IF EXISTS "monitored_chat_change_cursors" CASCADE;
+CREATE TABLE "monitored_chat_change_cursors" (
+	"consumer" text NOT NULL,
+	"seq" int8 NOT NULL,
+	CONSTRAINT "monitored_chat_change_cursors_pk" PRIMARY KEY ("consumer")
+);
+
+-- bundles: named sets of channels users subscribe to as a whole
+DROP TABLE IF EXISTS "bundles" CASCADE;
+CREATE TABLE "bundles" (
+	"id" serial8,
+	"name" text NOT NULL,
+	CONSTRAINT "bundles_pk" PRIMARY KEY ("id"),
+	CONSTRAINT "bundles_name_unique" UNIQUE ("name")
+);
+
+-- bundle membership; stored once per bundle, not per subscriber
+DROP TABLE IF EXISTS "bundle_channels" CASCADE;
+CREATE TABLE "bundle_channels" (
+	"bundles_id" int8 NOT NULL,
+	"monitored_chats_id" int8 NOT NULL,
+	"enabled" boolean NOT NULL DEFAULT TRUE,
+	CONSTRAINT "bundle_channels_pk" PRIMARY KEY ("bundles_id", "monitored_chats_id"),
+	CONSTRAINT "bundle_channels_fk_bundles" FOREIGN KEY ("bundles_id") REFERENCES "bundles"("id"),
+	CONSTRAINT "bundle_channels_fk_monitored_chats" FOREIGN KEY ("monitored_chats_id") REFERENCES "monitored_chats"("id")
+);
+
+DROP TABLE IF EXISTS "bundle_subscriptions" CASCADE;
+CREATE TABLE "bundle_subscriptions" (
+	"id" serial8,
+	"user_chats_id" int8 NOT NULL,
+	"bundles_id" int8 NOT NULL,
+	"enabled" boolean NOT NULL DEFAULT TRUE,
+	CONSTRAINT "bundle_subscriptions_pk" PRIMARY KEY ("id"),
+	CONSTRAINT "bundle_subscriptions_fk_user_chats" FOREIGN KEY ("user_chats_id") REFERENCES "user_chats"("id"),
+	CONSTRAINT "bundle_subscriptions_fk_bundles" FOREIGN KEY ("bundles_id") REFERENCES "bundles"("id"),
+	CONSTRAINT "bundle_subscriptions_bundles_id_user_chats_id_unique" UNIQUE ("bundles_id", "user_chats_id")
+);
+
+-- analytics events; partitioned by month, partitions are created ahead by analytics log writers
+DROP TABLE IF EXISTS "analytics_events" CASCADE;
+CREATE TABLE "analytics_events" (
+	"event_type" int2 NOT NULL, -- see common/analytics.py EventType
+	"event_time" timestamp with time zone NOT NULL,
+	"user_chat_id" int8, -- telegram chat id
+	"chat_id" int8, -- telegram chat id
+	"latency_seconds" float8,
+	"detail" text
+) PARTITION BY RANGE ("event_time");
+
+-- per channel counters by hour; upserted by feed bot
+DROP TABLE IF EXISTS "channel_rollups_hourly" CASCADE;
+CREATE TABLE "channel_rollups_hourly" (
+	"monitored_chats_id" int8 NOT NULL,
+	"bucket" timestamp with time zone NOT NULL,
+	"posts" int8 NOT NULL DEFAULT 0,
+	"deliveries" int8 NOT NULL DEFAULT 0,
+	"failures" int8 NOT NULL DEFAULT 0,
+	"duplicates" int8 NOT NULL DEFAULT 0,
+	"unfollows" int8 NOT NULL DEFAULT 0,
+	CONSTRAINT "channel_rollups_hourly_pk" PRIMARY KEY ("monitored_chats_id", "bucket"),
+	CONSTRAINT "channel_rollups_hourly_fk_monitored_chats" FOREIGN KEY ("monitored_chats_id") REFERENCES "monitored_chats"("id")
+);
+
+-- per channel counters by utc day; /stats reads only these
+DROP TABLE IF EXISTS "channel_rollups_daily" CASCADE;
+CREATE TABLE "channel_rollups_daily" (
+	"monitored_chats_id" int8 NOT NULL,
+	"bucket" timestamp with time zone NOT NULL,
+	"posts" int8 NOT NULL DEFAULT 0,
+	"deliveries" int8 NOT NULL DEFAULT 0,
+	"failures" int8 NOT NULL DEFAULT 0,
+	"duplicates" int8 NOT NULL DEFAULT 0,
+	"unfollows" int8 NOT NULL DEFAULT 0,
+	CONSTRAINT "channel_rollups_daily_pk" PRIMARY KEY ("monitored_chats_id", "bucket"),
+	CONSTRAINT "channel_rollups_daily_fk_monitored_chats" FOREIGN KEY ("monitored_chats_id") REFERENCES "monitored_chats"("id")
+);
+
+-- delivery outbox: forwards of posts to user chats waiting to be sent. Consumers claim batches by leasing them and
+-- delete sent ones; lease of consumer that died expires, so its items are claimed again. Peers are serialized input
+-- peers of the bot, so any process of the bot can send without entity cache. Items deferred by quiet hours of user chat
+-- are not sent before not_before; once due they are released gradually, when there is room in consumers' budget.
+-- Failed items that are to be retried are given back with not_before of the retry, so retries survive restarts too
+DROP TABLE IF EXISTS "delivery_outbox" CASCADE;
+CREATE TABLE "delivery_outbox" (
+	"id" bigserial,
+	"bot_index" int4 NOT NULL,
+	"user_chat_id" int8 NOT NULL,
+	"chat_id" int8,
+	"user_peer" bytea NOT NULL,
+	"from_peer" bytea NOT NULL,
+	"message_ids" int4[] NOT NULL,
+	"as_album" boolean NOT NULL,
+	"lease_until" timestamp with time zone,
+	"not_before" timestamp with time zone, -- NULL if item is sent as soon as possible
+	"attempts" int4 NOT NULL DEFAULT 0, -- failed attempts to send item
+	CONSTRAINT "delivery_outbox_pk" PRIMARY KEY ("id")
+);
+
+-- post handoff: posts of public channels passed from forwarders to the bot. Bot claims batches by leasing them and
+-- deletes handled ones; lease of bot that died expires, so its posts are claimed again. Text & urls of the post are
+-- passed along, so the bot runs filters without fetching the post
+DROP TABLE IF EXISTS "post_handoff" CASCADE;
+CREATE TABLE "post_handoff" (
+	"id" bigserial,
+	"chat_id" int8 NOT NULL,
+	"username" text NOT NULL,
+	"message_ids" int4[] NOT NULL,
+	"text" text NOT NULL DEFAULT '', -- text of the post to run filters on; album texts are joined
+	"urls" text[] NOT NULL DEFAULT '{}', -- hidden & button urls of the post to run filters on
+	"lease_until" timestamp with time zone,
+	CONSTRAINT "post_handoff_pk" PRIMARY KEY ("id")
+);
+
+-- channel subscribers: enabled subscribers of enabled monitored chats, denormalized from subscriptions, user chats &
+-- chats, so subscribers of channel are looked up by a single index probe on every post. Kept by triggers on source
+-- tables; user_telegram_chat_ids[i] is pinned to bot_indexes[i]. Channels without subscribers have no row
+DROP TABLE IF EXISTS "channel_subscribers" CASCADE;
+CREATE TABLE "channel_subscribers" (
+	"monitored_chats_id" int8 NOT NULL,
+	"telegram_chat_id" int8 NOT NULL,
+	"user_telegram_chat_ids" int8[] NOT NULL,
+	"bot_indexes" int4[] NOT NULL,
+	CONSTRAINT "channel_subscribers_pk" PRIMARY KEY ("monitored_chats_id"),
+	CONSTRAINT "channel_subscribers_fk_monitored_chats" FOREIGN KEY ("monitored_chats_id") REFERENCES "monitored_chats"("id"),
+	CONSTRAINT "channel_subscribers_telegram_chat_id_unique" UNIQUE ("telegram_chat_id")
+);
+
+-- telegram sessions of services, so they are not bound to host. Session keeps auth key & dc by name; entities (access
+-- hashes) are kept by scope shared by all sessions of the same account, so every process of it resolves them
+DROP TABLE IF EXISTS "telegram_sessions" CASCADE;
+CREATE TABLE "telegram_sessions" (
+	"name" text NOT NULL,
+	"dc_id" int4 NOT NULL,
+	"server_address" text NOT NULL,
+	"port" int4 NOT NULL,
+	"auth_key" bytea, -- NULL until session is authorized
+	"takeout_id" int8,
+	CONSTRAINT "telegram_sessions_pk" PRIMARY KEY ("name")
+);
+
+DROP TABLE IF EXISTS "telegram_update_states" CASCADE;
+CREATE TABLE "telegram_update_states" (
+	"session_name" text NOT NULL,
+	"entity_id" int8 NOT NULL, -- 0 for common update state
+	"pts" int4 NOT NULL,
+	"qts" int4 NOT NULL,
+	"date" timestamp with time zone NOT NULL,
+	"seq" int4 NOT NULL,
+	CONSTRAINT "telegram_update_states_pk" PRIMARY KEY ("session_name", "entity_id"),
+	CONSTRAINT "telegram_update_states_fk_telegram_sessions" FOREIGN KEY ("session_name") REFERENCES "telegram_sessions"("name")
+);
+
+DROP TABLE IF EXISTS "telegram_entities" CASCADE;
+CREATE TABLE "telegram_entities" (
+	"scope" text NOT NULL,
+	"id" int8 NOT NULL, -- marked peer id
+	"hash" int8 NOT NULL,
+	"username" text,
+	"phone" text,
+	"name" text,
+	CONSTRAINT "telegram_entities_pk" PRIMARY KEY ("scope", "id")
+);
+
 -- FUNCTIONS
 CREATE OR REPLACE FUNCTION monitored_chats_update_timestamp()
 RETURNS TRIGGER AS $$
@@ -66,6 +275,252 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+CREATE OR REPLACE FUNCTION function_notify_filters_updated()
+RETURNS TRIGGER AS $$
+BEGIN
+  NOTIFY notify_filters_updated;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION function_notify_digest_updated()
+RETURNS TRIGGER AS $$
+BEGIN
+  NOTIFY notify_digest_updated;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 2133 is arbitrary key of advisory lock serializing monitored chat change log writers. Every transaction that inserts
+-- or flips subscription or monitored chat holds it until commit, so follows and unfollows of all channels go one at a
+-- time. That is accepted, since these writes are single row ones made by user commands, while ordering seqs by commit
+-- without the lock needs xid snapshot checks on every read of the log. Bulk writes like disabling of user chats or
+-- bundle subscriptions don't touch these tables and don't take the lock; a bulk one that does would stall the others
+CREATE OR REPLACE FUNCTION function_log_monitored_chat_change()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM pg_advisory_xact_lock(2133);
+  INSERT INTO "monitored_chat_changes" ("monitored_chats_id") VALUES (NEW."id");
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION function_log_subscription_change()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM pg_advisory_xact_lock(2133);
+  INSERT INTO "monitored_chat_changes" ("monitored_chats_id") VALUES (NEW."monitored_chats_id");
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION function_notify_monitored_chat_changes()
+RETURNS TRIGGER AS $$
+BEGIN
+  NOTIFY notify_monitored_chat_changes;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION function_notify_delivery_outbox()
+RETURNS TRIGGER AS $$
+BEGIN
+  NOTIFY notify_delivery_outbox;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION function_notify_post_handoff()
+RETURNS TRIGGER AS $$
+BEGIN
+  NOTIFY notify_post_handoff;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- recomputes channel subscribers row of monitored chat from scratch; only done when monitored chat itself changes and
+-- on rebuild, follows & unfollows change just their own element. Monitored chat row is locked first, so recomputes of
+-- the same chat are serialized with each other and with element changes of the chat
+CREATE OR REPLACE FUNCTION refresh_channel_subscribers(target_monitored_chats_id int8)
+RETURNS void AS $$
+BEGIN
+  PERFORM 1 FROM "monitored_chats" WHERE "id"=target_monitored_chats_id FOR NO KEY UPDATE;
+  DELETE FROM "channel_subscribers" WHERE "monitored_chats_id"=target_monitored_chats_id;
+  INSERT INTO "channel_subscribers" ("monitored_chats_id", "telegram_chat_id", "user_telegram_chat_ids", "bot_indexes")
+  SELECT "monitored_chats"."id", "chats"."telegram_chat_id", "subscribers"."user_telegram_chat_ids", "subscribers"."bot_indexes"
+  FROM "monitored_chats"
+  JOIN "chats" ON "chats"."id"="monitored_chats"."chats_id"
+  CROSS JOIN LATERAL (
+    SELECT
+      array_agg("user_chats_chats"."telegram_chat_id" ORDER BY "user_chats"."id") AS "user_telegram_chat_ids",
+      array_agg("user_chats"."bot_index" ORDER BY "user_chats"."id") AS "bot_indexes"
+    FROM "subscriptions"
+    JOIN "user_chats" ON "user_chats"."id"="subscriptions"."user_chats_id"
+    JOIN "chats" AS "user_chats_chats" ON "user_chats_chats"."id"="user_chats"."chats_id"
+    WHERE "subscriptions"."monitored_chats_id"="monitored_chats"."id" AND "subscriptions"."enabled"=TRUE AND "user_chats"."enabled"=TRUE
+  ) AS "subscribers"
+  WHERE "monitored_chats"."id"=target_monitored_chats_id AND "monitored_chats"."enabled"=TRUE AND "subscribers"."user_telegram_chat_ids" IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- appends enabled user chat to subscribers of enabled monitored chat, unless it is there already. Monitored chat row is
+-- share locked, so concurrent follows of the chat don't wait for each other, only for its recompute
+CREATE OR REPLACE FUNCTION add_channel_subscriber(target_monitored_chats_id int8, target_user_chats_id int8)
+RETURNS void AS $$
+BEGIN
+  PERFORM 1 FROM "monitored_chats" WHERE "id"=target_monitored_chats_id AND "enabled"=TRUE FOR SHARE;
+
+  IF NOT FOUND THEN
+    RETURN;
+  END IF;
+
+  INSERT INTO "channel_subscribers" ("monitored_chats_id", "telegram_chat_id", "user_telegram_chat_ids", "bot_indexes")
+  SELECT "monitored_chats"."id", "chats"."telegram_chat_id", ARRAY["user_chats_chats"."telegram_chat_id"], ARRAY["user_chats"."bot_index"]
+  FROM "monitored_chats"
+  JOIN "chats" ON "chats"."id"="monitored_chats"."chats_id"
+  CROSS JOIN "user_chats"
+  JOIN "chats" AS "user_chats_chats" ON "user_chats_chats"."id"="user_chats"."chats_id"
+  WHERE "monitored_chats"."id"=target_monitored_chats_id AND "user_chats"."id"=target_user_chats_id AND "user_chats"."enabled"=TRUE
+  ON CONFLICT ("monitored_chats_id") DO UPDATE SET
+    "user_telegram_chat_ids"=array_append("channel_subscribers"."user_telegram_chat_ids", EXCLUDED."user_telegram_chat_ids"[1]),
+    "bot_indexes"=array_append("channel_subscribers"."bot_indexes", EXCLUDED."bot_indexes"[1])
+  WHERE NOT EXCLUDED."user_telegram_chat_ids"[1]=ANY("channel_subscribers"."user_telegram_chat_ids");
+END;
+$$ LANGUAGE plpgsql;
+
+-- removes user chat from subscribers of monitored chat along with its bot index; row without subscribers is dropped.
+-- User chat is given by telegram chat id, since that is what is stored and it may be changed already
+CREATE OR REPLACE FUNCTION remove_channel_subscriber(target_monitored_chats_id int8, target_user_telegram_chat_id int8)
+RETURNS void AS $$
+BEGIN
+  PERFORM 1 FROM "monitored_chats" WHERE "id"=target_monitored_chats_id FOR SHARE;
+  UPDATE "channel_subscribers" SET
+    "user_telegram_chat_ids"="user_telegram_chat_ids"[:array_position("user_telegram_chat_ids", target_user_telegram_chat_id) - 1]
+      || "user_telegram_chat_ids"[array_position("user_telegram_chat_ids", target_user_telegram_chat_id) + 1:],
+    "bot_indexes"="bot_indexes"[:array_position("user_telegram_chat_ids", target_user_telegram_chat_id) - 1]
+      || "bot_indexes"[array_position("user_telegram_chat_ids", target_user_telegram_chat_id) + 1:]
+  WHERE "monitored_chats_id"=target_monitored_chats_id AND target_user_telegram_chat_id=ANY("user_telegram_chat_ids");
+  DELETE FROM "channel_subscribers"
+  WHERE "monitored_chats_id"=target_monitored_chats_id AND cardinality("user_telegram_chat_ids")=0;
+END;
+$$ LANGUAGE plpgsql;
+
+-- one shot rebuild of the whole table, e.g. after it was created: SELECT rebuild_channel_subscribers();
+CREATE OR REPLACE FUNCTION rebuild_channel_subscribers()
+RETURNS void AS $$
+BEGIN
+  PERFORM refresh_channel_subscribers("id") FROM "monitored_chats" ORDER BY "id";
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION function_refresh_channel_subscribers_of_subscription()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF TG_OP = 'UPDATE' AND OLD."enabled"=NEW."enabled" AND OLD."user_chats_id"=NEW."user_chats_id"
+      AND OLD."monitored_chats_id"=NEW."monitored_chats_id" THEN
+    RETURN NULL;
+  END IF;
+
+  IF TG_OP IN ('UPDATE', 'DELETE') AND OLD."enabled"=TRUE THEN
+    PERFORM remove_channel_subscriber(OLD."monitored_chats_id", "chats"."telegram_chat_id")
+    FROM "user_chats" JOIN "chats" ON "chats"."id"="user_chats"."chats_id"
+    WHERE "user_chats"."id"=OLD."user_chats_id";
+  END IF;
+
+  IF TG_OP IN ('INSERT', 'UPDATE') AND NEW."enabled"=TRUE THEN
+    PERFORM add_channel_subscriber(NEW."monitored_chats_id", NEW."user_chats_id");
+  END IF;
+
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- user chat is removed from channels of its subscriptions as it was and added back as it is now; channels go in order
+-- of ids, so concurrent changes of several user chats don't deadlock
+CREATE OR REPLACE FUNCTION function_refresh_channel_subscribers_of_user_chat()
+RETURNS TRIGGER AS $$
+BEGIN
+  IF OLD."enabled"=TRUE THEN
+    PERFORM remove_channel_subscriber(
+      "subscriptions"."monitored_chats_id", (SELECT "telegram_chat_id" FROM "chats" WHERE "id"=OLD."chats_id"))
+    FROM "subscriptions"
+    WHERE "subscriptions"."user_chats_id"=NEW."id" AND "subscriptions"."enabled"=TRUE
+    ORDER BY "subscriptions"."monitored_chats_id";
+  END IF;
+
+  IF NEW."enabled"=TRUE THEN
+    PERFORM add_channel_subscriber("subscriptions"."monitored_chats_id", NEW."id")
+    FROM "subscriptions"
+    WHERE "subscriptions"."user_chats_id"=NEW."id" AND "subscriptions"."enabled"=TRUE
+    ORDER BY "subscriptions"."monitored_chats_id";
+  END IF;
+
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION function_refresh_channel_subscribers_of_monitored_chat()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM refresh_channel_subscribers(NEW."id");
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- migrated chat keeps its row in chats, but gets new telegram chat id; user chat keeps its place in arrays
+CREATE OR REPLACE FUNCTION function_refresh_channel_subscribers_of_chat()
+RETURNS TRIGGER AS $$
+BEGIN
+  UPDATE "channel_subscribers" SET "telegram_chat_id"=NEW."telegram_chat_id"
+  FROM "monitored_chats"
+  WHERE "monitored_chats"."id"="channel_subscribers"."monitored_chats_id" AND "monitored_chats"."chats_id"=NEW."id";
+  UPDATE "channel_subscribers"
+  SET "user_telegram_chat_ids"=array_replace("user_telegram_chat_ids", OLD."telegram_chat_id", NEW."telegram_chat_id")
+  WHERE "monitored_chats_id" IN (
+    SELECT "subscriptions"."monitored_chats_id"
+    FROM "subscriptions"
+    JOIN "user_chats" ON "user_chats"."id"="subscriptions"."user_chats_id"
+    WHERE "user_chats"."chats_id"=NEW."id" AND "subscriptions"."enabled"=TRUE
+  ) AND OLD."telegram_chat_id"=ANY("user_telegram_chat_ids");
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- payload is id of changed bundle
+CREATE OR REPLACE FUNCTION function_notify_bundle_channels_updated()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM pg_notify('notify_bundle_channels_updated', NEW."bundles_id"::text);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- payload is id of changed bundle
+CREATE OR REPLACE FUNCTION function_notify_bundle_subscriptions_updated()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM pg_notify('notify_bundle_subscriptions_updated', NEW."bundles_id"::text);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION function_notify_quiet_hours_updated()
+RETURNS TRIGGER AS $$
+BEGIN
+  NOTIFY notify_quiet_hours_updated;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- payload is telegram chat id of changed user chat
+CREATE OR REPLACE FUNCTION function_notify_user_chats_updated()
+RETURNS TRIGGER AS $$
+BEGIN
+  PERFORM pg_notify('notify_user_chats_updated', (SELECT "telegram_chat_id" FROM "chats" WHERE "id"=NEW."chats_id")::text);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
 -- TRIGGERS
 DROP TRIGGER IF EXISTS set_timestamp on "monitored_chats";
 CREATE TRIGGER set_timestamp
@@ -78,6 +533,98 @@ CREATE TRIGGER subscriptions_updated
 AFTER UPDATE OR INSERT ON "subscriptions"
 EXECUTE PROCEDURE function_notify_subscriptions_updated();
 
+DROP TRIGGER IF EXISTS filters_updated on "filters";
+CREATE TRIGGER filters_updated
+AFTER UPDATE OR INSERT ON "filters"
+EXECUTE PROCEDURE function_notify_filters_updated();
+
+DROP TRIGGER IF EXISTS user_chats_digest_updated on "user_chats";
+CREATE TRIGGER user_chats_digest_updated
+AFTER UPDATE OF "digest_period_minutes" ON "user_chats"
+EXECUTE PROCEDURE function_notify_digest_updated();
+
+DROP TRIGGER IF EXISTS subscriptions_digest_updated on "subscriptions";
+CREATE TRIGGER subscriptions_digest_updated
+AFTER UPDATE OF "digest_period_minutes" ON "subscriptions"
+EXECUTE PROCEDURE function_notify_digest_updated();
+
+DROP TRIGGER IF EXISTS user_chats_quiet_hours_updated on "user_chats";
+CREATE TRIGGER user_chats_quiet_hours_updated
+AFTER UPDATE OF "quiet_from_minute", "quiet_to_minute" ON "user_chats"
+EXECUTE PROCEDURE function_notify_quiet_hours_updated();
+
+DROP TRIGGER IF EXISTS user_chats_updated on "user_chats";
+CREATE TRIGGER user_chats_updated
+AFTER UPDATE OF "enabled", "language", "chats_id" OR INSERT ON "user_chats"
+FOR EACH ROW
+EXECUTE PROCEDURE function_notify_user_chats_updated();
+
+DROP TRIGGER IF EXISTS monitored_chats_changed on "monitored_chats";
+CREATE TRIGGER monitored_chats_changed
+AFTER UPDATE OF "enabled", "joiner" OR INSERT ON "monitored_chats"
+FOR EACH ROW
+EXECUTE PROCEDURE function_log_monitored_chat_change();
+
+DROP TRIGGER IF EXISTS subscriptions_changed on "subscriptions";
+CREATE TRIGGER subscriptions_changed
+AFTER UPDATE OF "enabled" OR INSERT ON "subscriptions"
+FOR EACH ROW
+EXECUTE PROCEDURE function_log_subscription_change();
+
+DROP TRIGGER IF EXISTS monitored_chat_changes_inserted on "monitored_chat_changes";
+CREATE TRIGGER monitored_chat_changes_inserted
+AFTER INSERT ON "monitored_chat_changes"
+EXECUTE PROCEDURE function_notify_monitored_chat_changes();
+
+DROP TRIGGER IF EXISTS bundle_channels_updated on "bundle_channels";
+CREATE TRIGGER bundle_channels_updated
+AFTER UPDATE OR INSERT ON "bundle_channels"
+FOR EACH ROW
+EXECUTE PROCEDURE function_notify_bundle_channels_updated();
+
+DROP TRIGGER IF EXISTS bundle_subscriptions_updated on "bundle_subscriptions";
+CREATE TRIGGER bundle_subscriptions_updated
+AFTER UPDATE OR INSERT ON "bundle_subscriptions"
+FOR EACH ROW
+EXECUTE PROCEDURE function_notify_bundle_subscriptions_updated();
+
+DROP TRIGGER IF EXISTS delivery_outbox_inserted on "delivery_outbox";
+CREATE TRIGGER delivery_outbox_inserted
+AFTER INSERT ON "delivery_outbox"
+EXECUTE PROCEDURE function_notify_delivery_outbox();
+
+DROP TRIGGER IF EXISTS post_handoff_inserted on "post_handoff";
+CREATE TRIGGER post_handoff_inserted
+AFTER INSERT ON "post_handoff"
+EXECUTE PROCEDURE function_notify_post_handoff();
+
+DROP TRIGGER IF EXISTS subscriptions_channel_subscribers on "subscriptions";
+CREATE TRIGGER subscriptions_channel_subscribers
+AFTER UPDATE OF "enabled", "user_chats_id", "monitored_chats_id" OR INSERT OR DELETE ON "subscriptions"
+FOR EACH ROW
+EXECUTE PROCEDURE function_refresh_channel_subscribers_of_subscription();
+
+DROP TRIGGER IF EXISTS user_chats_channel_subscribers on "user_chats";
+CREATE TRIGGER user_chats_channel_subscribers
+AFTER UPDATE OF "enabled", "bot_index", "chats_id" ON "user_chats"
+FOR EACH ROW
+WHEN (OLD."enabled" IS DISTINCT FROM NEW."enabled" OR OLD."bot_index" IS DISTINCT FROM NEW."bot_index" OR OLD."chats_id" IS DISTINCT FROM NEW."chats_id")
+EXECUTE PROCEDURE function_refresh_channel_subscribers_of_user_chat();
+
+DROP TRIGGER IF EXISTS monitored_chats_channel_subscribers on "monitored_chats";
+CREATE TRIGGER monitored_chats_channel_subscribers
+AFTER UPDATE OF "enabled", "chats_id" ON "monitored_chats"
+FOR EACH ROW
+WHEN (OLD."enabled" IS DISTINCT FROM NEW."enabled" OR OLD."chats_id" IS DISTINCT FROM NEW."chats_id")
+EXECUTE PROCEDURE function_refresh_channel_subscribers_of_monitored_chat();
+
+DROP TRIGGER IF EXISTS chats_channel_subscribers on "chats";
+CREATE TRIGGER chats_channel_subscribers
+AFTER UPDATE OF "telegram_chat_id" ON "chats"
+FOR EACH ROW
+WHEN (OLD."telegram_chat_id" IS DISTINCT FROM NEW."telegram_chat_id")
+EXECUTE PROCEDURE function_refresh_channel_subscribers_of_chat();
+
 -- INDEXES
 -- for is enrolled lookup
 DROP INDEX IF EXISTS chats_telegram_user_id_hash;
@@ -100,4 +647,27 @@ DROP INDEX IF EXISTS monitored_chats_id_hash;
 CREATE INDEX monitored_chats_id_hash ON "monitored_chats" USING HASH ("id");
 DROP INDEX IF EXISTS subscriptions_btree_multi;
 CREATE INDEX subscriptions_btree_multi ON "subscriptions" USING BTREE ("monitored_chats_id", "user_chats_id");
--- mb add hash on subscriptions.users_id to delete users faster?
\ No newline at end of file
+-- mb add hash on subscriptions.users_id to delete users faster?
+-- for keyset paginated list of user chat subscriptions
+DROP INDEX IF EXISTS subscriptions_user_chats_id_id_btree;
+CREATE INDEX subscriptions_user_chats_id_id_btree ON "subscriptions" USING BTREE ("user_chats_id", "id");
+
+-- for filters lookup
+DROP INDEX IF EXISTS filters_user_chats_id_btree;
+CREATE INDEX filters_user_chats_id_btree ON "filters" USING BTREE ("user_chats_id");
+
+-- for due digest items lookup
+DROP INDEX IF EXISTS digest_items_due_time_btree;
+CREATE INDEX digest_items_due_time_btree ON "digest_items" USING BTREE ("due_time");
+
+-- for bundles of channel lookup
+DROP INDEX IF EXISTS bundle_channels_monitored_chats_id_btree;
+CREATE INDEX bundle_channels_monitored_chats_id_btree ON "bundle_channels" USING BTREE ("monitored_chats_id");
+
+-- for deferred outbox items lookup; both of due items & of user chats having deferred backlog
+DROP INDEX IF EXISTS delivery_outbox_deferred_user_chat_id_btree;
+CREATE INDEX delivery_outbox_deferred_user_chat_id_btree ON "delivery_outbox" USING BTREE ("user_chat_id")
+WHERE "not_before" IS NOT NULL;
+DROP INDEX IF EXISTS delivery_outbox_deferred_not_before_btree;
+CREATE INDEX delivery_outbox_deferred_not_before_btree ON "delivery_outbox" USING BTREE ("not_before")
+WHERE "not_before" IS NOT NULL;
@@ -1,21 +1,43 @@
 from asyncio import gather
 from telethon import TelegramClient, events
 
-from common.handler import resolve_entity_try_cache
+from common.analytics import AnalyticsConfig, configure_analytics, with_command_event
+from common.cache import TtlLruCache
 from common.logging import get_logger
 from common.persistent_storage.factory import PersistenceConfig
 from common.client import CommonConfig, ClientWithPersistentStorage
+from common.session import SessionsConfig, create_session, get_bot_session_scope
 
 from handlers.forwarders import ForwardersHandler
 from handlers.help import HelpHandler
-from handlers.list import ListHandler
+from handlers.list import ListHandler, ListPageHandler, g_list_callback_pattern
 from handlers.follow import FollowHandler
 from handlers.forwarded_message import ForwardedMessageHandler
 from handlers.unfollow import UnfollowHandler
 from handlers.start import StartHandler
 from handlers.stop import StopHandler
 from handlers.all import AllHandler
+from handlers.profile import ProfileHandler
 from handlers.resolver_replies import ResolverRepliesHandler
+from handlers.filter import FilterHandler
+from handlers.unfilter import UnfilterHandler
+from handlers.digest import DigestHandler
+from handlers.quiet import QuietHandler
+from handlers.stats import StatsHandler
+from handlers.bundle import BundleHandler, UnbundleHandler, BundleEditHandler
+
+from bundle import BundleIndex
+from digest import DigestSettings, DigestScheduler
+from quiet import QuietHours
+from pool import BotPool
+from rollup import ChannelRollups
+from user_state import UserStateCache
+from resolver_dispatcher import ResolverDispatcher
+from delivery import DeliveryService
+from outbox import OutboxConsumer
+from handoff import HandoffConsumer
+from worker import DeliveryWorkerConfig, DeliveryWorkersPool
+from lanes import LanedTelegramClient, SendLanes, SendLanesConfig
 
 
 class BotConfig(CommonConfig):
@@ -23,21 +45,54 @@ class BotConfig(CommonConfig):
             self,
             api_id: int,
             api_hash: str,
-            token: str,
+            tokens: list,
             dev_key: str,
             resolver_usernames: list,
             forwarders_user_ids: set,
+            primary_bot_user_ids: set,
             resolve_max_wait_count: int,
             resolve_timeout_seconds: float,
             resolve_warning_wait_number: int,
+            resolver_failures_threshold: int,
+            resolver_open_seconds: float,
             forward_max_wait_count: int,
             forward_timeout_seconds: float,
-            persistence_config: PersistenceConfig):
+            digest_tick_seconds: float,
+            digest_max_items_per_tick: int,
+            digest_min_period_minutes: int,
+            digest_max_period_minutes: int,
+            delivery_max_attempts: int,
+            delivery_retry_delay_seconds: float,
+            delivery_max_flood_wait_seconds: float,
+            delivery_flush_seconds: float,
+            delivery_workers_count: int,
+            delivery_worker_lanes_count: int,
+            outbox_batch_size: int,
+            outbox_lease_seconds: float,
+            outbox_poll_seconds: float,
+            outbox_deferred_release_per_second: float,
+            handoff_batch_size: int,
+            handoff_lease_seconds: float,
+            handoff_poll_seconds: float,
+            drain_timeout_seconds: float,
+            rollups_flush_seconds: float,
+            duplicates_cache_max_size: int,
+            duplicates_cache_ttl_seconds: float,
+            stats_days: int,
+            list_page_size: int,
+            list_cache_ttl_seconds: float,
+            list_cache_max_size: int,
+            user_state_cache_max_size: int,
+            user_state_cache_ttl_seconds: float,
+            send_lanes_config: SendLanesConfig,
+            analytics_config: AnalyticsConfig,
+            persistence_config: PersistenceConfig,
+            sessions_config: SessionsConfig):
         super(BotConfig, self).__init__(
-            api_id=api_id, api_hash=api_hash, persistence_config=persistence_config)
+            api_id=api_id, api_hash=api_hash, persistence_config=persistence_config, sessions_config=sessions_config)
 
-        if token is None or len(token) < 1:
-            raise RuntimeError("Invalid token: " + token)
+        if tokens is None or len(tokens) < 1 or any(token is None or len(token) < 1 for token in tokens):
+            raise RuntimeError("Invalid tokens: none, empty or containing empty token")
 
         if resolver_usernames is None or len(resolver_usernames) < 1:
             raise RuntimeError("Invalid resolver_usernames: none or empty")
@@ -45,6 +100,9 @@ class BotConfig(CommonConfig):
         if forwarders_user_ids is None or len(forwarders_user_ids) < 1:
             raise RuntimeError("Invalid forwarders_user_ids: none or empty")
 
+        if primary_bot_user_ids is None:
+            raise RuntimeError("Invalid primary_bot_user_ids: none")
+
         if resolve_max_wait_count < 1:
             raise RuntimeError(f"Invalid resolve_max_wait_count={resolve_max_wait_count}")
 
@@ -54,122 +112,605 @@ class BotConfig(CommonConfig):
         if resolve_warning_wait_number < 1:
             raise RuntimeError(f"Invalid resolve_warning_wait_number={resolve_warning_wait_number}")
 
+        if resolver_failures_threshold < 1:
+            raise RuntimeError(f"Invalid resolver_failures_threshold={resolver_failures_threshold}")
+
+        if resolver_open_seconds <= 0:
+            raise RuntimeError(f"Invalid resolver_open_seconds={resolver_open_seconds}")
+
         if forward_max_wait_count < 1:
             raise RuntimeError(f"Invalid forward_max_wait_count={forward_max_wait_count}")
 
         if forward_timeout_seconds < 1:
             raise RuntimeError(f"Invalid forward_timeout_seconds={forward_timeout_seconds}")
 
-        self.token = token
+        if digest_tick_seconds <= 0:
+            raise RuntimeError(f"Invalid digest_tick_seconds={digest_tick_seconds}")
+
+        if digest_max_items_per_tick < 1:
+            raise RuntimeError(f"Invalid digest_max_items_per_tick={digest_max_items_per_tick}")
+
+        if digest_min_period_minutes < 1 or digest_max_period_minutes < digest_min_period_minutes:
+            raise RuntimeError(f"Invalid digest_min_period_minutes={digest_min_period_minutes} "
+                               f"digest_max_period_minutes={digest_max_period_minutes}")
+
+        if delivery_max_attempts < 1:
+            raise RuntimeError(f"Invalid delivery_max_attempts={delivery_max_attempts}")
+
+        if delivery_retry_delay_seconds <= 0:
+            raise RuntimeError(f"Invalid delivery_retry_delay_seconds={delivery_retry_delay_seconds}")
+
+        if delivery_max_flood_wait_seconds <= 0:
+            raise RuntimeError(f"Invalid delivery_max_flood_wait_seconds={delivery_max_flood_wait_seconds}")
+
+        if delivery_flush_seconds <= 0:
+            raise RuntimeError(f"Invalid delivery_flush_seconds={delivery_flush_seconds}")
+
+        if delivery_workers_count < 0:
+            raise RuntimeError(f"Invalid delivery_workers_count={delivery_workers_count}")
+
+        if delivery_worker_lanes_count < 1:
+            raise RuntimeError(f"Invalid delivery_worker_lanes_count={delivery_worker_lanes_count}")
+
+        if outbox_batch_size < 1:
+            raise RuntimeError(f"Invalid outbox_batch_size={outbox_batch_size}")
+
+        if outbox_lease_seconds <= 0:
+            raise RuntimeError(f"Invalid outbox_lease_seconds={outbox_lease_seconds}")
+
+        if outbox_poll_seconds <= 0:
+            raise RuntimeError(f"Invalid outbox_poll_seconds={outbox_poll_seconds}")
+
+        if outbox_deferred_release_per_second <= 0:
+            raise RuntimeError(f"Invalid outbox_deferred_release_per_second={outbox_deferred_release_per_second}")
+
+        if handoff_batch_size < 1:
+            raise RuntimeError(f"Invalid handoff_batch_size={handoff_batch_size}")
+
+        if handoff_lease_seconds <= 0:
+            raise RuntimeError(f"Invalid handoff_lease_seconds={handoff_lease_seconds}")
+
+        if handoff_poll_seconds <= 0:
+            raise RuntimeError(f"Invalid handoff_poll_seconds={handoff_poll_seconds}")
+
+        if drain_timeout_seconds < 0:
+            raise RuntimeError(f"Invalid drain_timeout_seconds={drain_timeout_seconds}")
+
+        if rollups_flush_seconds <= 0:
+            raise RuntimeError(f"Invalid rollups_flush_seconds={rollups_flush_seconds}")
+
+        if duplicates_cache_max_size < 1:
+            raise RuntimeError(f"Invalid duplicates_cache_max_size={duplicates_cache_max_size}")
+
+        if duplicates_cache_ttl_seconds <= 0:
+            raise RuntimeError(f"Invalid duplicates_cache_ttl_seconds={duplicates_cache_ttl_seconds}")
+
+        if stats_days < 1:
+            raise RuntimeError(f"Invalid stats_days={stats_days}")
+
+        if list_page_size < 1:
+            raise RuntimeError(f"Invalid list_page_size={list_page_size}")
+
+        if list_cache_ttl_seconds <= 0:
+            raise RuntimeError(f"Invalid list_cache_ttl_seconds={list_cache_ttl_seconds}")
+
+        if list_cache_max_size < 1:
+            raise RuntimeError(f"Invalid list_cache_max_size={list_cache_max_size}")
+
+        if user_state_cache_max_size < 1:
+            raise RuntimeError(f"Invalid user_state_cache_max_size={user_state_cache_max_size}")
+
+        if user_state_cache_ttl_seconds <= 0:
+            raise RuntimeError(f"Invalid user_state_cache_ttl_seconds={user_state_cache_ttl_seconds}")
+
+        if send_lanes_config is None:
+            raise RuntimeError("No send lanes config")
+
+        if analytics_config is None:
+            raise RuntimeError("No analytics config")
+
+        self.tokens = tokens
         self.dev_key = dev_key
         self.resolver_usernames = resolver_usernames
         self.forwarders_user_ids = forwarders_user_ids
+        self.primary_bot_user_ids = primary_bot_user_ids
         self.resolve_max_wait_count = resolve_max_wait_count
         self.resolve_timeout_seconds = resolve_timeout_seconds
         self.resolve_warning_wait_number = resolve_warning_wait_number
+        self.resolver_failures_threshold = resolver_failures_threshold
+        self.resolver_open_seconds = resolver_open_seconds
         self.forward_max_wait_count = forward_max_wait_count
         self.forward_timeout_seconds = forward_timeout_seconds
+        self.digest_tick_seconds = digest_tick_seconds
+        self.digest_max_items_per_tick = digest_max_items_per_tick
+        self.digest_min_period_minutes = digest_min_period_minutes
+        self.digest_max_period_minutes = digest_max_period_minutes
+        self.delivery_max_attempts = delivery_max_attempts
+        self.delivery_retry_delay_seconds = delivery_retry_delay_seconds
+        self.delivery_max_flood_wait_seconds = delivery_max_flood_wait_seconds
+        self.delivery_flush_seconds = delivery_flush_seconds
+        self.delivery_workers_count = delivery_workers_count
+        self.delivery_worker_lanes_count = delivery_worker_lanes_count
+        self.outbox_batch_size = outbox_batch_size
+        self.outbox_lease_seconds = outbox_lease_seconds
+        self.outbox_poll_seconds = outbox_poll_seconds
+        self.outbox_deferred_release_per_second = outbox_deferred_release_per_second
+        self.handoff_batch_size = handoff_batch_size
+        self.handoff_lease_seconds = handoff_lease_seconds
+        self.handoff_poll_seconds = handoff_poll_seconds
+        self.drain_timeout_seconds = drain_timeout_seconds
+        self.rollups_flush_seconds = rollups_flush_seconds
+        self.duplicates_cache_max_size = duplicates_cache_max_size
+        self.duplicates_cache_ttl_seconds = duplicates_cache_ttl_seconds
+        self.stats_days = stats_days
+        self.list_page_size = list_page_size
+        self.list_cache_ttl_seconds = list_cache_ttl_seconds
+        self.list_cache_max_size = list_cache_max_size
+        self.user_state_cache_max_size = user_state_cache_max_size
+        self.user_state_cache_ttl_seconds = user_state_cache_ttl_seconds
+        self.send_lanes_config = send_lanes_config
+        self.analytics_config = analytics_config
 
     def __repr__(self):
-        return super(BotConfig, self).__repr__() + f", token=***, dev_key=***, " \
+        return super(BotConfig, self).__repr__() + f", tokens=*** ({len(self.tokens)}), dev_key=***, " \
                                                    f"resolver_usernames={self.resolver_usernames}, " \
                                                    f"forwarders_user_ids={self.forwarders_user_ids}, " \
+                                                   f"primary_bot_user_ids={self.primary_bot_user_ids}, " \
                                                    f"resolve_max_wait_count={self.resolve_max_wait_count}, " \
                                                    f"resolve_timeout_seconds={self.resolve_timeout_seconds}, " \
                                                    f"resolve_warning_wait_number={self.resolve_warning_wait_number}, " \
+                                                   f"resolver_failures_threshold={self.resolver_failures_threshold}, " \
+                                                   f"resolver_open_seconds={self.resolver_open_seconds}, " \
                                                    f"forward_max_wait_count={self.forward_max_wait_count}, " \
-                                                   f"forward_timeout_seconds={self.forward_timeout_seconds}"
+                                                   f"forward_timeout_seconds={self.forward_timeout_seconds}, " \
+                                                   f"digest_tick_seconds={self.digest_tick_seconds}, " \
+                                                   f"digest_max_items_per_tick={self.digest_max_items_per_tick}, " \
+                                                   f"digest_min_period_minutes={self.digest_min_period_minutes}, " \
+                                                   f"digest_max_period_minutes={self.digest_max_period_minutes}, " \
+                                                   f"delivery_max_attempts={self.delivery_max_attempts}, " \
+                                                   f"delivery_retry_delay_seconds=" \
+                                                   f"{self.delivery_retry_delay_seconds}, " \
+                                                   f"delivery_max_flood_wait_seconds=" \
+                                                   f"{self.delivery_max_flood_wait_seconds}, " \
+                                                   f"delivery_flush_seconds={self.delivery_flush_seconds}, " \
+                                                   f"delivery_workers_count={self.delivery_workers_count}, " \
+                                                   f"delivery_worker_lanes_count=" \
+                                                   f"{self.delivery_worker_lanes_count}, " \
+                                                   f"outbox_batch_size={self.outbox_batch_size}, " \
+                                                   f"outbox_lease_seconds={self.outbox_lease_seconds}, " \
+                                                   f"outbox_poll_seconds={self.outbox_poll_seconds}, " \
+                                                   f"outbox_deferred_release_per_second=" \
+                                                   f"{self.outbox_deferred_release_per_second}, " \
+                                                   f"handoff_batch_size={self.handoff_batch_size}, " \
+                                                   f"handoff_lease_seconds={self.handoff_lease_seconds}, " \
+                                                   f"handoff_poll_seconds={self.handoff_poll_seconds}, " \
+                                                   f"drain_timeout_seconds={self.drain_timeout_seconds}, " \
+                                                   f"rollups_flush_seconds={self.rollups_flush_seconds}, " \
+                                                   f"duplicates_cache_max_size={self.duplicates_cache_max_size}, " \
+                                                   f"duplicates_cache_ttl_seconds=" \
+                                                   f"{self.duplicates_cache_ttl_seconds}, " \
+                                                   f"stats_days={self.stats_days}, " \
+                                                   f"list_page_size={self.list_page_size}, " \
+                                                   f"list_cache_ttl_seconds={self.list_cache_ttl_seconds}, " \
+                                                   f"list_cache_max_size={self.list_cache_max_size}, " \
+                                                   f"user_state_cache_max_size={self.user_state_cache_max_size}, " \
+                                                   f"user_state_cache_ttl_seconds=" \
+                                                   f"{self.user_state_cache_ttl_seconds}, " \
+                                                   f"send_lanes_config=({self.send_lanes_config}), " \
+                                                   f"analytics_config=({self.analytics_config})"
 
 
 class Bot(ClientWithPersistentStorage):
+    # ClientWithPersistentStorage overrides
+    async def connect(self):
+        # worker processes log in on their own meanwhile
+        if self.workers is not None:
+            self.workers.start()
+
+        await super(Bot, self).connect()
+
+    def get_telegram_clients(self) -> list:
+        return self.pool.clients
+
+    async def connect_telegram(self):
+        await self.pool.connect()
+
+    async def setup(self):
+        # users talk to the bot they are pinned to, so every bot of the pool gets the whole set of handlers
+        await gather(*[self.add_event_handlers(client=client) for client in self.pool.clients])
+
+        # Admin commands
+        # Add announce command
+        self.pool.get_primary_client().add_event_handler(
+            callback=with_command_event(command="all", callback=AllHandler(
+                persistent_storage=self.persistent_storage,
+                user_states=self.user_states,
+                key=self.config.dev_key,
+                pool=self.pool)),
+            event=events.NewMessage(pattern=r'^/all', forwards=False, incoming=True, outgoing=False))
+        # Add profile command
+        self.pool.get_primary_client().add_event_handler(
+            callback=with_command_event(command="profile", callback=ProfileHandler(
+                persistent_storage=self.persistent_storage,
+                user_states=self.user_states,
+                key=self.config.dev_key,
+                loop_monitor=self.loop_monitor,
+                pool=self.pool)),
+            event=events.NewMessage(pattern=r'^/profile', forwards=False, incoming=True, outgoing=False))
+
+    async def prepare(self):
+        # Sub to list of notifies
+        get_logger().info("Subbing to notifies ...")
+        await self.persistent_storage.subscribe(notifies_to_handlers=self.notifies_to_handlers)
+
+    def get_continuous_async_tasks(self):
+        return super(Bot, self).get_continuous_async_tasks() + [
+            self.persistent_storage.listen(
+                notifies_to_handlers=self.notifies_to_handlers,
+                should_run_func=self.client.is_connected),
+            self.digest_scheduler.run(),
+            self.delivery.run(),
+            self.analytics.run(),
+            self.rollups.run(),
+            self.handoff.run()] + [
+            client.run_until_disconnected() for client in self.pool.clients[1:]] + (
+            self.consumer.get_continuous_async_tasks() if self.consumer is not None else [])
+
+    # posts that are not in outbox yet are lost on restart anyway, so intake stops first; then the rest is drained
+    async def shutdown(self):
+        # handler of other bot is just not found on client
+        for client in self.pool.clients:
+            for forwarders_handler in self.forwarders_handlers:
+                client.remove_event_handler(forwarders_handler)
+
+        if self.handoff is not None:
+            self.handoff.stop()
+
+        if self.consumer is not None:
+            await self.consumer.drain(timeout_seconds=self.config.drain_timeout_seconds)
+
+        if self.workers is not None:
+            await self.workers.stop(timeout_seconds=self.config.drain_timeout_seconds)
+
+        await gather(self.rollups.flush(), self.analytics.flush(), return_exceptions=True)
+
+    async def disconnect(self):
+        await self.pool.disconnect()
+
+    # Bot
+    async def on_filters_update(self, payload: str):
+        get_logger().info("Handler for filters update notify called")
+
+        for forwarders_handler in self.forwarders_handlers:
+            forwarders_handler.invalidate_filters()
+
+    async def on_subscriptions_update(self, payload: str):
+        get_logger().info("Handler for subscriptions update notify called")
+
+        # set of channel subscribers whose filters should be compiled might have changed
+        for forwarders_handler in self.forwarders_handlers:
+            forwarders_handler.invalidate_filters()
+
+        # cached /list pages might be stale now
+        self.list_cache.clear()
+
+    async def on_digest_update(self, payload: str):
+        get_logger().info("Handler for digest update notify called")
+        self.digest_settings.invalidate()
+
+    async def on_quiet_hours_update(self, payload: str):
+        get_logger().info("Handler for quiet hours update notify called")
+        self.quiet_hours.invalidate()
+
+    async def on_user_chats_update(self, payload: str):
+        get_logger().debug(f"Handler for user chats update notify called: user chat={payload}")
+        self.user_states.invalidate(user_chat_id=int(payload))
+        self.bundles.invalidate_all_subscribers()
+
+    async def on_bundle_channels_update(self, payload: str):
+        get_logger().info(f"Handler for bundle channels update notify called: bundle={payload}")
+        self.bundles.invalidate_channels()
+
+        # set of channel subscribers whose filters should be compiled might have changed
+        for forwarders_handler in self.forwarders_handlers:
+            forwarders_handler.invalidate_filters()
+
+    async def on_bundle_subscriptions_update(self, payload: str):
+        get_logger().info(f"Handler for bundle subscriptions update notify called: bundle={payload}")
+        self.bundles.invalidate_subscribers(bundle_id=int(payload))
+
+        for forwarders_handler in self.forwarders_handlers:
+            forwarders_handler.invalidate_filters()
+
     def __init__(self, config: BotConfig):
         if config is None:
             raise RuntimeError("No config passed")
 
         self.config = config
         get_logger().info(msg="Creating Bot object with config: {}".format(self.config))
+        self.notifies_to_handlers = {
+            "notify_filters_updated": self.on_filters_update,
+            "notify_subscriptions_updated": self.on_subscriptions_update,
+            "notify_digest_updated": self.on_digest_update,
+            "notify_quiet_hours_updated": self.on_quiet_hours_update,
+            "notify_user_chats_updated": self.on_user_chats_update,
+            "notify_bundle_channels_updated": self.on_bundle_channels_update,
+            "notify_bundle_subscriptions_updated": self.on_bundle_subscriptions_update}
 
-        super(Bot, self).__init__(
-            client=TelegramClient(
-                'feed_bot',
+        # every bot of the pool is logged in on connect; first one is primary and keeps original session name
+        clients = [
+            LanedTelegramClient(
+                create_session(
+                    name='feed_bot' if bot_index == 0 else f'feed_bot_{bot_index}',
+                    scope=get_bot_session_scope(token=token),
+                    config=self.config.sessions_config),
                 api_id=config.api_id,
-                api_hash=config.api_hash).start(bot_token=config.token),
-            persistence_config=self.config.persistence_config)
+                api_hash=config.api_hash,
+                lanes=SendLanes(name=f"feed_bot bot {bot_index}", config=self.config.send_lanes_config))
+            for bot_index, token in enumerate(self.config.tokens)]
+
+        super(Bot, self).__init__(client=clients[0], persistence_config=self.config.persistence_config)
+
+        self.analytics = configure_analytics(
+            name="feed_bot", persistent_storage=self.persistent_storage, config=self.config.analytics_config)
+
+        self.pool = BotPool(clients=clients, tokens=self.config.tokens)
+
+        # per channel counters of every part of the bot
+        self.rollups = ChannelRollups(
+            persistent_storage=self.persistent_storage, flush_seconds=self.config.rollups_flush_seconds)
+
+        # prepare delivery stuff
+        self.delivery = DeliveryService(
+            persistent_storage=self.persistent_storage,
+            pool=self.pool,
+            rollups=self.rollups,
+            max_attempts=self.config.delivery_max_attempts,
+            retry_delay_seconds=self.config.delivery_retry_delay_seconds,
+            max_flood_wait_seconds=self.config.delivery_max_flood_wait_seconds,
+            flush_seconds=self.config.delivery_flush_seconds)
+
+        # this process is ingest only if there are delivery workers; it still sends digests & command replies
+        self.workers = None
+        self.consumer = None
+
+        if self.config.delivery_workers_count == 0:
+            self.consumer = OutboxConsumer(
+                persistent_storage=self.persistent_storage,
+                delivery=self.delivery,
+                partition_index=0,
+                partitions_count=1,
+                lanes_count=self.config.delivery_worker_lanes_count,
+                batch_size=self.config.outbox_batch_size,
+                lease_seconds=self.config.outbox_lease_seconds,
+                poll_seconds=self.config.outbox_poll_seconds,
+                deferred_release_per_second=self.config.outbox_deferred_release_per_second)
+            self.notifies_to_handlers["notify_delivery_outbox"] = self.consumer.on_outbox_update
+        else:
+            self.workers = DeliveryWorkersPool(configs=[
+                DeliveryWorkerConfig(
+                    api_id=self.config.api_id,
+                    api_hash=self.config.api_hash,
+                    tokens=self.config.tokens,
+                    worker_index=worker_index,
+                    workers_count=self.config.delivery_workers_count,
+                    lanes_count=self.config.delivery_worker_lanes_count,
+                    delivery_max_attempts=self.config.delivery_max_attempts,
+                    delivery_retry_delay_seconds=self.config.delivery_retry_delay_seconds,
+                    delivery_max_flood_wait_seconds=self.config.delivery_max_flood_wait_seconds,
+                    delivery_flush_seconds=self.config.delivery_flush_seconds,
+                    outbox_batch_size=self.config.outbox_batch_size,
+                    outbox_lease_seconds=self.config.outbox_lease_seconds,
+                    outbox_poll_seconds=self.config.outbox_poll_seconds,
+                    outbox_deferred_release_per_second=self.config.outbox_deferred_release_per_second,
+                    drain_timeout_seconds=self.config.drain_timeout_seconds,
+                    rollups_flush_seconds=self.config.rollups_flush_seconds,
+                    send_lanes_config=self.config.send_lanes_config,
+                    analytics_config=self.config.analytics_config,
+                    persistence_config=self.config.persistence_config,
+                    sessions_config=self.config.sessions_config)
+                for worker_index in range(self.config.delivery_workers_count)])
+
+        # prepare digest stuff
+        self.digest_settings = DigestSettings(persistent_storage=self.persistent_storage)
+        self.digest_scheduler = DigestScheduler(
+            persistent_storage=self.persistent_storage,
+            pool=self.pool,
+            delivery=self.delivery,
+            tick_seconds=self.config.digest_tick_seconds,
+            max_items_per_tick=self.config.digest_max_items_per_tick)
+
+        # shared by forwarders handlers of all pool bots
+        self.quiet_hours = QuietHours(persistent_storage=self.persistent_storage)
+
+        # resolvers are shared by all pool bots, so are their health & resolves in flight
+        self.resolver_dispatcher = ResolverDispatcher(
+            resolvers_count=len(self.config.resolver_usernames),
+            max_wait_count=self.config.resolve_max_wait_count,
+            timeout_seconds=self.config.resolve_timeout_seconds,
+            warning_wait_number=self.config.resolve_warning_wait_number,
+            failures_threshold=self.config.resolver_failures_threshold,
+            open_seconds=self.config.resolver_open_seconds)
 
-        # prepare resolver stuff
+        # subscribers of channels through bundles; shared by forwarders handlers of all pool bots
+        self.bundles = BundleIndex(persistent_storage=self.persistent_storage)
+
+        # shared by handlers of all pool bots
+        self.user_states = UserStateCache(
+            persistent_storage=self.persistent_storage,
+            max_size=self.config.user_state_cache_max_size,
+            ttl_seconds=self.config.user_state_cache_ttl_seconds)
+
+        # /list pages are shared by handlers of all pool bots
+        self.list_cache = TtlLruCache(
+            max_size=self.config.list_cache_max_size, ttl_seconds=self.config.list_cache_ttl_seconds)
+
+        # filled on setup
+        self.forwarders_handlers = list()
+        # created on setup along with forwarders handler of primary bot
+        self.handoff = None
+
+        # TODO: print hello message w request to type /start somehow
+        # TODO: do something on irrelevant msgs?
+        # dp.add_handler(MessageHandler(???))
+
+    async def add_event_handlers(self, client: TelegramClient):
+        # prepare resolver stuff; entities & replies are bound to the bot that talks to resolvers
+        # input entities are enough to talk to resolvers and are taken from session, which keeps them between runs
         get_logger().info(f"Resolving resolvers usernames={self.config.resolver_usernames}")
-        resolve_tasks = [
-            resolve_entity_try_cache(self.client, resolver_username)
-            for resolver_username in self.config.resolver_usernames]
-        resolver_entities = self.client.loop.run_until_complete(gather(*resolve_tasks))
+        resolver_entities = await gather(
+            *[client.get_input_entity(resolver_username) for resolver_username in self.config.resolver_usernames])
         resolver_replies = dict()
+        self.resolver_dispatcher.add_client(
+            client=client, resolver_entities=resolver_entities, resolver_replies=resolver_replies)
 
         # Add forwarders forwards handler
-        self.client.add_event_handler(
-            callback=ForwardersHandler(
+        forwarders_handler = ForwardersHandler(
+            persistent_storage=self.persistent_storage,
+            user_states=self.user_states,
+            forwarders_user_ids=self.config.forwarders_user_ids,
+            max_wait_count=self.config.forward_max_wait_count,
+            timeout_seconds=self.config.forward_timeout_seconds,
+            digest_settings=self.digest_settings,
+            quiet_hours=self.quiet_hours,
+            pool=self.pool,
+            rollups=self.rollups,
+            bundles=self.bundles,
+            duplicates_cache_max_size=self.config.duplicates_cache_max_size,
+            duplicates_cache_ttl_seconds=self.config.duplicates_cache_ttl_seconds)
+        self.forwarders_handlers.append(forwarders_handler)
+
+        # public channels posts handed off through db are fanned out by primary bot like ones in messages of forwarders
+        if client is self.pool.get_primary_client():
+            self.handoff = HandoffConsumer(
                 persistent_storage=self.persistent_storage,
-                forwarders_user_ids=self.config.forwarders_user_ids,
-                max_wait_count=self.config.forward_max_wait_count,
-                timeout_seconds=self.config.forward_timeout_seconds),
+                pool=self.pool,
+                forwarders_handler=forwarders_handler,
+                batch_size=self.config.handoff_batch_size,
+                lease_seconds=self.config.handoff_lease_seconds,
+                poll_seconds=self.config.handoff_poll_seconds)
+            self.notifies_to_handlers["notify_post_handoff"] = self.handoff.on_handoff_update
+
+        client.add_event_handler(
+            callback=forwarders_handler,
             event=events.NewMessage(from_users=self.config.forwarders_user_ids, incoming=True, outgoing=False))
 
         # Add resolver replies handler
-        self.client.add_event_handler(
+        client.add_event_handler(
             callback=ResolverRepliesHandler(resolver_replies=resolver_replies),
             event=events.NewMessage(from_users=resolver_entities, incoming=True, outgoing=False))
 
         # Add help handler
-        self.client.add_event_handler(
-            callback=HelpHandler(persistent_storage=self.persistent_storage),
+        client.add_event_handler(
+            callback=with_command_event(
+                command="help",
+                callback=HelpHandler(persistent_storage=self.persistent_storage, user_states=self.user_states)),
             event=events.NewMessage(pattern=r'^/help', forwards=False, incoming=True, outgoing=False))
 
         # Add list handler
-        self.client.add_event_handler(
-            callback=ListHandler(persistent_storage=self.persistent_storage),
+        client.add_event_handler(
+            callback=with_command_event(command="list", callback=ListHandler(
+                persistent_storage=self.persistent_storage,
+                user_states=self.user_states,
+                page_size=self.config.list_page_size,
+                cache=self.list_cache)),
             event=events.NewMessage(pattern=r'^/list', forwards=False, incoming=True, outgoing=False))
+        client.add_event_handler(
+            callback=with_command_event(command="list page", callback=ListPageHandler(
+                persistent_storage=self.persistent_storage,
+                user_states=self.user_states,
+                page_size=self.config.list_page_size,
+                cache=self.list_cache)),
+            event=events.CallbackQuery(pattern=g_list_callback_pattern))
+
+        # Add stats handler
+        client.add_event_handler(
+            callback=with_command_event(command="stats", callback=StatsHandler(
+                persistent_storage=self.persistent_storage, user_states=self.user_states, days=self.config.stats_days)),
+            event=events.NewMessage(pattern=r'^/stats', forwards=False, incoming=True, outgoing=False))
 
         # Add start handler
-        self.client.add_event_handler(
-            callback=StartHandler(persistent_storage=self.persistent_storage),
+        client.add_event_handler(
+            callback=with_command_event(command="start", callback=StartHandler(
+                persistent_storage=self.persistent_storage,
+                user_states=self.user_states,
+                pool=self.pool,
+                primary_bot_user_ids=self.config.primary_bot_user_ids)),
             event=events.NewMessage(pattern=r'^/start', forwards=False, incoming=True, outgoing=False))
-        self.client.add_event_handler(
-            callback=StopHandler(persistent_storage=self.persistent_storage),
+        client.add_event_handler(
+            callback=with_command_event(
+                command="stop",
+                callback=StopHandler(persistent_storage=self.persistent_storage, user_states=self.user_states)),
             event=events.NewMessage(pattern=r'^/stop', forwards=False, incoming=True, outgoing=False))
 
         # Add follow handlers
         # Multiple aliases are provided for follow command, but dont put all of these into interface to not confuse
-        self.client.add_event_handler(
-            callback=ForwardedMessageHandler(persistent_storage=self.persistent_storage),
+        client.add_event_handler(
+            callback=with_command_event(command="forwarded message", callback=ForwardedMessageHandler(
+                persistent_storage=self.persistent_storage, user_states=self.user_states)),
             event=events.NewMessage(forwards=True, incoming=True, outgoing=False))
-        self.client.add_event_handler(
-            callback=FollowHandler(
+        client.add_event_handler(
+            callback=with_command_event(command="follow", callback=FollowHandler(
                 persistent_storage=self.persistent_storage,
-                resolver_entities=resolver_entities,
-                resolver_replies=resolver_replies,
-                resolve_max_wait_count=self.config.resolve_max_wait_count,
-                resolve_timeout_seconds=self.config.resolve_timeout_seconds,
-                resolve_warning_wait_number=self.config.resolve_warning_wait_number),
+                user_states=self.user_states,
+                resolver_dispatcher=self.resolver_dispatcher)),
             event=events.NewMessage(pattern=r'^/(follow|add|enroll)', forwards=False, incoming=True, outgoing=False))
 
         # Un follow handlers
         # NOTE: must be added before follow, or follow is
-        self.client.add_event_handler(
-            callback=UnfollowHandler(
+        client.add_event_handler(
+            callback=with_command_event(command="unfollow", callback=UnfollowHandler(
                 persistent_storage=self.persistent_storage,
-                resolver_entities=resolver_entities,
-                resolver_replies=resolver_replies,
-                resolve_max_wait_count=self.config.resolve_max_wait_count,
-                resolve_timeout_seconds=self.config.resolve_timeout_seconds,
-                resolve_warning_wait_number=self.config.resolve_warning_wait_number),
+                user_states=self.user_states,
+                resolver_dispatcher=self.resolver_dispatcher,
+                rollups=self.rollups)),
             event=events.NewMessage(
                 pattern=r'^/(unfollow|del|drop|kick|remove)', forwards=False, incoming=True, outgoing=False))
 
-        # Admin commands
-        # Add announce command
-        self.client.add_event_handler(
-            callback=AllHandler(persistent_storage=self.persistent_storage, key=self.config.dev_key),
-            event=events.NewMessage(pattern=r'^/all', forwards=False, incoming=True, outgoing=False))
+        # Filter handlers
+        client.add_event_handler(
+            callback=with_command_event(
+                command="filter",
+                callback=FilterHandler(persistent_storage=self.persistent_storage, user_states=self.user_states)),
+            event=events.NewMessage(pattern=r'^/filter', forwards=False, incoming=True, outgoing=False))
+        client.add_event_handler(
+            callback=with_command_event(command="unfilter", callback=UnfilterHandler(
+                persistent_storage=self.persistent_storage, user_states=self.user_states)),
+            event=events.NewMessage(pattern=r'^/unfilter', forwards=False, incoming=True, outgoing=False))
 
-        # TODO: print hello message w request to type /start somehow
-        # TODO: do something on irrelevant msgs?
-        # dp.add_handler(MessageHandler(???))
+        # Bundle handlers
+        client.add_event_handler(
+            callback=with_command_event(
+                command="bundle",
+                callback=BundleHandler(persistent_storage=self.persistent_storage, user_states=self.user_states)),
+            event=events.NewMessage(pattern=r'^/bundle(\s|$)', forwards=False, incoming=True, outgoing=False))
+        client.add_event_handler(
+            callback=with_command_event(
+                command="unbundle",
+                callback=UnbundleHandler(persistent_storage=self.persistent_storage, user_states=self.user_states)),
+            event=events.NewMessage(pattern=r'^/unbundle', forwards=False, incoming=True, outgoing=False))
+
+        # bundle edit is admin command, but it resolves channels, which needs resolvers of this bot
+        if client is self.pool.get_primary_client():
+            client.add_event_handler(
+                callback=with_command_event(command="bundle_edit", callback=BundleEditHandler(
+                    persistent_storage=self.persistent_storage,
+                    user_states=self.user_states,
+                    key=self.config.dev_key,
+                    resolver_dispatcher=self.resolver_dispatcher)),
+                event=events.NewMessage(pattern=r'^/bundle_edit', forwards=False, incoming=True, outgoing=False))
+
+        # Add digest handler
+        client.add_event_handler(
+            callback=with_command_event(command="digest", callback=DigestHandler(
+                persistent_storage=self.persistent_storage,
+                user_states=self.user_states,
+                min_period_minutes=self.config.digest_min_period_minutes,
+                max_period_minutes=self.config.digest_max_period_minutes)),
+            event=events.NewMessage(pattern=r'^/digest', forwards=False, incoming=True, outgoing=False))
+
+        # Add quiet handler
+        client.add_event_handler(
+            callback=with_command_event(command="quiet", callback=QuietHandler(
+                persistent_storage=self.persistent_storage, user_states=self.user_states)),
+            event=events.NewMessage(pattern=r'^/quiet', forwards=False, incoming=True, outgoing=False))
@@ -0,0 +1,44 @@
+from common.logging import get_logger
+from common.persistent_storage.base import IPersistentStorage
+
+
+# Subscribers of channels through bundles. Bundle membership & bundle subscriptions are stored once per bundle, so they
+# are expanded into subscribers at fan-out time: channel -> bundles reverse index is loaded whole, subscribers are
+# loaded per bundle on first post of its channels. Both are invalidated by bundle notifies, so bundle edit costs one
+# reload of reverse index instead of rewriting subscriptions of every bundle subscriber
+class BundleIndex:
+    def __init__(self, persistent_storage: IPersistentStorage):
+        self.persistent_storage = persistent_storage
+        # channel chat id -> set of bundle ids; None until loaded
+        self.channel_bundles = None
+        # bundle id -> dict of user chat id -> bot index
+        self.bundle_subscribers = dict()
+
+    async def get_channel_subscribers(self, chat_id: int) -> dict:
+        if self.channel_bundles is None:
+            self.channel_bundles = await self.persistent_storage.get_channel_bundles()
+            get_logger().debug(f"Loaded bundles of {len(self.channel_bundles)} channels")
+
+        subscribers = dict()
+
+        for bundle_id in self.channel_bundles.get(chat_id, set()):
+            bundle_subscribers = self.bundle_subscribers.get(bundle_id)
+
+            if bundle_subscribers is None:
+                bundle_subscribers = await self.persistent_storage.get_bundle_subscribers(bundle_id=bundle_id)
+                get_logger().debug(f"Loaded {len(bundle_subscribers)} subscribers of bundle id={bundle_id}")
+                self.bundle_subscribers[bundle_id] = bundle_subscribers
+
+            subscribers.update(bundle_subscribers)
+
+        return subscribers
+
+    def invalidate_channels(self):
+        self.channel_bundles = None
+
+    def invalidate_subscribers(self, bundle_id: int):
+        self.bundle_subscribers.pop(bundle_id, None)
+
+    # user chat might have been enabled or disabled, which changes subscribers of every bundle it is subscribed to
+    def invalidate_all_subscribers(self):
+        self.bundle_subscribers.clear()
@@ -8,11 +8,105 @@ db_password = None
 db_host = "localhost"
 db_port = 5432
 
+# db pools; lookups of hot read path don't wait for connections behind slow writes. Statements running longer than
+# timeout are cancelled; 0 means no timeout
+db_read_pool_min_size = 1
+db_read_pool_max_size = 10
+db_read_pool_statement_timeout_ms = 10000
+db_write_pool_min_size = 1
+db_write_pool_max_size = 10
+db_write_pool_statement_timeout_ms = 30000
+# acquire waiting longer is warned about as pool saturation; pools stats are logged every db_pool_stats_seconds
+db_pool_acquire_warning_ms = 100
+db_pool_stats_seconds = 60.0
+db_pool_stats_window_size = 10000
+
+# telegram sessions; kept in db if persistence is postgres, so processes of the same account share entities & sessions
+# survive moving to another host. Existing sqlite session file is imported on first run. Changes are written every
+# sessions_flush_seconds
+sessions_in_storage = True
+sessions_flush_seconds = 5.0
+
 # resolver
 resolve_max_wait_count = 50
 resolve_timeout_seconds = 3.0
 resolve_warning_wait_number = 2
+# resolver failing that many resolves in a row is taken out of rotation for resolver_open_seconds
+resolver_failures_threshold = 3
+resolver_open_seconds = 300.0
+
+# users that are enrolled on primary bot instead of being redirected to the least loaded bot of the pool, e.g. canary
+# account, which follows and listens through primary bot
+primary_bot_user_ids = []
 
 # forwarder
 forward_max_wait_count = 500
 forward_timeout_seconds = 3.0
+
+# digest
+digest_tick_seconds = 10.0
+digest_max_items_per_tick = 5000
+digest_min_period_minutes = 5
+digest_max_period_minutes = 1440
+
+# delivery
+delivery_max_attempts = 3
+delivery_retry_delay_seconds = 5.0
+# longer flood waits don't hold sends of the bot, its deliveries are retried from outbox once it ends
+delivery_max_flood_wait_seconds = 300.0
+delivery_flush_seconds = 30.0
+# 0 to deliver in bot process itself; otherwise bot process is ingest only and sends are done by worker processes
+delivery_workers_count = 0
+# concurrent sends of worker or of bot process if there are no workers; posts to the same user chat are never sent
+# concurrently
+delivery_worker_lanes_count = 100
+
+# delivery outbox; items claimed by consumer that died are claimed again after lease
+outbox_batch_size = 500
+outbox_lease_seconds = 300.0
+outbox_poll_seconds = 1.0
+# items deferred by quiet hours are released at that rate at most once they are due, and only when there is room left
+# by the rest; rate is shared by all consumers
+outbox_deferred_release_per_second = 20.0
+# on SIGTERM items being sent are waited for that long, the rest is left in outbox
+drain_timeout_seconds = 20.0
+
+# post handoff; public channels posts are passed by forwarders through db. Posts claimed by bot that died are claimed
+# again after lease
+handoff_batch_size = 100
+handoff_lease_seconds = 60.0
+handoff_poll_seconds = 5.0
+
+# channel rollups
+rollups_flush_seconds = 60.0
+# same post is suppressed if it comes again within ttl
+duplicates_cache_max_size = 10000
+duplicates_cache_ttl_seconds = 3600.0
+stats_days = 7
+
+# list
+list_page_size = 20
+list_cache_ttl_seconds = 30.0
+list_cache_max_size = 1000
+
+# user state cache; notify keeps it in sync, ttl only guards against lost notifies
+user_state_cache_max_size = 100000
+user_state_cache_ttl_seconds = 3600.0
+
+# send lanes; requests of every bot client in flight are limited, command replies go first, then realtime deliveries,
+# then digests. Counts of slots reserved & SLOs are given in that order; lanes stats are logged every
+# send_lanes_stats_seconds
+send_lanes_max_in_flight = 50
+send_lanes_reserved_counts = [5, 20, 0]
+send_lanes_slo_seconds = [1.0, 10.0, 60.0]
+send_lanes_stats_seconds = 60.0
+send_lanes_stats_window_size = 10000
+
+# analytics; events are flushed to db every analytics_flush_ms or to rotating files in analytics_fallback_dir if db
+# doesn't take them within analytics_db_timeout_seconds
+analytics_buffer_size = 100000
+analytics_flush_ms = 1000
+analytics_db_timeout_seconds = 2.0
+analytics_fallback_dir = "."
+analytics_fallback_file_max_bytes = 10 * 1024 * 1024
+analytics_fallback_file_backups_count = 5
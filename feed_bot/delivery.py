@@ -0,0 +1,273 @@
+from asyncio import gather, sleep, TimeoutError
+from enum import Enum
+from time import monotonic
+from typing import Optional
+
+from telethon import TelegramClient, errors
+from telethon.tl.types import PeerChat, PeerChannel, InputChannel
+from telethon.utils import get_peer_id, resolve_id
+
+from common.analytics import EventType, record_event
+from common.logging import get_logger
+from common.persistent_storage.base import IPersistentStorage
+from common.telegram import ChatType
+from pool import BotPool
+from rollup import ChannelRollups, ChannelCounter
+
+
+class FailureReason(Enum):
+    PERMANENT = 0  # user blocked bot, deleted account or kicked bot out: never retry, disable user chat
+    FLOOD_WAIT = 1  # bot hit flood limit: retry after wait; all deliveries of the bot wait
+    TRANSIENT = 2  # network or server error: retry with backoff
+    MIGRATED = 3  # group was upgraded to supergroup: retry to new chat
+    UNKNOWN = 4  # log and drop
+
+
+g_permanent_errors = (
+    errors.UserIsBlockedError,
+    errors.InputUserDeactivatedError,
+    errors.UserBannedInChannelError,
+    errors.ChannelPrivateError)
+# these are permanent too, unless target is basic group that was upgraded to supergroup
+g_maybe_migrated_errors = (
+    errors.ChatIdInvalidError,
+    errors.PeerIdInvalidError,
+    errors.ChatWriteForbiddenError)
+g_transient_errors = (
+    errors.ServerError,
+    errors.RpcCallFailError,
+    ConnectionError,
+    TimeoutError)
+
+
+def is_basic_group_id(chat_id: int) -> bool:
+    _, peer_type = resolve_id(chat_id)
+
+    return peer_type is PeerChat
+
+
+def classify_failure(error: Exception, user_chat_id: int) -> FailureReason:
+    if isinstance(error, g_permanent_errors):
+        return FailureReason.PERMANENT
+    elif isinstance(error, g_maybe_migrated_errors):
+        return FailureReason.MIGRATED if is_basic_group_id(user_chat_id) else FailureReason.PERMANENT
+    elif isinstance(error, errors.FloodError):
+        return FailureReason.FLOOD_WAIT
+    elif isinstance(error, g_transient_errors):
+        return FailureReason.TRANSIENT
+
+    return FailureReason.UNKNOWN
+
+
+# returns id of supergroup the basic group was upgraded to or None if it was not
+async def get_migrated_chat_id(client: TelegramClient, user_chat_id: int) -> Optional[int]:
+    try:
+        chat = await client.get_entity(PeerChat(resolve_id(user_chat_id)[0]))
+    except Exception as e:
+        get_logger().warning(f"Failed to get chat={user_chat_id} to check its migration: {str(e)}")
+        return None
+
+    migrated_to = getattr(chat, "migrated_to", None)
+
+    if not isinstance(migrated_to, InputChannel):
+        return None
+
+    return get_peer_id(PeerChannel(migrated_to.channel_id))
+
+
+# Failed delivery to user chat that is to be retried after delay_seconds as attempt #attempt. Retries are kept by
+# caller, so they are not lost on restart
+class Retry:
+    def __init__(self, user_chat_id: int, delay_seconds: float, attempt: int):
+        self.user_chat_id = user_chat_id
+        self.delay_seconds = delay_seconds
+        self.attempt = attempt
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+
+# Sends posts to user chats through pool bots, classifies failures and acts on them: dead user chats are disabled in
+# batches, flood waits & transient errors are returned to be retried later, migrated groups are moved to their
+# supergroups and delivered to right away
+class DeliveryService:
+    def __init__(
+            self,
+            persistent_storage: IPersistentStorage,
+            pool: BotPool,
+            rollups: ChannelRollups,
+            max_attempts: int,
+            retry_delay_seconds: float,
+            max_flood_wait_seconds: float,
+            flush_seconds: float):
+        self.persistent_storage = persistent_storage
+        self.pool = pool
+        self.rollups = rollups
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+        self.max_flood_wait_seconds = max_flood_wait_seconds
+        self.flush_seconds = flush_seconds
+        # user chats to disable on next flush; nothing is sent to them meanwhile
+        self.dead_user_chat_ids = set()
+        # bot index -> monotonic time until which the bot is flood limited
+        self.bot_resume_times = dict()
+        self.sent_count = 0
+        self.failure_counters = {reason: 0 for reason in FailureReason}
+
+    async def run(self):
+        get_logger().info("Starting delivery service")
+
+        while True:
+            await sleep(self.flush_seconds)
+
+            try:
+                await self.flush_dead_user_chats()
+            except Exception as e:
+                get_logger().error(f"Failed to disable dead user chats: {str(e)}")
+
+            failure_counters = {reason.name: count for reason, count in self.failure_counters.items()}
+            get_logger().info(f"Delivery counters: sent={self.sent_count}; failures={failure_counters}")
+
+    async def flush_dead_user_chats(self):
+        if len(self.dead_user_chat_ids) == 0:
+            return
+
+        dead_user_chat_ids = list(self.dead_user_chat_ids)
+        disabled_count = await self.persistent_storage.disable_user_chats(chat_ids=dead_user_chat_ids)
+        get_logger().info(f"Disabled {disabled_count} out of {len(dead_user_chat_ids)} dead user chats: "
+                          f"{dead_user_chat_ids}")
+        self.dead_user_chat_ids.difference_update(dead_user_chat_ids)
+
+    def mark_dead(self, user_chat_id: int):
+        self.dead_user_chat_ids.add(user_chat_id)
+
+    # send_func(client, user_chat_id) must return awaitable of send; returns list of Retry of failed deliveries to be
+    # retried, the rest are done: sent, given up or dead. chat_id is channel whose post is delivered, it is None for
+    # messages of bot itself
+    async def deliver(
+            self,
+            bot_index: int,
+            user_chat_ids: list,
+            send_func,
+            chat_id: Optional[int] = None,
+            attempt: int = 1) -> list:
+        retries = list()
+        user_chat_ids = [user_chat_id for user_chat_id in user_chat_ids if user_chat_id not in self.dead_user_chat_ids]
+        resume_seconds = self.bot_resume_times.get(bot_index, 0) - monotonic()
+
+        # nothing is sent during long flood wait, which would only prolong it; the attempt is not used up either
+        if resume_seconds > self.max_flood_wait_seconds:
+            get_logger().debug(f"Bot index={bot_index} is flood limited for {resume_seconds}s; retry delivery later")
+
+            return [
+                Retry(user_chat_id=user_chat_id, delay_seconds=resume_seconds, attempt=attempt)
+                for user_chat_id in user_chat_ids]
+
+        if resume_seconds > 0:
+            get_logger().debug(f"Bot index={bot_index} is flood limited; wait {resume_seconds}s before delivery")
+            await sleep(resume_seconds)
+
+        client = self.pool.get_client(bot_index=bot_index)
+        send_start_time = monotonic()
+        results = await gather(
+            *[send_func(client, user_chat_id) for user_chat_id in user_chat_ids], return_exceptions=True)
+        send_seconds = monotonic() - send_start_time
+
+        for user_chat_id, result in zip(user_chat_ids, results):
+            if isinstance(result, Exception):
+                try:
+                    retry = await self.handle_failure(
+                        bot_index=bot_index,
+                        user_chat_id=user_chat_id,
+                        send_func=send_func,
+                        chat_id=chat_id,
+                        error=result,
+                        attempt=attempt)
+
+                    if retry is not None:
+                        retries.append(retry)
+                except Exception as e:
+                    get_logger().error(f"Failed to handle delivery failure to {user_chat_id}: {str(e)}")
+            else:
+                self.sent_count += 1
+                self.rollups.add(chat_id=chat_id, counter=ChannelCounter.DELIVERIES)
+                record_event(
+                    event_type=EventType.DELIVERY,
+                    user_chat_id=user_chat_id,
+                    latency_seconds=send_seconds,
+                    detail=f"bot {bot_index}, attempt {attempt}")
+
+        return retries
+
+    def get_retry(self, delay_seconds: float, user_chat_id: int, attempt: int) -> Optional[Retry]:
+        if attempt >= self.max_attempts:
+            get_logger().warning(f"Give up delivery to {user_chat_id} after {attempt} attempts")
+            return None
+
+        return Retry(user_chat_id=user_chat_id, delay_seconds=delay_seconds, attempt=attempt + 1)
+
+    # returns retry of failed delivery or None if it is not retried
+    async def handle_failure(
+            self,
+            bot_index: int,
+            user_chat_id: int,
+            send_func,
+            chat_id: Optional[int],
+            error: Exception,
+            attempt: int) -> Optional[Retry]:
+        reason = classify_failure(error=error, user_chat_id=user_chat_id)
+        migrated_chat_id = None
+
+        if reason == FailureReason.MIGRATED:
+            migrated_chat_id = await get_migrated_chat_id(
+                client=self.pool.get_client(bot_index=bot_index), user_chat_id=user_chat_id)
+
+            if migrated_chat_id is None:
+                reason = FailureReason.PERMANENT
+
+        self.failure_counters[reason] += 1
+        self.rollups.add(chat_id=chat_id, counter=ChannelCounter.FAILURES)
+        record_event(event_type=EventType.DELIVERY_FAILURE, user_chat_id=user_chat_id, detail=reason.name)
+        get_logger().debug(f"Delivery to {user_chat_id} failed, reason={reason.name} attempt #{attempt}: {str(error)}")
+
+        if reason == FailureReason.PERMANENT:
+            self.mark_dead(user_chat_id=user_chat_id)
+        elif reason == FailureReason.FLOOD_WAIT:
+            wait_seconds = getattr(error, "seconds", self.retry_delay_seconds)
+            self.bot_resume_times[bot_index] = max(self.bot_resume_times.get(bot_index, 0), monotonic() + wait_seconds)
+
+            if wait_seconds > self.max_flood_wait_seconds:
+                get_logger().warning(f"Bot index={bot_index} flood wait={wait_seconds}s is too long; retry delivery to "
+                                     f"{user_chat_id} and the rest of deliveries of the bot after it")
+
+                return Retry(user_chat_id=user_chat_id, delay_seconds=wait_seconds, attempt=attempt)
+
+            return self.get_retry(delay_seconds=wait_seconds, user_chat_id=user_chat_id, attempt=attempt)
+        elif reason == FailureReason.TRANSIENT:
+            return self.get_retry(
+                delay_seconds=self.retry_delay_seconds * 2 ** (attempt - 1), user_chat_id=user_chat_id, attempt=attempt)
+        elif reason == FailureReason.MIGRATED:
+            did_migrate = await self.persistent_storage.migrate_user_chat(
+                chat_id=user_chat_id, new_chat_id=migrated_chat_id, new_chat_type=ChatType.SUPER_GROUP)
+            get_logger().info(f"User chat={user_chat_id} was upgraded to {migrated_chat_id}; did_migrate={did_migrate}")
+
+            if did_migrate:
+                if attempt >= self.max_attempts:
+                    get_logger().warning(f"Give up delivery to {user_chat_id} after {attempt} attempts")
+                    return None
+
+                retries = await self.deliver(
+                    bot_index=bot_index,
+                    user_chat_ids=[migrated_chat_id],
+                    send_func=send_func,
+                    chat_id=chat_id,
+                    attempt=attempt + 1)
+
+                return retries[0] if len(retries) > 0 else None
+
+            # supergroup is a user chat on its own already, so old group is just dead
+            self.mark_dead(user_chat_id=user_chat_id)
+        else:
+            get_logger().warning(f"Delivery to {user_chat_id} failed for unknown reason: {str(error)}")
+
+        return None
@@ -0,0 +1,181 @@
+from asyncio import sleep
+from datetime import datetime, timezone
+from math import ceil
+
+from common.logging import get_logger
+from common.persistent_storage.base import IPersistentStorage
+from common.resources.localization import get_localized, Language, g_key_digest_header
+from pool import BotPool
+from delivery import DeliveryService, FailureReason, classify_failure
+from lanes import SendLane, send_lane
+
+
+# telegram message limit is 4096, keep some space for markdown
+g_digest_max_message_length = 4000
+# multiplicative hashing constant (knuth); spreads sequential chat ids over the period
+g_digest_phase_multiplier = 2654435761
+
+
+# returns next time digest of user chat is due; every user chat has its own phase inside the period, so digests of
+# different users are spread evenly over time instead of being sent all at the same moment
+def get_digest_due_time(user_chat_id: int, period_minutes: int, now: datetime) -> datetime:
+    period_seconds = period_minutes * 60
+    phase_seconds = (abs(user_chat_id) * g_digest_phase_multiplier) % period_seconds
+    now_seconds = now.timestamp()
+    due_seconds = ceil((now_seconds - phase_seconds) / period_seconds) * period_seconds + phase_seconds
+
+    return datetime.fromtimestamp(due_seconds, tz=timezone.utc)
+
+
+def get_post_link(joiner: str, message_id: int):
+    return f"https://t.me/{joiner}/{message_id}"
+
+
+# returns list of (message, item ids) with links grouped by channel; channel that doesn't fit into message is continued
+# in the next one under its title again
+def get_digest_messages(header: str, items: list) -> list:
+    chat_links = dict()
+
+    for item_id, chat_id, title, joiner, message_id in items:
+        chat_links.setdefault((chat_id, title), list()).append(
+            (item_id, get_post_link(joiner=joiner, message_id=message_id)))
+
+    messages = [[header, list()]]
+
+    for (chat_id, title), links in chat_links.items():
+        title_part = f"**{title}**"
+        is_title_added = False
+
+        for item_id, link in links:
+            part = f"\n{link}" if is_title_added else f"\n\n{title_part}\n{link}"
+
+            if len(messages[-1][0]) + len(part) > g_digest_max_message_length:
+                messages.append([f"{title_part}\n{link}", [item_id]])
+            else:
+                messages[-1][0] += part
+                messages[-1][1].append(item_id)
+
+            is_title_added = True
+
+    return messages
+
+
+class DigestSettings:
+    def __init__(self, persistent_storage: IPersistentStorage):
+        self.persistent_storage = persistent_storage
+        self.user_chat_periods = None
+        self.subscription_periods = None
+
+    def invalidate(self):
+        get_logger().info("Invalidating digest settings")
+        self.user_chat_periods = None
+        self.subscription_periods = None
+
+    # returns user_chat_id -> period for user chats that receive posts of the chat as digest
+    async def get_digest_periods(self, chat_id: int, user_chat_ids) -> dict:
+        if self.user_chat_periods is None or self.subscription_periods is None:
+            self.user_chat_periods, self.subscription_periods = await self.persistent_storage.get_digest_periods()
+            get_logger().debug(f"Loaded digest settings: user chats={self.user_chat_periods} "
+                               f"subscriptions={self.subscription_periods}")
+
+        digest_periods = dict()
+
+        for user_chat_id in user_chat_ids:
+            # subscription setting has priority over user chat setting; 0 means no digest
+            period = self.subscription_periods.get(
+                (user_chat_id, chat_id), self.user_chat_periods.get(user_chat_id, 0))
+
+            if period > 0:
+                digest_periods[user_chat_id] = period
+
+        return digest_periods
+
+
+class DigestScheduler:
+    def __init__(
+            self,
+            persistent_storage: IPersistentStorage,
+            pool: BotPool,
+            delivery: DeliveryService,
+            tick_seconds: float,
+            max_items_per_tick: int):
+        self.persistent_storage = persistent_storage
+        self.pool = pool
+        self.delivery = delivery
+        self.tick_seconds = tick_seconds
+        self.max_items_per_tick = max_items_per_tick
+
+    async def run(self):
+        get_logger().info("Starting digest scheduler")
+
+        while True:
+            await sleep(self.tick_seconds)
+
+            # digests may wait, command replies & realtime deliveries go first
+            try:
+                with send_lane(SendLane.BULK):
+                    await self.send_due_digests()
+            except Exception as e:
+                get_logger().error(f"Failed to send due digests: {str(e)}")
+
+    async def send_due_digests(self):
+        items = await self.persistent_storage.get_due_digest_items(limit=self.max_items_per_tick)
+
+        if len(items) == 0:
+            return
+
+        # group by user chat, preserving order of posts
+        user_chat_items = dict()
+        user_chat_languages_bot_indexes = dict()
+        disabled_item_ids = list()
+
+        for item_id, user_chat_id, user_chat_enabled, language, bot_index, chat_id, title, joiner, message_id in items:
+            if not user_chat_enabled:
+                disabled_item_ids.append(item_id)
+                continue
+
+            user_chat_languages_bot_indexes[user_chat_id] = language, bot_index
+            user_chat_items.setdefault(user_chat_id, list()).append((item_id, chat_id, title, joiner, message_id))
+
+        get_logger().info(f"Sending digests to {len(user_chat_items)} user chats, {len(items)} items due; "
+                          f"dropping {len(disabled_item_ids)} items of disabled user chats")
+        await self.persistent_storage.delete_digest_items(item_ids=disabled_item_ids)
+
+        # spread sends evenly over the tick instead of bursting them all at once
+        send_interval_seconds = self.tick_seconds / len(user_chat_items) if len(user_chat_items) > 0 else 0
+
+        for user_chat_id, user_items in user_chat_items.items():
+            language, bot_index = user_chat_languages_bot_indexes[user_chat_id]
+
+            try:
+                await self.send_digest(
+                    user_chat_id=user_chat_id, language=language, bot_index=bot_index, items=user_items)
+            except Exception as e:
+                # unsent items are kept, so they are going to be sent on next tick; or dropped once dead user chat is
+                # disabled
+                get_logger().error(f"Failed to send digest of {len(user_items)} items to {user_chat_id}: {str(e)}")
+
+                if classify_failure(error=e, user_chat_id=user_chat_id) == FailureReason.PERMANENT:
+                    self.delivery.mark_dead(user_chat_id=user_chat_id)
+
+            await sleep(send_interval_seconds)
+
+    # items of every message are deleted once it is sent, so failed digest is resumed from the first unsent message
+    async def send_digest(self, user_chat_id: int, language: Language, bot_index: int, items: list):
+        messages = get_digest_messages(header=get_localized(g_key_digest_header, language, [len(items)]), items=items)
+        client = self.pool.get_client(bot_index=bot_index)
+
+        for message, item_ids in messages:
+            try:
+                await client.send_message(entity=user_chat_id, message=message, parse_mode="md", link_preview=False)
+            except Exception as e:
+                # flood, network & dead user chat errors are up to caller; others like MessageTooLong would fail the
+                # same way on every tick, so items of the message are dropped
+                if classify_failure(error=e, user_chat_id=user_chat_id) != FailureReason.UNKNOWN:
+                    raise
+
+                get_logger().error(f"Dropping {len(item_ids)} digest items of {user_chat_id}: {str(e)}")
+
+            await self.persistent_storage.delete_digest_items(item_ids=item_ids)
+
+        get_logger().debug(f"Sent digest of {len(items)} items in {len(messages)} messages to {user_chat_id}")
@@ -4,13 +4,16 @@ from telethon.events import NewMessage, StopPropagation
 from telethon.tl.types import Message
 from .base import BaseFeedBotHandler
 from common.persistent_storage.base import IPersistentStorage
+from user_state import UserStateCache
 from common.logging import get_logger
+from pool import BotPool
 
 
 class AllHandler(BaseFeedBotHandler):
-    def __init__(self, persistent_storage: IPersistentStorage, key: str):
-        super(AllHandler, self).__init__(persistent_storage=persistent_storage)
+    def __init__(self, persistent_storage: IPersistentStorage, user_states: UserStateCache, key: str, pool: BotPool):
+        super(AllHandler, self).__init__(persistent_storage=persistent_storage, user_states=user_states)
         self.key_str = key
+        self.pool = pool
 
     # CallableHandlerWithStorage
     async def __call__(self, event: NewMessage.Event):
@@ -29,13 +32,14 @@ class AllHandler(BaseFeedBotHandler):
 
         # get users
         users = await self.persistent_storage.get_all_user_chats()
-        enabled_user_chat_ids = [chat_id for enabled, _, _, chat_id in users if enabled]
+        enabled_user_chat_ids = [(chat_id, bot_index) for enabled, _, _, chat_id, bot_index in users if enabled]
         get_logger().debug(msg=f"total users={len(users)}: {users}; "
                                f"enabled={len(enabled_user_chat_ids)}: {enabled_user_chat_ids}")
-        resolved_entities = await gather(
-            *[event.client.get_input_entity(chat_id) for chat_id in enabled_user_chat_ids], return_exceptions=True)
 
-        tasks = [event.client.send_message(entity, actual_message) for entity in resolved_entities]
+        # every user is messaged by the bot of the pool it is pinned to
+        tasks = [
+            self.pool.get_client(bot_index=bot_index).send_message(chat_id, actual_message)
+            for chat_id, bot_index in enabled_user_chat_ids]
         sent_messages = await gather(*tasks, return_exceptions=True)
         successful_messages_count = sum(1 for msg in sent_messages if isinstance(msg, Message))
         get_logger().debug(msg=f"successful messages={successful_messages_count} out of total={sent_messages}")
@@ -1,13 +1,14 @@
-from asyncio import gather, sleep
+from asyncio import gather, shield, wait_for, TimeoutError
+from typing import Optional
 from telethon.events import NewMessage, StopPropagation
 from telethon.tl.types import Channel
 from common.persistent_storage.base import IPersistentStorage
+from user_state import UserState, UserStateCache
+from resolver_dispatcher import ResolverDispatcher
 
-from common.utils import circular_generator
-from common.handler import CallableHandlerWithStorage, get_resolve_descriptor, resolve_entity_try_cache
+from common.handler import CallableHandlerWithStorage, resolve_entity_try_cache
 from common.logging import get_logger
 from common.telegram import contains_joinchat_link
-from common.protocol import g_resolver_request_command, g_resolver_separator
 from common.resources.localization import get_localized, Language, get_language_from_ietf_code
 from common.resources.localization import g_key_handlers_follow_unfollow_no_args, g_key_handlers_failed_to_resolve
 from common.resources.localization import g_key_handlers_not_enrolled, g_key_handlers_no_username
@@ -23,70 +24,34 @@ async def get_sender_and_language_from_event(event: NewMessage.Event) -> tuple:
 
 
 async def query_resolver(
-        resolver_entity,
-        resolver_replies: dict,
-        max_wait_count: int,
-        timeout_seconds: float,
-        warning_wait_number: int,
-        event: NewMessage.Event,
-        arg: str,
-        locale) -> tuple:
-    get_logger().info(msg=f"{arg} is joinchat link, assuming it's to private channel; query resolver")
-
-    # send resolve request to resolver
-    sent_message = await event.client.send_message(resolver_entity, f"{g_resolver_request_command} {arg}")
-    resolver_id = await event.client.get_peer_id(resolver_entity)
-    resolve_descriptor = get_resolve_descriptor(resolver_id=resolver_id, message_id=sent_message.id)
-
-    # await reply to that request; but don't wait forever: raise on timeout
-    waits = 1
-    while resolve_descriptor not in resolver_replies:
-        if max_wait_count < waits:
-            err_msg = f"Failed to wait for resolver' reply to {resolve_descriptor}: it was not received"
-            get_logger().warning(msg=err_msg)
-            await event.message.respond(get_localized(g_key_handlers_failed_to_resolve, locale, [arg]))
-            raise RuntimeError(f"Failed to resolve {arg}: {err_msg}")
+        resolver_dispatcher: ResolverDispatcher, event: NewMessage.Event, arg: str, locale) -> tuple:
+    resolve = resolver_dispatcher.resolve_link(client=event.client, link=arg)
 
-        if waits == warning_wait_number:
+    # resolve might be shared with other users, so each of them is told about slow or failed resolve on its own
+    try:
+        try:
+            return await wait_for(shield(resolve), timeout=resolver_dispatcher.warning_seconds)
+        except TimeoutError:
             await event.message.respond(get_localized(g_key_handlers_resolve_might_take_time, locale, [arg]))
 
-        get_logger().debug(f"waiting for resolver' reply to {resolve_descriptor}, wait#{waits} for {timeout_seconds}s")
-        await sleep(timeout_seconds)
-        waits += 1
-
-    reply_text = resolver_replies.pop(resolve_descriptor)
-    get_logger().debug(f"reply to={resolve_descriptor} was received={reply_text}")
-
-    # parse reply
-    return tuple(reply_text.split(g_resolver_separator))
+        return await shield(resolve)
+    except Exception as e:
+        get_logger().warning(msg=f"Failed to resolve arg={arg}: {str(e)}")
+        await event.message.respond(get_localized(g_key_handlers_failed_to_resolve, locale, [arg]))
+        raise RuntimeError(f"Failed to resolve {arg}: {str(e)}")
 
 
 async def get_resolved_arg(
-        resolver_entity,
-        resolver_replies: dict,
-        max_wait_count: int,
-        timeout_seconds: float,
-        warning_wait_number: int,
-        event: NewMessage.Event,
-        arg: str,
-        locale) -> tuple:
+        resolver_dispatcher: ResolverDispatcher, event: NewMessage.Event, arg: str, locale) -> tuple:
     if contains_joinchat_link(arg=arg):
-        return await query_resolver(
-            resolver_entity=resolver_entity,
-            resolver_replies=resolver_replies,
-            max_wait_count=max_wait_count,
-            timeout_seconds=timeout_seconds,
-            warning_wait_number=warning_wait_number,
-            event=event,
-            arg=arg,
-            locale=locale)
+        return await query_resolver(resolver_dispatcher=resolver_dispatcher, event=event, arg=arg, locale=locale)
     else:
         entity = None
 
         # get channel from arg; getting full entities for username
         # query input entities first to maximize use of cache
         try:
-            entity = await resolve_entity_try_cache(event.client, arg)
+            entity = await shield(resolver_dispatcher.resolve_username(client=event.client, username=arg))
         except Exception as e:
             get_logger().warning(msg=f"Failed to resolve arg={arg}: {str(e)}")
             await event.message.respond(get_localized(g_key_handlers_failed_to_resolve, locale, [arg]))
@@ -107,16 +72,49 @@ async def get_resolved_arg(
         return chat_id, entity.title, entity.username
 
 
+# arg is either chat id (as shown by /list) or channel username/link; returns None if it can't be resolved
+async def get_chat_id_from_arg(event: NewMessage.Event, arg: str) -> Optional[int]:
+    try:
+        # it works because username can't be a number
+        return int(arg)
+    except ValueError:
+        pass
+
+    try:
+        entity = await resolve_entity_try_cache(event.client, arg)
+    except Exception as e:
+        get_logger().warning(msg=f"Failed to resolve arg={arg}: {str(e)}")
+        return None
+
+    if not isinstance(entity, Channel):
+        get_logger().warning(msg=f"Failed to resolve arg={arg}: not a channel")
+        return None
+
+    return await event.client.get_peer_id(entity)
+
+
 class BaseFeedBotHandler(CallableHandlerWithStorage):
-    def __init__(self, persistent_storage: IPersistentStorage):
+    def __init__(self, persistent_storage: IPersistentStorage, user_states: UserStateCache):
         super(BaseFeedBotHandler, self).__init__(persistent_storage=persistent_storage)
 
+        if user_states is None:
+            raise RuntimeError("User states must be passed")
+
+        self.user_states = user_states
+
     async def assert_enrolled(self, event: NewMessage.Event) -> Language:
         user_chat_id = event.chat_id
-        is_enrolled, locale = await self.persistent_storage.get_user_enrolled_and_locale(user_chat_id=user_chat_id)
+        user_state = await self.user_states.get(user_chat_id=user_chat_id)
+        locale = user_state.language
+
+        if not user_state.is_enrolled:
+            # language of chat that never existed is taken from sender once and kept until chat is started
+            if locale is None:
+                _, locale = await get_sender_and_language_from_event(event=event)
+                self.user_states.put(
+                    user_chat_id=user_chat_id,
+                    state=UserState(is_enrolled=False, language=locale, chat_type=user_state.chat_type))
 
-        if not is_enrolled:
-            _, locale = await get_sender_and_language_from_event(event=event)
             get_logger().debug(msg=f"Chat id={user_chat_id} is not enrolled so ignore command")
             await event.message.respond(get_localized(g_key_handlers_not_enrolled, locale))
             raise StopPropagation
@@ -124,14 +122,7 @@ class BaseFeedBotHandler(CallableHandlerWithStorage):
         return locale
 
     async def get_resolved_chat_ids_title_joiner_from_event(
-            self,
-            resolver_entity_generator,
-            resolver_replies: dict,
-            max_wait_count: int,
-            timeout_seconds: float,
-            warning_wait_number: int,
-            event: NewMessage.Event,
-            is_follow: bool):
+            self, resolver_dispatcher: ResolverDispatcher, event: NewMessage.Event, is_follow: bool):
         chat_id = event.chat_id
         try_digit_args = not is_follow
         handler_name = "follow" if is_follow else "unfollow"
@@ -166,15 +157,8 @@ class BaseFeedBotHandler(CallableHandlerWithStorage):
 
         # return exceptions so on failure to resolve other resolves don't fail
         resolve_tasks = [
-            get_resolved_arg(
-                resolver_entity=next(resolver_entity_generator),
-                resolver_replies=resolver_replies,
-                max_wait_count=max_wait_count,
-                timeout_seconds=timeout_seconds,
-                warning_wait_number=warning_wait_number,
-                event=event,
-                arg=arg,
-                locale=locale) for arg in resolvable_args]
+            get_resolved_arg(resolver_dispatcher=resolver_dispatcher, event=event, arg=arg, locale=locale)
+            for arg in resolvable_args]
         chat_id_title_joiner_tuples = await gather(*resolve_tasks, return_exceptions=True)
 
         # filter exceptions
@@ -195,14 +179,12 @@ class BaseFeedBotHandlerWithResolve(BaseFeedBotHandler):
     def __init__(
             self,
             persistent_storage: IPersistentStorage,
-            resolver_entities: list,
-            resolver_replies: dict,
-            resolve_max_wait_count: int,
-            resolve_timeout_seconds: float,
-            resolve_warning_wait_number: int):
-        super(BaseFeedBotHandlerWithResolve, self).__init__(persistent_storage=persistent_storage)
-        self.circular_resolver_generator = circular_generator(resolver_entities)
-        self.resolver_replies = resolver_replies
-        self.resolve_max_wait_count = resolve_max_wait_count
-        self.resolve_timeout_seconds = resolve_timeout_seconds
-        self.resolve_warning_wait_number = resolve_warning_wait_number
+            user_states: UserStateCache,
+            resolver_dispatcher: ResolverDispatcher):
+        super(BaseFeedBotHandlerWithResolve, self).__init__(
+            persistent_storage=persistent_storage, user_states=user_states)
+
+        if resolver_dispatcher is None:
+            raise RuntimeError("Resolver dispatcher must be passed")
+
+        self.resolver_dispatcher = resolver_dispatcher
@@ -0,0 +1,171 @@
+from asyncio import gather
+
+from telethon.events import NewMessage, StopPropagation
+from .base import BaseFeedBotHandler, BaseFeedBotHandlerWithResolve, get_resolved_arg, get_chat_id_from_arg
+from common.persistent_storage.base import IPersistentStorage
+from user_state import UserStateCache
+from resolver_dispatcher import ResolverDispatcher
+from common.logging import get_logger
+from common.resources.localization import Language, get_localized
+from common.resources.localization import g_key_handlers_bundle_no_bundles, g_key_handlers_bundle_list
+from common.resources.localization import g_key_handlers_bundle_not_found, g_key_handlers_bundle_already_enabled
+from common.resources.localization import g_key_handlers_bundle_did_enable, g_key_handlers_unbundle_no_args
+from common.resources.localization import g_key_handlers_unbundle_not_subscribed
+from common.resources.localization import g_key_handlers_unbundle_did_disable
+
+
+g_bundle_edit_add = "add"
+g_bundle_edit_del = "del"
+
+
+def get_args(event: NewMessage.Event) -> list:
+    # first argument is command
+    return [arg for arg in event.message.message.split(' ')[1:] if len(arg) > 0]
+
+
+# Without args shows bundles; with args subscribes chat to bundles with these names
+class BundleHandler(BaseFeedBotHandler):
+    def __init__(self, persistent_storage: IPersistentStorage, user_states: UserStateCache):
+        super(BundleHandler, self).__init__(persistent_storage=persistent_storage, user_states=user_states)
+
+    # CallableHandlerWithStorage
+    async def __call__(self, event: NewMessage.Event):
+        names = get_args(event=event)
+        get_logger().info(msg=f"bundle handler called; chat_id={event.chat_id} names={names}")
+        # assert user is enrolled
+        locale = await self.assert_enrolled(event=event)
+
+        if len(names) < 1:
+            await self.list(event=event, language=locale)
+        else:
+            await gather(*[self.subscribe(event=event, name=name, language=locale) for name in names])
+
+        raise StopPropagation
+
+    # Internal
+    async def list(self, event: NewMessage.Event, language: Language):
+        bundles, user_chat_bundles = await gather(
+            self.persistent_storage.get_bundles(),
+            self.persistent_storage.get_user_chat_bundles(user_chat_id=event.chat_id))
+        get_logger().debug(msg=f"bundle handler: bundles={bundles} subscribed={user_chat_bundles}")
+
+        if len(bundles) < 1:
+            await event.message.respond(get_localized(g_key_handlers_bundle_no_bundles, language))
+            return
+
+        message = str()
+
+        for name, channels_count in bundles:
+            message += f"\n> {name} ({channels_count})"
+
+        await event.message.respond(
+            get_localized(g_key_handlers_bundle_list, language, [message, ", ".join(user_chat_bundles) or "-"]),
+            parse_mode="md")
+
+    async def subscribe(self, event: NewMessage.Event, name: str, language: Language):
+        bundle_exists, enabled_before = await self.persistent_storage.add_or_enable_bundle_subscription(
+            user_chat_id=event.chat_id, bundle_name=name)
+        get_logger().debug(f"user chat id={event.chat_id} subscribing to bundle={name}: "
+                           f"bundle_exists={bundle_exists} enabled_before={enabled_before}")
+
+        if not bundle_exists:
+            await event.message.respond(get_localized(g_key_handlers_bundle_not_found, language, [name]))
+        elif enabled_before:
+            await event.message.respond(get_localized(g_key_handlers_bundle_already_enabled, language, [name]))
+        else:
+            await event.message.respond(get_localized(g_key_handlers_bundle_did_enable, language, [name]))
+
+
+class UnbundleHandler(BaseFeedBotHandler):
+    def __init__(self, persistent_storage: IPersistentStorage, user_states: UserStateCache):
+        super(UnbundleHandler, self).__init__(persistent_storage=persistent_storage, user_states=user_states)
+
+    # CallableHandlerWithStorage
+    async def __call__(self, event: NewMessage.Event):
+        names = get_args(event=event)
+        get_logger().info(msg=f"unbundle handler called; chat_id={event.chat_id} names={names}")
+        # assert user is enrolled
+        locale = await self.assert_enrolled(event=event)
+
+        if len(names) < 1:
+            await event.message.respond(get_localized(g_key_handlers_unbundle_no_args, locale))
+            raise StopPropagation
+
+        await gather(*[self.unsubscribe(event=event, name=name, language=locale) for name in names])
+
+        raise StopPropagation
+
+    # Internal
+    async def unsubscribe(self, event: NewMessage.Event, name: str, language: Language):
+        enabled_before = await self.persistent_storage.disable_bundle_subscription(
+            user_chat_id=event.chat_id, bundle_name=name)
+        get_logger().debug(f"user chat id={event.chat_id} unsubscribing from bundle={name}: "
+                           f"enabled_before={enabled_before}")
+
+        if enabled_before:
+            await event.message.respond(get_localized(g_key_handlers_unbundle_did_disable, language, [name]))
+        else:
+            await event.message.respond(get_localized(g_key_handlers_unbundle_not_subscribed, language, [name]))
+
+
+# Admin command: /bundle_edit key name add|del channels. Bundle is created on first added channel
+class BundleEditHandler(BaseFeedBotHandlerWithResolve):
+    def __init__(
+            self,
+            persistent_storage: IPersistentStorage,
+            user_states: UserStateCache,
+            key: str,
+            resolver_dispatcher: ResolverDispatcher):
+        super(BundleEditHandler, self).__init__(
+            persistent_storage=persistent_storage,
+            user_states=user_states,
+            resolver_dispatcher=resolver_dispatcher)
+        self.key_str = key
+
+    # CallableHandlerWithStorage
+    async def __call__(self, event: NewMessage.Event):
+        get_logger().info(msg=f"bundle edit handler called; chat_id={event.chat_id}")
+        args = get_args(event=event)
+
+        # first argument is command, second must be key
+        if len(args) < 1 or args[0] != self.key_str:
+            get_logger().warning(msg=f"unauthorized call of bundle edit handler!!! chat_id={event.chat_id} "
+                                     f"msg={event.message.message}")
+            raise StopPropagation
+
+        if len(args) < 4 or args[2] not in (g_bundle_edit_add, g_bundle_edit_del):
+            await event.message.respond(
+                f"Usage: /bundle_edit key name {g_bundle_edit_add}|{g_bundle_edit_del} channels")
+            raise StopPropagation
+
+        name, action, channel_args = args[1], args[2], args[3:]
+        edit_func = self.add if action == g_bundle_edit_add else self.delete
+        results = await gather(*[edit_func(event=event, name=name, arg=arg) for arg in channel_args])
+        await event.message.respond(f"Bundle {name}:\n" + "\n".join(results))
+
+        raise StopPropagation
+
+    # Internal
+    async def add(self, event: NewMessage.Event, name: str, arg: str) -> str:
+        try:
+            chat_id, title, joiner = await get_resolved_arg(
+                resolver_dispatcher=self.resolver_dispatcher, event=event, arg=arg, locale=Language.ENGLISH)
+        except Exception as e:
+            return f"{arg}: failed to resolve: {str(e)}"
+
+        existed_before = await self.persistent_storage.add_or_enable_bundle_channel(
+            bundle_name=name, target_chat_id=int(chat_id), target_title=title, target_joiner=joiner)
+        get_logger().info(f"added chat id={chat_id} to bundle={name}; existed_before={existed_before}")
+
+        return f"{arg}: {'already in bundle' if existed_before else 'added'}"
+
+    async def delete(self, event: NewMessage.Event, name: str, arg: str) -> str:
+        chat_id = await get_chat_id_from_arg(event=event, arg=arg)
+
+        if chat_id is None:
+            return f"{arg}: failed to resolve"
+
+        was_in_bundle = await self.persistent_storage.disable_bundle_channel(bundle_name=name, target_chat_id=chat_id)
+        get_logger().info(f"removed chat id={chat_id} from bundle={name}; was_in_bundle={was_in_bundle}")
+
+        return f"{arg}: {'removed' if was_in_bundle else 'not in bundle'}"
@@ -0,0 +1,97 @@
+from telethon.events import NewMessage, StopPropagation
+from .base import BaseFeedBotHandler, get_chat_id_from_arg
+from common.persistent_storage.base import IPersistentStorage
+from user_state import UserStateCache
+from common.logging import get_logger
+from common.resources.localization import get_localized, g_key_handlers_failed_to_resolve
+from common.resources.localization import g_key_handlers_digest_usage, g_key_handlers_digest_not_followed
+from common.resources.localization import g_key_handlers_digest_did_enable, g_key_handlers_digest_did_disable
+from common.resources.localization import g_key_handlers_digest_did_inherit, g_key_handlers_filter_scope_all
+
+
+g_digest_off_arg = "off"
+# resets channel digest period, so channel follows the period set for all channels
+g_digest_default_arg = "default"
+
+
+class DigestHandler(BaseFeedBotHandler):
+    def __init__(
+            self,
+            persistent_storage: IPersistentStorage,
+            user_states: UserStateCache,
+            min_period_minutes: int,
+            max_period_minutes: int):
+        super(DigestHandler, self).__init__(persistent_storage=persistent_storage, user_states=user_states)
+        self.min_period_minutes = min_period_minutes
+        self.max_period_minutes = max_period_minutes
+
+    # CallableHandlerWithStorage
+    async def __call__(self, event: NewMessage.Event):
+        get_logger().info(msg=f"digest handler called; chat_id={event.chat_id}")
+        # assert user is enrolled
+        locale = await self.assert_enrolled(event=event)
+
+        # first argument is command; optional channel goes before period
+        split_args = event.message.message.split()[1:]
+        usage = get_localized(g_key_handlers_digest_usage, locale, [self.min_period_minutes, self.max_period_minutes])
+
+        if len(split_args) < 1 or len(split_args) > 2:
+            get_logger().debug(msg=f"Invalid args for digest command: {split_args}")
+            await event.message.respond(usage)
+            raise StopPropagation
+
+        period_arg = split_args[-1].lower()
+        period_minutes = None
+
+        if period_arg == g_digest_default_arg:
+            if len(split_args) < 2:
+                get_logger().debug(msg=f"Channel is missing for digest default: {split_args}")
+                await event.message.respond(usage)
+                raise StopPropagation
+        elif period_arg != g_digest_off_arg:
+            try:
+                period_minutes = int(period_arg)
+            except ValueError:
+                period_minutes = -1
+
+            if not self.min_period_minutes <= period_minutes <= self.max_period_minutes:
+                get_logger().debug(msg=f"Invalid period for digest command: {period_arg}")
+                await event.message.respond(usage)
+                raise StopPropagation
+
+        if len(split_args) == 1:
+            scope_name = get_localized(g_key_handlers_filter_scope_all, locale)
+            found = await self.persistent_storage.set_user_chat_digest_period(
+                user_chat_id=event.chat_id, period_minutes=period_minutes)
+        else:
+            scope_name = split_args[0]
+            target_chat_id = await get_chat_id_from_arg(event=event, arg=scope_name)
+
+            if target_chat_id is None:
+                await event.message.respond(get_localized(g_key_handlers_failed_to_resolve, locale, [scope_name]))
+                raise StopPropagation
+
+            # for subscription off means no digest even if it's on for the user chat, while default (null) means
+            # period of the user chat
+            if period_arg == g_digest_default_arg:
+                subscription_period_minutes = None
+            else:
+                subscription_period_minutes = period_minutes if period_minutes is not None else 0
+
+            found = await self.persistent_storage.set_subscription_digest_period(
+                user_chat_id=event.chat_id, target_chat_id=target_chat_id, period_minutes=subscription_period_minutes)
+
+        get_logger().debug(f"user chat id={event.chat_id} set digest period={period_minutes} for {scope_name}: "
+                           f"found={found}")
+
+        if not found:
+            await event.message.respond(get_localized(g_key_handlers_digest_not_followed, locale, [scope_name]))
+        elif period_arg == g_digest_default_arg:
+            await event.message.respond(get_localized(g_key_handlers_digest_did_inherit, locale, [scope_name]))
+        elif period_minutes is None:
+            await event.message.respond(get_localized(g_key_handlers_digest_did_disable, locale, [scope_name]))
+        else:
+            await event.message.respond(
+                get_localized(g_key_handlers_digest_did_enable, locale, [period_minutes, scope_name]))
+
+        raise StopPropagation
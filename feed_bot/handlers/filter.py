@@ -0,0 +1,94 @@
+from telethon.events import NewMessage, StopPropagation
+from .base import BaseFeedBotHandler, get_chat_id_from_arg
+from common.filter import get_filter_type_from_string, normalize_filter_pattern
+from common.persistent_storage.base import IPersistentStorage
+from user_state import UserStateCache
+from common.telegram import get_monitored_chat_name
+from common.logging import get_logger
+from common.resources.localization import get_localized, Language, g_key_handlers_failed_to_resolve
+from common.resources.localization import g_key_handlers_filter_usage, g_key_handlers_filter_invalid_pattern
+from common.resources.localization import g_key_handlers_filter_not_followed, g_key_handlers_filter_already_enabled
+from common.resources.localization import g_key_handlers_filter_did_enable, g_key_handlers_filter_scope_all
+from common.resources.localization import g_key_handlers_filter_list
+
+
+class FilterHandler(BaseFeedBotHandler):
+    def __init__(self, persistent_storage: IPersistentStorage, user_states: UserStateCache):
+        super(FilterHandler, self).__init__(persistent_storage=persistent_storage, user_states=user_states)
+
+    # CallableHandlerWithStorage
+    async def __call__(self, event: NewMessage.Event):
+        get_logger().info(msg=f"filter handler called; chat_id={event.chat_id}")
+        # assert user is enrolled
+        locale = await self.assert_enrolled(event=event)
+
+        # first argument is command; pattern is the rest of message as is, because regex might contain whitespaces
+        split_args = event.message.message.split(maxsplit=2)[1:]
+
+        if len(split_args) == 0:
+            await self.respond_with_filters(event=event, language=locale)
+            raise StopPropagation
+
+        target_chat_id = None
+        scope_name = get_localized(g_key_handlers_filter_scope_all, locale)
+
+        # optional first arg is channel to apply filter to
+        if get_filter_type_from_string(split_args[0]) is None:
+            scope_name = split_args[0]
+            target_chat_id = await get_chat_id_from_arg(event=event, arg=scope_name)
+
+            if target_chat_id is None:
+                await event.message.respond(get_localized(g_key_handlers_failed_to_resolve, locale, [scope_name]))
+                raise StopPropagation
+
+            split_args = split_args[1].split(maxsplit=1) if len(split_args) > 1 else []
+
+        if len(split_args) != 2 or get_filter_type_from_string(split_args[0]) is None:
+            get_logger().debug(msg=f"Invalid args for filter command: {split_args}")
+            await event.message.respond(get_localized(g_key_handlers_filter_usage, locale))
+            raise StopPropagation
+
+        filter_type = get_filter_type_from_string(split_args[0])
+
+        try:
+            pattern = normalize_filter_pattern(filter_type=filter_type, pattern=split_args[1])
+        except RuntimeError as e:
+            get_logger().debug(msg=f"Invalid filter pattern={split_args[1]}: {str(e)}")
+            await event.message.respond(
+                get_localized(g_key_handlers_filter_invalid_pattern, locale, [split_args[1], str(e)]))
+            raise StopPropagation
+
+        is_target_followed, existed_before, enabled_before = await self.persistent_storage.add_or_enable_filter(
+            user_chat_id=event.chat_id, target_chat_id=target_chat_id, filter_type=filter_type, pattern=pattern)
+        get_logger().debug(f"filter {filter_type.name}={pattern} for user_chat_id={event.chat_id} "
+                           f"target_chat_id={target_chat_id} is_target_followed={is_target_followed} "
+                           f"existed_before={existed_before}, enabled_before={enabled_before}")
+        args = [filter_type.name.lower(), pattern, scope_name]
+
+        if not is_target_followed:
+            await event.message.respond(get_localized(g_key_handlers_filter_not_followed, locale, [scope_name]))
+        elif enabled_before:
+            await event.message.respond(get_localized(g_key_handlers_filter_already_enabled, locale, args))
+        else:
+            await event.message.respond(get_localized(g_key_handlers_filter_did_enable, locale, args))
+
+        raise StopPropagation
+
+    # Internal
+    async def respond_with_filters(self, event: NewMessage.Event, language: Language):
+        filters = await self.persistent_storage.get_user_chat_enabled_filters(user_chat_id=event.chat_id)
+        get_logger().debug(msg=f"filter handler: there are {len(filters)} filters: {filters}")
+
+        if len(filters) == 0:
+            await event.message.respond(get_localized(g_key_handlers_filter_usage, language))
+            return
+
+        message = str()
+
+        for filter_id, filter_type, pattern, target_chat_id, target_title in filters:
+            scope_name = get_localized(g_key_handlers_filter_scope_all, language) if target_chat_id is None \
+                else get_monitored_chat_name(title=target_title, chat_id=target_chat_id)
+            message += f"\n> {filter_id}: {filter_type.name.lower()} \"{pattern}\" ({scope_name})"
+
+        await event.message.respond(
+            get_localized(g_key_handlers_filter_list, language, [len(filters), message]), parse_mode="md")
@@ -1,7 +1,10 @@
 from telethon.events import NewMessage, StopPropagation
 from .base import BaseFeedBotHandlerWithResolve
 from common.persistent_storage.base import IPersistentStorage
+from user_state import UserStateCache
+from resolver_dispatcher import ResolverDispatcher
 from common.logging import get_logger
+from common.analytics import EventType, record_event
 from common.resources.localization import get_localized, g_key_handlers_follow_already_enabled
 from common.resources.localization import Language, g_key_handlers_follow_did_enable
 
@@ -29,6 +32,7 @@ async def follow(
         await event.message.respond(
             get_localized(g_key_handlers_follow_already_enabled, language, [target_joiner]))
     else:
+        record_event(event_type=EventType.FOLLOW, user_chat_id=user_chat_id, chat_id=target_chat_id)
         # no need to handle separately existed before and not existed before
         await event.message.respond(get_localized(g_key_handlers_follow_did_enable, language, [target_joiner]))
 
@@ -37,27 +41,17 @@ class FollowHandler(BaseFeedBotHandlerWithResolve):
     def __init__(
             self,
             persistent_storage: IPersistentStorage,
-            resolver_entities: list,
-            resolver_replies: dict,
-            resolve_max_wait_count: int,
-            resolve_timeout_seconds: float,
-            resolve_warning_wait_number: int):
+            user_states: UserStateCache,
+            resolver_dispatcher: ResolverDispatcher):
         super(FollowHandler, self).__init__(
             persistent_storage=persistent_storage,
-            resolver_entities=resolver_entities,
-            resolver_replies=resolver_replies,
-            resolve_max_wait_count=resolve_max_wait_count,
-            resolve_timeout_seconds=resolve_timeout_seconds,
-            resolve_warning_wait_number=resolve_warning_wait_number)
+            user_states=user_states,
+            resolver_dispatcher=resolver_dispatcher)
 
     # CallableHandlerWithStorage
     async def __call__(self, event: NewMessage.Event):
         resolved_dict, _, locale = await self.get_resolved_chat_ids_title_joiner_from_event(
-            resolver_entity_generator=self.circular_resolver_generator,
-            resolver_replies=self.resolver_replies,
-            max_wait_count=self.resolve_max_wait_count,
-            timeout_seconds=self.resolve_timeout_seconds,
-            warning_wait_number=self.resolve_warning_wait_number,
+            resolver_dispatcher=self.resolver_dispatcher,
             event=event,
             is_follow=True)
 
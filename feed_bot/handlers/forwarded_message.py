@@ -2,6 +2,7 @@ from asyncio import gather
 from telethon.events import NewMessage, StopPropagation
 from telethon.tl.types import Channel
 from common.persistent_storage.base import IPersistentStorage
+from user_state import UserStateCache
 from .base import BaseFeedBotHandler
 from .follow import follow
 from common.logging import get_logger
@@ -10,8 +11,8 @@ from common.resources.localization import g_key_handlers_forwarded_message_not_p
 
 
 class ForwardedMessageHandler(BaseFeedBotHandler):
-    def __init__(self, persistent_storage: IPersistentStorage):
-        super(ForwardedMessageHandler, self).__init__(persistent_storage=persistent_storage)
+    def __init__(self, persistent_storage: IPersistentStorage, user_states: UserStateCache):
+        super(ForwardedMessageHandler, self).__init__(persistent_storage=persistent_storage, user_states=user_states)
 
     # FollowHandler
     async def __call__(self, event: NewMessage.Event):
@@ -1,26 +1,61 @@
 from asyncio import gather, sleep
+from datetime import datetime, timezone
+from typing import Optional
 
+from telethon import TelegramClient
 from telethon.events import NewMessage, StopPropagation
 
 from .base import BaseFeedBotHandler
 from common.persistent_storage.base import IPersistentStorage
+from user_state import UserStateCache
+from common.cache import TtlLruCache
 from common.logging import get_logger
 from common.protocol import MessageType
-from common.telegram import get_forwarded_message_hash
+from common.startup import report_first
+from common.telegram import get_forwarded_message_hash, get_messages_filterable_text_and_urls
+from common.filter import FilterMatcher
+from digest import DigestSettings, get_digest_due_time
+from quiet import QuietHours
+from pool import BotPool
+from rollup import ChannelRollups, ChannelCounter
+from bundle import BundleIndex
+from outbox import DeliveryJob
+from lanes import SendLane, send_lane
 
 
 class ForwardersHandler(BaseFeedBotHandler):
     def __init__(
             self,
             persistent_storage: IPersistentStorage,
+            user_states: UserStateCache,
             forwarders_user_ids: set,
             max_wait_count: int,
-            timeout_seconds: float):
-        super(ForwardersHandler, self).__init__(persistent_storage=persistent_storage)
+            timeout_seconds: float,
+            digest_settings: DigestSettings,
+            quiet_hours: QuietHours,
+            pool: BotPool,
+            rollups: ChannelRollups,
+            bundles: BundleIndex,
+            duplicates_cache_max_size: int,
+            duplicates_cache_ttl_seconds: float):
+        super(ForwardersHandler, self).__init__(persistent_storage=persistent_storage, user_states=user_states)
         self.forwarders_user_ids = forwarders_user_ids
         self.forwards = dict()
         self.max_wait_count = max_wait_count
         self.timeout_seconds = timeout_seconds
+        self.digest_settings = digest_settings
+        self.quiet_hours = quiet_hours
+        self.pool = pool
+        # chat id -> compiled filters of channel subscribers
+        self.channel_filter_matchers = dict()
+        self.rollups = rollups
+        self.bundles = bundles
+        # post key -> True for posts handled recently; same post comes twice if two forwarders monitor its channel
+        self.recent_posts = TtlLruCache(max_size=duplicates_cache_max_size, ttl_seconds=duplicates_cache_ttl_seconds)
+
+    def invalidate_filters(self):
+        get_logger().info(msg=f"Invalidating {len(self.channel_filter_matchers)} cached channel filter matchers")
+        self.channel_filter_matchers.clear()
 
     # helpers
     def accumulate_forward(self, event: NewMessage.Event):
@@ -53,31 +88,283 @@ class ForwardersHandler(BaseFeedBotHandler):
                     # if take_first_forward was called its already popped
                     self.pop_list_if_empty(msg_hash=msg_hash)
 
+    # returns whether the post was handled recently; marks it handled otherwise
+    def is_duplicate_post(
+            self, forwarded_message_type: MessageType, forwarded_from_chat_id: int, messages: list) -> bool:
+        # forwards to bot get new ids, so private channels posts are told by ids in the source channel
+        if forwarded_message_type == MessageType.FORWARD_SOURCE:
+            post_ids = tuple(message.fwd_from.channel_post for message in messages)
+        else:
+            post_ids = tuple(messages)
+
+        key = forwarded_from_chat_id, post_ids
+
+        if self.recent_posts.get(key) is not None:
+            return True
+
+        self.recent_posts.put(key, True)
+
+        return False
+
+    async def get_channel_filter_matcher(self, chat_id: int) -> FilterMatcher:
+        if chat_id not in self.channel_filter_matchers:
+            rules = await self.persistent_storage.get_channel_filters(chat_id=chat_id)
+            get_logger().debug(msg=f"Compiling {len(rules)} filters of chat id={chat_id} subs")
+            self.channel_filter_matchers[chat_id] = FilterMatcher(rules=rules)
+
+        return self.channel_filter_matchers[chat_id]
+
+    # returns subscribers whose filters match the post, so it must not be delivered to them; filterable_text_and_urls
+    # come with handed off posts, others are taken from messages
+    async def get_filtered_out_user_chat_ids(
+            self,
+            client: TelegramClient,
+            forwarded_from_chat_id: int,
+            subbed_user_chat_ids: set,
+            filterable_text_and_urls: Optional[tuple],
+            **kwargs_forward):
+        matcher = await self.get_channel_filter_matcher(chat_id=forwarded_from_chat_id)
+
+        if matcher.is_empty():
+            return set()
+
+        if filterable_text_and_urls is not None:
+            text, urls = filterable_text_and_urls
+
+            return matcher.get_matched_user_chat_ids(text=text, urls=urls) & subbed_user_chat_ids
+
+        messages = kwargs_forward['messages']
+
+        # public channels posts of forwarder messages come as ids only, so fetch messages themselves
+        if len(messages) > 0 and isinstance(messages[0], int):
+            try:
+                messages = await client.get_messages(kwargs_forward['from_peer'], ids=messages)
+            except Exception as e:
+                get_logger().error(msg=f"Failed to get messages={messages} from={forwarded_from_chat_id} to "
+                                       f"filter them, so deliver unfiltered: {str(e)}")
+                return set()
+
+        text, urls = get_messages_filterable_text_and_urls(messages=[msg for msg in messages if msg is not None])
+
+        return matcher.get_matched_user_chat_ids(text=text, urls=urls) & subbed_user_chat_ids
+
+    # returns subscribers that receive the post as digest, so post is buffered for them instead of being forwarded
+    async def buffer_digest_post(self, forwarded_from_chat_id: int, subbed_user_chat_ids: set, message_ids: list):
+        digest_periods = await self.digest_settings.get_digest_periods(
+            chat_id=forwarded_from_chat_id, user_chat_ids=subbed_user_chat_ids)
+
+        if len(digest_periods) == 0:
+            return set()
+
+        # digest due during quiet hours of user chat is sent once they end
+        now = datetime.now(tz=timezone.utc)
+        due_times = {
+            user_chat_id: get_digest_due_time(user_chat_id, period, now)
+            for user_chat_id, period in digest_periods.items()}
+        due_times.update(await self.quiet_hours.get_quiet_end_times(user_chat_times=due_times))
+        # album is a single post and its link is the link to its first message
+        items = [
+            (user_chat_id, forwarded_from_chat_id, message_ids[0], due_time)
+            for user_chat_id, due_time in due_times.items()]
+
+        try:
+            await self.persistent_storage.add_digest_items(items=items)
+        except Exception as e:
+            get_logger().error(msg=f"Failed to buffer digest post={message_ids} from={forwarded_from_chat_id}, so "
+                                   f"forward it right away: {str(e)}")
+            return set()
+
+        return set(digest_periods.keys())
+
+    # returns jobs or exceptions of user chats that could not be resolved
+    async def get_delivery_jobs(
+            self,
+            bot_index: int,
+            user_chat_ids: list,
+            forwarded_from_chat_id: int,
+            forwards_count: int,
+            not_befores: dict,
+            **kwargs_forward) -> list:
+        client = self.pool.get_client(bot_index=bot_index)
+        from_peer = kwargs_forward['from_peer']
+        message_ids = kwargs_forward['messages']
+
+        # private channels path forwards messages themselves from chat with forwarder
+        if len(message_ids) > 0 and not isinstance(message_ids[0], int):
+            message_ids = [message.id for message in message_ids]
+
+        # jobs are sent by consumers with no entity cache, so ingest resolves user chats
+        user_peers = await gather(
+            *[client.get_input_entity(user_chat_id) for user_chat_id in user_chat_ids], return_exceptions=True)
+        jobs = list()
+
+        for user_chat_id, user_peer in zip(user_chat_ids, user_peers):
+            if isinstance(user_peer, Exception):
+                get_logger().error(msg=f"Bot index={bot_index} failed to resolve {user_chat_id}: {str(user_peer)}")
+                jobs.append(user_peer)
+                continue
+
+            jobs.append(DeliveryJob(
+                bot_index=bot_index,
+                user_chat_id=user_chat_id,
+                chat_id=forwarded_from_chat_id,
+                user_peer=user_peer,
+                from_peer=from_peer,
+                message_ids=message_ids,
+                as_album=forwards_count > 1,
+                not_before=not_befores.get(user_chat_id)))
+
+        return jobs
+
+    # input peer is bound to the bot that resolved it, so other bots of the pool resolve public channel on their own
+    async def get_delivery_jobs_of_bot(
+            self,
+            client: TelegramClient,
+            bot_index: int,
+            user_chat_ids: list,
+            forwarded_from_chat_id: int,
+            forwarded_username: Optional[str],
+            forwards_count: int,
+            not_befores: dict,
+            **kwargs_forward) -> list:
+        bot_client = self.pool.get_client(bot_index=bot_index)
+
+        if bot_client is not client:
+            try:
+                kwargs_forward = dict(kwargs_forward, from_peer=await bot_client.get_input_entity(forwarded_username))
+            except Exception as e:
+                get_logger().error(msg=f"Bot index={bot_index} failed to resolve {forwarded_username}: {str(e)}")
+                return [e] * len(user_chat_ids)
+
+        return await self.get_delivery_jobs(
+            bot_index=bot_index,
+            user_chat_ids=user_chat_ids,
+            forwarded_from_chat_id=forwarded_from_chat_id,
+            forwards_count=forwards_count,
+            not_befores=not_befores,
+            **kwargs_forward)
+
+    # client is the bot post came to
     async def forward_messages(
             self,
-            event: NewMessage.Event,
+            client: TelegramClient,
             forwarded_message_type: MessageType,
             forwarded_from_chat_id: int,
+            forwarded_username: Optional[str],
             forwards_count: int,
+            filterable_text_and_urls: Optional[tuple] = None,
+            handoff_post_id: Optional[int] = None,
             **kwargs_forward):
-        # query subs for forwarded chat id
-        subbed_user_chat_ids = await self.persistent_storage.get_channel_subscribers(chat_id=forwarded_from_chat_id)
+        if self.is_duplicate_post(
+                forwarded_message_type=forwarded_message_type,
+                forwarded_from_chat_id=forwarded_from_chat_id,
+                messages=kwargs_forward['messages']):
+            get_logger().info(msg=f"{forwarded_message_type.name} #{forwards_count} from={forwarded_from_chat_id} "
+                                  f"was handled already; skip duplicate")
+            self.rollups.add(chat_id=forwarded_from_chat_id, counter=ChannelCounter.DUPLICATES)
+            return
+
+        # private channels posts come to every bot of the pool, so they are counted by primary one only
+        if forwarded_message_type == MessageType.MESSAGE or client is self.pool.get_primary_client():
+            self.rollups.add(chat_id=forwarded_from_chat_id, counter=ChannelCounter.POSTS)
+
+        # query subs for forwarded chat id; direct subscribers & subscribers of bundles with the channel
+        bundle_user_chat_id_to_bot_index, subbed_user_chat_id_to_bot_index = await gather(
+            self.bundles.get_channel_subscribers(chat_id=forwarded_from_chat_id),
+            self.persistent_storage.get_channel_subscribers(chat_id=forwarded_from_chat_id))
+        subbed_user_chat_id_to_bot_index = {**bundle_user_chat_id_to_bot_index, **subbed_user_chat_id_to_bot_index}
+
+        # posts of private channels are forwarded to every bot of the pool, so each bot delivers them to own users
+        if forwarded_message_type == MessageType.FORWARD_SOURCE:
+            subbed_user_chat_id_to_bot_index = {
+                user_chat_id: bot_index for user_chat_id, bot_index in subbed_user_chat_id_to_bot_index.items()
+                if self.pool.get_client(bot_index=bot_index) is client}
+
+        subbed_user_chat_ids = set(subbed_user_chat_id_to_bot_index.keys())
+        filtered_out_user_chat_ids = await self.get_filtered_out_user_chat_ids(
+            client=client,
+            forwarded_from_chat_id=forwarded_from_chat_id,
+            subbed_user_chat_ids=subbed_user_chat_ids,
+            filterable_text_and_urls=filterable_text_and_urls,
+            **kwargs_forward)
+        subbed_user_chat_ids = subbed_user_chat_ids - filtered_out_user_chat_ids
+
+        # digest links only work for public channels, so posts of private ones are always forwarded right away
+        digest_user_chat_ids = set()
+
+        if forwarded_message_type == MessageType.MESSAGE:
+            digest_user_chat_ids = await self.buffer_digest_post(
+                forwarded_from_chat_id=forwarded_from_chat_id,
+                subbed_user_chat_ids=subbed_user_chat_ids,
+                message_ids=kwargs_forward['messages'])
+            subbed_user_chat_ids = subbed_user_chat_ids - digest_user_chat_ids
+
+        # post is deferred for subs in quiet hours till they end
+        now = datetime.now(tz=timezone.utc)
+        not_befores = await self.quiet_hours.get_quiet_end_times(
+            user_chat_times={user_chat_id: now for user_chat_id in subbed_user_chat_ids})
+
         get_logger().debug(msg=f"Forward {forwarded_message_type.name} #{forwards_count} "
                                f"from={forwarded_from_chat_id} to {len(subbed_user_chat_ids)} "
-                               f"subs: {subbed_user_chat_ids}")
+                               f"subs: {subbed_user_chat_ids}; filtered out for {len(filtered_out_user_chat_ids)} "
+                               f"subs: {filtered_out_user_chat_ids}; buffered for digest of "
+                               f"{len(digest_user_chat_ids)} subs: {digest_user_chat_ids}; deferred for "
+                               f"{len(not_befores)} subs in quiet hours: {set(not_befores.keys())}")
 
-        # forward message to each sub
-        forwarded_messages = await gather(
-            *[event.client.forward_messages(
-                entity=user_chat_id,
-                as_album=forwards_count > 1,
-                **kwargs_forward) for user_chat_id in subbed_user_chat_ids],
-            return_exceptions=True)
-        successes = [messages for messages in forwarded_messages if isinstance(messages, list) and len(messages) > 0]
-        failures = [
-            messages for messages in forwarded_messages if not (isinstance(messages, list) and len(messages) > 0)]
+        # forward message to each sub using the bot sub is pinned to
+        bot_index_to_user_chat_ids = dict()
+
+        for user_chat_id in subbed_user_chat_ids:
+            bot_index_to_user_chat_ids.setdefault(
+                subbed_user_chat_id_to_bot_index[user_chat_id], list()).append(user_chat_id)
+
+        bots_jobs = await gather(
+            *[self.get_delivery_jobs_of_bot(
+                client=client,
+                bot_index=bot_index,
+                user_chat_ids=user_chat_ids,
+                forwarded_from_chat_id=forwarded_from_chat_id,
+                forwarded_username=forwarded_username,
+                forwards_count=forwards_count,
+                not_befores=not_befores,
+                **kwargs_forward) for bot_index, user_chat_ids in bot_index_to_user_chat_ids.items()])
+        jobs = [job for bot_jobs in bots_jobs for job in bot_jobs if isinstance(job, DeliveryJob)]
+        failures = [job for bot_jobs in bots_jobs for job in bot_jobs if not isinstance(job, DeliveryJob)]
+
+        # whole fan out of the post is stored at once; sending is up to outbox consumers
+        await self.persistent_storage.add_outbox_items(
+            items=[job.to_item() for job in jobs],
+            handoff_post_ids=[] if handoff_post_id is None else [handoff_post_id])
         get_logger().info(msg=f"{forwarded_message_type.name} #{forwards_count} from={forwarded_from_chat_id} "
-                              f"was forwarded to {len(successes)} chats; failures #{len(failures)}={failures}")
+                              f"was queued to outbox for {len(jobs)} chats; failures #{len(failures)}={failures}")
+
+        if len(jobs) > 0:
+            report_first("forward")
+
+    # public channels posts come both in messages of forwarders and through post handoff; handed off post comes with
+    # text & urls to filter it by and is deleted with its fan out
+    async def forward_public_post(
+            self,
+            client: TelegramClient,
+            forwarded_username: str,
+            forwarded_message_ids: list,
+            filterable_text_and_urls: Optional[tuple] = None,
+            handoff_post_id: Optional[int] = None):
+        # resolve chat from username
+        forwarded_from_chat = await client.get_input_entity(forwarded_username)
+        # have to use get_peer_id because entity by default has modified fake id
+        forwarded_from_chat_id = await client.get_peer_id(forwarded_from_chat)
+
+        await self.forward_messages(
+            client=client,
+            forwarded_message_type=MessageType.MESSAGE,
+            forwarded_from_chat_id=forwarded_from_chat_id,
+            forwarded_username=forwarded_username,
+            forwards_count=len(forwarded_message_ids),
+            filterable_text_and_urls=filterable_text_and_urls,
+            handoff_post_id=handoff_post_id,
+            messages=forwarded_message_ids,
+            from_peer=forwarded_from_chat)
 
     # CallableHandlerWithStorage
     async def __call__(self, event: NewMessage.Event):
@@ -94,34 +381,38 @@ class ForwardersHandler(BaseFeedBotHandler):
             self.accumulate_forward(event=event)
             raise StopPropagation
 
-        # parse message
-        message_words = event.message.message.split(' ')
+        # forwarder batches posts: every line of message is a post of its own
+        lines = [line for line in event.message.message.split("\n") if len(line) > 0]
+        # posts are fetched in realtime lane, so they don't wait for digests
+        with send_lane(SendLane.REALTIME):
+            results = await gather(
+                *[self.handle_line(event=event, line=line) for line in lines], return_exceptions=True)
+
+        for line, result in zip(lines, results):
+            if isinstance(result, Exception):
+                get_logger().error(msg=f"Failed to handle line={line} of message id={event.message.id} from "
+                                       f"forwarder with user id={event.message.from_id}: {str(result)}")
+
+        raise StopPropagation
+
+    async def handle_line(self, event: NewMessage.Event, line: str):
+        # parse line
+        message_words = line.split(' ')
 
         if len(message_words) < 3:
             get_logger().error(
-                msg=f"forwarder with user id={event.message.from_id} sent message id={event.message.id} of "
-                    f"invalid format: {event.message.message}")
-            raise StopPropagation
+                msg=f"forwarder with user id={event.message.from_id} sent message id={event.message.id} with line "
+                    f"of invalid format: {line}")
+            return
 
         forwarded_message_type = MessageType[message_words[0]]
 
         # branch on message type
         if forwarded_message_type == MessageType.MESSAGE:
-            forwarded_username = message_words[1]
-            forwarded_message_ids = [int(message_id) for message_id in message_words[2:]]
-
-            # resolve chat from username
-            forwarded_from_chat = await event.client.get_input_entity(forwarded_username)
-            # have to use get_peer_id because entity by default has modified fake id
-            forwarded_from_chat_id = await event.client.get_peer_id(forwarded_from_chat)
-
-            await self.forward_messages(
-                event=event,
-                forwarded_message_type=forwarded_message_type,
-                forwarded_from_chat_id=forwarded_from_chat_id,
-                forwards_count=len(forwarded_message_ids),
-                messages=forwarded_message_ids,
-                from_peer=forwarded_from_chat)
+            await self.forward_public_post(
+                client=event.client,
+                forwarded_username=message_words[1],
+                forwarded_message_ids=[int(message_id) for message_id in message_words[2:]])
         elif forwarded_message_type == MessageType.FORWARD_SOURCE:
             forwarded_from_chat_id = int(message_words[1])
             forwarded_message_hashes = [int(message_hash) for message_hash in message_words[2:]]
@@ -135,7 +426,7 @@ class ForwardersHandler(BaseFeedBotHandler):
                     # erase all msg_hashes that are saved
                     self.erase_forwards(hashes=forwarded_message_hashes)
 
-                    raise StopPropagation
+                    return
 
                 get_logger().debug(
                     f"waiting for all expected forwards to come wait#{waits} for {self.timeout_seconds}s")
@@ -145,12 +436,12 @@ class ForwardersHandler(BaseFeedBotHandler):
             forwarded_messages = [self.take_first_forward(msg_hash=msg_hash) for msg_hash in forwarded_message_hashes]
 
             await self.forward_messages(
-                event=event,
+                client=event.client,
                 forwarded_message_type=forwarded_message_type,
                 forwarded_from_chat_id=forwarded_from_chat_id,
+                forwarded_username=None,
                 forwards_count=len(forwarded_messages),
-                messages=forwarded_messages)
+                messages=forwarded_messages,
+                from_peer=await event.get_input_chat())
         else:
             raise RuntimeError(f"Message type={forwarded_message_type.name} is not handled")
-
-        raise StopPropagation
@@ -4,14 +4,16 @@ from telethon.events import NewMessage, StopPropagation
 
 from .base import BaseFeedBotHandler
 from common.persistent_storage.base import IPersistentStorage
+from user_state import UserStateCache
 from common.logging import get_logger
 from common.resources.localization import get_localized, g_key_handlers_help_0, g_key_handlers_help_1
-from common.resources.localization import g_key_handlers_help_2
+from common.resources.localization import g_key_handlers_help_2, g_key_handlers_help_3, g_key_handlers_help_4
+from common.resources.localization import g_key_handlers_help_5, g_key_handlers_help_6
 
 
 class HelpHandler(BaseFeedBotHandler):
-    def __init__(self, persistent_storage: IPersistentStorage):
-        super(HelpHandler, self).__init__(persistent_storage=persistent_storage)
+    def __init__(self, persistent_storage: IPersistentStorage, user_states: UserStateCache):
+        super(HelpHandler, self).__init__(persistent_storage=persistent_storage, user_states=user_states)
 
     # CallableHandlerWithStorage
     async def __call__(self, event: NewMessage.Event):
@@ -19,7 +21,14 @@ class HelpHandler(BaseFeedBotHandler):
         # assert user is enrolled
         locale = await self.assert_enrolled(event=event)
 
-        keys = [g_key_handlers_help_0, g_key_handlers_help_1, g_key_handlers_help_2]
+        keys = [
+            g_key_handlers_help_0,
+            g_key_handlers_help_1,
+            g_key_handlers_help_2,
+            g_key_handlers_help_3,
+            g_key_handlers_help_4,
+            g_key_handlers_help_5,
+            g_key_handlers_help_6]
 
         for idx, key in enumerate(keys):
             is_last = idx == len(keys)
@@ -1,49 +1,159 @@
-from asyncio import sleep
 from math import ceil
+from typing import Optional
 
-from telethon.events import NewMessage, StopPropagation
+from telethon import Button, errors
+from telethon.events import NewMessage, CallbackQuery, StopPropagation
 from .base import BaseFeedBotHandler
+from common.cache import TtlLruCache
 from common.telegram import get_monitored_chat_name
 from common.persistent_storage.base import IPersistentStorage
+from user_state import UserStateCache
 from common.logging import get_logger
 
-from common.resources.localization import get_localized, g_key_handlers_list_count, g_key_handlers_list_list
+from common.resources.localization import get_localized, Language
+from common.resources.localization import g_key_handlers_list_count, g_key_handlers_list_list
 
+# callback data of page buttons: prefix, direction, cursor subscription id, number of page to show
+g_list_callback_prefix = "list"
+g_list_callback_separator = ":"
+g_list_callback_next = "n"
+g_list_callback_previous = "p"
+g_list_callback_pattern = f"^{g_list_callback_prefix}{g_list_callback_separator}".encode()
 
+
+def get_page_callback_data(is_forward: bool, cursor_subscription_id: int, page: int) -> bytes:
+    direction = g_list_callback_next if is_forward else g_list_callback_previous
+
+    return g_list_callback_separator.join(
+        [g_list_callback_prefix, direction, str(cursor_subscription_id), str(page)]).encode()
+
+
+# returns is_forward, cursor_subscription_id, page or raises on malformed data
+def parse_page_callback_data(data: bytes) -> tuple:
+    prefix, direction, cursor_subscription_id, page = data.decode().split(g_list_callback_separator)
+
+    if prefix != g_list_callback_prefix or direction not in (g_list_callback_next, g_list_callback_previous):
+        raise RuntimeError(f"Invalid list callback data={data}")
+
+    return direction == g_list_callback_next, int(cursor_subscription_id), int(page)
+
+
+# Renders /list as single message showing one page of subscriptions; pages are switched by inline buttons that edit
+# the message in place. Pages are fetched with keyset pagination, so each page costs the same regardless of its number
 class ListHandler(BaseFeedBotHandler):
-    def __init__(self, persistent_storage: IPersistentStorage):
-        super(ListHandler, self).__init__(persistent_storage=persistent_storage)
+    def __init__(
+            self,
+            persistent_storage: IPersistentStorage,
+            user_states: UserStateCache,
+            page_size: int,
+            cache: TtlLruCache):
+        super(ListHandler, self).__init__(persistent_storage=persistent_storage, user_states=user_states)
+        self.page_size = page_size
+        # (user chat id, cursor subscription id, is_forward) -> (total_count, subs); cleared on subscriptions update
+        self.cache = cache
+
+    async def get_page(self, user_chat_id: int, cursor_subscription_id: Optional[int], is_forward: bool) -> tuple:
+        key = user_chat_id, cursor_subscription_id, is_forward
+        page = self.cache.get(key)
+
+        if page is None:
+            page = await self.persistent_storage.get_user_chat_id_enabled_subscriptions_page(
+                user_chat_id=user_chat_id,
+                cursor_subscription_id=cursor_subscription_id,
+                is_forward=is_forward,
+                limit=self.page_size)
+            self.cache.put(key, page)
+
+        return page
+
+    # returns text & buttons of the page
+    def render_page(self, locale: Language, total_count: int, subs: list, page: int) -> tuple:
+        text = get_localized(g_key_handlers_list_count, locale, [total_count])
+
+        if len(subs) < 1:
+            return text, None
+
+        pages = ceil(total_count / self.page_size)
+        # subscriptions might have changed since the page was requested
+        page = max(1, min(page, pages))
+        message = str()
+
+        for _, title, subscription_chat_id in subs:
+            message += "\n> "
+            message += get_monitored_chat_name(title=title, chat_id=subscription_chat_id)
+
+        text += "\n\n" + get_localized(g_key_handlers_list_list, locale, [page, pages, message])
+        buttons = list()
+
+        if page > 1:
+            buttons.append(Button.inline("◀", data=get_page_callback_data(
+                is_forward=False, cursor_subscription_id=subs[0][0], page=page - 1)))
+
+        if page < pages:
+            buttons.append(Button.inline("▶", data=get_page_callback_data(
+                is_forward=True, cursor_subscription_id=subs[-1][0], page=page + 1)))
+
+        return text, buttons if len(buttons) > 0 else None
 
     # CallableHandlerWithStorage
     async def __call__(self, event: NewMessage.Event):
         get_logger().info(msg=f"list handler called; chat_id={event.chat_id}")
         # assert user is enrolled
         locale = await self.assert_enrolled(event=event)
-        # get channels user is subbed to
-        user_chat_id_subs_title_ids = await self.persistent_storage.get_user_chat_id_enabled_subscriptions(
-            user_chat_id=event.chat_id)
-        sub_count = len(user_chat_id_subs_title_ids)
-        get_logger().debug(msg=f"list handler: there are {sub_count} subs: {user_chat_id_subs_title_ids}")
-
-        await event.message.respond(get_localized(g_key_handlers_list_count, locale, [sub_count]), parse_mode="md")
-        if sub_count > 0:
-            await sleep(0.5)
-
-        batch_length = 5
-        for idx in range(0, sub_count, batch_length):
-            begin = idx
-            end = min(idx + batch_length, sub_count)
-            is_last = end == sub_count
-            message = str()
-
-            for title, subscription_chat_id in user_chat_id_subs_title_ids[begin: end]:
-                message += "\n> "
-                message += get_monitored_chat_name(title=title, chat_id=subscription_chat_id)
-
-            # + 1 to start from 1 instead of 0
-            args = [begin // batch_length + 1, ceil(sub_count / batch_length), message]
-            await event.message.respond(get_localized(g_key_handlers_list_list, locale, args), parse_mode="md")
-            if not is_last:
-                await sleep(1)
+        # get first page of channels user is subbed to
+        total_count, subs = await self.get_page(
+            user_chat_id=event.chat_id, cursor_subscription_id=None, is_forward=True)
+        get_logger().debug(msg=f"list handler: there are {total_count} subs, first page: {subs}")
+
+        text, buttons = self.render_page(locale=locale, total_count=total_count, subs=subs, page=1)
+        await event.message.respond(text, buttons=buttons, parse_mode="md")
+
+        raise StopPropagation
+
+
+class ListPageHandler(ListHandler):
+    def __init__(
+            self,
+            persistent_storage: IPersistentStorage,
+            user_states: UserStateCache,
+            page_size: int,
+            cache: TtlLruCache):
+        super(ListPageHandler, self).__init__(
+            persistent_storage=persistent_storage, user_states=user_states, page_size=page_size, cache=cache)
+
+    # CallableHandlerWithStorage
+    async def __call__(self, event: CallbackQuery.Event):
+        get_logger().info(msg=f"list page handler called; chat_id={event.chat_id} data={event.data}")
+        is_forward, cursor_subscription_id, page = parse_page_callback_data(data=event.data)
+
+        user_state = await self.user_states.get(user_chat_id=event.chat_id)
+        locale = user_state.language
+
+        if not user_state.is_enrolled:
+            get_logger().debug(msg=f"Chat id={event.chat_id} is not enrolled so ignore list page request")
+            await event.answer()
+            raise StopPropagation
+
+        total_count, subs = await self.get_page(
+            user_chat_id=event.chat_id, cursor_subscription_id=cursor_subscription_id, is_forward=is_forward)
+
+        # previous page might be short if subscriptions before it were removed; it is the first one then
+        if not is_forward and len(subs) < self.page_size:
+            page = 1
+
+        # every subscription past cursor was removed, so start over
+        if len(subs) < 1 and total_count > 0:
+            total_count, subs = await self.get_page(
+                user_chat_id=event.chat_id, cursor_subscription_id=None, is_forward=True)
+            page = 1
+
+        text, buttons = self.render_page(locale=locale, total_count=total_count, subs=subs, page=page)
+
+        try:
+            await event.edit(text, buttons=buttons, parse_mode="md")
+        except errors.MessageNotModifiedError:
+            get_logger().debug(f"List page of chat id={event.chat_id} is not modified")
+
+        await event.answer()
 
         raise StopPropagation
@@ -0,0 +1,78 @@
+from telethon.events import NewMessage, StopPropagation
+from .base import BaseFeedBotHandler
+from common.persistent_storage.base import IPersistentStorage
+from common.monitor import LoopMonitor, g_profile_interval_seconds
+from user_state import UserStateCache
+from common.logging import get_logger
+from pool import BotPool
+
+
+g_profile_default_seconds = 10
+g_profile_max_seconds = 60
+g_profile_top_count = 20
+# telegram message is at most 4096 chars
+g_profile_max_message_length = 4000
+
+
+def get_percent(count: int, total_count: int) -> str:
+    return f"{100 * count / max(1, total_count):5.1f}%"
+
+
+class ProfileHandler(BaseFeedBotHandler):
+    def __init__(
+            self,
+            persistent_storage: IPersistentStorage,
+            user_states: UserStateCache,
+            key: str,
+            loop_monitor: LoopMonitor,
+            pool: BotPool):
+        super(ProfileHandler, self).__init__(persistent_storage=persistent_storage, user_states=user_states)
+        self.key_str = key
+        self.loop_monitor = loop_monitor
+        self.pool = pool
+
+    # CallableHandlerWithStorage
+    async def __call__(self, event: NewMessage.Event):
+        get_logger().info(msg=f"profile handler called; chat_id={event.chat_id}")
+
+        # first argument is command, second must be key, third is optional profiling duration in seconds
+        if self.key_str not in event.message.message:
+            get_logger().warning(msg=f"unauthorized call of profile handler!!! chat_id={event.chat_id} "
+                                     f"msg={event.message.message}")
+            raise StopPropagation
+
+        split_args = event.message.message.split()[2:]
+
+        try:
+            seconds = int(split_args[0]) if len(split_args) > 0 else g_profile_default_seconds
+        except ValueError:
+            seconds = g_profile_default_seconds
+
+        seconds = min(max(1, seconds), g_profile_max_seconds)
+
+        try:
+            samples_count, top_functions, tasks_dump = await self.loop_monitor.profile(
+                seconds=seconds, top_count=g_profile_top_count)
+        except RuntimeError as e:
+            await event.message.respond(f"Failed to profile: {str(e)}", parse_mode=None)
+            raise StopPropagation
+
+        # tasks go last, because they are cut first if message is too long
+        lines = [f"Profile of {seconds}s: {samples_count} samples, "
+                 f"{samples_count * g_profile_interval_seconds:.1f}s of cpu", f"Loop lag: {self.loop_monitor.lags}"]
+        lines += ["Hot functions (self, total):"]
+        lines += [
+            f"{get_percent(self_count, samples_count)} {get_percent(total_count, samples_count)} {function}"
+            for function, self_count, total_count in top_functions]
+        lines += [
+            f"Send lanes of bot {bot_index}: " + "; ".join(
+                f"{lane} in flight {stats['in_flight']}, waiting {stats['waiting']}, p99 {stats['latency_p99_ms']}ms"
+                for lane, stats in client.lanes.get_stats().items())
+            for bot_index, client in enumerate(self.pool.clients)]
+        lines += [f"Tasks ({sum(count for _, count in tasks_dump)}):"]
+        lines += [f"{count:5d} {location}" for location, count in tasks_dump]
+
+        # functions & tasks are shown as is, so no markdown
+        await event.message.respond("\n".join(lines)[:g_profile_max_message_length], parse_mode=None)
+
+        raise StopPropagation
@@ -0,0 +1,65 @@
+from telethon.events import NewMessage, StopPropagation
+from .base import BaseFeedBotHandler
+from common.persistent_storage.base import IPersistentStorage
+from user_state import UserStateCache
+from common.logging import get_logger
+from common.resources.localization import get_localized, g_key_handlers_quiet_usage
+from common.resources.localization import g_key_handlers_quiet_did_enable, g_key_handlers_quiet_did_disable
+from quiet import g_minutes_per_day
+
+
+g_quiet_off_arg = "off"
+# utc offsets of time zones in hours
+g_quiet_min_utc_offset = -12
+g_quiet_max_utc_offset = 14
+
+
+class QuietHandler(BaseFeedBotHandler):
+    def __init__(self, persistent_storage: IPersistentStorage, user_states: UserStateCache):
+        super(QuietHandler, self).__init__(persistent_storage=persistent_storage, user_states=user_states)
+
+    # CallableHandlerWithStorage
+    async def __call__(self, event: NewMessage.Event):
+        get_logger().info(msg=f"quiet handler called; chat_id={event.chat_id}")
+        # assert user is enrolled
+        locale = await self.assert_enrolled(event=event)
+
+        # first argument is command; hours are given in local time of user, utc offset is optional
+        split_args = event.message.message.split()[1:]
+        usage = get_localized(g_key_handlers_quiet_usage, locale, [g_quiet_min_utc_offset, g_quiet_max_utc_offset])
+
+        if len(split_args) == 1 and split_args[0].lower() == g_quiet_off_arg:
+            await self.persistent_storage.set_user_chat_quiet_hours(
+                user_chat_id=event.chat_id, from_minute=None, to_minute=None)
+            get_logger().debug(f"user chat id={event.chat_id} disabled quiet hours")
+            await event.message.respond(get_localized(g_key_handlers_quiet_did_disable, locale))
+            raise StopPropagation
+
+        try:
+            if len(split_args) < 2 or len(split_args) > 3:
+                raise ValueError(f"expected 2 or 3 args, got {len(split_args)}")
+
+            from_hour, to_hour = int(split_args[0]), int(split_args[1])
+            utc_offset = int(split_args[2]) if len(split_args) == 3 else 0
+        except ValueError as e:
+            get_logger().debug(msg=f"Invalid args for quiet command: {split_args}: {str(e)}")
+            await event.message.respond(usage)
+            raise StopPropagation
+
+        if not 0 <= from_hour < 24 or not 0 <= to_hour < 24 or from_hour == to_hour \
+                or not g_quiet_min_utc_offset <= utc_offset <= g_quiet_max_utc_offset:
+            get_logger().debug(msg=f"Invalid hours or utc offset for quiet command: {split_args}")
+            await event.message.respond(usage)
+            raise StopPropagation
+
+        # quiet hours are stored in utc
+        from_minute = (from_hour - utc_offset) * 60 % g_minutes_per_day
+        to_minute = (to_hour - utc_offset) * 60 % g_minutes_per_day
+        await self.persistent_storage.set_user_chat_quiet_hours(
+            user_chat_id=event.chat_id, from_minute=from_minute, to_minute=to_minute)
+        get_logger().debug(f"user chat id={event.chat_id} set quiet hours from {from_minute} to {to_minute} utc "
+                           f"minute of day")
+        await event.message.respond(
+            get_localized(g_key_handlers_quiet_did_enable, locale, [from_hour, to_hour, f"{utc_offset:+d}"]))
+
+        raise StopPropagation
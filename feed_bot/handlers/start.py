@@ -4,18 +4,28 @@ from telethon.events import NewMessage, StopPropagation
 from telethon.tl.types import User
 from .base import BaseFeedBotHandler, get_sender_and_language_from_event
 from common.persistent_storage.base import IPersistentStorage
+from user_state import UserState, UserStateCache
 from common.logging import get_logger
-from common.telegram import get_chat_type_from_event
+from common.telegram import ChatType, get_chat_type_from_event
+from pool import BotPool
 
 from common.resources.localization import get_localized, g_key_handlers_start_already_enabled
 from common.resources.localization import g_key_handlers_start_already_existed, g_key_handlers_start_introduction_0
 from common.resources.localization import g_key_handlers_start_introduction_1, g_key_handlers_start_introduction_2
-from common.resources.localization import g_key_handlers_start_not_user
+from common.resources.localization import g_key_handlers_start_not_user, g_key_handlers_start_redirect
+from common.resources.localization import g_key_handlers_start_redirect_group
 
 
 class StartHandler(BaseFeedBotHandler):
-    def __init__(self, persistent_storage: IPersistentStorage):
-        super(StartHandler, self).__init__(persistent_storage=persistent_storage)
+    def __init__(
+            self,
+            persistent_storage: IPersistentStorage,
+            user_states: UserStateCache,
+            pool: BotPool,
+            primary_bot_user_ids: set):
+        super(StartHandler, self).__init__(persistent_storage=persistent_storage, user_states=user_states)
+        self.pool = pool
+        self.primary_bot_user_ids = primary_bot_user_ids
 
     # CallableHandlerWithStorage
     async def __call__(self, event: NewMessage.Event):
@@ -31,11 +41,33 @@ class StartHandler(BaseFeedBotHandler):
         get_logger().info(msg=f"start handler called; user_name={sender.username} chat_id={chat_id} "
                               f"chat_type={chat_type.name} language={language.name}")
 
+        bot_index = self.pool.get_bot_index(event.client)
+
+        # primary bot is the public entry point, so it places users on the least loaded bot of the pool; groups are
+        # given link that adds the bot to group, because private start link can't enroll them. Users pinned to primary
+        # bot are enrolled right here
+        if bot_index == 0 and len(self.pool) > 1 and sender.id not in self.primary_bot_user_ids:
+            user_state = await self.user_states.get(user_chat_id=chat_id)
+
+            if not user_state.is_enrolled:
+                least_loaded_bot_index = await self.pool.get_least_loaded_bot_index(
+                    persistent_storage=self.persistent_storage)
+
+                if least_loaded_bot_index != bot_index:
+                    get_logger().info(f"Redirect chat_id={chat_id} to bot index={least_loaded_bot_index}")
+                    is_group = chat_type != ChatType.PRIVATE
+                    start_link = self.pool.get_start_link(bot_index=least_loaded_bot_index, is_group=is_group)
+                    redirect_key = g_key_handlers_start_redirect_group if is_group else g_key_handlers_start_redirect
+                    await event.message.respond(get_localized(redirect_key, language, [start_link]))
+                    raise StopPropagation
+
         # check if chat were stored/enabled already, on lack of it add
         existed_before, enabled_before, db_language = await self.persistent_storage.add_or_enable_user_chat(
-            chat_id=chat_id, chat_type=chat_type, language=language)
+            chat_id=chat_id, chat_type=chat_type, language=language, bot_index=bot_index)
         get_logger().debug(f"chat_id={chat_id} existed_before={existed_before}, enabled_before={enabled_before}, "
                            f"db_language={db_language}")
+        self.user_states.put(
+            user_chat_id=chat_id, state=UserState(is_enrolled=True, language=db_language, chat_type=chat_type))
 
         if enabled_before:
             await event.message.respond(get_localized(g_key_handlers_start_already_enabled, db_language))
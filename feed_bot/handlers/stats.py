@@ -0,0 +1,39 @@
+from telethon.events import NewMessage, StopPropagation
+from .base import BaseFeedBotHandler
+from common.telegram import get_monitored_chat_name
+from common.persistent_storage.base import IPersistentStorage
+from user_state import UserStateCache
+from common.logging import get_logger
+from common.resources.localization import get_localized, g_key_handlers_stats_no_subs, g_key_handlers_stats
+
+
+# Shows how many posts each followed channel published and how many of them were delivered & unfollowed over the last
+# days; reads daily rollups only, so it costs the same regardless of channel activity
+class StatsHandler(BaseFeedBotHandler):
+    def __init__(self, persistent_storage: IPersistentStorage, user_states: UserStateCache, days: int):
+        super(StatsHandler, self).__init__(persistent_storage=persistent_storage, user_states=user_states)
+        self.days = days
+
+    # CallableHandlerWithStorage
+    async def __call__(self, event: NewMessage.Event):
+        get_logger().info(msg=f"stats handler called; chat_id={event.chat_id}")
+        # assert user is enrolled
+        locale = await self.assert_enrolled(event=event)
+
+        stats = await self.persistent_storage.get_user_chat_channel_stats(user_chat_id=event.chat_id, days=self.days)
+        get_logger().debug(msg=f"stats handler: there are {len(stats)} subs: {stats}")
+
+        if len(stats) < 1:
+            await event.message.respond(get_localized(g_key_handlers_stats_no_subs, locale))
+            raise StopPropagation
+
+        message = str()
+
+        for chat_id, title, posts, deliveries, _, _, unfollows in stats:
+            message += "\n> "
+            message += get_monitored_chat_name(title=title, chat_id=chat_id)
+            message += f" - {posts} / {deliveries} / {unfollows}"
+
+        await event.message.respond(get_localized(g_key_handlers_stats, locale, [self.days, message]), parse_mode="md")
+
+        raise StopPropagation
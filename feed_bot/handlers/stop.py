@@ -1,14 +1,15 @@
 from telethon.events import NewMessage, StopPropagation
 from .base import BaseFeedBotHandler
 from common.persistent_storage.base import IPersistentStorage
+from user_state import UserState, UserStateCache
 from common.logging import get_logger
 
 from common.resources.localization import get_localized, g_key_handlers_stop_not_started, g_key_handlers_stop_did_stop
 
 
 class StopHandler(BaseFeedBotHandler):
-    def __init__(self, persistent_storage: IPersistentStorage):
-        super(StopHandler, self).__init__(persistent_storage=persistent_storage)
+    def __init__(self, persistent_storage: IPersistentStorage, user_states: UserStateCache):
+        super(StopHandler, self).__init__(persistent_storage=persistent_storage, user_states=user_states)
 
     # CallableHandlerWithStorage
     async def __call__(self, event: NewMessage.Event):
@@ -18,6 +19,10 @@ class StopHandler(BaseFeedBotHandler):
 
         # disable chat
         enabled_before = await self.persistent_storage.disable_user_chat(chat_id=event.chat_id)
+        user_state = await self.user_states.get(user_chat_id=event.chat_id)
+        self.user_states.put(
+            user_chat_id=event.chat_id,
+            state=UserState(is_enrolled=False, language=locale, chat_type=user_state.chat_type))
 
         # if it was enabled, its disabled now; else tell user its already disabled
         if enabled_before:
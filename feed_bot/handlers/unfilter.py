@@ -0,0 +1,43 @@
+from telethon.events import NewMessage, StopPropagation
+from .base import BaseFeedBotHandler
+from common.persistent_storage.base import IPersistentStorage
+from user_state import UserStateCache
+from common.logging import get_logger
+from common.resources.localization import get_localized, g_key_handlers_follow_unfollow_no_args
+from common.resources.localization import g_key_handlers_unfilter_not_found, g_key_handlers_unfilter_did_disable
+
+
+class UnfilterHandler(BaseFeedBotHandler):
+    def __init__(self, persistent_storage: IPersistentStorage, user_states: UserStateCache):
+        super(UnfilterHandler, self).__init__(persistent_storage=persistent_storage, user_states=user_states)
+
+    # CallableHandlerWithStorage
+    async def __call__(self, event: NewMessage.Event):
+        get_logger().info(msg=f"unfilter handler called; chat_id={event.chat_id}")
+        # assert user is enrolled
+        locale = await self.assert_enrolled(event=event)
+
+        # first argument is command
+        split_args = event.message.message.split()[1:]
+
+        if len(split_args) < 1:
+            get_logger().debug(msg="No args for unfilter command")
+            await event.message.respond(get_localized(g_key_handlers_follow_unfollow_no_args, locale, ["unfilter"]))
+            raise StopPropagation
+
+        for arg in split_args:
+            try:
+                filter_id = int(arg)
+            except ValueError:
+                await event.message.respond(get_localized(g_key_handlers_unfilter_not_found, locale, [arg]))
+                continue
+
+            did_disable = await self.persistent_storage.disable_filter(user_chat_id=event.chat_id, filter_id=filter_id)
+            get_logger().debug(f"user chat id={event.chat_id} disabling filter id={filter_id}: {did_disable}")
+
+            if did_disable:
+                await event.message.respond(get_localized(g_key_handlers_unfilter_did_disable, locale, [filter_id]))
+            else:
+                await event.message.respond(get_localized(g_key_handlers_unfilter_not_found, locale, [filter_id]))
+
+        raise StopPropagation
@@ -4,7 +4,11 @@ from telethon.events import NewMessage, StopPropagation
 from .base import BaseFeedBotHandlerWithResolve
 from common.telegram import get_monitored_chat_name
 from common.persistent_storage.base import IPersistentStorage
+from user_state import UserStateCache
+from resolver_dispatcher import ResolverDispatcher
+from rollup import ChannelRollups, ChannelCounter
 from common.logging import get_logger
+from common.analytics import EventType, record_event
 from common.resources.localization import Language, get_localized
 from common.resources.localization import g_key_handlers_unfollow_not_followed, g_key_handlers_unfollow_did_disable
 
@@ -13,28 +17,20 @@ class UnfollowHandler(BaseFeedBotHandlerWithResolve):
     def __init__(
             self,
             persistent_storage: IPersistentStorage,
-            resolver_entities: list,
-            resolver_replies: dict,
-            resolve_max_wait_count: int,
-            resolve_timeout_seconds: float,
-            resolve_warning_wait_number: int):
+            user_states: UserStateCache,
+            resolver_dispatcher: ResolverDispatcher,
+            rollups: ChannelRollups):
         super(UnfollowHandler, self).__init__(
             persistent_storage=persistent_storage,
-            resolver_entities=resolver_entities,
-            resolver_replies=resolver_replies,
-            resolve_max_wait_count=resolve_max_wait_count,
-            resolve_timeout_seconds=resolve_timeout_seconds,
-            resolve_warning_wait_number=resolve_warning_wait_number)
+            user_states=user_states,
+            resolver_dispatcher=resolver_dispatcher)
+        self.rollups = rollups
 
     # CallableHandlerWithStorage
     async def __call__(self, event: NewMessage.Event):
         # usernames are resolved and numeric arguments are given back as chat_id_args
         resolved_dict, chat_id_args, locale = await self.get_resolved_chat_ids_title_joiner_from_event(
-            resolver_entity_generator=self.circular_resolver_generator,
-            resolver_replies=self.resolver_replies,
-            max_wait_count=self.resolve_max_wait_count,
-            timeout_seconds=self.resolve_timeout_seconds,
-            warning_wait_number=self.resolve_warning_wait_number,
+            resolver_dispatcher=self.resolver_dispatcher,
             event=event,
             is_follow=False)
 
@@ -76,6 +72,8 @@ class UnfollowHandler(BaseFeedBotHandlerWithResolve):
                     [get_monitored_chat_name(title=title, chat_id=target_chat_id)]))
         else:
             # if there was subscription so unfollow actually happened
+            record_event(event_type=EventType.UNFOLLOW, user_chat_id=event.chat_id, chat_id=target_chat_id)
+            self.rollups.add(chat_id=target_chat_id, counter=ChannelCounter.UNFOLLOWS)
             await event.message.respond(
                 get_localized(
                     g_key_handlers_unfollow_did_disable,
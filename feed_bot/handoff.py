@@ -0,0 +1,98 @@
+from asyncio import Event, TimeoutError, gather, wait_for
+
+from common.logging import get_logger
+from common.persistent_storage.base import IPersistentStorage
+from handlers.forwarders import ForwardersHandler
+from lanes import SendLane, send_lane
+from pool import BotPool
+
+
+# Posts of public channels are handed off by forwarders through db instead of telegram messages: forwarder inserts them,
+# insert notifies the bot, the bot claims them by lease and fans them out like ones coming in messages of forwarders.
+# Post is deleted in the same transaction its fan out is stored in outbox, so post is fanned out once even if bot dies
+# right after. Posts claimed by bot that died before are claimed again once lease expires; digest items of such post
+# may be buffered twice then
+class HandoffConsumer:
+    def __init__(
+            self,
+            persistent_storage: IPersistentStorage,
+            pool: BotPool,
+            forwarders_handler: ForwardersHandler,
+            batch_size: int,
+            lease_seconds: float,
+            poll_seconds: float):
+        if batch_size < 1:
+            raise RuntimeError(f"Invalid batch_size={batch_size}")
+
+        if lease_seconds <= 0:
+            raise RuntimeError(f"Invalid lease_seconds={lease_seconds}")
+
+        if poll_seconds <= 0:
+            raise RuntimeError(f"Invalid poll_seconds={poll_seconds}")
+
+        self.persistent_storage = persistent_storage
+        self.pool = pool
+        # handler of primary bot; it routes public channels posts to the rest of the pool
+        self.forwarders_handler = forwarders_handler
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.wakeup = Event()
+        self.is_stopped = False
+
+    async def on_handoff_update(self, payload: str):
+        self.wakeup.set()
+
+    # posts claimed already are handled till the end; the rest is left to the next run
+    def stop(self):
+        self.is_stopped = True
+        self.wakeup.set()
+
+    async def run(self):
+        get_logger().info("Starting post handoff consumer")
+
+        while not self.is_stopped:
+            self.wakeup.clear()
+            claimed_count = 0
+
+            try:
+                claimed_count = await self.consume()
+            except Exception as e:
+                get_logger().error(f"Failed to consume handed off posts: {str(e)}")
+
+            # full batch means there is backlog, so claim again right away
+            if claimed_count == self.batch_size:
+                continue
+
+            try:
+                await wait_for(self.wakeup.wait(), timeout=self.poll_seconds)
+            except TimeoutError:
+                pass
+
+    async def consume(self) -> int:
+        posts = await self.persistent_storage.claim_handoff_posts(
+            limit=self.batch_size, lease_seconds=self.lease_seconds)
+
+        if len(posts) == 0:
+            return 0
+
+        get_logger().debug(f"Claimed {len(posts)} handed off posts")
+        with send_lane(SendLane.REALTIME):
+            results = await gather(
+                *[self.forwarders_handler.forward_public_post(
+                    client=self.pool.get_primary_client(),
+                    forwarded_username=username,
+                    forwarded_message_ids=message_ids,
+                    filterable_text_and_urls=(text, urls),
+                    handoff_post_id=post_id) for post_id, _, username, message_ids, text, urls in posts],
+                return_exceptions=True)
+
+        # failed posts would likely fail the same way again, so they are dropped like failed messages of forwarders;
+        # skipped duplicates are dropped too
+        for post, result in zip(posts, results):
+            if isinstance(result, Exception):
+                get_logger().error(f"Failed to handle handed off post={post}: {str(result)}")
+
+        await self.persistent_storage.delete_handoff_posts(post_ids=[post[0] for post in posts])
+
+        return len(posts)
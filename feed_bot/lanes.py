@@ -0,0 +1,225 @@
+from asyncio import Event
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from enum import Enum
+from time import monotonic
+
+from telethon import TelegramClient
+
+from common.histogram import RollingHistogram
+from common.logging import get_logger
+from common.persistent_storage.pool import get_ms
+
+
+class SendLane(Enum):
+    INTERACTIVE = 0  # replies to commands of users
+    REALTIME = 1  # deliveries of posts as soon as they are posted & ingest of posts
+    BULK = 2  # digests & the rest that may wait
+
+
+# requests are sent in lane of the task that sends them; tasks of event handlers are interactive unless they say else.
+# Tasks inherit lane of the task that created them
+g_send_lane = ContextVar("send_lane", default=SendLane.INTERACTIVE)
+# whether task holds a slot already; requests telethon sends while handling request reuse the slot
+g_holds_send_slot = ContextVar("holds_send_slot", default=False)
+
+# send latency bounds in seconds
+g_send_latency_bounds_seconds = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 300]
+
+
+# requests of the block and of tasks it creates are sent in lane
+@contextmanager
+def send_lane(lane: SendLane):
+    token = g_send_lane.set(lane)
+
+    try:
+        yield
+    finally:
+        g_send_lane.reset(token)
+
+
+class SendLanesConfig:
+    # reserved_counts & slo_seconds are lists in order of lanes
+    def __init__(
+            self,
+            max_in_flight: int,
+            reserved_counts: list,
+            slo_seconds: list,
+            stats_seconds: float,
+            stats_window_size: int):
+        if max_in_flight < 1:
+            raise RuntimeError(f"Invalid max_in_flight={max_in_flight}")
+
+        if reserved_counts is None or len(reserved_counts) != len(SendLane) \
+                or any(count < 0 for count in reserved_counts) or sum(reserved_counts) > max_in_flight:
+            raise RuntimeError(f"Invalid reserved_counts={reserved_counts}")
+
+        if slo_seconds is None or len(slo_seconds) != len(SendLane) or any(seconds <= 0 for seconds in slo_seconds):
+            raise RuntimeError(f"Invalid slo_seconds={slo_seconds}")
+
+        if stats_seconds <= 0:
+            raise RuntimeError(f"Invalid stats_seconds={stats_seconds}")
+
+        self.max_in_flight = max_in_flight
+        self.reserved_counts = reserved_counts
+        self.slo_seconds = slo_seconds
+        self.stats_seconds = stats_seconds
+        self.stats_window_size = stats_window_size
+
+    def __repr__(self):
+        return str(self.__dict__)
+
+
+class LaneStats:
+    def __init__(self, lane: SendLane, reserved_count: int, slo_seconds: float, window_size: int):
+        self.lane = lane
+        self.reserved_count = reserved_count
+        self.slo_seconds = slo_seconds
+        self.in_flight_count = 0
+        # events of tasks waiting for slot in order of arrival
+        self.waiters = list()
+        self.waits = RollingHistogram(window_size=window_size, bounds=g_send_latency_bounds_seconds)
+        self.latencies = RollingHistogram(window_size=window_size, bounds=g_send_latency_bounds_seconds)
+        # since last stats
+        self.sends_count = 0
+        self.slo_misses_count = 0
+
+    def get_unused_reserved_count(self) -> int:
+        return max(0, self.reserved_count - self.in_flight_count)
+
+    def get_stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight_count,
+            "waiting": len(self.waiters),
+            "sends": self.sends_count,
+            "slo_misses": self.slo_misses_count,
+            "wait_p50_ms": get_ms(self.waits.get_percentile(50)),
+            "wait_p99_ms": get_ms(self.waits.get_percentile(99)),
+            "latency_p50_ms": get_ms(self.latencies.get_percentile(50)),
+            "latency_p99_ms": get_ms(self.latencies.get_percentile(99)),
+            "latency_max_ms": get_ms(self.latencies.get_max())}
+
+
+# Limits requests of bot in flight to max_in_flight, so sends of fan out don't pile up in front of command replies in
+# telethon sender, and hands freed slots to waiting lanes in order of priority. Capacity reserved for lane is never
+# taken by other lanes, so replies have room even when deliveries wait out flood limits. Latency of every request from
+# the moment it waits for slot till it is done is checked against SLO of its lane. Stats are logged every
+# stats_seconds on release, so idle lanes log nothing
+class SendLanes:
+    def __init__(self, name: str, config: SendLanesConfig):
+        if config is None:
+            raise RuntimeError(f"No send lanes config of {name} passed")
+
+        self.name = name
+        self.config = config
+        self.lanes = [
+            LaneStats(
+                lane=lane,
+                reserved_count=config.reserved_counts[lane.value],
+                slo_seconds=config.slo_seconds[lane.value],
+                window_size=config.stats_window_size)
+            for lane in SendLane]
+        self.in_flight_count = 0
+        self.stats_time = monotonic()
+
+    @asynccontextmanager
+    async def acquire(self, lane: SendLane):
+        # request sent while handling another one would wait for slot held by itself
+        if g_holds_send_slot.get():
+            yield
+            return
+
+        lane_stats = self.lanes[lane.value]
+        start_time = monotonic()
+
+        # lane doesn't overtake its own waiters
+        if len(lane_stats.waiters) == 0 and self.can_take(lane_stats=lane_stats):
+            self.take(lane_stats=lane_stats)
+        else:
+            await self.wait(lane_stats=lane_stats)
+
+        lane_stats.waits.add(monotonic() - start_time)
+        token = g_holds_send_slot.set(True)
+
+        try:
+            yield
+        finally:
+            g_holds_send_slot.reset(token)
+            self.release(lane_stats=lane_stats, latency_seconds=monotonic() - start_time)
+
+    def get_stats(self) -> dict:
+        return {lane_stats.lane.name: lane_stats.get_stats() for lane_stats in self.lanes}
+
+    # Internal
+    # free slots are what is left after unused reservations of other lanes
+    def can_take(self, lane_stats: LaneStats) -> bool:
+        reserved_count = sum(
+            other.get_unused_reserved_count() for other in self.lanes if other is not lane_stats)
+
+        return self.in_flight_count + reserved_count < self.config.max_in_flight
+
+    # slot is taken for waiter on hand over
+    async def wait(self, lane_stats: LaneStats):
+        event = Event()
+        lane_stats.waiters.append(event)
+
+        try:
+            await event.wait()
+        except BaseException:
+            # slot handed to cancelled waiter goes to the next one
+            if event.is_set():
+                self.release_slot(lane_stats=lane_stats)
+            else:
+                lane_stats.waiters.remove(event)
+
+            raise
+
+    def take(self, lane_stats: LaneStats):
+        lane_stats.in_flight_count += 1
+        self.in_flight_count += 1
+
+    def release(self, lane_stats: LaneStats, latency_seconds: float):
+        self.release_slot(lane_stats=lane_stats)
+        lane_stats.latencies.add(latency_seconds)
+        lane_stats.sends_count += 1
+
+        if latency_seconds > lane_stats.slo_seconds:
+            if lane_stats.slo_misses_count == 0:
+                get_logger().warning(f"{lane_stats.lane.name} lane of {self.name} missed SLO of "
+                                     f"{lane_stats.slo_seconds}s: request took {latency_seconds:.1f}s; "
+                                     f"{lane_stats.get_stats()}")
+
+            lane_stats.slo_misses_count += 1
+
+        if monotonic() - self.stats_time >= self.config.stats_seconds:
+            get_logger().info(f"Send lanes of {self.name} stats: in flight {self.in_flight_count}/"
+                              f"{self.config.max_in_flight}; {self.get_stats()}")
+
+            for stats in self.lanes:
+                stats.sends_count = 0
+                stats.slo_misses_count = 0
+
+            self.stats_time = monotonic()
+
+    def release_slot(self, lane_stats: LaneStats):
+        lane_stats.in_flight_count -= 1
+        self.in_flight_count -= 1
+        self.hand_over()
+
+    # hands free slots to waiters in order of lanes priority
+    def hand_over(self):
+        for waiting_lane in self.lanes:
+            while len(waiting_lane.waiters) > 0 and self.can_take(lane_stats=waiting_lane):
+                self.take(lane_stats=waiting_lane)
+                waiting_lane.waiters.pop(0).set()
+
+
+# Bot client whose requests are sent through send lanes
+class LanedTelegramClient(TelegramClient):
+    def __init__(self, *args, lanes: SendLanes, **kwargs):
+        super(LanedTelegramClient, self).__init__(*args, **kwargs)
+        self.lanes = lanes
+
+    async def __call__(self, request, ordered=False):
+        async with self.lanes.acquire(lane=g_send_lane.get()):
+            return await super(LanedTelegramClient, self).__call__(request, ordered=ordered)
@@ -1,7 +1,11 @@
 from common.logging import configure_logging
 from common.resources.localization import load_localizations
 from bot import Bot, BotConfig, PersistenceConfig
+from common.persistent_storage.pool import PoolConfig
 from common.persistent_storage.factory import PostgresConfig, PersistentStorageType
+from common.analytics import AnalyticsConfig
+from common.session import SessionsConfig
+from lanes import SendLanesConfig
 import config
 import sys
 
@@ -14,51 +18,114 @@ def main():
     # 0 - prog name
     # 1 - api id
     # 2 - api hash
-    # 3 - bot token
+    # 3 - bot tokens separated by comma; first one is primary bot
     # 4 - dev key
-    # 5 - resolver username
+    # 5 - resolver usernames separated by comma
     # >=6 - forwarders user ids
     if len(sys.argv) < 7:
-        raise RuntimeError("App id, app hash, token, dev key, resolver username and forwarders user ids "
+        raise RuntimeError("App id, app hash, tokens, dev key, resolver username and forwarders user ids "
                            "are required to be passed as command line argument")
 
     api_id = int(sys.argv[1])
     api_hash = sys.argv[2]
-    token = sys.argv[3]
+    tokens = sys.argv[3].split(',')
     dev_key = sys.argv[4]
-    # accepting single resolver arg for now, but it should be easy to scale in the future because everything else
-    # is prepared for multi resolvers
-    resolver_usernames = [sys.argv[5]]
+    resolver_usernames = sys.argv[5].split(',')
     forwarders_user_ids = {int(arg) for arg in sys.argv[6:]}
 
     # Load localizations
     load_localizations()
 
     # Load configs
+    read_pool_config = PoolConfig(
+        min_size=config.db_read_pool_min_size,
+        max_size=config.db_read_pool_max_size,
+        statement_timeout_ms=config.db_read_pool_statement_timeout_ms,
+        acquire_warning_ms=config.db_pool_acquire_warning_ms,
+        stats_seconds=config.db_pool_stats_seconds,
+        stats_window_size=config.db_pool_stats_window_size)
+    write_pool_config = PoolConfig(
+        min_size=config.db_write_pool_min_size,
+        max_size=config.db_write_pool_max_size,
+        statement_timeout_ms=config.db_write_pool_statement_timeout_ms,
+        acquire_warning_ms=config.db_pool_acquire_warning_ms,
+        stats_seconds=config.db_pool_stats_seconds,
+        stats_window_size=config.db_pool_stats_window_size)
     postgres_config = PostgresConfig(
         database=config.db_name,
         user=config.db_user,
         password=config.db_password,
         host=config.db_host,
-        port=config.db_port)
+        port=config.db_port,
+        read_pool_config=read_pool_config,
+        write_pool_config=write_pool_config)
     persistence_type = \
         PersistentStorageType.Postgres if config.persistence_use_postgres else PersistentStorageType.Pickle
     persistence_config = PersistenceConfig(
         persistence_type=persistence_type,
         postgres_config=postgres_config)
+    sessions_config = SessionsConfig(
+        in_storage=config.persistence_use_postgres and config.sessions_in_storage,
+        flush_seconds=config.sessions_flush_seconds)
+    analytics_config = AnalyticsConfig(
+        buffer_size=config.analytics_buffer_size,
+        flush_ms=config.analytics_flush_ms,
+        db_timeout_seconds=config.analytics_db_timeout_seconds,
+        fallback_dir=config.analytics_fallback_dir,
+        fallback_file_max_bytes=config.analytics_fallback_file_max_bytes,
+        fallback_file_backups_count=config.analytics_fallback_file_backups_count)
+    send_lanes_config = SendLanesConfig(
+        max_in_flight=config.send_lanes_max_in_flight,
+        reserved_counts=config.send_lanes_reserved_counts,
+        slo_seconds=config.send_lanes_slo_seconds,
+        stats_seconds=config.send_lanes_stats_seconds,
+        stats_window_size=config.send_lanes_stats_window_size)
     bot_config = BotConfig(
         api_id=api_id,
         api_hash=api_hash,
-        token=token,
+        tokens=tokens,
         dev_key=dev_key,
         resolver_usernames=resolver_usernames,
         forwarders_user_ids=forwarders_user_ids,
+        primary_bot_user_ids=set(config.primary_bot_user_ids),
         resolve_max_wait_count=config.resolve_max_wait_count,
         resolve_timeout_seconds=config.resolve_timeout_seconds,
         resolve_warning_wait_number=config.resolve_warning_wait_number,
+        resolver_failures_threshold=config.resolver_failures_threshold,
+        resolver_open_seconds=config.resolver_open_seconds,
         forward_max_wait_count=config.forward_max_wait_count,
         forward_timeout_seconds=config.forward_timeout_seconds,
-        persistence_config=persistence_config)
+        digest_tick_seconds=config.digest_tick_seconds,
+        digest_max_items_per_tick=config.digest_max_items_per_tick,
+        digest_min_period_minutes=config.digest_min_period_minutes,
+        digest_max_period_minutes=config.digest_max_period_minutes,
+        delivery_max_attempts=config.delivery_max_attempts,
+        delivery_retry_delay_seconds=config.delivery_retry_delay_seconds,
+        delivery_max_flood_wait_seconds=config.delivery_max_flood_wait_seconds,
+        delivery_flush_seconds=config.delivery_flush_seconds,
+        delivery_workers_count=config.delivery_workers_count,
+        delivery_worker_lanes_count=config.delivery_worker_lanes_count,
+        outbox_batch_size=config.outbox_batch_size,
+        outbox_lease_seconds=config.outbox_lease_seconds,
+        outbox_poll_seconds=config.outbox_poll_seconds,
+        outbox_deferred_release_per_second=config.outbox_deferred_release_per_second,
+        handoff_batch_size=config.handoff_batch_size,
+        handoff_lease_seconds=config.handoff_lease_seconds,
+        handoff_poll_seconds=config.handoff_poll_seconds,
+        drain_timeout_seconds=config.drain_timeout_seconds,
+        rollups_flush_seconds=config.rollups_flush_seconds,
+        duplicates_cache_max_size=config.duplicates_cache_max_size,
+        duplicates_cache_ttl_seconds=config.duplicates_cache_ttl_seconds,
+        stats_days=config.stats_days,
+        list_page_size=config.list_page_size,
+        list_cache_ttl_seconds=config.list_cache_ttl_seconds,
+        list_cache_max_size=config.list_cache_max_size,
+        user_state_cache_max_size=config.user_state_cache_max_size,
+        user_state_cache_ttl_seconds=config.user_state_cache_ttl_seconds,
+        send_lanes_config=send_lanes_config,
+        analytics_config=analytics_config,
+        persistence_config=persistence_config,
+        sessions_config=sessions_config)
 
     # Create bot obj
     bot = Bot(config=bot_config)
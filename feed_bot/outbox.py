@@ -0,0 +1,339 @@
+from asyncio import Event, Queue, QueueEmpty, sleep, wait_for, TimeoutError
+from datetime import datetime
+from time import monotonic
+from typing import Optional
+
+from telethon import TelegramClient
+from telethon.extensions import BinaryReader
+
+from common.logging import get_logger
+from common.persistent_storage.base import IPersistentStorage
+from delivery import DeliveryService
+from lanes import SendLane, send_lane
+
+
+# Forward of post to single user chat; input peers are resolved by ingest, so consumers need no entity cache. Access
+# hashes are bound to bot account, not to session, so they are valid for any session of the same bot
+class DeliveryJob:
+    def __init__(
+            self,
+            bot_index: int,
+            user_chat_id: int,
+            chat_id: Optional[int],
+            user_peer,
+            from_peer,
+            message_ids: list,
+            as_album: bool,
+            not_before: Optional[datetime] = None,
+            item_id: Optional[int] = None,
+            attempt: int = 1):
+        self.bot_index = bot_index
+        self.user_chat_id = user_chat_id
+        self.chat_id = chat_id
+        self.user_peer = user_peer
+        self.from_peer = from_peer
+        self.message_ids = message_ids
+        self.as_album = as_album
+        # job is deferred till then by quiet hours of user chat; None if it is sent as soon as possible. Claimed jobs
+        # are due, so it is not read back
+        self.not_before = not_before
+        # id of outbox item; None until job is stored
+        self.item_id = item_id
+        # failed jobs are given back to outbox to be retried, so attempt is read back with the job
+        self.attempt = attempt
+
+    # item of delivery outbox
+    def to_item(self) -> tuple:
+        return self.bot_index, self.user_chat_id, self.chat_id, bytes(self.user_peer), bytes(self.from_peer), \
+               self.message_ids, self.as_album, self.not_before
+
+    @staticmethod
+    def from_item(item: tuple):
+        item_id, bot_index, user_chat_id, chat_id, user_peer, from_peer, message_ids, as_album, attempts = item
+
+        return DeliveryJob(
+            bot_index=bot_index,
+            user_chat_id=user_chat_id,
+            chat_id=chat_id,
+            user_peer=BinaryReader(user_peer).tgread_object(),
+            from_peer=BinaryReader(from_peer).tgread_object(),
+            message_ids=message_ids,
+            as_album=as_album,
+            item_id=item_id,
+            attempt=attempts + 1)
+
+    def __repr__(self):
+        return f"item_id={self.item_id}, bot_index={self.bot_index}, user_chat_id={self.user_chat_id}, " \
+               f"chat_id={self.chat_id}, message_ids={self.message_ids}, not_before={self.not_before}, " \
+               f"attempt={self.attempt}"
+
+
+# user chat is always handled by the same consumer & lane, so posts are delivered to it in order
+def get_partition_index(user_chat_id: int, partitions_count: int) -> int:
+    return abs(user_chat_id) % partitions_count
+
+
+# Delivers jobs of outbox partition: claims batches of items, spreads them over lanes by user chat, deletes done ones
+# and gives failed ones back to be retried. Claimed items are leased, so items of consumer that died are claimed again
+# once lease expires; delivery is at least once then. At most batch_size items are in flight, so consumer that is
+# slower than ingest leaves the rest of backlog in outbox for others. New items are claimed right away on outbox
+# notify, poll_seconds only guards against lost notifies. Deferred items that are due only take room left by the rest
+# and are released at deferred_release_per_second at most, which is split between partitions; so backlog of quiet hours
+# is spread over slack of sends instead of being sent all at once when they end. Due retries are claimed as soon as
+# possible
+class OutboxConsumer:
+    def __init__(
+            self,
+            persistent_storage: IPersistentStorage,
+            delivery: DeliveryService,
+            partition_index: int,
+            partitions_count: int,
+            lanes_count: int,
+            batch_size: int,
+            lease_seconds: float,
+            poll_seconds: float,
+            deferred_release_per_second: float):
+        if partition_index < 0 or partitions_count <= partition_index:
+            raise RuntimeError(f"Invalid partition_index={partition_index} partitions_count={partitions_count}")
+
+        if lanes_count < 1:
+            raise RuntimeError(f"Invalid lanes_count={lanes_count}")
+
+        if batch_size < 1:
+            raise RuntimeError(f"Invalid batch_size={batch_size}")
+
+        if lease_seconds <= 0:
+            raise RuntimeError(f"Invalid lease_seconds={lease_seconds}")
+
+        if poll_seconds <= 0:
+            raise RuntimeError(f"Invalid poll_seconds={poll_seconds}")
+
+        if deferred_release_per_second <= 0:
+            raise RuntimeError(f"Invalid deferred_release_per_second={deferred_release_per_second}")
+
+        self.persistent_storage = persistent_storage
+        self.delivery = delivery
+        self.partition_index = partition_index
+        self.partitions_count = partitions_count
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        # token bucket of deferred items release; bucket holds a second of release, so it does not pile up when there
+        # is no slack
+        self.deferred_release_per_second = deferred_release_per_second / partitions_count
+        self.deferred_release_tokens = 0
+        self.deferred_release_time = monotonic()
+        self.lane_queues = [Queue() for _ in range(lanes_count)]
+        # ids of claimed items that are not sent yet
+        self.in_flight_ids = set()
+        # ids of done items that are not deleted from outbox yet
+        self.done_ids = list()
+        # (id, attempts, delay_seconds) of failed items that are not given back to outbox yet
+        self.retry_items = list()
+        # user chat id -> id of its item being retried; its newer items that are claimed already are given back to
+        # wait for the retry in outbox, so they don't overtake it
+        self.retrying_item_ids = dict()
+        # ids of such items that are not given back yet
+        self.release_ids = list()
+        self.wakeup = Event()
+        self.is_draining = False
+
+    def get_continuous_async_tasks(self):
+        return [self.run()] + [self.run_lane(lane_queue=lane_queue) for lane_queue in self.lane_queues]
+
+    async def on_outbox_update(self, payload: str):
+        self.wakeup.set()
+
+    async def run(self):
+        get_logger().info(f"Starting outbox consumer of partition {self.partition_index}/{self.partitions_count}")
+
+        while not self.is_draining:
+            self.wakeup.clear()
+            limit = self.batch_size - len(self.in_flight_ids)
+            claimed_count = 0
+
+            try:
+                await self.flush_done()
+
+                if limit > 0:
+                    claimed_count = await self.claim(limit=limit, deferred=False)
+
+                if claimed_count < limit:
+                    claimed_count += await self.claim_deferred(limit=limit - claimed_count)
+            except Exception as e:
+                get_logger().error(f"Failed to claim outbox items: {str(e)}")
+
+            # full batch means there is backlog, so claim again right away
+            if claimed_count == limit and limit > 0:
+                continue
+
+            try:
+                await wait_for(self.wakeup.wait(), timeout=self.poll_seconds)
+            except TimeoutError:
+                pass
+
+    async def claim_deferred(self, limit: int) -> int:
+        now = monotonic()
+        self.deferred_release_tokens = min(
+            max(1.0, self.deferred_release_per_second),
+            self.deferred_release_tokens + (now - self.deferred_release_time) * self.deferred_release_per_second)
+        self.deferred_release_time = now
+        release_limit = min(limit, int(self.deferred_release_tokens))
+
+        if release_limit < 1:
+            return 0
+
+        claimed_count = await self.claim(limit=release_limit, deferred=True)
+        self.deferred_release_tokens -= claimed_count
+
+        if claimed_count > 0:
+            get_logger().debug(f"Released {claimed_count} deferred outbox items")
+
+        return claimed_count
+
+    async def claim(self, limit: int, deferred: bool) -> int:
+        items = await self.persistent_storage.claim_outbox_items(
+            partition_index=self.partition_index,
+            partitions_count=self.partitions_count,
+            limit=limit,
+            lease_seconds=self.lease_seconds,
+            deferred=deferred)
+
+        for item in items:
+            try:
+                job = DeliveryJob.from_item(item=item)
+            except Exception as e:
+                # it would fail the same way on every claim
+                get_logger().error(f"Failed to read outbox item id={item[0]}, drop it: {str(e)}")
+                self.done_ids.append(item[0])
+                continue
+
+            self.in_flight_ids.add(job.item_id)
+            # all user chats of the partition have the same remainder, so drop it to spread them over lanes evenly
+            lane_index = get_partition_index(
+                user_chat_id=abs(job.user_chat_id) // self.partitions_count, partitions_count=len(self.lane_queues))
+            self.lane_queues[lane_index].put_nowait(job)
+
+        if len(items) > 0:
+            get_logger().debug(f"Claimed {len(items)} outbox items")
+
+        return len(items)
+
+    async def flush_done(self):
+        if len(self.done_ids) > 0:
+            done_ids = self.done_ids
+            self.done_ids = list()
+
+            try:
+                await self.persistent_storage.delete_outbox_items(item_ids=done_ids)
+            except Exception:
+                self.done_ids.extend(done_ids)
+                raise
+
+        if len(self.retry_items) > 0:
+            retry_items = self.retry_items
+            self.retry_items = list()
+
+            try:
+                await self.persistent_storage.retry_outbox_items(items=retry_items)
+            except Exception:
+                self.retry_items.extend(retry_items)
+                raise
+
+        if len(self.release_ids) > 0:
+            release_ids = self.release_ids
+            self.release_ids = list()
+
+            try:
+                await self.persistent_storage.release_outbox_items(item_ids=release_ids)
+            except Exception:
+                self.release_ids.extend(release_ids)
+                raise
+
+    @staticmethod
+    def get_send_func(job: DeliveryJob):
+        # migrated user chat is retried by its new id, which is not resolved by ingest
+        def send_func(client: TelegramClient, user_chat_id: int):
+            return client.forward_messages(
+                entity=job.user_peer if user_chat_id == job.user_chat_id else user_chat_id,
+                messages=job.message_ids,
+                from_peer=job.from_peer,
+                as_album=job.as_album)
+
+        return send_func
+
+    async def run_lane(self, lane_queue: Queue):
+        while True:
+            job = await lane_queue.get()
+            retrying_item_id = self.retrying_item_ids.get(job.user_chat_id, job.item_id)
+
+            if retrying_item_id == job.item_id:
+                # it is the retry itself or user chat has none
+                self.retrying_item_ids.pop(job.user_chat_id, None)
+                await self.deliver(job=job)
+            else:
+                get_logger().debug(f"Give back job=({job}) to wait for retry of item id={retrying_item_id}")
+                self.release_ids.append(job.item_id)
+
+            was_full = len(self.in_flight_ids) >= self.batch_size
+            self.in_flight_ids.discard(job.item_id)
+
+            if was_full:
+                self.wakeup.set()
+
+    async def deliver(self, job: DeliveryJob):
+        retries = list()
+
+        try:
+            with send_lane(SendLane.REALTIME):
+                retries = await self.delivery.deliver(
+                    bot_index=job.bot_index,
+                    user_chat_ids=[job.user_chat_id],
+                    send_func=self.get_send_func(job=job),
+                    chat_id=job.chat_id,
+                    attempt=job.attempt)
+        except Exception as e:
+            get_logger().error(f"Failed to deliver job=({job}): {str(e)}")
+
+        if len(retries) == 0:
+            self.done_ids.append(job.item_id)
+        elif retries[0].user_chat_id != job.user_chat_id:
+            # supergroup the group was upgraded to is not resolved by ingest, so item can not be kept for it
+            get_logger().warning(f"Drop retry={retries[0]} of job=({job}) to upgraded group")
+            self.done_ids.append(job.item_id)
+        else:
+            self.retry_items.append((job.item_id, retries[0].attempt - 1, retries[0].delay_seconds))
+            self.retrying_item_ids[job.user_chat_id] = job.item_id
+
+    # Stops claiming, gives queued items back to outbox and waits up to timeout_seconds for items being sent; items
+    # that are still not sent are given back too, so nothing is lost on restart. Failed items are given back with their
+    # retries
+    async def drain(self, timeout_seconds: float):
+        get_logger().info(f"Draining outbox consumer: {len(self.in_flight_ids)} items in flight")
+        self.is_draining = True
+        self.wakeup.set()
+        queued_ids = list()
+
+        for lane_queue in self.lane_queues:
+            while True:
+                try:
+                    queued_ids.append(lane_queue.get_nowait().item_id)
+                except QueueEmpty:
+                    break
+
+        self.in_flight_ids.difference_update(queued_ids)
+        await self.persistent_storage.release_outbox_items(item_ids=queued_ids)
+
+        deadline = monotonic() + timeout_seconds
+
+        while len(self.in_flight_ids) > 0 and monotonic() < deadline:
+            await sleep(0.1)
+
+        await self.flush_done()
+
+        if len(self.in_flight_ids) > 0:
+            get_logger().warning(f"{len(self.in_flight_ids)} outbox items were not sent in {timeout_seconds}s; "
+                                 f"give them back")
+            await self.persistent_storage.release_outbox_items(item_ids=list(self.in_flight_ids))
+
+        get_logger().info(f"Outbox consumer is drained; {len(queued_ids)} queued items were given back")
@@ -0,0 +1,65 @@
+from asyncio import gather
+
+from telethon import TelegramClient
+
+from common.logging import get_logger
+from common.persistent_storage.base import IPersistentStorage
+
+
+# Set of bots serving the same users base; every user chat is pinned to one of them, because bot can only message
+# users who started it. Bot with index 0 is the primary one: it receives forwarders messages and onboards new users
+class BotPool:
+    def __init__(self, clients: list, tokens: list):
+        if clients is None or len(clients) < 1:
+            raise RuntimeError("Bot pool must contain at least one bot")
+
+        if tokens is None or len(tokens) != len(clients):
+            raise RuntimeError(f"Invalid amount of tokens for pool of {len(clients)} bots")
+
+        self.clients = clients
+        self.tokens = tokens
+        # loaded on connect
+        self.usernames = [None] * len(clients)
+
+    def __len__(self):
+        return len(self.clients)
+
+    # logs in every bot of the pool concurrently
+    async def connect(self):
+        await gather(*[client.start(bot_token=token) for client, token in zip(self.clients, self.tokens)])
+
+        bots_me = await gather(*[client.get_me() for client in self.clients])
+        self.usernames = [me.username for me in bots_me]
+        get_logger().info(f"Bot pool of {len(self.clients)} bots: {self.usernames}")
+
+    async def disconnect(self):
+        await gather(*[client.disconnect() for client in self.clients])
+
+    def get_primary_client(self) -> TelegramClient:
+        return self.clients[0]
+
+    def get_client(self, bot_index: int) -> TelegramClient:
+        if 0 <= bot_index < len(self.clients):
+            return self.clients[bot_index]
+
+        # pool was shrunk; primary bot is the best guess, because every user used to start it first
+        get_logger().warning(f"Bot index={bot_index} is out of pool of {len(self.clients)} bots; use primary bot")
+
+        return self.get_primary_client()
+
+    def get_bot_index(self, client: TelegramClient) -> int:
+        for bot_index, pool_client in enumerate(self.clients):
+            if pool_client is client:
+                return bot_index
+
+        raise RuntimeError(f"Client={client} is not in bot pool")
+
+    # link of group start adds the bot to group chosen by user, where it is started right away
+    def get_start_link(self, bot_index: int, is_group: bool = False) -> str:
+        return f"https://t.me/{self.usernames[bot_index]}?{'startgroup' if is_group else 'start'}=start"
+
+    async def get_least_loaded_bot_index(self, persistent_storage: IPersistentStorage) -> int:
+        bot_loads = await persistent_storage.get_bot_loads()
+        get_logger().debug(f"Bot loads={bot_loads}")
+
+        return min(range(len(self.clients)), key=lambda bot_index: bot_loads.get(bot_index, 0))
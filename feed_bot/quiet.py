@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from common.logging import get_logger
+from common.persistent_storage.base import IPersistentStorage
+
+
+g_minutes_per_day = 24 * 60
+
+
+# returns time quiet hours end at if time is inside them or None otherwise; minutes are utc minutes of day and quiet
+# hours that end before they start span midnight
+def get_quiet_end_time(from_minute: int, to_minute: int, time: datetime) -> Optional[datetime]:
+    minute = time.hour * 60 + time.minute
+
+    if from_minute <= to_minute:
+        is_quiet = from_minute <= minute < to_minute
+    else:
+        is_quiet = from_minute <= minute or minute < to_minute
+
+    if not is_quiet:
+        return None
+
+    end_time = time.replace(hour=to_minute // 60, minute=to_minute % 60, second=0, microsecond=0)
+
+    if end_time <= time:
+        end_time += timedelta(days=1)
+
+    return end_time
+
+
+# Quiet hours of user chats; posts coming to user chat during them are deferred till they end
+class QuietHours:
+    def __init__(self, persistent_storage: IPersistentStorage):
+        self.persistent_storage = persistent_storage
+        self.user_chat_quiet_hours = None
+
+    def invalidate(self):
+        get_logger().info("Invalidating quiet hours")
+        self.user_chat_quiet_hours = None
+
+    # user_chat_times is user_chat_id -> time post is to be delivered at; returns user_chat_id -> time quiet hours end
+    # at for user chats whose time is inside their quiet hours
+    async def get_quiet_end_times(self, user_chat_times: dict) -> dict:
+        if self.user_chat_quiet_hours is None:
+            self.user_chat_quiet_hours = await self.persistent_storage.get_quiet_hours()
+            get_logger().debug(f"Loaded quiet hours of {len(self.user_chat_quiet_hours)} user chats")
+
+        quiet_end_times = dict()
+
+        for user_chat_id, time in user_chat_times.items():
+            quiet_hours = self.user_chat_quiet_hours.get(user_chat_id)
+
+            if quiet_hours is None:
+                continue
+
+            quiet_end_time = get_quiet_end_time(from_minute=quiet_hours[0], to_minute=quiet_hours[1], time=time)
+
+            if quiet_end_time is not None:
+                quiet_end_times[user_chat_id] = quiet_end_time
+
+        return quiet_end_times
@@ -0,0 +1,175 @@
+from asyncio import ensure_future, sleep
+from time import monotonic
+
+from telethon import TelegramClient
+
+from common.handler import get_resolve_descriptor, resolve_entity_try_cache
+from common.logging import get_logger
+from common.protocol import g_resolver_request_command, g_resolver_separator, g_resolver_response_error_prefix
+
+
+# weight of the latest resolve in smoothed latency of resolver
+g_latency_smoothing = 0.2
+
+
+class ResolverHealth:
+    def __init__(self, resolver_index: int):
+        self.resolver_index = resolver_index
+        self.in_flight_count = 0
+        # exponentially smoothed latency of successful resolves; None until the first one
+        self.latency_seconds = None
+        self.consecutive_failures_count = 0
+        # monotonic time until which resolver is out of rotation
+        self.open_until = 0
+
+    def is_healthy(self, now: float) -> bool:
+        return self.open_until <= now
+
+    def __repr__(self):
+        return f"resolver_index={self.resolver_index}, in_flight={self.in_flight_count}, " \
+               f"latency_seconds={self.latency_seconds}, failures={self.consecutive_failures_count}"
+
+
+# Spreads resolve requests over resolvers: every request goes to the least loaded healthy resolver, resolver that
+# fails failures_threshold times in a row is taken out of rotation for open_seconds. After that it is tried again and
+# the first failure takes it out again. Resolvers are the same for every bot of the pool, but their entities & replies
+# are bound to the bot that talks to them, so every bot is added with its own. Concurrent resolves of the same arg are
+# coalesced into one, whichever bot they come to
+class ResolverDispatcher:
+    def __init__(
+            self,
+            resolvers_count: int,
+            max_wait_count: int,
+            timeout_seconds: float,
+            warning_wait_number: int,
+            failures_threshold: int,
+            open_seconds: float):
+        if resolvers_count < 1:
+            raise RuntimeError(f"Invalid resolvers_count={resolvers_count}")
+
+        if failures_threshold < 1:
+            raise RuntimeError(f"Invalid failures_threshold={failures_threshold}")
+
+        if open_seconds <= 0:
+            raise RuntimeError(f"Invalid open_seconds={open_seconds}")
+
+        self.max_wait_count = max_wait_count
+        self.timeout_seconds = timeout_seconds
+        # users are told that resolve might take time once it is waited for that long
+        self.warning_seconds = (warning_wait_number - 1) * timeout_seconds
+        self.failures_threshold = failures_threshold
+        self.open_seconds = open_seconds
+        self.healths = [ResolverHealth(resolver_index=resolver_index) for resolver_index in range(resolvers_count)]
+        # client -> (resolver entities in order of resolvers, resolver replies)
+        self.clients = dict()
+        # key -> future of resolve in flight
+        self.in_flight = dict()
+
+    def add_client(self, client: TelegramClient, resolver_entities: list, resolver_replies: dict):
+        if len(resolver_entities) != len(self.healths):
+            raise RuntimeError(f"Expected {len(self.healths)} resolver entities, got {len(resolver_entities)}")
+
+        self.clients[client] = resolver_entities, resolver_replies
+
+    # returns future of (chat id, title, joiner) of private channel by joinchat link
+    def resolve_link(self, client: TelegramClient, link: str):
+        return self.get_single_flight(key=("link", link), coro_func=lambda: self.query(client=client, link=link))
+
+    # returns future of entity of public channel by username or link; usernames are resolved by bot itself
+    def resolve_username(self, client: TelegramClient, username: str):
+        return self.get_single_flight(
+            key=("username", username.lower()), coro_func=lambda: resolve_entity_try_cache(client, username))
+
+    # Internal
+    # the first caller starts coro_func(), the rest get the same future until it is done
+    def get_single_flight(self, key: tuple, coro_func):
+        future = self.in_flight.get(key)
+
+        if future is not None:
+            get_logger().debug(f"Resolve of {key} is in flight already; join it")
+            return future
+
+        future = ensure_future(coro_func())
+        self.in_flight[key] = future
+        future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+
+        return future
+
+    def choose(self) -> ResolverHealth:
+        now = monotonic()
+        healthy = [health for health in self.healths if health.is_healthy(now=now)]
+
+        # resolving does not stop when every resolver is out; the one to come back first is tried
+        if len(healthy) == 0:
+            health = min(self.healths, key=lambda health: health.open_until)
+            get_logger().warning(f"Every resolver is out of rotation; try the one to come back first: {health}")
+
+            return health
+
+        return min(healthy, key=lambda health: (health.in_flight_count, health.latency_seconds or 0))
+
+    async def query(self, client: TelegramClient, link: str) -> tuple:
+        health = self.choose()
+        resolver_entities, resolver_replies = self.clients[client]
+        get_logger().info(msg=f"{link} is joinchat link, assuming it's to private channel; query resolver: {health}")
+        health.in_flight_count += 1
+        start_time = monotonic()
+
+        try:
+            reply_text = await self.request(
+                client=client,
+                resolver_entity=resolver_entities[health.resolver_index],
+                resolver_replies=resolver_replies,
+                link=link)
+        except Exception as e:
+            self.on_failure(health=health, error=e)
+            raise
+        finally:
+            health.in_flight_count -= 1
+
+        self.on_success(health=health, latency_seconds=monotonic() - start_time)
+
+        # resolver did its job even if link is bad
+        if reply_text.startswith(g_resolver_response_error_prefix):
+            raise RuntimeError(f"Resolver failed to resolve {link}: {reply_text}")
+
+        return tuple(reply_text.split(g_resolver_separator))
+
+    async def request(self, client: TelegramClient, resolver_entity, resolver_replies: dict, link: str) -> str:
+        # send resolve request to resolver
+        sent_message = await client.send_message(resolver_entity, f"{g_resolver_request_command} {link}")
+        resolver_id = await client.get_peer_id(resolver_entity)
+        resolve_descriptor = get_resolve_descriptor(resolver_id=resolver_id, message_id=sent_message.id)
+
+        # await reply to that request; but don't wait forever: raise on timeout
+        waits = 1
+        while resolve_descriptor not in resolver_replies:
+            if self.max_wait_count < waits:
+                raise RuntimeError(f"Resolver' reply to {resolve_descriptor} was not received in "
+                                   f"{self.max_wait_count * self.timeout_seconds}s")
+
+            get_logger().debug(
+                f"waiting for resolver' reply to {resolve_descriptor}, wait#{waits} for {self.timeout_seconds}s")
+            await sleep(self.timeout_seconds)
+            waits += 1
+
+        reply_text = resolver_replies.pop(resolve_descriptor)
+        get_logger().debug(f"reply to={resolve_descriptor} was received={reply_text}")
+
+        return reply_text
+
+    def on_success(self, health: ResolverHealth, latency_seconds: float):
+        health.consecutive_failures_count = 0
+
+        if health.latency_seconds is None:
+            health.latency_seconds = latency_seconds
+        else:
+            health.latency_seconds += g_latency_smoothing * (latency_seconds - health.latency_seconds)
+
+    def on_failure(self, health: ResolverHealth, error: Exception):
+        health.consecutive_failures_count += 1
+        get_logger().warning(f"Resolver failed: {health}: {str(error)}")
+
+        if health.consecutive_failures_count >= self.failures_threshold:
+            health.open_until = monotonic() + self.open_seconds
+            get_logger().error(f"Resolver is out of rotation for {self.open_seconds}s: {health}")
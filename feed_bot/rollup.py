@@ -0,0 +1,72 @@
+from asyncio import sleep
+from datetime import datetime, timezone
+from enum import Enum
+
+from common.logging import get_logger
+from common.persistent_storage.base import IPersistentStorage
+
+
+# order matches counter columns of rollup tables
+class ChannelCounter(Enum):
+    POSTS = 0
+    DELIVERIES = 1
+    FAILURES = 2
+    DUPLICATES = 3  # posts suppressed because the same post was already handled
+    UNFOLLOWS = 4
+
+
+def get_hour_bucket(now: datetime) -> datetime:
+    return now.replace(minute=0, second=0, microsecond=0)
+
+
+# Per channel counters are aggregated in memory by hour and flushed every flush_seconds as upserts into hourly and
+# daily rollup tables, so counting costs no db round trip per event. Counters of failed flush are kept for the next one
+class ChannelRollups:
+    def __init__(self, persistent_storage: IPersistentStorage, flush_seconds: float):
+        if flush_seconds <= 0:
+            raise RuntimeError(f"Invalid flush_seconds={flush_seconds}")
+
+        self.persistent_storage = persistent_storage
+        self.flush_seconds = flush_seconds
+        # (chat id, hour bucket) -> list of counts indexed by ChannelCounter
+        self.counters = dict()
+
+    def add(self, chat_id: int, counter: ChannelCounter, count: int = 1):
+        if chat_id is None or count == 0:
+            return
+
+        key = chat_id, get_hour_bucket(datetime.now(timezone.utc))
+        self.counters.setdefault(key, [0] * len(ChannelCounter))[counter.value] += count
+
+    async def run(self):
+        get_logger().info("Starting channel rollups")
+
+        while True:
+            await sleep(self.flush_seconds)
+
+            try:
+                await self.flush()
+            except Exception as e:
+                get_logger().error(f"Failed to flush channel rollups: {str(e)}")
+
+    async def flush(self):
+        if len(self.counters) == 0:
+            return
+
+        counters = self.counters
+        self.counters = dict()
+        rows = [(chat_id, hour, *counts) for (chat_id, hour), counts in counters.items()]
+
+        try:
+            await self.persistent_storage.add_channel_rollups(rows=rows)
+        except Exception:
+            # merge back, so nothing is lost
+            for key, counts in counters.items():
+                merged = self.counters.setdefault(key, [0] * len(ChannelCounter))
+
+                for idx, count in enumerate(counts):
+                    merged[idx] += count
+
+            raise
+
+        get_logger().debug(f"Flushed {len(rows)} channel rollups")
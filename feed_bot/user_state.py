@@ -0,0 +1,49 @@
+from typing import Optional
+
+from common.cache import TtlLruCache
+from common.logging import get_logger
+from common.persistent_storage.base import IPersistentStorage
+from common.resources.localization import Language
+from common.telegram import ChatType
+
+
+class UserState:
+    # language & chat type are None if user chat never existed
+    def __init__(self, is_enrolled: bool, language: Optional[Language], chat_type: Optional[ChatType]):
+        self.is_enrolled = is_enrolled
+        self.language = language
+        self.chat_type = chat_type
+
+    def __repr__(self):
+        return f"is_enrolled={self.is_enrolled}, language={self.language}, chat_type={self.chat_type}"
+
+
+# Enrollment, language & chat type of user chats shared by every handler, so common command path makes no db round
+# trip. States are read through from storage, put by /start & /stop and invalidated by user chats update notify;
+# ttl only guards against notifies lost while listen connection was down
+class UserStateCache:
+    def __init__(self, persistent_storage: IPersistentStorage, max_size: int, ttl_seconds: float):
+        self.persistent_storage = persistent_storage
+        # user chat id -> UserState
+        self.cache = TtlLruCache(max_size=max_size, ttl_seconds=ttl_seconds)
+
+    async def get(self, user_chat_id: int) -> UserState:
+        state = self.cache.get(user_chat_id)
+
+        if state is None:
+            is_enrolled, language, chat_type = await self.persistent_storage.get_user_chat_state(
+                user_chat_id=user_chat_id)
+            state = UserState(is_enrolled=is_enrolled, language=language, chat_type=chat_type)
+            get_logger().debug(f"Loaded state of user chat={user_chat_id}: {state}")
+            self.cache.put(user_chat_id, state)
+
+        return state
+
+    def put(self, user_chat_id: int, state: UserState):
+        self.cache.put(user_chat_id, state)
+
+    def invalidate(self, user_chat_id: int):
+        self.cache.pop(user_chat_id)
+
+    def clear(self):
+        self.cache.clear()
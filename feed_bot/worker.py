@@ -0,0 +1,203 @@
+from asyncio import gather, get_event_loop
+from multiprocessing import get_context
+
+from common.analytics import AnalyticsConfig, configure_analytics
+from common.client import CommonConfig, ClientWithPersistentStorage
+from common.session import SessionsConfig, create_session, get_bot_session_scope
+from common.logging import configure_logging, get_logger
+from common.persistent_storage.factory import PersistenceConfig
+from delivery import DeliveryService
+from lanes import LanedTelegramClient, SendLanes, SendLanesConfig
+from outbox import OutboxConsumer
+from pool import BotPool
+from rollup import ChannelRollups
+
+
+class DeliveryWorkerConfig(CommonConfig):
+    def __init__(
+            self,
+            api_id: int,
+            api_hash: str,
+            tokens: list,
+            worker_index: int,
+            workers_count: int,
+            lanes_count: int,
+            delivery_max_attempts: int,
+            delivery_retry_delay_seconds: float,
+            delivery_max_flood_wait_seconds: float,
+            delivery_flush_seconds: float,
+            outbox_batch_size: int,
+            outbox_lease_seconds: float,
+            outbox_poll_seconds: float,
+            outbox_deferred_release_per_second: float,
+            drain_timeout_seconds: float,
+            rollups_flush_seconds: float,
+            send_lanes_config: SendLanesConfig,
+            analytics_config: AnalyticsConfig,
+            persistence_config: PersistenceConfig,
+            sessions_config: SessionsConfig):
+        super(DeliveryWorkerConfig, self).__init__(
+            api_id=api_id, api_hash=api_hash, persistence_config=persistence_config, sessions_config=sessions_config)
+
+        if tokens is None or len(tokens) < 1:
+            raise RuntimeError("Invalid tokens: none or empty")
+
+        if worker_index < 0 or workers_count <= worker_index:
+            raise RuntimeError(f"Invalid worker_index={worker_index} workers_count={workers_count}")
+
+        if lanes_count < 1:
+            raise RuntimeError(f"Invalid lanes_count={lanes_count}")
+
+        if send_lanes_config is None:
+            raise RuntimeError("No send lanes config")
+
+        if analytics_config is None:
+            raise RuntimeError("No analytics config")
+
+        self.tokens = tokens
+        self.worker_index = worker_index
+        self.workers_count = workers_count
+        self.lanes_count = lanes_count
+        self.delivery_max_attempts = delivery_max_attempts
+        self.delivery_retry_delay_seconds = delivery_retry_delay_seconds
+        self.delivery_max_flood_wait_seconds = delivery_max_flood_wait_seconds
+        self.delivery_flush_seconds = delivery_flush_seconds
+        self.outbox_batch_size = outbox_batch_size
+        self.outbox_lease_seconds = outbox_lease_seconds
+        self.outbox_poll_seconds = outbox_poll_seconds
+        self.outbox_deferred_release_per_second = outbox_deferred_release_per_second
+        self.drain_timeout_seconds = drain_timeout_seconds
+        self.rollups_flush_seconds = rollups_flush_seconds
+        self.send_lanes_config = send_lanes_config
+        self.analytics_config = analytics_config
+
+    def __repr__(self):
+        return super(DeliveryWorkerConfig, self).__repr__() + f", tokens=*** ({len(self.tokens)}), " \
+                                                              f"worker_index={self.worker_index}, " \
+                                                              f"workers_count={self.workers_count}, " \
+                                                              f"lanes_count={self.lanes_count}"
+
+
+class DeliveryWorker(ClientWithPersistentStorage):
+    # ClientWithPersistentStorage overrides
+    def get_continuous_async_tasks(self):
+        return super(DeliveryWorker, self).get_continuous_async_tasks() + [
+            client.run_until_disconnected() for client in self.pool.clients[1:]] + [
+            self.persistent_storage.listen(
+                notifies_to_handlers=self.notifies_to_handlers,
+                should_run_func=self.client.is_connected),
+            self.delivery.run(),
+            self.analytics.run(),
+            self.rollups.run()] + self.consumer.get_continuous_async_tasks()
+
+    def get_telegram_clients(self) -> list:
+        return self.pool.clients
+
+    async def connect_telegram(self):
+        await self.pool.connect()
+
+    async def prepare(self):
+        await self.persistent_storage.subscribe(notifies_to_handlers=self.notifies_to_handlers)
+
+    async def shutdown(self):
+        await self.consumer.drain(timeout_seconds=self.config.drain_timeout_seconds)
+        await gather(self.rollups.flush(), self.analytics.flush(), return_exceptions=True)
+
+    async def disconnect(self):
+        await self.pool.disconnect()
+
+    def __init__(self, config: DeliveryWorkerConfig):
+        if config is None:
+            raise RuntimeError("No config passed")
+
+        self.config = config
+        get_logger().info(msg="Creating DeliveryWorker object with config: {}".format(self.config))
+
+        # every worker logs in with its own sessions of pool bots
+        clients = [
+            LanedTelegramClient(
+                create_session(
+                    name=f'feed_bot_worker{config.worker_index}_{bot_index}',
+                    scope=get_bot_session_scope(token=token),
+                    config=self.config.sessions_config),
+                api_id=config.api_id,
+                api_hash=config.api_hash,
+                lanes=SendLanes(
+                    name=f"feed_bot_worker{config.worker_index} bot {bot_index}", config=self.config.send_lanes_config))
+            for bot_index, token in enumerate(self.config.tokens)]
+
+        super(DeliveryWorker, self).__init__(client=clients[0], persistence_config=self.config.persistence_config)
+
+        self.analytics = configure_analytics(
+            name=f"feed_bot_worker{config.worker_index}",
+            persistent_storage=self.persistent_storage,
+            config=self.config.analytics_config)
+
+        self.pool = BotPool(clients=clients, tokens=self.config.tokens)
+        self.rollups = ChannelRollups(
+            persistent_storage=self.persistent_storage, flush_seconds=self.config.rollups_flush_seconds)
+        self.delivery = DeliveryService(
+            persistent_storage=self.persistent_storage,
+            pool=self.pool,
+            rollups=self.rollups,
+            max_attempts=self.config.delivery_max_attempts,
+            retry_delay_seconds=self.config.delivery_retry_delay_seconds,
+            max_flood_wait_seconds=self.config.delivery_max_flood_wait_seconds,
+            flush_seconds=self.config.delivery_flush_seconds)
+        # worker consumes its own partition of outbox
+        self.consumer = OutboxConsumer(
+            persistent_storage=self.persistent_storage,
+            delivery=self.delivery,
+            partition_index=self.config.worker_index,
+            partitions_count=self.config.workers_count,
+            lanes_count=self.config.lanes_count,
+            batch_size=self.config.outbox_batch_size,
+            lease_seconds=self.config.outbox_lease_seconds,
+            poll_seconds=self.config.outbox_poll_seconds,
+            deferred_release_per_second=self.config.outbox_deferred_release_per_second)
+        self.notifies_to_handlers = {"notify_delivery_outbox": self.consumer.on_outbox_update}
+
+
+# entry point of worker process
+def run_delivery_worker(config: DeliveryWorkerConfig):
+    configure_logging(name=f"feed_bot_worker{config.worker_index}")
+    DeliveryWorker(config=config).run()
+
+
+# Processes that deliver outbox items, each its own partition of user chats
+class DeliveryWorkersPool:
+    def __init__(self, configs: list):
+        if configs is None or len(configs) < 1:
+            raise RuntimeError("Delivery workers pool must contain at least one worker")
+
+        # spawn, because forked child would inherit running event loop & telegram connections of ingest
+        self.context = get_context("spawn")
+        self.configs = configs
+        self.processes = list()
+
+    def __len__(self):
+        return len(self.configs)
+
+    def start(self):
+        get_logger().info(f"Starting {len(self.configs)} delivery workers")
+
+        for config in self.configs:
+            process = self.context.Process(
+                target=run_delivery_worker,
+                args=(config,),
+                name=f"feed_bot_worker{config.worker_index}",
+                daemon=True)
+            process.start()
+            self.processes.append(process)
+
+    # workers drain on SIGTERM on their own; they get it from service manager too, this is for the case they don't
+    async def stop(self, timeout_seconds: float):
+        get_logger().info(f"Stopping {len(self.processes)} delivery workers")
+        loop = get_event_loop()
+
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+
+        await gather(*[
+            loop.run_in_executor(None, process.join, timeout_seconds) for process in self.processes])
@@ -8,8 +8,41 @@ db_password = None
 db_host = "localhost"
 db_port = 5432
 
+# db pools; lookups of hot read path don't wait for connections behind slow writes. Statements running longer than
+# timeout are cancelled; 0 means no timeout
+db_read_pool_min_size = 1
+db_read_pool_max_size = 10
+db_read_pool_statement_timeout_ms = 10000
+db_write_pool_min_size = 1
+db_write_pool_max_size = 10
+db_write_pool_statement_timeout_ms = 30000
+# acquire waiting longer is warned about as pool saturation; pools stats are logged every db_pool_stats_seconds
+db_pool_acquire_warning_ms = 100
+db_pool_stats_seconds = 60.0
+db_pool_stats_window_size = 10000
+
+# telegram sessions; kept in db if persistence is postgres, so session survives moving forwarder to another host.
+# Existing sqlite session file is imported on first run. Changes are written every sessions_flush_seconds. Session in
+# db is per forwarder: {} is replaced by its intervals
+sessions_in_storage = True
+sessions_flush_seconds = 5.0
+session_name_format = "forwarder_{}"
+
 # other
-feedbot_username = "@channel_aggregator_bot"
-modification_time_handicap_seconds = 10
+# bots of feed bot pool; first one is primary
+feedbot_usernames = ["@channel_aggregator_bot"]
 validation_hour = 4
 album_timeout_seconds = 5
+# updates dropped by prefilter before message handlers are counted & logged every prefilter_stats_seconds
+prefilter_stats_seconds = 60.0
+# public channels posts are passed to feed bot through db instead of telegram messages; needs bot that consumes them
+handoff_public_posts = True
+
+# outbound queue to feed bots; posts are collected for outbound_flush_seconds and sent in one control message per bot.
+# Sends are paced to outbound_sends_per_second with bursts of up to outbound_burst sends. Posts not sent yet are kept
+# in journal file, which is per forwarder: {} is replaced by its intervals
+outbound_journal_file_path_format = "forwarder_{}.outbound.sqlite"
+outbound_flush_seconds = 1.0
+outbound_sends_per_second = 1.0
+outbound_burst = 5
+outbound_max_message_length = 4000
@@ -5,14 +5,17 @@ from typing import Optional
 from telethon import TelegramClient, events
 from telethon.tl.functions.channels import JoinChannelRequest
 
-from common.handler import resolve_entity_try_cache
 from common.logging import get_logger
 from common.persistent_storage.factory import PersistenceConfig
 from common.client import CommonConfig, ClientWithPersistentStorage
+from common.session import SessionsConfig, create_session
+from common.startup import report_startup_stage
 from common.telegram import contains_joinchat_link, join_link
 
 from handlers.message import MessageHandler
 from handlers.album import AlbumHandler
+from handlers.prefilter import PrefilterHandler
+from outbound import OutboundJournal, OutboundQueue
 
 from common.interval import MultiInterval
 
@@ -24,57 +27,172 @@ class ForwarderConfig(CommonConfig):
             api_hash: str,
             monitored_chats_id_interval: MultiInterval,
             persistence_config: PersistenceConfig,
-            feedbot_username: str,
-            modification_time_handicap_seconds: int,
+            sessions_config: SessionsConfig,
+            session_name: str,
+            feedbot_usernames: list,
             validation_hour: int,
-            album_timeout_seconds: float):
+            album_timeout_seconds: float,
+            prefilter_stats_seconds: float,
+            handoff_public_posts: bool,
+            outbound_journal_file_path: str,
+            outbound_flush_seconds: float,
+            outbound_sends_per_second: float,
+            outbound_burst: int,
+            outbound_max_message_length: int):
         super(ForwarderConfig, self).__init__(
-            api_id=api_id, api_hash=api_hash, persistence_config=persistence_config)
+            api_id=api_id, api_hash=api_hash, persistence_config=persistence_config, sessions_config=sessions_config)
+
+        if session_name is None or len(session_name) < 1:
+            raise RuntimeError("Invalid session_name: none or empty")
+
+        if feedbot_usernames is None or len(feedbot_usernames) < 1:
+            raise RuntimeError("Invalid feedbot_usernames: none or empty")
+
+        if prefilter_stats_seconds <= 0:
+            raise RuntimeError(f"Invalid prefilter_stats_seconds={prefilter_stats_seconds}")
+
+        if outbound_journal_file_path is None or len(outbound_journal_file_path) < 1:
+            raise RuntimeError("Invalid outbound_journal_file_path: none or empty")
+
+        if outbound_flush_seconds <= 0:
+            raise RuntimeError(f"Invalid outbound_flush_seconds={outbound_flush_seconds}")
+
+        if outbound_sends_per_second <= 0:
+            raise RuntimeError(f"Invalid outbound_sends_per_second={outbound_sends_per_second}")
+
+        if outbound_burst < 1:
+            raise RuntimeError(f"Invalid outbound_burst={outbound_burst}")
+
+        # telegram message is at most 4096 chars
+        if outbound_max_message_length < 1 or outbound_max_message_length > 4096:
+            raise RuntimeError(f"Invalid outbound_max_message_length={outbound_max_message_length}")
+
         self.monitored_chats_id_interval = monitored_chats_id_interval
-        self.feedbot_username = feedbot_username
-        self.modification_time_handicap_seconds = modification_time_handicap_seconds
+        self.session_name = session_name
+        self.feedbot_usernames = feedbot_usernames
         self.validation_hour = validation_hour
         self.album_timeout_seconds = album_timeout_seconds
+        self.prefilter_stats_seconds = prefilter_stats_seconds
+        self.handoff_public_posts = handoff_public_posts
+        self.outbound_journal_file_path = outbound_journal_file_path
+        self.outbound_flush_seconds = outbound_flush_seconds
+        self.outbound_sends_per_second = outbound_sends_per_second
+        self.outbound_burst = outbound_burst
+        self.outbound_max_message_length = outbound_max_message_length
 
     def __repr__(self):
         return super(ForwarderConfig, self).__repr__()\
-               + f", feedbot_username={self.feedbot_username}" \
+               + f", session_name={self.session_name}" \
+                 f", feedbot_usernames={self.feedbot_usernames}" \
                  f", monitored_chats_id_interval={self.monitored_chats_id_interval}" \
-                 f", modification_time_handicap_seconds={self.modification_time_handicap_seconds}" \
                  f", validation_hour={self.validation_hour}" \
-                 f", album_timeout_seconds={self.album_timeout_seconds}"
+                 f", album_timeout_seconds={self.album_timeout_seconds}" \
+                 f", prefilter_stats_seconds={self.prefilter_stats_seconds}" \
+                 f", handoff_public_posts={self.handoff_public_posts}" \
+                 f", outbound_journal_file_path={self.outbound_journal_file_path}" \
+                 f", outbound_flush_seconds={self.outbound_flush_seconds}" \
+                 f", outbound_sends_per_second={self.outbound_sends_per_second}" \
+                 f", outbound_burst={self.outbound_burst}" \
+                 f", outbound_max_message_length={self.outbound_max_message_length}"
 
 
 class Forwarder(ClientWithPersistentStorage):
     # ClientWithPersistentStorage overrides
+    async def setup(self):
+        # input entities are enough to send to feed bots and are taken from session, which keeps them between runs
+        get_logger().info(f"Resolving feedbot_usernames={self.config.feedbot_usernames}")
+        self.feedbot_entities = await gather(
+            *[self.client.get_input_entity(username) for username in self.config.feedbot_usernames])
+        # posts are sent to feed bots in batches; ones not sent before restart are kept in journal
+        self.outbound = OutboundQueue(
+            client=self.client,
+            handoff_storage=self.persistent_storage if self.config.handoff_public_posts else None,
+            feedbot_entities=self.feedbot_entities,
+            journal=OutboundJournal(file_path=self.config.outbound_journal_file_path),
+            flush_seconds=self.config.outbound_flush_seconds,
+            sends_per_second=self.config.outbound_sends_per_second,
+            burst=self.config.outbound_burst,
+            max_message_length=self.config.outbound_max_message_length)
+
+        # Add prefilter. The order matters! Must be added before message handlers, so dropped updates are never built
+        # into their events. Monitored channels are loaded before, so nothing is dropped until then; cursor is not
+        # touched, so first run still compares whole state
+        chat_to_enabled_joiner_dict, _ = await self.persistent_storage.get_monitored_channels_delta(
+            prev_seq=None, monitored_chats_id_interval=self.config.monitored_chats_id_interval)
+        self.prefilter.update_channels(chat_to_enabled_joiner_dict=chat_to_enabled_joiner_dict, is_whole_state=True)
+        self.client.add_event_handler(callback=self.prefilter, event=events.Raw())
+
+        # Add album handler. The order matters! Must be added before message handler
+        self.client.add_event_handler(
+            callback=AlbumHandler(
+                persistent_storage=self.persistent_storage,
+                outbound=self.outbound,
+                album_timeout_seconds=self.config.album_timeout_seconds),
+            event=events.NewMessage(func=lambda e: e.grouped_id, incoming=True, outgoing=False))
+
+        # Add message handler
+        self.client.add_event_handler(
+            callback=MessageHandler(
+                persistent_storage=self.persistent_storage, outbound=self.outbound),
+            event=events.NewMessage(func=lambda e: not e.grouped_id, incoming=True, outgoing=False))
+
     async def prepare(self):
         # Sub to list of notifies
         get_logger().info("Subbing to notifies ...")
         await self.persistent_storage.subscribe(notifies_to_handlers=self.notifies_to_handlers)
-        get_logger().info("Ensure joined and db channels are in sync")
-        await self.compare_telegram_subs_with_db()
+        # position in monitored chat change log is kept between runs, so only changes missed while down are caught up
+        self.monitored_chat_changes_seq = await self.persistent_storage.get_monitored_chat_changes_cursor(
+            consumer=self.monitored_chat_changes_consumer)
+        get_logger().info(f"Monitored chat changes cursor of consumer={self.monitored_chat_changes_consumer} "
+                          f"is {self.monitored_chat_changes_seq}")
 
     def get_continuous_async_tasks(self):
         return super(Forwarder, self).get_continuous_async_tasks() + [
             self.persistent_storage.listen(
                 notifies_to_handlers=self.notifies_to_handlers,
                 should_run_func=self.client.is_connected),
-            self.validation_task()]
+            self.validation_task(),
+            self.outbound.run()]
+
+    async def disconnect(self):
+        await super(Forwarder, self).disconnect()
+
+        if self.outbound is not None:
+            self.outbound.journal.close()
 
     # Forwarder
-    async def get_monitored_chats_delta(self, prev_max_time: Optional[str]):
-        chat_to_enabled_joiner_dict, new_max_time = await self.persistent_storage.get_monitored_channels_delta(
-            handicap_seconds=self.config.modification_time_handicap_seconds,
-            prev_max_time=prev_max_time,
+    # prev_seq=None means whole state; call save_monitored_chat_changes_seq once the delta is handled
+    async def get_monitored_chats_delta(self, prev_seq: Optional[int]):
+        chat_to_enabled_joiner_dict, new_seq = await self.persistent_storage.get_monitored_channels_delta(
+            prev_seq=prev_seq,
             monitored_chats_id_interval=self.config.monitored_chats_id_interval)
-        get_logger().info(f"Max monitored channels mod time {self.monitored_channels_max_mod_time} -> {new_max_time}")
-        self.monitored_channels_max_mod_time = new_max_time
+        get_logger().info(f"Monitored chat changes seq {self.monitored_chat_changes_seq} -> {new_seq}")
+        self.monitored_chat_changes_seq = max(new_seq, self.monitored_chat_changes_seq or 0)
+        self.prefilter.update_channels(
+            chat_to_enabled_joiner_dict=chat_to_enabled_joiner_dict, is_whole_state=prev_seq is None)
 
         return chat_to_enabled_joiner_dict
 
+    async def save_monitored_chat_changes_seq(self):
+        await self.persistent_storage.set_monitored_chat_changes_cursor(
+            consumer=self.monitored_chat_changes_consumer, seq=self.monitored_chat_changes_seq)
+
     async def validation_task(self):
         get_logger().info("Starting validation task")
 
+        # messages are handled already, so first validation does not delay them. Changes made while forwarder was down
+        # are caught up from the log; full comparison is needed only on the very first run, which has no cursor yet
+        try:
+            if self.monitored_chat_changes_seq is None:
+                get_logger().info("Ensure joined and db channels are in sync")
+                await self.compare_telegram_subs_with_db()
+            else:
+                await self.on_monitored_chat_changes(payload=str())
+
+            report_startup_stage("validated")
+        except Exception as e:
+            get_logger().error(f"Failed to validate joined and db channels on start: {str(e)}")
+
         while True:
             now = datetime.today()
             future = datetime(now.year, now.month, now.day, self.config.validation_hour, 0)
@@ -85,16 +203,21 @@ class Forwarder(ClientWithPersistentStorage):
             await sleep(sleep_seconds)
             await self.compare_telegram_subs_with_db()
 
-    async def on_subscriptions_update(self):
-        get_logger().info("Handler for subscriptions update notify called")
+    async def on_monitored_chat_changes(self, payload: str):
+        get_logger().info("Handler for monitored chat changes notify called")
+
+        # whole state is compared on first run, so there is no delta until then
+        if self.monitored_chat_changes_seq is None:
+            get_logger().info("Monitored chat changes cursor is not set yet; skip")
+            return
 
-        chat_to_enabled_joiner_dict = await self.get_monitored_chats_delta(
-            prev_max_time=self.monitored_channels_max_mod_time)
+        chat_to_enabled_joiner_dict = await self.get_monitored_chats_delta(prev_seq=self.monitored_chat_changes_seq)
         enabled_joiners = [joiner for chat_id, (enabled, joiner) in chat_to_enabled_joiner_dict.items() if enabled]
         get_logger().info(f"Delta monitored_channels enabled count={len(enabled_joiners)}: {enabled_joiners}")
 
         # join missing
         await self.join_chats(joiners=enabled_joiners)
+        await self.save_monitored_chat_changes_seq()
 
     async def join_username(self, username: str):
         # sometimes channels might get deleted so they wont resolve
@@ -129,7 +252,7 @@ class Forwarder(ClientWithPersistentStorage):
         get_logger().debug(f"Got {len(joined_chat_ids)} dialogs")
 
         # Get chats to monitor from db
-        chat_to_enabled_joiner_dict = await self.get_monitored_chats_delta(prev_max_time=None)
+        chat_to_enabled_joiner_dict = await self.get_monitored_chats_delta(prev_seq=None)
 
         # Now compare
         joined_not_in_db = [chat_id for chat_id in joined_chat_ids if chat_id not in chat_to_enabled_joiner_dict]
@@ -140,6 +263,11 @@ class Forwarder(ClientWithPersistentStorage):
 
         # join missing
         await self.join_chats(joiners=in_db_not_joined)
+        await self.save_monitored_chat_changes_seq()
+
+        # change log is only read past cursors, so what every forwarder consumed is dropped once a day
+        deleted_count = await self.persistent_storage.delete_consumed_monitored_chat_changes()
+        get_logger().info(f"Deleted {deleted_count} consumed monitored chat changes")
 
     def __init__(self, config: ForwarderConfig):
         if config is None:
@@ -147,29 +275,25 @@ class Forwarder(ClientWithPersistentStorage):
 
         self.config = config
         get_logger().info(msg="Creating Forwarder object with config: {}".format(self.config))
-        self.monitored_channels_max_mod_time = None
-        self.notifies_to_handlers = {"notify_subscriptions_updated": self.on_subscriptions_update}
+        # seq of the last handled monitored chat change; None until the first full comparison
+        self.monitored_chat_changes_seq = None
+        self.monitored_chat_changes_consumer = f"forwarder {self.config.monitored_chats_id_interval}"
+        self.notifies_to_handlers = {"notify_monitored_chat_changes": self.on_monitored_chat_changes}
 
         super(Forwarder, self).__init__(
+            # sqlite session is per host, while session in storage is per forwarder
             client=TelegramClient(
-                'forwarder',
+                create_session(
+                    name=self.config.session_name,
+                    scope=self.config.session_name,
+                    config=self.config.sessions_config,
+                    sqlite_session_name='forwarder'),
                 api_id=config.api_id,
-                api_hash=config.api_hash).start(),
+                api_hash=config.api_hash),
             persistence_config=self.config.persistence_config)
 
-        get_logger().info(f"Resolving feedbot_username={self.config.feedbot_username}")
-        self.feedbot_entity = self.client.loop.run_until_complete(
-            resolve_entity_try_cache(self.client, self.config.feedbot_username))
-
-        # Add album handler. The order matters! Must be added before message handler
-        self.client.add_event_handler(
-            callback=AlbumHandler(
-                persistent_storage=self.persistent_storage,
-                feedbot_entity=self.feedbot_entity,
-                album_timeout_seconds=self.config.album_timeout_seconds),
-            event=events.NewMessage(func=lambda e: e.grouped_id, incoming=True, outgoing=False))
-
-        # Add message handler
-        self.client.add_event_handler(
-            callback=MessageHandler(persistent_storage=self.persistent_storage, feedbot_entity=self.feedbot_entity),
-            event=events.NewMessage(func=lambda e: not e.grouped_id, incoming=True, outgoing=False))
+        self.prefilter = PrefilterHandler(stats_seconds=self.config.prefilter_stats_seconds)
+        # resolved on setup
+        self.feedbot_entities = None
+        # created on setup
+        self.outbound = None
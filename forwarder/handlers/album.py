@@ -4,15 +4,15 @@ from telethon.events import NewMessage, StopPropagation
 
 from common.handler import CallableHandlerWithStorage
 from common.logging import get_logger
-from common.telegram import get_chat_type_from_event, ChatType, get_forwarded_message_hash
+from common.telegram import get_chat_type_from_event, get_messages_filterable_text_and_urls, ChatType
 from common.persistent_storage.base import IPersistentStorage
-from common.protocol import MessageType
+from outbound import OutboundItem, OutboundQueue
 
 
 class AlbumHandler(CallableHandlerWithStorage):
-    def __init__(self, persistent_storage: IPersistentStorage, feedbot_entity, album_timeout_seconds: float):
+    def __init__(self, persistent_storage: IPersistentStorage, outbound: OutboundQueue, album_timeout_seconds: float):
         super(AlbumHandler, self).__init__(persistent_storage=persistent_storage)
-        self.feedbot_entity = feedbot_entity
+        self.outbound = outbound
         self.album_timeout_seconds = album_timeout_seconds
         self.albums = dict()
 
@@ -35,28 +35,14 @@ class AlbumHandler(CallableHandlerWithStorage):
         aggregated_album_messages = self.albums.pop(album_descriptor)
         get_logger().debug(msg=f"album ({album_descriptor}) aggregated #{len(aggregated_album_messages)} messages")
 
-        # no need for export link - just send username (because id wont be resolved) and msg_id.
-        # it WORKS with not joined channels (public)
+        # pass to feed bots as a single post; private channels have no username, so their posts are forwarded
         chat = await event.get_chat()
-
-        if chat.username is None:
-            # private channels path
-            # forward message
-            forwarded_messages = await event.client.forward_messages(
-                entity=self.feedbot_entity,
-                as_album=True,
-                messages=aggregated_album_messages)
-
-            # send source channel info
-            forwarded_messages_hashes_str = " ".join(str(get_forwarded_message_hash(msg)) for msg in forwarded_messages)
-            await event.client.send_message(
-                entity=self.feedbot_entity,
-                message=f"{MessageType.FORWARD_SOURCE.name} {event.chat_id} {forwarded_messages_hashes_str}")
-        else:
-            # public channels path
-            messages_str = " ".join(str(msg.id) for msg in aggregated_album_messages)
-            await event.client.send_message(
-                entity=self.feedbot_entity,
-                message=f"{MessageType.MESSAGE.name} {chat.username} {messages_str}")
+        text, urls = get_messages_filterable_text_and_urls(messages=aggregated_album_messages)
+        await self.outbound.submit(item=OutboundItem(
+            chat_id=event.chat_id,
+            username=chat.username,
+            message_ids=[msg.id for msg in aggregated_album_messages],
+            text=text,
+            urls=urls))
 
         raise StopPropagation
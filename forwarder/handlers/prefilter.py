@@ -0,0 +1,83 @@
+from enum import Enum
+from time import monotonic
+from typing import Optional
+
+from telethon import utils
+from telethon.events import StopPropagation
+from telethon.tl.types import UpdateNewChannelMessage, UpdateNewMessage, UpdateShortMessage, UpdateShortChatMessage
+from telethon.tl.types import PeerChannel
+
+from common.logging import get_logger
+
+
+class DropReason(Enum):
+    NOT_CHANNEL = 0  # private chats & groups
+    OUTGOING = 1
+    NOT_MONITORED = 2  # channels that are joined, but not monitored by this forwarder (anymore)
+
+
+# Raw updates handler that goes before message handlers & stops propagation of new messages that would be rejected by
+# them anyway, so no events are built for those. Monitored channels are kept in sync with monitored chats delta; other
+# updates are passed as is. Counts are logged every stats_seconds on call
+class PrefilterHandler:
+    def __init__(self, stats_seconds: float):
+        if stats_seconds <= 0:
+            raise RuntimeError(f"Invalid stats_seconds={stats_seconds}")
+
+        self.stats_seconds = stats_seconds
+        # telegram chat ids of enabled monitored chats
+        self.channel_ids = set()
+        # since last stats
+        self.passed_count = 0
+        self.dropped_counts = [0] * len(DropReason)
+        self.stats_time = monotonic()
+
+    # chat_to_enabled_joiner_dict is whole state if is_whole_state, otherwise delta
+    def update_channels(self, chat_to_enabled_joiner_dict: dict, is_whole_state: bool):
+        if is_whole_state:
+            self.channel_ids = set()
+
+        for chat_id, (enabled, _) in chat_to_enabled_joiner_dict.items():
+            if enabled:
+                self.channel_ids.add(chat_id)
+            else:
+                self.channel_ids.discard(chat_id)
+
+        get_logger().info(f"Prefilter passes messages of {len(self.channel_ids)} monitored channels")
+
+    def get_drop_reason(self, update) -> Optional[DropReason]:
+        if isinstance(update, (UpdateNewMessage, UpdateShortMessage, UpdateShortChatMessage)):
+            return DropReason.NOT_CHANNEL
+
+        if not isinstance(update, UpdateNewChannelMessage):
+            return None
+
+        message = update.message
+
+        if getattr(message, "out", False):
+            return DropReason.OUTGOING
+
+        # supergroups are channels too, but they are never monitored
+        if not isinstance(getattr(message, "to_id", None), PeerChannel) \
+                or utils.get_peer_id(message.to_id) not in self.channel_ids:
+            return DropReason.NOT_MONITORED
+
+        return None
+
+    async def __call__(self, update):
+        drop_reason = self.get_drop_reason(update=update)
+
+        if drop_reason is None:
+            self.passed_count += 1
+        else:
+            self.dropped_counts[drop_reason.value] += 1
+
+        if monotonic() - self.stats_time >= self.stats_seconds:
+            dropped = {reason.name: self.dropped_counts[reason.value] for reason in DropReason}
+            get_logger().info(f"Prefilter stats: passed {self.passed_count} updates, dropped {dropped}")
+            self.passed_count = 0
+            self.dropped_counts = [0] * len(DropReason)
+            self.stats_time = monotonic()
+
+        if drop_reason is not None:
+            raise StopPropagation
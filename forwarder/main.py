@@ -1,7 +1,9 @@
 from common.logging import configure_logging
 from forwarder import Forwarder, ForwarderConfig, PersistenceConfig
+from common.persistent_storage.pool import PoolConfig
 from common.persistent_storage.factory import PostgresConfig, PersistentStorageType
 from common.interval import ContinuousInclusiveInterval, MultiInterval
+from common.session import SessionsConfig
 import config
 import sys
 
@@ -33,27 +35,54 @@ def main():
     multi_interval = MultiInterval(intervals=intervals)
 
     # Load configs
+    read_pool_config = PoolConfig(
+        min_size=config.db_read_pool_min_size,
+        max_size=config.db_read_pool_max_size,
+        statement_timeout_ms=config.db_read_pool_statement_timeout_ms,
+        acquire_warning_ms=config.db_pool_acquire_warning_ms,
+        stats_seconds=config.db_pool_stats_seconds,
+        stats_window_size=config.db_pool_stats_window_size)
+    write_pool_config = PoolConfig(
+        min_size=config.db_write_pool_min_size,
+        max_size=config.db_write_pool_max_size,
+        statement_timeout_ms=config.db_write_pool_statement_timeout_ms,
+        acquire_warning_ms=config.db_pool_acquire_warning_ms,
+        stats_seconds=config.db_pool_stats_seconds,
+        stats_window_size=config.db_pool_stats_window_size)
     postgres_config = PostgresConfig(
         database=config.db_name,
         user=config.db_user,
         password=config.db_password,
         host=config.db_host,
-        port=config.db_port)
+        port=config.db_port,
+        read_pool_config=read_pool_config,
+        write_pool_config=write_pool_config)
     persistence_type = \
         PersistentStorageType.Postgres if config.persistence_use_postgres else PersistentStorageType.Pickle
     persistence_config = PersistenceConfig(
         persistence_type=persistence_type,
         postgres_config=postgres_config,
         persistence_pickle_file_path=None)
+    sessions_config = SessionsConfig(
+        in_storage=config.persistence_use_postgres and config.sessions_in_storage,
+        flush_seconds=config.sessions_flush_seconds)
     forwarder_config = ForwarderConfig(
         api_id=api_id,
         api_hash=api_hash,
         monitored_chats_id_interval=multi_interval,
         persistence_config=persistence_config,
-        feedbot_username=config.feedbot_username,
-        modification_time_handicap_seconds=config.modification_time_handicap_seconds,
+        sessions_config=sessions_config,
+        session_name=config.session_name_format.format("_".join(sys.argv[3:])),
+        feedbot_usernames=config.feedbot_usernames,
         validation_hour=config.validation_hour,
-        album_timeout_seconds=config.album_timeout_seconds)
+        album_timeout_seconds=config.album_timeout_seconds,
+        prefilter_stats_seconds=config.prefilter_stats_seconds,
+        handoff_public_posts=config.handoff_public_posts,
+        outbound_journal_file_path=config.outbound_journal_file_path_format.format("_".join(sys.argv[3:])),
+        outbound_flush_seconds=config.outbound_flush_seconds,
+        outbound_sends_per_second=config.outbound_sends_per_second,
+        outbound_burst=config.outbound_burst,
+        outbound_max_message_length=config.outbound_max_message_length)
 
     # Create forwarder obj
     forwarder = Forwarder(config=forwarder_config)
@@ -0,0 +1,290 @@
+import json
+import sqlite3
+from asyncio import sleep
+from time import monotonic
+from typing import Optional
+
+from telethon import TelegramClient, errors
+
+from common.logging import get_logger
+from common.persistent_storage.base import IPersistentStorage
+from common.protocol import MessageType
+from common.startup import report_first
+from common.telegram import get_forwarded_message_hash
+
+
+# Channel post to be sent to feed bots; album is a single post of several messages
+class OutboundItem:
+    def __init__(
+            self,
+            chat_id: int,
+            username: Optional[str],
+            message_ids: list,
+            text: str,
+            urls: list,
+            sent_bot_indexes: Optional[set] = None,
+            item_id: Optional[int] = None):
+        self.chat_id = chat_id
+        # None for private channels, whose posts are forwarded to every bot of the pool
+        self.username = username
+        self.message_ids = message_ids
+        # what filters run on; handed off with the post, so the bot doesn't fetch it
+        self.text = text
+        self.urls = urls
+        # bots of the pool the item is sent to already, so failed flush is retried for the rest only
+        self.sent_bot_indexes = sent_bot_indexes if sent_bot_indexes is not None else set()
+        # id in journal; None until item is stored
+        self.item_id = item_id
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "chat_id": self.chat_id,
+            "username": self.username,
+            "message_ids": self.message_ids,
+            "text": self.text,
+            "urls": self.urls,
+            "sent_bot_indexes": sorted(self.sent_bot_indexes)})
+
+    @staticmethod
+    def from_json(item_id: int, text: str):
+        fields = json.loads(text)
+
+        # items journaled by older forwarder have no text, urls & sent bots
+        return OutboundItem(
+            chat_id=fields["chat_id"],
+            username=fields["username"],
+            message_ids=fields["message_ids"],
+            text=fields.get("text", str()),
+            urls=fields.get("urls", list()),
+            sent_bot_indexes=set(fields.get("sent_bot_indexes", list())),
+            item_id=item_id)
+
+    def __repr__(self):
+        return f"item_id={self.item_id}, chat_id={self.chat_id}, username={self.username}, " \
+               f"message_ids={self.message_ids}, sent_bot_indexes={self.sent_bot_indexes}"
+
+
+# Items are kept in sqlite file until they are sent, so posts queued before restart are sent after it. Writes are tiny
+# and done right from event loop
+class OutboundJournal:
+    def __init__(self, file_path: str):
+        if file_path is None or len(file_path) < 1:
+            raise RuntimeError("Invalid journal file path: none or empty")
+
+        self.connection = sqlite3.connect(file_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS outbound_items (id INTEGER PRIMARY KEY AUTOINCREMENT, item TEXT NOT NULL)")
+        self.connection.commit()
+
+    def add(self, item: OutboundItem) -> int:
+        cursor = self.connection.execute("INSERT INTO outbound_items (item) VALUES (?)", (item.to_json(),))
+        self.connection.commit()
+
+        return cursor.lastrowid
+
+    def update(self, items: list):
+        self.connection.executemany(
+            "UPDATE outbound_items SET item=? WHERE id=?", [(item.to_json(), item.item_id) for item in items])
+        self.connection.commit()
+
+    def delete(self, item_ids: list):
+        self.connection.executemany("DELETE FROM outbound_items WHERE id=?", [(item_id,) for item_id in item_ids])
+        self.connection.commit()
+
+    def load(self) -> list:
+        rows = self.connection.execute("SELECT id, item FROM outbound_items ORDER BY id").fetchall()
+
+        return [OutboundItem.from_json(item_id=item_id, text=text) for item_id, text in rows]
+
+    def close(self):
+        self.connection.close()
+
+
+# Token bucket: at most burst sends at once, sends_per_second on average
+class SendPacer:
+    def __init__(self, sends_per_second: float, burst: int):
+        if sends_per_second <= 0:
+            raise RuntimeError(f"Invalid sends_per_second={sends_per_second}")
+
+        if burst < 1:
+            raise RuntimeError(f"Invalid burst={burst}")
+
+        self.sends_per_second = sends_per_second
+        self.burst = burst
+        self.tokens = burst
+        self.update_time = monotonic()
+
+    async def acquire(self):
+        while True:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.update_time) * self.sends_per_second)
+            self.update_time = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await sleep((1 - self.tokens) / self.sends_per_second)
+
+    # account hit flood limit anyway; nothing is sent until it is over
+    async def wait_flood(self, seconds: float):
+        self.tokens = 0
+        await sleep(seconds)
+        self.update_time = monotonic()
+
+
+def get_chunks(lines: list, max_length: int) -> list:
+    chunks = list()
+
+    for line in lines:
+        if len(chunks) > 0 and len(chunks[-1]) + 1 + len(line) <= max_length:
+            chunks[-1] += "\n" + line
+        else:
+            chunks.append(line)
+
+    return chunks
+
+
+# Posts of monitored channels are collected for flush_seconds and sent to feed bots at once: private channels posts are
+# forwarded to every bot, then every bot gets one control message with a line per post. Sends are paced to stay within
+# limits of user account; flood wait pauses the whole queue, so channels don't compete for the account. Bots an item is
+# sent to are recorded in journal, so failed flush or restart in the middle of it sends the item only to the rest of
+# bots; the bot that failed in the middle gets its part again and drops duplicates. Items are removed once sent to all.
+# Posts of public channels are handed off to the bot through db instead if handoff_storage is passed; they are queued
+# only if handoff fails
+class OutboundQueue:
+    def __init__(
+            self,
+            client: TelegramClient,
+            handoff_storage: Optional[IPersistentStorage],
+            feedbot_entities: list,
+            journal: OutboundJournal,
+            flush_seconds: float,
+            sends_per_second: float,
+            burst: int,
+            max_message_length: int):
+        if feedbot_entities is None or len(feedbot_entities) < 1:
+            raise RuntimeError("Invalid feedbot_entities: none or empty")
+
+        if flush_seconds <= 0:
+            raise RuntimeError(f"Invalid flush_seconds={flush_seconds}")
+
+        self.client = client
+        self.handoff_storage = handoff_storage
+        # first one is primary bot of the pool
+        self.feedbot_entities = feedbot_entities
+        self.journal = journal
+        self.flush_seconds = flush_seconds
+        self.pacer = SendPacer(sends_per_second=sends_per_second, burst=burst)
+        self.max_message_length = max_message_length
+        # journal is loaded on run
+        self.pending = list()
+
+    async def submit(self, item: OutboundItem):
+        if item.username is not None and self.handoff_storage is not None:
+            try:
+                await self.handoff_storage.add_handoff_posts(
+                    posts=[(item.chat_id, item.username, item.message_ids, item.text, item.urls)])
+                get_logger().debug(f"Handed off outbound item: {item}")
+                report_first("forward")
+                return
+            except Exception as e:
+                get_logger().error(f"Failed to hand off item=({item}), queue it: {str(e)}")
+
+        self.put(item=item)
+
+    def put(self, item: OutboundItem):
+        item.item_id = self.journal.add(item=item)
+        self.pending.append(item)
+        get_logger().debug(f"Queued outbound item: {item}")
+
+    async def run(self):
+        # items put before run are in journal as well
+        self.pending = self.journal.load()
+        get_logger().info(f"Starting outbound queue; {len(self.pending)} items are queued")
+
+        while True:
+            await sleep(self.flush_seconds)
+
+            if len(self.pending) == 0:
+                continue
+
+            items = self.pending
+            self.pending = list()
+
+            try:
+                await self.flush(items=items)
+            except Exception as e:
+                get_logger().error(f"Failed to flush {len(items)} outbound items, retry on next flush: {str(e)}")
+                self.pending = items + self.pending
+
+    async def flush(self, items: list):
+        public_items = [item for item in items if item.username is not None]
+        private_items = [item for item in items if item.username is None]
+        get_logger().info(f"Flushing {len(public_items)} public and {len(private_items)} private channels posts")
+
+        for bot_index, feedbot_entity in enumerate(self.feedbot_entities):
+            # primary bot routes posts of public channels to the rest of the pool
+            bot_public_items = [
+                item for item in public_items if bot_index == 0 and bot_index not in item.sent_bot_indexes]
+            bot_private_items = [item for item in private_items if bot_index not in item.sent_bot_indexes]
+
+            if len(bot_public_items) == 0 and len(bot_private_items) == 0:
+                continue
+
+            lines = [
+                f"{MessageType.MESSAGE.name} {item.username} {' '.join(str(msg_id) for msg_id in item.message_ids)}"
+                for item in bot_public_items]
+
+            # bot can only forward what was forwarded to itself, so every bot of the pool gets its own copy
+            for item in bot_private_items:
+                line = await self.forward(feedbot_entity=feedbot_entity, item=item)
+
+                if line is not None:
+                    lines.append(line)
+
+            for message in get_chunks(lines=lines, max_length=self.max_message_length):
+                await self.send(lambda: self.client.send_message(entity=feedbot_entity, message=message))
+
+            for item in bot_public_items + bot_private_items:
+                item.sent_bot_indexes.add(bot_index)
+
+            self.journal.update(items=bot_public_items + bot_private_items)
+
+        self.journal.delete(item_ids=[item.item_id for item in items])
+
+        if len(items) > 0:
+            report_first("forward")
+
+    # returns control line of forwarded post or None if it can't be forwarded
+    async def forward(self, feedbot_entity, item: OutboundItem) -> Optional[str]:
+        try:
+            forwarded_messages = await self.send(lambda: self.client.forward_messages(
+                entity=feedbot_entity,
+                messages=item.message_ids,
+                from_peer=item.chat_id,
+                as_album=len(item.message_ids) > 1))
+        except Exception as e:
+            # e.g. post was deleted; it would fail the same way on every flush
+            get_logger().error(f"Failed to forward item=({item}), drop it: {str(e)}")
+            return None
+
+        hashes = [str(get_forwarded_message_hash(msg)) for msg in forwarded_messages if msg is not None]
+
+        if len(hashes) == 0:
+            return None
+
+        return f"{MessageType.FORWARD_SOURCE.name} {item.chat_id} {' '.join(hashes)}"
+
+    # send_func() must return awaitable of send; it is called again after flood wait
+    async def send(self, send_func):
+        while True:
+            await self.pacer.acquire()
+
+            try:
+                return await send_func()
+            except errors.FloodWaitError as e:
+                get_logger().warning(f"Outbound sends hit flood wait of {e.seconds}s")
+                await self.pacer.wait_flood(seconds=e.seconds)
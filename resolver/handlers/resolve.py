@@ -9,6 +9,7 @@ from telethon.errors.rpcerrorlist import UserAlreadyParticipantError
 from common.logging import get_logger
 from common.telegram import contains_joinchat_link, join_link, get_monitored_chat_name
 from common.protocol import g_resolver_response_error_prefix, g_resolver_separator
+from common.startup import report_first
 
 
 class ResolveHandler:
@@ -74,6 +75,7 @@ class ResolveHandler:
                            f"{get_monitored_chat_name(title=resolved_title, chat_id=resolved_chat_id)}")
         await event.message.reply(
             g_resolver_separator.join([str(resolved_chat_id), str(resolved_title), str(resolved_joiner)]))
+        report_first("resolve")
 
         # leave that chat
         if did_join:
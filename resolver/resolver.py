@@ -5,7 +5,6 @@ from telethon import TelegramClient, events
 from common.logging import get_logger
 from common.client import BaseClientConfig, Client
 from common.protocol import g_resolver_request_command
-from common.handler import resolve_entity_try_cache
 
 from handlers.resolve import ResolveHandler
 
@@ -28,6 +27,20 @@ class ResolverConfig(BaseClientConfig):
 
 # TODO: at some point add validation task that will leave all joined chats
 class Resolver(Client):
+    # Client overrides
+    async def setup(self):
+        # input entities are enough to filter requests and are taken from session, which keeps them between runs
+        get_logger().info(f"Resolving from_usernames={self.config.from_usernames}")
+        self.from_entities = await gather(
+            *[self.client.get_input_entity(username) for username in self.config.from_usernames])
+
+        # Add resolve handler
+        self.client.add_event_handler(
+            callback=ResolveHandler(join_tries=self.config.join_tries),
+            event=events.NewMessage(
+                pattern=f'^{g_resolver_request_command}', forwards=False, incoming=True, outgoing=False,
+                from_users=self.from_entities))
+
     def __init__(self, config: ResolverConfig):
         if config is None:
             raise RuntimeError("No config passed")
@@ -36,21 +49,9 @@ class Resolver(Client):
             client=TelegramClient(
                 'resolver',
                 api_id=config.api_id,
-                api_hash=config.api_hash).start())
+                api_hash=config.api_hash))
 
         self.config = config
         get_logger().info(msg="Creating Resolver object with config: {}".format(self.config))
-
-        # resolve from usernames
-        get_logger().info(f"Resolving from_usernames={self.config.from_usernames}")
-        resolve_tasks = [
-            resolve_entity_try_cache(self.client, username)
-            for username in self.config.from_usernames]
-        self.from_entities = self.client.loop.run_until_complete(gather(*resolve_tasks))
-
-        # Add resolve handler
-        self.client.add_event_handler(
-            callback=ResolveHandler(join_tries=self.config.join_tries),
-            event=events.NewMessage(
-                pattern=f'^{g_resolver_request_command}', forwards=False, incoming=True, outgoing=False,
-                from_users=self.from_entities))
+        # resolved on setup
+        self.from_entities = None